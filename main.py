@@ -2,125 +2,205 @@
 Главный файл бота "Парфюмерный календарь"
 Telegram-бот для поиска и объяснения парфюмерных терминов
 """
+import asyncio
 import logging
 import os
+import signal
 import sys
+import time
+from datetime import time as dt_time
+from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from telegram.ext import (Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler,
+                          ApplicationHandlerStop, ContextTypes, filters)
 
 # Добавляем папку src в path для импорта модулей
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-from config import BOT_TOKEN, ADMIN_USER_IDS, validate_config, DEBUG
-from database import PerfumeDatabase
+from config import (BOT_TOKEN, ADMIN_USER_IDS, validate_config, DEBUG, DATABASE_PATH, STORAGE_BACKEND,
+                    DB_POOL_MAX_SIZE, TENANTS, DICTIONARY_MEMORY_LIMIT,
+                    LOG_LEVEL, LOG_FORMAT, LOG_SEARCH_SAMPLE_RATE, LOG_SALT, PROFILING_TOKEN, TENANTS_TOKEN,
+                    GOOGLE_SHEETS_ID, GOOGLE_CREDENTIALS, SHEETS_SYNC_INTERVAL, SHEETS_BATCH_SIZE,
+                    HISTORY_SIZE, HISTORY_IDLE_TTL, HISTORY_MAX_USERS,
+                    SUGGESTION_IDLE_TTL, SUGGESTION_MAX_DRAFTS,
+                    SEARCH_PAGE_SIZE, SEARCH_CURSOR_IDLE_TTL, SEARCH_MAX_CURSORS,
+                    DICTIONARY_ARTIFACT_PATH, DICTIONARY_ARTIFACT_INTERVAL, SNAPSHOT_REFRESH_INTERVAL,
+                    USER_METRICS_PRECISION, USER_METRICS_FLUSH_INTERVAL,
+                    MISSED_QUERIES_CAPACITY, MISSED_QUERIES_KEEP_DAYS, MISSED_QUERIES_INTERVAL,
+                    USER_DATA_PATH, USER_DATA_FLUSH_INTERVAL,
+                    HEALTH_STALL_SECONDS, HEALTH_MAX_DB_RTT, HEALTH_MAX_QUEUE,
+                    SHUTDOWN_DRAIN_TIMEOUT, SHUTDOWN_TIMEOUT,
+                    RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_IDLE_TTL, RATE_LIMIT_MAX_USERS,
+                    WORKERS, WEBHOOK_URL, WEBHOOK_PORT, LEADER_LOCK_PATH,
+                    GLOSSARY_MIN_WORDS, GLOSSARY_MAX_TERMS, BOT_API_BASE_URL,
+                    BROADCAST_TIME, BROADCAST_TIMEZONE, BROADCAST_RATE, BROADCAST_CONCURRENCY,
+                    RELATED_TERMS_INTERVAL, RELATED_TERMS_SHOWN,
+                    TELEGRAM_POOL_SIZE, TELEGRAM_KEEPALIVE, TELEGRAM_HTTP2)
+from storage_backend import StorageBackend, TERM, CATEGORY, UPDATE, DELETE, MERGE
+from term_record import TermRecord
 from external_storage import ExternalStorage
+from rate_limiter import RateLimiter
+from cluster import LeaderElection, SQLiteWriter, WorkerPool
+from glossary import GlossaryIndex
+from description_search import DescriptionIndex
+import rendering
+from rendering import PARSE_MODE, render_term_card
+from broadcast import Broadcaster
+from recommendations import RelatedTermsIndexer
+from sheets_sync import SheetsSync, open_spreadsheet
+from user_history import UserHistory
+from dictionary_snapshot import SnapshotStore
+from search_ranking import EXACT, SearchRanker, SearchCursors, Cursor
+from suggestion_intake import SuggestionIntake, SuggestionError
+from change_bus import ChangeBus
+from dictionary_artifact import DictionaryCompiler, open_artifact
+from missed_queries import MissTracker
+from unique_users import UniqueUsers
+from text_normalizer import normalize
+from health import HealthMonitor
+from shutdown import GracefulShutdown
+from telegram_api import OutboundLimiter, build_request, MAX_TRACKED_MESSAGES
+from tenants import CacheBudget, TenantRegistry, load_tenants
+from logging_setup import setup_logging, stop_logging, hash_user_id
+from profiling import Profiler, handle_request as handle_profiling_request
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO if not DEBUG else logging.DEBUG
+# Настройка логирования: запись в очередь, вывод в фоновом потоке
+setup_logging(
+    level='DEBUG' if DEBUG else LOG_LEVEL,
+    json_format=LOG_FORMAT == 'json',
+    sample_rates={'search': LOG_SEARCH_SAMPLE_RATE, 'glossary': LOG_SEARCH_SAMPLE_RATE},
+    salt=LOG_SALT
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = PerfumeDatabase()
+# Пределы кэшей в памяти на процесс; несколько словарей делят их по весам (см. TENANTS)
+PROCESS_BUDGET = CacheBudget(
+    history_users=HISTORY_MAX_USERS,
+    drafts=SUGGESTION_MAX_DRAFTS,
+    rate_limit_users=RATE_LIMIT_MAX_USERS,
+    tracked_messages=MAX_TRACKED_MESSAGES,
+    search_cursors=SEARCH_MAX_CURSORS,
+    db_pool_size=DB_POOL_MAX_SIZE,
+    index_bytes=DICTIONARY_MEMORY_LIMIT * 1024 * 1024
+)
+
+# Команды редактирования словаря (только для администраторов):
+# команда -> (сущность, действие, метод хранилища, подсказка по формату)
+EDIT_COMMANDS = {
+    'editterm': (TERM, UPDATE, 'update_term',
+                 "/editterm <id>\nназвание: ...\nопределение: ...\nкатегория: ...\nпримеры: ...\nсинонимы: ..."),
+    'deleteterm': (TERM, DELETE, 'delete_term', "/deleteterm <id>"),
+    'mergeterms': (TERM, MERGE, 'merge_terms', "/mergeterms <id исходного> <id итогового>"),
+    'editcategory': (CATEGORY, UPDATE, 'update_category', "/editcategory <id>\nназвание: ...\nописание: ..."),
+    'deletecategory': (CATEGORY, DELETE, 'delete_category', "/deletecategory <id>"),
+    'mergecategories': (CATEGORY, MERGE, 'merge_categories', "/mergecategories <id исходной> <id итоговой>"),
+}
+
+# Сдвиг первых запусков фоновых задач соседних словарей (секунд)
+TENANT_JOB_STAGGER = 7
+
+# Подписи полей в строках "поле: значение"
+EDIT_LABELS = {
+    TERM: {'название': 'term', 'определение': 'definition', 'категория': 'category_name',
+           'примеры': 'examples', 'синонимы': 'synonyms'},
+    CATEGORY: {'название': 'name', 'описание': 'description'},
+}
 
 class PerfumeBot:
-    def __init__(self):
-        """Инициализация бота"""
-        self.db = db
-        self.storage = ExternalStorage()
+    def __init__(self, database: StorageBackend, storage: ExternalStorage = None,
+                 budget: CacheBudget = PROCESS_BUDGET, artifact_path: str = DICTIONARY_ARTIFACT_PATH):
+        """Инициализация бота одного словаря: пределы кэшей - доля словаря в памяти процесса"""
+        self.db = database
+        self.storage = storage or ExternalStorage(USER_DATA_PATH)
+        self.rate_limiter = RateLimiter(
+            rate=RATE_LIMIT_RATE,
+            burst=RATE_LIMIT_BURST,
+            idle_ttl=RATE_LIMIT_IDLE_TTL,
+            max_users=budget.rate_limit_users
+        )
+        # Индексы поиска загружаются из файла словаря, если он есть, иначе строятся из базы
+        artifact = open_artifact(artifact_path, self.db)
+        self.glossary = GlossaryIndex(self.db, artifact)
+        self.descriptions = DescriptionIndex(self.db, artifact=artifact)
+        self.history = UserHistory(
+            self.db,
+            size=HISTORY_SIZE,
+            idle_ttl=HISTORY_IDLE_TTL,
+            max_users=budget.history_users
+        )
         
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /start"""
-        user = update.effective_user
+        # Черновики предложений терминов (только в памяти до отправки)
+        self.intake = SuggestionIntake(self.db, idle_ttl=SUGGESTION_IDLE_TTL, max_drafts=budget.drafts)
+        
+        # Поиск, карточки и категории читаются из снимка словаря в памяти, а не из базы
+        self.snapshots = SnapshotStore(self.db, refresh_interval=SNAPSHOT_REFRESH_INTERVAL, artifact=artifact)
         
-        welcome_text = f"""
-🌸 Добро пожаловать в *Парфюмерный календарь*!
+        # Выдача поиска по единой оценке и курсоры кнопки "Показать еще"
+        self.ranker = SearchRanker(self.snapshots, self.descriptions)
+        self.cursors = SearchCursors(idle_ttl=SEARCH_CURSOR_IDLE_TTL, max_cursors=budget.search_cursors)
+        
+        # Правки словаря точечно обновляют индексы, снимок и кэш историй без перестроения
+        # Правки после сборки файла словаря повторяются по журналу
+        self.changes = ChangeBus(self.db, revision=artifact.revision if artifact else None)
+        self.changes.subscribe(self.glossary.apply_change, TERM)
+        self.changes.subscribe(self.descriptions.apply_change, TERM)
+        self.changes.subscribe(self.history.apply_change, TERM)
+        self.changes.subscribe_batch(self.snapshots.apply_changes)
+        
+        # Уникальные пользователи за день/неделю/месяц для экрана статистики
+        self.audience = UniqueUsers(self.db, precision=USER_METRICS_PRECISION)
+        
+        # Сводки неуспешных поисков для отчета /misses
+        self.misses = MissTracker(self.db, capacity=MISSED_QUERIES_CAPACITY, keep_days=MISSED_QUERIES_KEEP_DAYS)
 
-Привет, {user.first_name}! Я помогу вам разобраться в мире парфюмерии.
+    async def sync_changes(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Подхватывает правки словаря, сделанные другими процессами, и обновляет счетчики снимка"""
+        self.changes.poll()
+        self.snapshots.maybe_refresh()
 
-📚 *Как использовать:*
-• Просто напишите любой парфюмерный термин для поиска
-• Нажимайте на кнопки для быстрого доступа к функциям
-• Изучайте случайные термины
-• Предлагайте новые термины для словаря
-        """
+    async def rate_limit_guard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отсекает слишком частые запросы до поиска и обработки кнопок"""
+        user = update.effective_user
+        if not user or self.rate_limiter.allow(user.id):
+            return
         
-        # Создаем клавиатуру с основными функциями
-        keyboard = [
-            [
-                InlineKeyboardButton("🎲 Случайный термин", callback_data="random"),
-                InlineKeyboardButton("📚 Категории", callback_data="categories")
-            ],
-            [
-                InlineKeyboardButton("💡 Предложить термин", callback_data="suggest"),
-                InlineKeyboardButton("📊 Статистика", callback_data="stats")
-            ],
-            [
-                InlineKeyboardButton("ℹ️ Помощь", callback_data="help")
-            ]
-        ]
-        inline_markup = InlineKeyboardMarkup(keyboard)
+        # Предупреждаем один раз за серию, остальные запросы молча отбрасываем
+        if self.rate_limiter.should_warn(user.id):
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Слишком много запросов, подождите немного")
+            elif update.effective_message:
+                await update.effective_message.reply_text("⏳ Слишком много запросов, подождите немного")
+        
+        raise ApplicationHandlerStop
+        
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /start"""
+        user = update.effective_user
+        self.intake.cancel(user.id)
         
         await update.message.reply_text(
-            welcome_text,
-            parse_mode='Markdown',
-            reply_markup=inline_markup
+            rendering.WELCOME.render(name=user.first_name),
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.MAIN_MENU
         )
         
         # Инструкция по доступу к меню
         await update.message.reply_text(
-            "💡 *Как вернуться к главному меню:*\n"
-            "📱 На телефоне: нажмите ☰ (три полоски) слева от строки ввода\n"
-            "💻 На компьютере: напишите `/start` или `/help`",
-            parse_mode='Markdown',
+            rendering.MENU_HINT,
+            parse_mode=PARSE_MODE,
             reply_markup=ReplyKeyboardRemove()
         )
         
         # Логируем статистику
-        logger.info(f"Новый пользователь: {user.id} (@{user.username})")
+        logger.info("Новый пользователь: %s", hash_user_id(user.id),
+                    extra={'event': 'new_user', 'user': hash_user_id(user.id)})
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
-        help_text = """
-📖 *Справка по боту "Парфюмерный календарь"*
-
-🔍 *Поиск терминов:*
-Просто напишите мне любое слово или термин из мира парфюмерии, и я объясню его значение.
-
-Примеры: "верхние ноты", "beast mode", "атомайзер"
-
-📋 *Функции бота:*
-🏠 Главное меню - возврат к основным функциям
-ℹ️ Справка - как пользоваться ботом
-🎲 Случайный термин - изучение новых понятий
-📚 Категории - просмотр терминов по темам
-💡 Предложить термин - добавление новых слов
-📊 Статистика - информация о базе данных
-
-🎯 *Поиск работает по:*
-• Точному названию термина
-• Синонимам и альтернативным названиям
-• Частичным совпадениям
-• Содержимому определений
-
-💡 *Хотите помочь?*
-Используйте кнопку "💡 Предложить термин" чтобы предложить новый термин или улучшение существующего.
-
-❓ *Не нашли термин?*
-Напишите администратору канала @your_admin или воспользуйтесь кнопкой "💡 Предложить термин"
-        """
-        
-        keyboard = [
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
-            help_text,
-            parse_mode='Markdown',
-            reply_markup=reply_markup
+            rendering.HELP,
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.BACK_TO_MENU
         )
 
     async def random_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -135,179 +215,194 @@ class PerfumeBot:
 
     async def categories_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /categories"""
-        categories = self.db.get_categories()
+        snapshot = self.snapshots.current
+        categories = snapshot.get_categories()
         
         if not categories:
             await update.message.reply_text("❌ Категории не найдены.")
             return
         
-        text = "📚 *Категории терминов:*\n\n"
-        keyboard = []
+        # Количество терминов во всех категориях одним запросом
+        counts = snapshot.count_terms_by_category()
+        text = rendering.render_categories(categories, counts)
         
-        for category in categories:
-            # Считаем количество терминов в категории
-            with self.db.get_connection() as conn:
-                cursor = conn.execute(
-                    'SELECT COUNT(*) as count FROM terms WHERE category_id = ?',
-                    (category['id'],)
-                )
-                count = cursor.fetchone()['count']
-            
-            text += f"🏷️ *{category['name']}* ({count} терминов)\n"
-            if category['description']:
-                text += f"   {category['description']}\n"
-            text += "\n"
-            
-            # Добавляем кнопку для каждой категории
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"📖 {category['name']} ({count})",
-                    callback_data=f"category_{category['id']}"
-                )
-            ])
-        
-        keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="start")])
+        # Кнопка для каждой категории
+        keyboard = [
+            [InlineKeyboardButton(f"📖 {category.name} ({counts.get(category.id, 0)})",
+                                  callback_data=f"category_{category.id}")]
+            for category in categories
+        ]
+        keyboard.append([rendering.MENU_BUTTON])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.message.reply_text(
             text,
-            parse_mode='Markdown',
+            parse_mode=PARSE_MODE,
             reply_markup=reply_markup
         )
 
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает статистику базы данных"""
         stats = self.db.get_stats()
-        
-        text = f"""
-📊 *Статистика парфюмерного словаря:*
-
-📚 Всего терминов: *{stats['total_terms']}*
-🏷️ Категорий: *{stats['total_categories']}*
-🔍 Поисков за неделю: *{stats['searches_week']}*
-💡 Ожидает модерации: *{stats['pending_suggestions']}*
-
-🔥 *Популярные термины:*
-        """
-        
-        if stats['popular_terms']:
-            for i, term in enumerate(stats['popular_terms'], 1):
-                text += f"{i}. {term['term']} ({term['usage_count']} запросов)\n"
-        else:
-            text += "Пока нет статистики по запросам"
-        
-        keyboard = [
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        users = self.audience.counts()
         
         await update.message.reply_text(
-            text,
-            parse_mode='Markdown',
-            reply_markup=reply_markup
+            rendering.render_stats(stats, users),
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.BACK_TO_MENU
         )
 
     async def search_terms(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик поиска терминов по тексту сообщения"""
+        started = time.perf_counter()
         query = update.message.text.strip()
         user_id = update.effective_user.id
-        
+        self.audience.add(user_id)
         
         # Игнорируем команды
         if query.startswith('/'):
             return
         
-        logger.info(f"Поиск термина: '{query}' пользователем {user_id}")
+        # Длинный текст (например, пересланный пост) разбираем как глоссарий
+        if '\n' in query or len(query.split()) >= GLOSSARY_MIN_WORDS:
+            await self.glossary_reply(update, query)
+            self.log_handler_event('glossary', 'search_terms', user_id, 'glossary', started)
+            return
         
-        # Ищем термины
-        results = self.db.search_terms(query)
+        # Ищем термины: название, синонимы, часть названия и описание ("пахнет свежо, цитрусово")
+        # с единой оценкой - страница лучших терминов
+        page = self.ranker.search(query, limit=SEARCH_PAGE_SIZE)
         
-        if not results:
+        if not page.hits:
             # Логируем неуспешный поиск
             self.db.log_search(user_id, query, found=False)
             self.storage.log_search(user_id, query, found=False)
             
-            await update.message.reply_text(
-                f"❌ Термин '*{query}*' не найден.\n\n"
-                "💡 Попробуйте:\n"
-                "• Проверить написание\n"
-                "• Использовать синонимы\n"
-                "• Посмотреть категории через кнопку \"📚 Категории\"\n"
-                "• Предложить новый термин: кнопка \"💡 Предложить термин\"",
-                parse_mode='Markdown'
-            )
+            await update.message.reply_text(rendering.NOT_FOUND.render(query=query), parse_mode=PARSE_MODE)
+            self.log_handler_event('search', 'search_terms', user_id, 'miss', started, query=query, results=0)
             return
         
-        if len(results) == 1:
-            # Найден один термин - показываем его
-            term = results[0]
-            self.db.log_search(user_id, query, term['id'], found=True)
+        if page.total == 1 or page.hits[0].signal == EXACT:
+            # Найден один термин или название целиком - показываем его
+            term = page.hits[0].record
+            self.db.log_search(user_id, query, term.id, found=True)
             self.storage.log_search(user_id, query, found=True)
-            self.db.increment_usage(term['id'])
+            self.db.increment_usage(term.id)
             await self.send_term_info(update, term)
         else:
-            # Найдено несколько терминов - показываем список
-            text = f"🔍 По запросу '*{query}*' найдено {len(results)} терминов:\n\n"
-            keyboard = []
-            
-            for i, term in enumerate(results[:10], 1):  # Показываем максимум 10
-                text += f"{i}. *{term['term']}*"
-                if term['category_name']:
-                    text += f" ({term['category_name']})"
-                text += "\n"
-                
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{i}. {term['term']}",
-                        callback_data=f"term_{term['id']}"
-                    )
-                ])
-            
-            keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="start")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
+            # Найдено несколько терминов - показываем первую страницу
+            text, reply_markup = self.render_search_page(user_id, query, page)
             await update.message.reply_text(
                 text,
-                parse_mode='Markdown',
+                parse_mode=PARSE_MODE,
                 reply_markup=reply_markup
             )
+        
+        tier = 'description' if page.by_description else 'dictionary'
+        self.log_handler_event('search', 'search_terms', user_id, tier, started, query=query, results=page.total)
 
-    async def send_term_info(self, update: Update, term: dict, is_random: bool = False):
-        """Отправляет информацию о термине"""
-        # Форматируем информацию о термине
-        text = f"📚 *{term['term']}*\n\n"
+    def render_search_page(self, user_id: int, query: str, page, seen: tuple = ()):
+        """Текст и кнопки страницы выдачи; кнопка "Показать еще" - если есть следующая страница"""
+        offset = len(seen)
+        text = rendering.render_search_results(query, page.records, page.by_description,
+                                               total=page.total, offset=offset)
+        keyboard = [
+            [InlineKeyboardButton(f"{i}. {term.term}", callback_data=f"term_{term.id}")]
+            for i, term in enumerate(page.records, offset + 1)
+        ]
+        if page.next_key is not None:
+            # В callback_data только номер курсора: запрос может не уместиться в 64 байта
+            cursor = Cursor(user_id, query, tuple(seen) + tuple(term.id for term in page.records))
+            cursor_id = self.cursors.save(cursor)
+            keyboard.append([InlineKeyboardButton(rendering.SEARCH_MORE_BUTTON, callback_data=f"more_{cursor_id}")])
+        keyboard.append([rendering.MENU_BUTTON])
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def show_more(self, update: Update, cursor_id: int):
+        """Кнопка "Показать еще": следующая страница выдачи после курсора"""
+        user_id = update.effective_user.id
+        cursor = self.cursors.get(user_id, cursor_id)
+        page = self.ranker.search(cursor.query, limit=SEARCH_PAGE_SIZE, exclude=cursor.seen) if cursor else None
+        if page is None or not page.hits:
+            # Курсор забыт или словарь изменился, и непоказанных терминов не осталось
+            await update.callback_query.edit_message_text(
+                rendering.SEARCH_EXPIRED,
+                parse_mode=PARSE_MODE,
+                reply_markup=rendering.BACK_TO_MENU
+            )
+            return
         
-        # Определение
-        text += f"📖 {term['definition']}\n\n"
+        text, reply_markup = self.render_search_page(user_id, cursor.query, page, seen=cursor.seen)
+        await update.callback_query.edit_message_text(
+            text,
+            parse_mode=PARSE_MODE,
+            reply_markup=reply_markup
+        )
+
+    @staticmethod
+    def log_handler_event(event: str, handler: str, user_id: int, tier: str, started: float, **fields):
+        """Структурная запись о выполненном обработчике: какой путь сработал и за сколько
+
+        Сообщение форматируется уже в потоке вывода логов; массовые события прореживаются (LOG_SEARCH_SAMPLE_RATE).
+        """
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.info("%s: %s за %s мс", handler, tier, latency_ms, extra={
+            'event': event, 'handler': handler, 'user': hash_user_id(user_id),
+            'tier': tier, 'latency_ms': latency_ms, **fields,
+        })
+
+    async def glossary_reply(self, update: Update, text: str):
+        """Показывает все термины словаря, встретившиеся в тексте"""
+        found = self.glossary.find_terms(text, limit=GLOSSARY_MAX_TERMS)
+        logger.debug("Глоссарий текста (%s символов): найдено %s терминов", len(text), len(found))
         
-        # Категория
-        if term['category_name']:
-            text += f"🏷️ *Категория:* {term['category_name']}\n"
+        if not found:
+            await update.message.reply_text(
+                "🔍 В этом тексте не нашлось терминов из словаря.\n\n"
+                "Чтобы найти один термин, отправьте только его название."
+            )
+            return
         
-        # Примеры
-        if term['examples']:
-            text += f"💡 *Примеры:* {term['examples']}\n"
+        keyboard = []
+        for term_id, term in found:
+            button = InlineKeyboardButton(f"📖 {term}", callback_data=f"term_{term_id}")
+            # По две кнопки в ряд, чтобы список оставался компактным
+            if keyboard and len(keyboard[-1]) < 2:
+                keyboard[-1].append(button)
+            else:
+                keyboard.append([button])
+        keyboard.append([rendering.MENU_BUTTON])
         
-        # Синонимы
-        if term['synonyms']:
-            text += f"🔄 *Синонимы:* {term['synonyms']}\n"
+        await update.message.reply_text(
+            f"📖 Термины в тексте: {len(found)}\n\nНажмите на термин, чтобы прочитать объяснение:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+    async def send_term_info(self, update: Update, term: TermRecord, is_random: bool = False):
+        """Отправляет информацию о термине"""
+        text = render_term_card(term)
         
-        # Статистика использования
-        if term['usage_count'] > 0:
-            text += f"📊 *Запросов:* {term['usage_count']}\n"
+        # Термины, открытые самим пользователем, попадают в "Мои запросы"
+        if not is_random and update.effective_user:
+            self.history.add(update.effective_user.id, term.id, term.term)
         
-        # Создаем клавиатуру
+        # Связанные термины (готовый список, рассчитанный фоновой задачей)
+        related = self.db.get_related_terms(term.id, limit=RELATED_TERMS_SHOWN)
         keyboard = [
             [
-                InlineKeyboardButton("🎲 Другой случайный", callback_data="random"),
-                InlineKeyboardButton("📚 Категории", callback_data="categories")
+                InlineKeyboardButton(f"🔗 {name}", callback_data=f"term_{related_id}")
+                for related_id, name in related[i:i + 2]
             ]
+            for i in range(0, len(related), 2)
         ]
         
+        keyboard.append([
+            InlineKeyboardButton("🎲 Другой случайный", callback_data="random"),
+            InlineKeyboardButton("📚 Категории", callback_data="categories")
+        ])
+        
         if not is_random:
-            keyboard.append([
-                InlineKeyboardButton("🏠 Главное меню", callback_data="start")
-            ])
+            keyboard.append([rendering.MENU_BUTTON])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -315,13 +410,13 @@ class PerfumeBot:
         if update.callback_query:
             await update.callback_query.edit_message_text(
                 text,
-                parse_mode='Markdown',
+                parse_mode=PARSE_MODE,
                 reply_markup=reply_markup
             )
         else:
             await update.message.reply_text(
                 text,
-                parse_mode='Markdown',
+                parse_mode=PARSE_MODE,
                 reply_markup=reply_markup
             )
 
@@ -329,9 +424,14 @@ class PerfumeBot:
         """Обработчик нажатий на inline кнопки"""
         query = update.callback_query
         await query.answer()
+        self.audience.add(update.effective_user.id)
         
         data = query.data
         
+        # Любая другая кнопка прерывает прием предложения, чтобы следующее сообщение снова было поиском
+        if data != "suggest":
+            self.intake.cancel(update.effective_user.id)
+        
         if data == "start":
             await self.start_callback(update, context)
         elif data == "help":
@@ -350,66 +450,35 @@ class PerfumeBot:
             await self.suggest_callback(update, context)
         elif data == "stats":
             await self.stats_callback(update, context)
+        elif data == "subscription":
+            await self.subscription_callback(update, context)
+        elif data == "subscribe":
+            await self.set_subscription(update, subscribe=True)
+        elif data == "unsubscribe":
+            await self.set_subscription(update, subscribe=False)
+        elif data == "history":
+            await self.show_history(update)
+        elif data.startswith("miss_"):
+            await self.miss_to_suggestion(update, int(data.split("_")[1]))
+        elif data.startswith("more_"):
+            await self.show_more(update, int(data.split("_")[1]))
 
     async def start_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Callback для кнопки 'Главное меню'"""
         user = update.effective_user
         
-        welcome_text = f"""
-🌸 *Парфюмерный календарь*
-
-Привет, {user.first_name}! Чем могу помочь?
-
-🔍 Напишите любой парфюмерный термин или выберите действие:
-        """
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("🎲 Случайный термин", callback_data="random"),
-                InlineKeyboardButton("📚 Категории", callback_data="categories")
-            ],
-            [
-                InlineKeyboardButton("💡 Предложить термин", callback_data="suggest"),
-                InlineKeyboardButton("📊 Статистика", callback_data="stats")
-            ],
-            [
-                InlineKeyboardButton("ℹ️ Помощь", callback_data="help")
-            ]
-        ]
-        inline_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.callback_query.edit_message_text(
-            welcome_text,
-            parse_mode='Markdown',
-            reply_markup=inline_markup
+            rendering.MAIN_MENU_TEXT.render(name=user.first_name),
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.MAIN_MENU
         )
 
     async def help_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Callback для кнопки 'Помощь'"""
-        help_text = """
-📖 *Как пользоваться ботом:*
-
-🔍 *Поиск:* Просто напишите термин
-💡 *Предложить:* Нажмите кнопку "💡 Предложить термин"
-🎲 *Изучать:* Нажимайте "Случайный термин"
-📚 *Категории:* Просматривайте по темам
-
-*Примеры запросов:*
-• "верхние ноты"
-• "beast mode" 
-• "атомайзер"
-• "флэнкер"
-        """
-        
-        keyboard = [
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.callback_query.edit_message_text(
-            help_text,
-            parse_mode='Markdown',
-            reply_markup=reply_markup
+            rendering.HELP_SHORT,
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.BACK_TO_MENU
         )
 
     async def random_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -423,204 +492,346 @@ class PerfumeBot:
 
     async def categories_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Callback для кнопки 'Категории'"""
-        categories = self.db.get_categories()
+        snapshot = self.snapshots.current
+        categories = snapshot.get_categories()
         
         if not categories:
             await update.callback_query.edit_message_text("❌ Категории не найдены.")
             return
         
-        text = "📚 *Категории терминов:*\n\n"
-        keyboard = []
+        # Количество терминов во всех категориях одним запросом
+        counts = snapshot.count_terms_by_category()
+        text = rendering.render_categories(categories, counts)
         
-        for category in categories:
-            # Считаем количество терминов в категории
-            with self.db.get_connection() as conn:
-                cursor = conn.execute(
-                    'SELECT COUNT(*) as count FROM terms WHERE category_id = ?',
-                    (category['id'],)
-                )
-                count = cursor.fetchone()['count']
-            
-            text += f"🏷️ *{category['name']}* ({count} терминов)\n"
-            if category['description']:
-                text += f"   {category['description']}\n"
-            text += "\n"
-            
-            # Добавляем кнопку для каждой категории
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"📖 {category['name']} ({count})",
-                    callback_data=f"category_{category['id']}"
-                )
-            ])
-        
-        keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="start")])
+        # Кнопка для каждой категории
+        keyboard = [
+            [InlineKeyboardButton(f"📖 {category.name} ({counts.get(category.id, 0)})",
+                                  callback_data=f"category_{category.id}")]
+            for category in categories
+        ]
+        keyboard.append([rendering.MENU_BUTTON])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.callback_query.edit_message_text(
             text,
-            parse_mode='Markdown',
+            parse_mode=PARSE_MODE,
             reply_markup=reply_markup
         )
 
     async def suggest_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /suggest для предложения термина"""
-        text = """
-💡 *Предложите новый термин!*
-
-Отправьте сообщение в формате:
-```
-Название термина
-Объяснение термина
-Категория (необязательно)
-Примеры использования (необязательно)
-```
-
-*Пример:*
-```
-Винтаж
-Старый, редкий аромат из прошлых лет
-Жаргон
-"Этот винтаж 80-х годов стоит целое состояние"
-```
-
-Ваше предложение будет рассмотрено администратором.
-        """
-        
-        await update.message.reply_text(text, parse_mode='Markdown')
+        self.intake.start(update.effective_user.id)
+        await update.message.reply_text(rendering.SUGGEST, parse_mode=PARSE_MODE, reply_markup=rendering.BACK_TO_MENU)
 
     async def suggest_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Callback для кнопки 'Предложить термин'"""
-        text = """
-💡 *Предложите новый термин!*
-
-Отправьте сообщение в формате:
-```
-Название термина
-Объяснение термина
-Категория (необязательно)
-Примеры использования (необязательно)
-```
-
-*Пример:*
-```
-Винтаж
-Старый, редкий аромат из прошлых лет
-Жаргон
-"Этот винтаж 80-х годов стоит целое состояние"
-```
-
-Ваше предложение будет рассмотрено администратором.
-        """
-        
-        keyboard = [
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+        self.intake.start(update.effective_user.id)
         await update.callback_query.edit_message_text(
-            text,
-            parse_mode='Markdown',
-            reply_markup=reply_markup
+            rendering.SUGGEST,
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.BACK_TO_MENU
         )
 
+    async def suggestion_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сообщение пользователя, от которого бот ждет предложение термина (вместо поиска)"""
+        user = update.effective_user
+        try:
+            suggestion = self.intake.submit(user.id, update.message.text)
+        except SuggestionError as e:
+            await update.message.reply_text(rendering.SUGGEST_INVALID.render(error=e), parse_mode=PARSE_MODE)
+            return
+        
+        if suggestion is None:
+            # Пришло только название - ждем объяснение
+            term = self.intake.pending_term(user.id)
+            await update.message.reply_text(rendering.SUGGEST_DEFINITION.render(term=term), parse_mode=PARSE_MODE)
+            return
+        
+        if self.suggestion_pending(suggestion.term):
+            await update.message.reply_text(rendering.SUGGEST_PENDING.render(term=suggestion.term),
+                                            parse_mode=PARSE_MODE, reply_markup=rendering.BACK_TO_MENU)
+            return
+        
+        username = user.username or user.first_name
+        # В режиме масштабирования запись ждет подтверждения писателя - не в event loop
+        await asyncio.to_thread(self.db.add_suggestion, user.id, username, *suggestion)
+        await asyncio.to_thread(self.storage.save_user_suggestion, user.id, username,
+                                suggestion.term, suggestion.definition)
+        logger.info("Новое предложение термина", extra={'event': 'suggestion', 'user': hash_user_id(user.id)})
+        await update.message.reply_text(rendering.SUGGEST_SAVED.render(term=suggestion.term),
+                                        parse_mode=PARSE_MODE, reply_markup=rendering.BACK_TO_MENU)
+
+    async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /cancel - отмена предложения термина"""
+        if self.intake.cancel(update.effective_user.id):
+            await update.message.reply_text(rendering.SUGGEST_CANCELLED, parse_mode=PARSE_MODE,
+                                            reply_markup=rendering.BACK_TO_MENU)
+
+    def suggestion_pending(self, term: str) -> bool:
+        """Есть ли уже такое предложение среди ожидающих модерации"""
+        key = normalize(term)
+        return any(normalize(item['suggested_term']) == key for item in self.db.get_pending_suggestions())
+
     async def show_category_terms(self, update: Update, category_id: int):
         """Показывает термины из выбранной категории"""
         # Получаем информацию о категории
-        with self.db.get_connection() as conn:
-            cursor = conn.execute('SELECT * FROM categories WHERE id = ?', (category_id,))
-            category = cursor.fetchone()
-            
-            if not category:
-                await update.callback_query.edit_message_text("❌ Категория не найдена")
-                return
-            
-            # Получаем термины этой категории
-            cursor = conn.execute('''
-                SELECT * FROM terms 
-                WHERE category_id = ? 
-                ORDER BY term
-            ''', (category_id,))
-            terms = cursor.fetchall()
-        
-        if not terms:
-            text = f"📚 *{category['name']}*\n\nВ этой категории пока нет терминов."
-        else:
-            text = f"📚 *{category['name']}* ({len(terms)} терминов)\n\n"
-            
-            keyboard = []
-            for term in terms[:15]:  # Максимум 15 терминов
-                text += f"• {term['term']}\n"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"📖 {term['term']}",
-                        callback_data=f"term_{term['id']}"
-                    )
-                ])
-            
-            if len(terms) > 15:
-                text += f"\n... и еще {len(terms) - 15} терминов"
+        snapshot = self.snapshots.current
+        category = snapshot.get_category(category_id)
+        
+        if not category:
+            await update.callback_query.edit_message_text("❌ Категория не найдена")
+            return
+        
+        # Получаем термины этой категории
+        terms = snapshot.get_category_terms(category_id)
         
-        keyboard = keyboard or []
+        text = rendering.render_category_terms(category, terms)
+        # Максимум 15 терминов
+        keyboard = [[InlineKeyboardButton(f"📖 {term.term}", callback_data=f"term_{term.id}")] for term in terms[:15]]
         keyboard.append([
             InlineKeyboardButton("📚 Все категории", callback_data="categories"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="start")
+            rendering.MENU_BUTTON
         ])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.callback_query.edit_message_text(
             text,
-            parse_mode='Markdown',
+            parse_mode=PARSE_MODE,
             reply_markup=reply_markup
         )
 
     async def stats_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Callback для кнопки 'Статистика'"""
         stats = self.db.get_database_stats()
+        users = self.audience.counts()
+        
+        await update.callback_query.edit_message_text(
+            rendering.render_stats(stats, users, popular_limit=5),
+            parse_mode=PARSE_MODE,
+            reply_markup=rendering.BACK_TO_MENU
+        )
+
+    async def show_term_by_id(self, update: Update, term_id: int):
+        """Показывает термин по ID"""
+        term = self.snapshots.current.get_term_by_id(term_id)
+        
+        if term:
+            # Увеличиваем счетчик использования
+            self.db.increment_usage(term_id)
+            await self.send_term_info(update, term)
+        else:
+            await update.callback_query.edit_message_text("❌ Термин не найден")
+
+    async def api_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /apistats - метрики вызовов Bot API (только для администраторов)"""
+        if update.effective_user.id not in ADMIN_USER_IDS:
+            return
+        
+        limiter = context.bot.rate_limiter
+        metrics = limiter.snapshot() if isinstance(limiter, OutboundLimiter) else {}
+        if not metrics:
+            await update.message.reply_text("Вызовов Bot API пока не было")
+            return
+        
+        lines = ["📡 Вызовы Bot API (метод: вызовы / ошибки / повторы / подавлено, среднее и макс. время):", ""]
+        for method, item in metrics.items():
+            lines.append(
+                f"{method}: {item['calls']} / {item['failures']} / {item['retries']} / {item['suppressed']}, "
+                f"{item['avg_ms']:.0f} мс, макс. {item['max_ms']:.0f} мс"
+            )
+        await update.message.reply_text("\n".join(lines))
+
+    async def misses_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /misses [дней] - частые запросы без результата (только для администраторов)"""
+        if update.effective_user.id not in ADMIN_USER_IDS:
+            return
+        
+        days = int(context.args[0]) if context.args and context.args[0].isdigit() else 7
+        days = min(max(days, 1), MISSED_QUERIES_KEEP_DAYS)
+        
+        def collect():
+            self.misses.refresh()
+            # Запросы, которые уже находятся тем же поиском, что у пользователей (термин добавили), в отчет не попадают
+            return [
+                miss for miss in self.misses.top(days=days, limit=100)
+                if not self.ranker.search(miss.query, limit=1).hits
+            ][:50]
+        
+        # До сотни поисков по всему словарю - в отдельном потоке, чтобы не задерживать других пользователей
+        misses = await asyncio.to_thread(collect)
+        if not misses:
+            await update.message.reply_text(f"За {days} дн. запросов без результата нет")
+            return
+        
+        lines = [f"🔎 Частые запросы без результата за {days} дн. (кнопка - добавить в предложения):", ""]
+        for i, miss in enumerate(misses, 1):
+            count = f"{miss.count}" if not miss.error else f"{miss.count - miss.error}-{miss.count}"
+            lines.append(f"{i}. {miss.query} - {count}")
+        buttons = [
+            InlineKeyboardButton(f"➕ {i}", callback_data=f"miss_{miss.sample}")
+            for i, miss in enumerate(misses, 1) if miss.sample
+        ]
+        keyboard = [buttons[i:i + 5] for i in range(0, len(buttons), 5)]
+        await update.message.reply_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard))
+
+    async def miss_to_suggestion(self, update: Update, search_id: int):
+        """Кнопка отчета /misses: превращает запрос без результата в предложение термина"""
+        user = update.effective_user
+        if user.id not in ADMIN_USER_IDS:
+            return
+        
+        rows = self.db.get_search_log(after_id=search_id - 1, limit=1)
+        if not rows or rows[0][0] != search_id:
+            await update.effective_message.reply_text("❌ Запрос не найден в журнале поисков")
+            return
+        query = rows[0][3].strip()
         
-        stats_text = f"""
-📊 *Статистика парфюмерного словаря*
+        if self.suggestion_pending(query):
+            await update.effective_message.reply_text(f"Предложение «{query}» уже ждет рассмотрения")
+            return
+        await asyncio.to_thread(self.db.add_suggestion, user.id, user.username or user.first_name, query,
+                                "Частый запрос без результата (отчет /misses)")
+        await update.effective_message.reply_text(f"✅ «{query}» добавлен в предложения терминов")
+        logger.info("Запрос без результата добавлен в предложения", extra={'event': 'miss_suggestion'})
 
-📚 Всего терминов: *{stats['total_terms']}*
-🏷️ Категорий: *{stats['total_categories']}*
-🔍 Поисков за неделю: *{stats['searches_week']}*
-💡 Ожидает модерации: *{stats['pending_suggestions']}*
+    @staticmethod
+    def parse_edit_command(text: str, labels: dict):
+        """Разбирает команду редактирования: id в первой строке, далее строки "поле: значение"
 
-🔥 *Популярные термины:*
+        Возвращает (список id, поля) или None, если команда записана неверно; "-" очищает поле.
         """
+        lines = text.strip().splitlines()
+        ids = lines[0].split()[1:]
+        if not ids or not all(item.isdigit() for item in ids):
+            return None
+        
+        fields = {}
+        for line in lines[1:]:
+            if not line.strip():
+                continue
+            label, separator, value = line.partition(':')
+            field = labels.get(label.strip().lower())
+            if not separator or field is None:
+                return None
+            value = value.strip()
+            fields[field] = None if value == '-' else value
+        return [int(item) for item in ids], fields
+
+    async def edit_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команд редактирования словаря (только для администраторов)"""
+        if update.effective_user.id not in ADMIN_USER_IDS:
+            return
+        
+        command = update.message.text.split()[0][1:].split('@')[0].lower()
+        entity, action, method, usage = EDIT_COMMANDS[command]
+        parsed = self.parse_edit_command(update.message.text, EDIT_LABELS[entity])
+        if parsed is None or len(parsed[0]) != (2 if action == MERGE else 1) or bool(parsed[1]) != (action == UPDATE):
+            await update.message.reply_text(f"Формат команды:\n{usage}\n\n\"-\" вместо значения очищает поле")
+            return
+        ids, fields = parsed
+        
+        # Существование проверяется чтением заранее, чтобы назвать сразу все отсутствующие ID
+        get = self.db.get_term_by_id if entity == TERM else self.db.get_category
+        missing = [str(item) for item in ids if get(item) is None]
+        if missing:
+            await update.message.reply_text(f"❌ Не найдено: {', '.join(missing)}")
+            return
         
-        # Добавляем популярные термины если есть
-        if stats.get('popular_terms'):
-            for i, term in enumerate(stats['popular_terms'][:5], 1):
-                stats_text += f"{i}. {term['term']} ({term['usage_count']} запросов)\n"
+        try:
+            args = (*ids, fields) if action == UPDATE else ids
+            revision = await asyncio.to_thread(getattr(self.db, method), *args)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+        
+        self.changes.sync()
+        logger.info("Правка словаря: %s %s %s", entity, action, ids,
+                    extra={'event': 'dictionary_edit', 'user': hash_user_id(update.effective_user.id)})
+        if revision is None:
+            # Запись удалена другой правкой между проверкой и изменением
+            await update.message.reply_text("❌ Не найдено")
         else:
-            stats_text += "Пока нет данных о популярности терминов"
+            await update.message.reply_text(f"✅ Готово, ревизия словаря {revision}")
+
+    async def subscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /subscribe - подписка на термин дня"""
+        await self.set_subscription(update, subscribe=True)
+
+    async def unsubscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /unsubscribe - отписка от термина дня"""
+        await self.set_subscription(update, subscribe=False)
+
+    async def show_history(self, update: Update):
+        """Последние термины, которые смотрел пользователь (кнопка 'Мои запросы' и /history)"""
+        history = self.history.get(update.effective_user.id)
+        
+        text = rendering.HISTORY if history else rendering.HISTORY_EMPTY
         
         keyboard = [
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="start")]
+            [
+                InlineKeyboardButton(f"📖 {term}", callback_data=f"term_{term_id}")
+                for term_id, term in history[i:i + 2]
+            ]
+            for i in range(0, len(history), 2)
         ]
+        keyboard.append([rendering.MENU_BUTTON])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text, parse_mode=PARSE_MODE, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(text, parse_mode=PARSE_MODE, reply_markup=reply_markup)
+
+    async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /history"""
+        await self.show_history(update)
+
+    async def subscription_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Callback для кнопки 'Термин дня'"""
+        subscribed = self.db.is_subscribed(update.effective_chat.id)
+        
+        text = rendering.SUBSCRIPTION.render(time=BROADCAST_TIME)
+        text += rendering.SUBSCRIBED if subscribed else rendering.NOT_SUBSCRIBED
+        
+        keyboard = [
+            [
+                InlineKeyboardButton("🔕 Отписаться", callback_data="unsubscribe") if subscribed
+                else InlineKeyboardButton("🔔 Подписаться", callback_data="subscribe")
+            ],
+            [rendering.MENU_BUTTON]
+        ]
+        
         await update.callback_query.edit_message_text(
-            stats_text, 
-            parse_mode='Markdown',
-            reply_markup=reply_markup
+            text,
+            parse_mode=PARSE_MODE,
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
-    async def show_term_by_id(self, update: Update, term_id: int):
-        """Показывает термин по ID"""
-        term = self.db.get_term_by_id(term_id)
+    async def set_subscription(self, update: Update, subscribe: bool):
+        """Подписывает или отписывает чат от термина дня"""
+        chat_id = update.effective_chat.id
         
-        if term:
-            # Увеличиваем счетчик использования
-            self.db.increment_usage(term_id)
-            await self.send_term_info(update, term)
+        if subscribe:
+            if self.db.is_subscribed(chat_id):
+                text = "✅ Вы уже подписаны на термин дня."
+            else:
+                await asyncio.to_thread(self.db.add_subscriber, chat_id)
+                text = f"🔔 Готово! Термин дня будет приходить каждый день в {BROADCAST_TIME}.\nОтписаться: /unsubscribe"
         else:
-            await update.callback_query.edit_message_text("❌ Термин не найден")
+            if self.db.is_subscribed(chat_id):
+                await asyncio.to_thread(self.db.remove_subscriber, chat_id)
+                text = "🔕 Вы отписались от термина дня. Подписаться снова: /subscribe"
+            else:
+                text = "Вы не подписаны на термин дня. Подписаться: /subscribe"
+        
+        # Новым сообщением, чтобы не затирать карточку термина из рассылки
+        await update.effective_message.reply_text(text)
+        logger.info("Подписка на термин дня: %s", subscribe,
+                    extra={'event': 'subscription', 'user': hash_user_id(chat_id)})
 
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
-        logger.error(f"Ошибка: {context.error}")
+        logger.error("Ошибка: %s", context.error, exc_info=context.error)
         
         if update and update.effective_message:
             await update.effective_message.reply_text(
@@ -636,42 +847,210 @@ async def setup_bot_commands(application):
     await application.bot.set_my_commands(commands)
     logger.info("Команды бота настроены")
 
+def register_handlers(app: Application, bot: PerfumeBot):
+    """Регистрирует обработчики бота в приложении"""
+    # Ограничение частоты запросов выполняется раньше всех остальных обработчиков
+    app.add_handler(TypeHandler(Update, bot.rate_limit_guard), group=-1)
+    
+    # Правки словаря из других процессов применяются до поиска
+    app.add_handler(TypeHandler(Update, bot.sync_changes), group=-3)
+    
+    # Добавляем обработчики команд (английские и русские)
+    # Только основная команда /start (остальные скрыты - только через кнопки)
+    app.add_handler(CommandHandler("start", bot.start_command))
+    app.add_handler(CommandHandler("subscribe", bot.subscribe_command))
+    app.add_handler(CommandHandler("unsubscribe", bot.unsubscribe_command))
+    app.add_handler(CommandHandler("history", bot.history_command))
+    app.add_handler(CommandHandler("apistats", bot.api_stats_command))
+    app.add_handler(CommandHandler("misses", bot.misses_command))
+    app.add_handler(CommandHandler("suggest", bot.suggest_command))
+    app.add_handler(CommandHandler("cancel", bot.cancel_command))
+    app.add_handler(CommandHandler(list(EDIT_COMMANDS), bot.edit_command))
+    
+    # Обработчик кнопок
+    app.add_handler(CallbackQueryHandler(bot.button_handler))
+    
+    # Сообщения с предложением термина (после кнопки "💡 Предложить термин") не доходят до поиска
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & bot.intake.filter, bot.suggestion_message))
+    
+    # Обработчик текстовых сообщений (поиск терминов)
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.search_terms))
+    
+    # Обработчик ошибок
+    app.add_error_handler(bot.error_handler)
+
+def build_api_request(shared: bool = False):
+    """Клиент Bot API с настройками TELEGRAM_*; shared - один клиент на ботов всех словарей"""
+    http2 = None if TELEGRAM_HTTP2 == 'auto' else TELEGRAM_HTTP2 == 'true'
+    return build_request(TELEGRAM_POOL_SIZE, keepalive_expiry=TELEGRAM_KEEPALIVE, http2=http2, shared=shared)
+
+def application_builder(token: str = BOT_TOKEN, request=None, tracked_messages: int = MAX_TRACKED_MESSAGES):
+    """Конструктор приложения: токен, пул соединений и слой исходящих вызовов Bot API"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request or build_api_request())
+        .rate_limiter(OutboundLimiter(max_tracked_messages=tracked_messages))
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    return builder
+
+def schedule_broadcast(app: Application, database: StorageBackend, shutdown: GracefulShutdown = None,
+                       delay: float = 0):
+    """Планирует ежедневную рассылку термина дня и продолжение прерванной"""
+    timezone = ZoneInfo(BROADCAST_TIMEZONE)
+    hour, minute = (int(part) for part in BROADCAST_TIME.split(':'))
+    broadcaster = Broadcaster(database, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY, timezone=timezone)
+    
+    callback = broadcaster.job_callback
+    if shutdown:
+        # Рассылка сохраняет доставленные пачки при отмене, поэтому при остановке ее можно прервать
+        callback = shutdown.cancellable(callback)
+    app.job_queue.run_daily(callback, dt_time(hour, minute, tzinfo=timezone), name="term_of_the_day")
+    # Если бот перезапустился посреди рассылки, дослать ее оставшимся подписчикам
+    app.job_queue.run_once(callback, 10 + delay, data={'create': False}, name="term_of_the_day_resume")
+    logger.info("Рассылка термина дня запланирована на %s (%s)", BROADCAST_TIME, BROADCAST_TIMEZONE)
+    return broadcaster
+
+def schedule_related_terms(app: Application, database: StorageBackend, delay: float = 0):
+    """Планирует периодический пересчет связанных терминов"""
+    indexer = RelatedTermsIndexer(database)
+    app.job_queue.run_repeating(indexer.job_callback, RELATED_TERMS_INTERVAL, first=30 + delay, name="related_terms")
+    return indexer
+
+def schedule_sheets_sync(app: Application, database: StorageBackend, delay: float = 0):
+    """Планирует выгрузку журналов в Google Sheets, если таблица настроена"""
+    if not GOOGLE_SHEETS_ID:
+        return None
+    sync = SheetsSync(database, lambda: open_spreadsheet(GOOGLE_SHEETS_ID, GOOGLE_CREDENTIALS),
+                      batch_size=SHEETS_BATCH_SIZE)
+    app.job_queue.run_repeating(sync.job_callback, SHEETS_SYNC_INTERVAL, first=20 + delay, name="sheets_sync")
+    return sync
+
+def schedule_missed_queries(app: Application, tracker: MissTracker, delay: float = 0):
+    """Планирует дочитывание журнала поисков в сводки неуспешных запросов"""
+    app.job_queue.run_repeating(tracker.job_callback, MISSED_QUERIES_INTERVAL, first=40 + delay, name="missed_queries")
+
+def schedule_user_data(app: Application, storage: ExternalStorage, delay: float = 0):
+    """Отложенная запись журнала поисков и предложений (без fsync, в отдельном потоке)"""
+    app.job_queue.run_repeating(storage.job_callback, USER_DATA_FLUSH_INTERVAL,
+                                first=USER_DATA_FLUSH_INTERVAL + delay, name="user_data")
+
+def schedule_user_metrics(app: Application, audience: UniqueUsers, delay: float = 0):
+    """Сохранение сводок уникальных пользователей в базу (в отдельном потоке)"""
+    app.job_queue.run_repeating(audience.job_callback, USER_METRICS_FLUSH_INTERVAL,
+                                first=USER_METRICS_FLUSH_INTERVAL + delay, name="user_metrics")
+
+def schedule_dictionary_artifact(app: Application, compiler: DictionaryCompiler, delay: float = 0):
+    """Планирует пересборку файла словаря после правок"""
+    if not compiler.path:
+        return
+    app.job_queue.run_repeating(compiler.job_callback, DICTIONARY_ARTIFACT_INTERVAL,
+                                first=DICTIONARY_ARTIFACT_INTERVAL + delay, name="dictionary_artifact")
+
+def build_worker_application(database: StorageBackend, storage) -> Application:
+    """Создает приложение процесса-обработчика (без получения обновлений)"""
+    bot = PerfumeBot(database, storage)
+    app = application_builder().updater(None).build()
+    register_handlers(app, bot)
+    # Каждый обработчик копит свои сводки и сохраняет их через процесс-писатель
+    schedule_user_metrics(app, bot.audience)
+    app.bot_data['on_stop'] = [bot.audience.flush]
+    return app
+
 def main():
     """Главная функция запуска бота"""
-    import asyncio
-    import fcntl
     from threading import Thread
-    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
     
-    # Проверяем, не запущен ли уже бот
-    lock_file = "bot.lock"
-    try:
-        lock_fd = os.open(lock_file, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
-        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        logger.info("🔒 Блокировка файла получена - бот не запущен")
-    except (OSError, IOError):
-        logger.error("❌ Бот уже запущен! Остановите другой экземпляр.")
-        sys.exit(1)
+    # Словари процесса (см. TENANTS) регистрируются после получения лидерства
+    postgres = STORAGE_BACKEND == 'postgres'
+    registry = TenantRegistry(postgres=postgres)
     
-    logger.info("🚀 Запуск бота...")
+    # Профилирование по запросу администратора (см. PROFILING_TOKEN)
+    profiler = Profiler()
+    
+    # Состояние для проб /healthz и /readyz
+    monitor = HealthMonitor(
+        stall_after=HEALTH_STALL_SECONDS,
+        max_db_rtt=HEALTH_MAX_DB_RTT,
+        max_queue_depth=HEALTH_MAX_QUEUE
+    )
     
     # Простой HTTP сервер для Render
     class HealthHandler(BaseHTTPRequestHandler):
         def do_GET(self):
+            probe = (monitor.handle_request(self.path)
+                     or registry.handle_request(self.path, self.headers, TENANTS_TOKEN))
+            if probe is not None:
+                status, content_type, body = probe
+                self.send_response(status)
+                self.send_header('Content-type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if self.profiling_request('GET'):
+                return
             self.send_response(200)
             self.send_header('Content-type', 'text/plain')
             self.end_headers()
             self.wfile.write(b'Bot is running!')
         
+        def do_POST(self):
+            if not self.profiling_request('POST'):
+                self.send_error(404)
+        
+        def profiling_request(self, method):
+            response = handle_profiling_request(profiler, PROFILING_TOKEN, method, self.path, self.headers)
+            if response is None:
+                return False
+            status, content_type, body, filename = response
+            self.send_response(status)
+            self.send_header('Content-type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if filename:
+                self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+        
         def log_message(self, format, *args):
             pass  # Отключаем логи HTTP сервера
     
-    # Запуск HTTP сервера в отдельном потоке
+    # Запуск HTTP сервера в отдельном потоке. Каждый запрос обслуживается своим потоком
+    # и не обращается ни к event loop, ни к базе, поэтому проба отвечает и при зависшем боте
     port = int(os.environ.get('PORT', 10000))
-    httpd = HTTPServer(('0.0.0.0', port), HealthHandler)
+    httpd = ThreadingHTTPServer(('0.0.0.0', port), HealthHandler)
+    httpd.daemon_threads = True
     http_thread = Thread(target=httpd.serve_forever, daemon=True)
     http_thread.start()
-    logger.info(f"HTTP сервер запущен на порту {port}")
+    logger.info("HTTP сервер запущен на порту %s", port)
+    
+    # Выбор лидера: второй экземпляр не завершается, а ждет в резерве
+    # (HTTP сервер уже отвечает: резерв жив, но не готов)
+    election = LeaderElection(LEADER_LOCK_PATH)
+    if not election.try_acquire():
+        logger.info("⏳ Бот уже запущен другим процессом, ожидаем в резерве...")
+        election.wait_for_leadership()
+    logger.info("🔒 Лидерство получено - этот процесс обрабатывает обновления")
+    
+    logger.info("🚀 Запуск бота...")
+    
+    # Словари процесса: у каждого свой бот, своя база и доля памяти кэшей
+    try:
+        tenants = load_tenants(TENANTS, BOT_TOKEN, None if postgres else DATABASE_PATH,
+                               DICTIONARY_ARTIFACT_PATH, postgres=postgres, user_data_path=USER_DATA_PATH)
+        # Доли словарей в сумме не превышают пределов процесса (в том числе DICTIONARY_MEMORY_LIMIT)
+        budgets = PROCESS_BUDGET.split([tenant.weight for tenant in tenants])
+    except (OSError, ValueError) as e:
+        logger.error("Ошибка настройки TENANTS: %s", e)
+        return
+    for tenant, budget in zip(tenants, budgets):
+        registry.add(tenant, budget)
+    db = registry.primary.database
+    multi = len(registry) > 1
     
     # Настройка продакшена при первом запуске
     if not os.path.exists("data"):
@@ -680,63 +1059,174 @@ def main():
     
     # Инициализация базы данных при первом запуске
     try:
-        db_test = PerfumeDatabase()
-        stats = db_test.get_database_stats()
+        stats = db.get_database_stats()
         if stats['total_terms'] == 0:
             logger.info("База данных пуста, инициализируем начальные данные...")
             # Здесь база данных уже инициализирована в __init__
-        logger.info(f"База данных готова: {stats['total_terms']} терминов")
-        db_test.close()
+        logger.info("База данных готова: %s терминов", stats['total_terms'])
     except Exception as e:
-        logger.error(f"Ошибка инициализации базы данных: {e}")
+        logger.error("Ошибка инициализации базы данных: %s", e)
         return
     
     # Проверяем конфигурацию
     is_valid, message = validate_config()
     if not is_valid:
-        logger.error(f"Ошибка конфигурации: {message}")
+        logger.error("Ошибка конфигурации: %s", message)
         return
     
     logger.info("Запуск бота 'Парфюмерный календарь'...")
     
-    # Создаем экземпляр бота
-    bot = PerfumeBot()
+    if multi:
+        logger.info("Словарей в процессе: %s (%s)", len(registry), ", ".join(registry.entries))
+        if WORKERS > 1:
+            logger.warning("WORKERS=%s не используется: несколько словарей обслуживаются в одном процессе", WORKERS)
     
-    # Создаем приложение
-    app = Application.builder().token(BOT_TOKEN).build()
+    # Остановка по SIGTERM: дождаться обработчиков, дописать очереди, закрыть базу
+    shutdown = GracefulShutdown(drain_timeout=SHUTDOWN_DRAIN_TIMEOUT, total_timeout=SHUTDOWN_TIMEOUT)
     
-    # Добавляем обработчики команд (английские и русские)
-    # Только основная команда /start (остальные скрыты - только через кнопки)
-    app.add_handler(CommandHandler("start", bot.start_command))
+    # Боты словарей делят один клиент Bot API
+    request = build_api_request(shared=True) if multi else None
     
-    # Обработчик кнопок
-    app.add_handler(CallbackQueryHandler(bot.button_handler))
+    pool = None
+    writer = None
+    for index, entry in enumerate(list(registry)):
+        tenant = entry.tenant
+        
+        # Файл словаря собирается до создания бота и процессов-обработчиков, чтобы они открыли свежую версию
+        compiler = DictionaryCompiler(entry.database, tenant.artifact_path)
+        compiler.refresh()
+        
+        # Создаем экземпляр бота и приложение
+        bot = entry.bot = PerfumeBot(entry.database, ExternalStorage(tenant.user_data_path),
+                                     budget=entry.budget, artifact_path=tenant.artifact_path)
+        
+        # Снимок и индексы поиска словаря должны уместиться в его долю памяти процесса
+        # (в режиме масштабирования они живут в процессах-обработчиках)
+        if WORKERS <= 1 or multi:
+            size = entry.measure_indexes()
+            if size > entry.budget.index_bytes:
+                logger.error("Словарь %s не запущен: снимок и индексы поиска занимают %.1f МБ, доля словаря %.1f МБ "
+                             "(DICTIONARY_MEMORY_LIMIT)", tenant.name, size / 2 ** 20, entry.budget.index_bytes / 2 ** 20)
+                registry.remove(tenant.name)
+                continue
+        
+        app = entry.app = application_builder(tenant.token, request, entry.budget.tracked_messages).build()
+        
+        # В режиме масштабирования лидер только принимает обновления и пишет в БД,
+        # а обработку выполняют процессы-обработчики
+        if WORKERS > 1 and not multi:
+            # SQLite пишет только лидер; серверная СУБД принимает запись от всех процессов
+            db_path = DATABASE_PATH if STORAGE_BACKEND == 'sqlite' else None
+            pool = WorkerPool(WORKERS, build_worker_application, db_path)
+            pool.start()
+            writer = SQLiteWriter(bot.db, bot.storage, pool.write_queue, pool.reply_queues)
+            writer.start()
+            app.add_handler(TypeHandler(Update, pool.dispatch), group=-1)
+            monitor.add_queue('writes', pool.write_queue.qsize)
+            monitor.add_queue('updates', lambda: sum(queue.qsize() for queue in pool.update_queues))
+        else:
+            register_handlers(app, bot)
+        
+        # Время последнего обновления отмечается раньше всех обработчиков
+        app.add_handler(TypeHandler(Update, monitor.track_update), group=-2)
+        app.add_handler(TypeHandler(Update, entry.track_update), group=-4)
+        
+        # Фоновые задачи выполняет только лидер, поэтому они не дублируются при нескольких экземплярах;
+        # первые запуски задач соседних словарей разнесены во времени
+        delay = index * TENANT_JOB_STAGGER
+        schedule_broadcast(app, bot.db, shutdown, delay)
+        schedule_related_terms(app, bot.db, delay)
+        if entry is registry.primary:
+            # Таблица Google Sheets одна - в нее выгружаются журналы основного словаря
+            schedule_sheets_sync(app, bot.db)
+        schedule_dictionary_artifact(app, compiler, delay)
+        schedule_missed_queries(app, bot.misses, delay)
+        schedule_user_data(app, bot.storage, delay)
+        schedule_user_metrics(app, bot.audience, delay)
     
-    # Обработчик текстовых сообщений (поиск терминов)
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.search_terms))
+    if not len(registry):
+        logger.error("Ни один словарь не уместился в DICTIONARY_MEMORY_LIMIT")
+        return
     
-    # Обработчик ошибок
-    app.add_error_handler(bot.error_handler)
+    # Готовность зависит от хранилищ всех запущенных словарей
+    for entry in registry:
+        monitor.add_database(entry.tenant.name, entry.database)
+    
+    # Основной словарь владеет приложением, которое запускается ниже
+    bot = registry.primary.bot
+    app = registry.primary.app
     
     logger.info("Бот готов к работе!")
     
     # Настраиваем команды бота
     async def post_init(application):
         await setup_bot_commands(application)
+        profiler.attach()
+        monitor.start()
+        shutdown.install(application, on_signal=monitor.begin_shutdown)
+        if not pool:
+            # Индексы глоссария и поиска по описанию строятся до первого запроса
+            for entry in registry:
+                suffix = f':{entry.tenant.name}' if multi else ''
+                monitor.warm_up('glossary' + suffix, lambda bot=entry.bot: bot.glossary.find_terms(''))
+                monitor.warm_up('descriptions' + suffix, entry.bot.descriptions.sync)
+        # Приложения остальных словарей работают в том же event loop (всегда через polling)
+        await registry.start_additional(on_start=setup_bot_commands)
+    
+    async def post_stop(application):
+        # Прием обновлений остановлен, очередь обновлений и задачи JobQueue завершены
+        # (у остальных словарей - здесь же); задачи монитора отменяются, пока event loop еще работает
+        await registry.stop_additional()
+        shutdown.drained()
+        monitor.stop()
     
     app.post_init = post_init
+    app.post_stop = post_stop
+    
+    # Процессы-обработчики дописывают свои очереди, затем писатель - очередь записи
+    if pool:
+        shutdown.add_step('workers', lambda: pool.stop(timeout=shutdown.remaining()))
+    if writer:
+        shutdown.add_step('writes', lambda: writer.stop(timeout=shutdown.remaining()))
+    def flush_metrics():
+        for entry in registry:
+            entry.bot.audience.flush()
+    
+    def flush_user_data():
+        # Записи процессов-обработчиков уже применены этапом writes; здесь файл сбрасывается на диск
+        for entry in registry:
+            entry.bot.storage.flush(durable=True)
+    
+    shutdown.add_step('metrics', flush_metrics)
+    shutdown.add_step('user_data', flush_user_data)
+    shutdown.add_step('database', registry.close)
+    shutdown.add_step('leader', election.release)
+    
+    # SIGTERM обрабатывает GracefulShutdown, остальные сигналы - PTB
+    stop_signals = (signal.SIGINT, signal.SIGABRT)
     
     # Запускаем бота
     try:
-        app.run_polling(drop_pending_updates=True)
+        if WEBHOOK_URL:
+            app.run_webhook(
+                listen='0.0.0.0',
+                port=WEBHOOK_PORT,
+                url_path='telegram',
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/telegram",
+                drop_pending_updates=True,
+                stop_signals=stop_signals
+            )
+        else:
+            app.run_polling(drop_pending_updates=True, stop_signals=stop_signals)
     finally:
-        # Очищаем блокировку при завершении
-        try:
-            os.close(lock_fd)
-            os.unlink(lock_file)
-            logger.info("🔓 Блокировка файла освобождена")
-        except:
-            pass
+        shutdown.mark('telegram')
+        shutdown.run_steps()
+        logger.info("🔓 Остановка завершена: %s", shutdown.report(), extra={
+            'event': 'shutdown',
+            'phases': {name: round(seconds * 1000) for name, seconds, _ in shutdown.phases}
+        })
+        # Очередь логов дописывается последней, после отчета об остановке
+        stop_logging()
 
 if __name__ == "__main__":
     main()
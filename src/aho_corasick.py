@@ -0,0 +1,162 @@
+"""
+Автомат Ахо-Корасик для поиска множества строк за один проход по тексту
+"""
+from array import array
+from collections import deque
+from typing import Any, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик
+
+    Переходы всех состояний хранятся в одном словаре с ключом (состояние, символ),
+    что заметно компактнее словаря на каждое состояние. Новые строки можно
+    добавлять в любой момент: они сразу вставляются в бор, а суффиксные ссылки
+    пересчитываются один раз перед следующим поиском.
+    """
+
+    def __init__(self):
+        self._transitions = {}
+        self._fail: List[int] = [0]
+        self._outputs: List[Any] = [None]
+        self._output_link: List[int] = [0]
+        self._depth: List[int] = [0]
+        self._dirty = False
+        self.patterns_count = 0
+
+    def add(self, pattern: str, value: Any):
+        """Добавляет строку и связанное с ней значение"""
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._transitions.get((state, char))
+            if next_state is None:
+                next_state = len(self._fail)
+                self._transitions[(state, char)] = next_state
+                self._fail.append(0)
+                self._outputs.append(None)
+                self._output_link.append(0)
+                self._depth.append(self._depth[state] + 1)
+            state = next_state
+
+        if self._outputs[state] is None:
+            self._outputs[state] = [value]
+            self.patterns_count += 1
+        elif value not in self._outputs[state]:
+            self._outputs[state].append(value)
+        self._dirty = True
+
+    def discard(self, pattern: str, value: Any):
+        """Убирает значение строки; состояния бора остаются, ссылки пересчитываются перед поиском"""
+        state = 0
+        for char in pattern:
+            state = self._transitions.get((state, char))
+            if state is None:
+                return
+        outputs = self._outputs[state]
+        if not outputs or value not in outputs:
+            return
+        outputs.remove(value)
+        if not outputs:
+            self._outputs[state] = None
+            self.patterns_count -= 1
+        self._dirty = True
+
+    def build(self):
+        """Пересчитывает суффиксные ссылки обходом бора в ширину"""
+        children = {}
+        for (state, char), next_state in self._transitions.items():
+            children.setdefault(state, []).append((char, next_state))
+
+        queue = deque()
+        for char, next_state in children.get(0, ()):
+            self._fail[next_state] = 0
+            self._output_link[next_state] = 0
+            queue.append(next_state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in children.get(state, ()):
+                fail = self._fail[state]
+                while fail and (fail, char) not in self._transitions:
+                    fail = self._fail[fail]
+                fail = self._transitions.get((fail, char), 0)
+                self._fail[next_state] = fail
+                # Ссылка на ближайший суффикс, на котором заканчивается строка
+                self._output_link[next_state] = fail if self._outputs[fail] is not None else self._output_link[fail]
+                queue.append(next_state)
+
+        self._dirty = False
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Находит все вхождения: (начало, конец, значение)"""
+        if self._dirty:
+            self.build()
+
+        transitions = self._transitions
+        fail = self._fail
+        outputs = self._outputs
+        output_link = self._output_link
+        depth = self._depth
+
+        state = 0
+        for position, char in enumerate(text):
+            while state and (state, char) not in transitions:
+                state = fail[state]
+            state = transitions.get((state, char), 0)
+
+            match_state = state if outputs[state] is not None else output_link[state]
+            while match_state:
+                end = position + 1
+                for value in outputs[match_state]:
+                    yield end - depth[match_state], end, value
+                match_state = output_link[match_state]
+
+    def export(self, builder, prefix: str):
+        """Записывает автомат в файл словаря (значения строк - целые числа)"""
+        if self._dirty:
+            self.build()
+        builder.add_array(f"{prefix}.from", array('i', (state for state, _ in self._transitions)))
+        builder.add_array(f"{prefix}.char", array('i', (ord(char) for _, char in self._transitions)))
+        builder.add_array(f"{prefix}.to", array('i', self._transitions.values()))
+        builder.add_array(f"{prefix}.fail", array('i', self._fail))
+        builder.add_array(f"{prefix}.output_link", array('i', self._output_link))
+        builder.add_array(f"{prefix}.depth", array('i', self._depth))
+
+        states = [state for state, outputs in enumerate(self._outputs) if outputs]
+        offsets = array('q', [0])
+        values = array('q')
+        for state in states:
+            values.extend(self._outputs[state])
+            offsets.append(len(values))
+        builder.add_array(f"{prefix}.output_states", array('i', states))
+        builder.add_array(f"{prefix}.output_offsets", offsets)
+        builder.add_array(f"{prefix}.output_values", values)
+
+    @classmethod
+    def load(cls, artifact, prefix: str) -> 'AhoCorasick':
+        """Восстанавливает построенный автомат из файла словаря без пересчета ссылок
+
+        Массивы копируются в списки и словарь, чтобы автомат можно было дополнять.
+        """
+        automaton = cls()
+        automaton._transitions = dict(zip(
+            zip(artifact.array(f"{prefix}.from"), map(chr, artifact.array(f"{prefix}.char"))),
+            artifact.array(f"{prefix}.to")
+        ))
+        automaton._fail = artifact.array(f"{prefix}.fail").tolist()
+        automaton._output_link = artifact.array(f"{prefix}.output_link").tolist()
+        automaton._depth = artifact.array(f"{prefix}.depth").tolist()
+        automaton._outputs = [None] * len(automaton._fail)
+
+        offsets = artifact.array(f"{prefix}.output_offsets")
+        values = artifact.array(f"{prefix}.output_values").tolist()
+        states = artifact.array(f"{prefix}.output_states").tolist()
+        for i, state in enumerate(states):
+            automaton._outputs[state] = values[offsets[i]:offsets[i + 1]]
+        automaton.patterns_count = len(states)
+        return automaton
+
+    def __len__(self) -> int:
+        return self.patterns_count
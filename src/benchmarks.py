@@ -0,0 +1,858 @@
+"""
+Замеры производительности бота
+Запуск: python benchmarks.py <замер> [--terms N]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from database import PerfumeDatabase
+
+
+def build_benchmark_db(db_path: str, terms_count: int) -> PerfumeDatabase:
+    """Создает базу с синтетическим словарем заданного размера"""
+    db = PerfumeDatabase(db_path)
+    with db.get_connection() as conn:
+        conn.executemany(
+            'INSERT INTO categories (name) VALUES (?)',
+            [(f"Категория {i}",) for i in range(50)]
+        )
+        conn.executemany('''
+            INSERT INTO terms (term, definition, category_id, examples, synonyms, usage_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            (
+                f"Термин {i}",
+                f"Определение термина номер {i}: аромат с нотами цитруса, амбры и мускуса " * 3,
+                i % 50 + 1,
+                f"Пример использования термина {i} в отзыве о парфюме",
+                f"синоним {i}, synonym {i}",
+                i % 97,
+            )
+            for i in range(terms_count)
+        ))
+    db.rebuild_normalized_fields()
+    return db
+
+
+def legacy_search_terms(db: PerfumeDatabase, query: str, limit: int = 10):
+    """Прежняя реализация поиска: словарь на каждую строку таблицы"""
+    query_lower = query.lower().strip()
+    with db.get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT t.*, c.name as category_name
+            FROM terms t
+            LEFT JOIN categories c ON t.category_id = c.id
+            ORDER BY t.usage_count DESC, t.term
+        ''')
+        all_terms = [dict(row) for row in cursor.fetchall()]
+        for term_data in all_terms:
+            if term_data['term'].lower() == query_lower:
+                return [term_data]
+        results = [t for t in all_terms if t['synonyms'] and query_lower in t['synonyms'].lower()]
+        if results:
+            return results[:limit]
+        results = [t for t in all_terms if query_lower in t['term'].lower()]
+        if results:
+            return results[:limit]
+        return [t for t in all_terms if query_lower in t['definition'].lower()][:limit]
+
+
+def _measure_search(variant: str, db_path: str, queries, result_queue):
+    """Замер одного варианта поиска в отдельном процессе (чистый пик RSS)"""
+    db = PerfumeDatabase(db_path)
+    search = db.search_terms if variant == 'records' else lambda q: legacy_search_terms(db, q)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    stats = {}
+    for query in queries:
+        tracemalloc.start()
+        start = time.perf_counter()
+        results = search(query)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats[query] = (len(results), elapsed * 1000, peak / 1024 / 1024)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result_queue.put((stats, (rss_after - rss_before) / 1024))
+
+
+def bench_search_memory(terms_count: int):
+    """Пиковая память и время одного поиска: словари на строку против компактных записей"""
+    queries = ['термин 5', 'synonym 777', 'несуществующий запрос']
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'bench.db')
+        build_benchmark_db(db_path, terms_count)
+        print(f"Словарь: {terms_count} терминов")
+
+        for variant in ('legacy', 'records'):
+            result_queue = context.Queue()
+            process = context.Process(target=_measure_search, args=(variant, db_path, queries, result_queue))
+            process.start()
+            stats, rss_growth = result_queue.get()
+            process.join()
+
+            print(f"\n{variant}: прирост пикового RSS {rss_growth:.1f} МБ")
+            for query, (found, ms, peak_mb) in stats.items():
+                print(f"  '{query}': найдено {found}, {ms:.1f} мс, пик аллокаций {peak_mb:.1f} МБ")
+
+
+def _make_post(terms_count: int, size: int = 4096) -> str:
+    """Синтетический пост канала размером около size символов с упоминаниями терминов"""
+    filler = "Сегодня в парфюмерном календаре говорим о новом аромате, его шлейфе и стойкости."
+    parts = []
+    i = 0
+    while sum(len(part) + 1 for part in parts) < size:
+        parts.append(filler if i % 3 else f"Упомянем термин {random.randrange(terms_count)}.")
+        i += 1
+    return ' '.join(parts)[:size]
+
+
+def bench_glossary(terms_count: int):
+    """Поиск всех терминов в посте 4 КБ: автомат Ахо-Корасик против поиска по всему сообщению"""
+    from glossary import GlossaryIndex
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        print(f"Словарь: {terms_count} терминов")
+
+        index = GlossaryIndex(db)
+        start = time.perf_counter()
+        index.sync()
+        index.automaton.build()
+        print(f"Построение автомата: {time.perf_counter() - start:.2f} с, строк: {len(index.automaton)}, "
+              f"RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+
+        posts = [_make_post(terms_count) for _ in range(20)]
+
+        start = time.perf_counter()
+        found = [index.find_terms(post) for post in posts]
+        elapsed = (time.perf_counter() - start) * 1000 / len(posts)
+        print(f"Глоссарий поста 4 КБ: {elapsed:.2f} мс, в среднем найдено "
+              f"{sum(map(len, found)) / len(found):.1f} терминов")
+
+        start = time.perf_counter()
+        for post in posts[:3]:
+            db.search_terms(post)
+        elapsed = (time.perf_counter() - start) * 1000 / 3
+        print(f"Прежний путь (весь пост как один запрос): {elapsed:.2f} мс, терминов не найдено")
+
+        # Добавление терминов: вставка в бор и одна перестройка ссылок при следующем поиске
+        for i in range(100):
+            db.add_term(f"Новый термин {i}", "Определение", "Категория 1")
+        start = time.perf_counter()
+        index.find_terms("Сегодня обсуждаем новый термин 7 и термин 15")
+        print(f"Дозагрузка 100 терминов и первый поиск: {(time.perf_counter() - start) * 1000:.0f} мс")
+
+
+def _log_sessions(db: PerfumeDatabase, terms_count: int, users: int, start_id: int = 0):
+    """Синтетический журнал поисков: сессии по 3-6 близких терминов с паузами в часы"""
+    now = time.time()
+    rows = []
+    for user_id in range(start_id, start_id + users):
+        started = now - random.randrange(30 * 24 * 3600)
+        for session in range(3):
+            topic = random.randrange(terms_count)
+            for step in range(random.randint(3, 6)):
+                term_id = (topic + random.randrange(20)) % terms_count + 1
+                searched_at = started + session * 4 * 3600 + step * 60
+                rows.append((user_id, term_id, f"Термин {term_id - 1}", 1,
+                             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(searched_at))))
+    with db.get_connection() as conn:
+        conn.executemany('''
+            INSERT INTO search_stats (user_id, term_id, query, found, search_date) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+    return len(rows)
+
+
+def _request_time_related(db: PerfumeDatabase, term_id: int, limit: int = 4):
+    """Расчет связанных терминов прямо при запросе (самосоединение журнала поисков)"""
+    with db.get_connection() as conn:
+        return conn.execute('''
+            SELECT b.term_id, COUNT(*) AS together 
+            FROM search_stats a 
+            JOIN search_stats b ON a.user_id = b.user_id AND a.term_id != b.term_id 
+                AND ABS(strftime('%s', a.search_date) - strftime('%s', b.search_date)) <= 1800 
+            WHERE a.term_id = ? 
+            GROUP BY b.term_id 
+            ORDER BY together DESC 
+            LIMIT ?
+        ''', (term_id, limit)).fetchall()
+
+
+def bench_related(terms_count: int):
+    """Связанные термины: фоновый пересчет и чтение готового списка против расчета при запросе"""
+    from recommendations import RelatedTermsIndexer
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        users = max(terms_count // 5, 100)
+        searches = _log_sessions(db, terms_count, users)
+        print(f"Словарь: {terms_count} терминов, журнал: {searches} поисков")
+
+        indexer = RelatedTermsIndexer(db)
+        start = time.perf_counter()
+        updated = indexer.update()
+        print(f"Первый пересчет: {time.perf_counter() - start:.1f} с, терминов: {updated}")
+
+        added = _log_sessions(db, terms_count, 200, start_id=users)
+        start = time.perf_counter()
+        updated = indexer.update()
+        print(f"Инкрементальный пересчет (+{added} поисков): {(time.perf_counter() - start) * 1000:.0f} мс, "
+              f"терминов: {updated}")
+
+        sample = [random.randrange(terms_count) + 1 for _ in range(200)]
+        start = time.perf_counter()
+        for term_id in sample:
+            db.get_related_terms(term_id)
+        elapsed = (time.perf_counter() - start) * 1000 / len(sample)
+        print(f"Чтение готового списка: {elapsed:.3f} мс на карточку")
+
+        start = time.perf_counter()
+        for term_id in sample[:5]:
+            _request_time_related(db, term_id)
+        elapsed = (time.perf_counter() - start) * 1000 / 5
+        print(f"Расчет при запросе: {elapsed:.1f} мс на карточку")
+
+
+def _descriptor_words(count: int):
+    """Синтетические прилагательные-дескрипторы: корень и две формы ("...ый" и "...о")"""
+    consonants, vowels = 'бвгдзклмнпрстфхш', 'аоуэи'
+    roots = set()
+    while len(roots) < count:
+        roots.add(''.join(random.choice(consonants) + random.choice(vowels) for _ in range(3)) + random.choice('бвгдзклмнпрсф'))
+    return [(root + 'ый', root + 'о') for root in sorted(roots)]
+
+
+def bench_describe(terms_count: int):
+    """Поиск по описанию: BM25 по разреженной матрице против подстроки в определении"""
+    from description_search import DescriptionIndex
+
+    random.seed(1)
+    words = _descriptor_words(5000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = PerfumeDatabase(os.path.join(tmp_dir, 'bench.db'))
+        descriptors = [random.sample(range(len(words)), 6) for _ in range(terms_count)]
+        with db.get_connection() as conn:
+            conn.execute("INSERT INTO categories (name) VALUES ('Категория')")
+            conn.executemany(
+                'INSERT INTO terms (term, definition, category_id, examples) VALUES (?, ?, 1, ?)',
+                (
+                    (f"Термин {i}", "Аромат " + ", ".join(words[w][0] for w in chosen[:4]),
+                     "В отзывах: " + ", ".join(words[w][0] for w in chosen[4:]))
+                    for i, chosen in enumerate(descriptors)
+                )
+            )
+        db.rebuild_normalized_fields()
+        print(f"Словарь: {terms_count} терминов")
+
+        index = DescriptionIndex(db)
+        start = time.perf_counter()
+        index.sync()
+        print(f"Построение индекса: {time.perf_counter() - start:.1f} с, основ: {len(index.postings)}, "
+              f"RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+
+        # Запрос описывает термин другими формами слов: "пахнет <дескриптор>о, <дескриптор>о"
+        targets = random.sample(range(terms_count), 200)
+        queries = [
+            (i + 1, "пахнет " + ", ".join(words[w][1] for w in random.sample(descriptors[i], 3)))
+            for i in targets
+        ]
+
+        for name, search in (
+            ('Подстрока в определении', lambda q: [t.id for t in db.search_terms(q)]),
+            ('BM25 по описанию', lambda q: [term_id for term_id, _ in index.search_ids(q)]),
+        ):
+            sample = queries if name.startswith('BM25') else queries[:20]
+            start = time.perf_counter()
+            hits = sum(target in search(query) for target, query in sample)
+            elapsed = (time.perf_counter() - start) * 1000 / len(sample)
+            print(f"{name}: recall@10 {hits / len(sample):.0%}, {elapsed:.2f} мс на запрос")
+
+        for i in range(100):
+            db.add_term(f"Новый термин {i}", "Аромат " + ", ".join(words[w][0] for w in descriptors[i][:4]))
+        # Новые термины индекс дочитывает по шине изменений, поиск к базе не обращается
+        start = time.perf_counter()
+        index.sync()
+        index.search_ids(queries[0][1])
+        print(f"Дозагрузка 100 терминов и первый поиск: {(time.perf_counter() - start) * 1000:.0f} мс")
+
+
+def bench_edits(terms_count: int):
+    """Правки словаря: точечное обновление индексов по шине изменений против полного перестроения"""
+    from change_bus import ChangeBus
+    from description_search import DescriptionIndex
+    from glossary import GlossaryIndex
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        print(f"Словарь: {terms_count} терминов")
+
+        glossary, descriptions = GlossaryIndex(db), DescriptionIndex(db)
+        start = time.perf_counter()
+        glossary.sync()
+        glossary.automaton.build()
+        descriptions.sync()
+        rebuild = time.perf_counter() - start
+        print(f"Полное построение индексов: {rebuild:.2f} с")
+
+        bus = ChangeBus(db)
+        bus.subscribe(glossary.apply_change)
+        bus.subscribe(descriptions.apply_change)
+
+        # Правки вперемешку: переименование, слияние, удаление
+        ids = random.sample(range(1, terms_count + 1), 300)
+        renamed = []
+        start = time.perf_counter()
+        for i in range(0, len(ids), 3):
+            db.update_term(ids[i], {'term': f"Переименованный термин {i}", 'definition': "Аромат свежескошенной травы"})
+            db.merge_terms(ids[i + 1], ids[i])
+            db.delete_term(ids[i + 2])
+            bus.sync()
+            renamed.append((ids[i], f"Переименованный термин {i}"))
+        elapsed = (time.perf_counter() - start) * 1000 / len(ids)
+        print(f"Правка с записью и обновлением индексов: {elapsed:.2f} мс "
+              f"(перестроение после каждой правки: {rebuild * 1000:.0f} мс)")
+
+        start = time.perf_counter()
+        glossary.find_terms("обсуждаем термин")
+        print(f"Первый поиск после правок (пересчет ссылок автомата): {(time.perf_counter() - start) * 1000:.0f} мс")
+
+        term_id, name = renamed[0]
+        assert [found_id for found_id, _ in glossary.find_terms(f"Сегодня про {name.lower()}")] == [term_id]
+        removed = set(ids[1::3]) | set(ids[2::3])
+        assert not removed & {found_id for found_id, _ in descriptions.search_ids("свежескошенной травы", limit=200)}
+        print(f"В индексах: {len(glossary.automaton)} строк глоссария, {len(descriptions)} документов")
+
+
+def bench_artifact(terms_count: int):
+    """Старт процесса: индексы из файла словаря (mmap) против построения из базы"""
+    from description_search import DescriptionIndex
+    from dictionary_artifact import compile_dictionary, open_artifact
+    from dictionary_snapshot import SnapshotStore
+    from glossary import GlossaryIndex
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        path = os.path.join(tmp_dir, 'dictionary.bin')
+        print(f"Словарь: {terms_count} терминов")
+
+        start = time.perf_counter()
+        compile_dictionary(db, path)
+        print(f"Сборка файла словаря: {time.perf_counter() - start:.2f} с, {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+
+        posts = [_make_post(terms_count) for _ in range(5)]
+        results = {}
+        for name, artifact in (('Из базы', None), ('Из файла словаря', open_artifact(path, db))):
+            start = time.perf_counter()
+            glossary = GlossaryIndex(db, artifact)
+            descriptions = DescriptionIndex(db, artifact=artifact)
+            glossary.sync()
+            descriptions.sync()
+            print(f"{name}: индексы готовы за {(time.perf_counter() - start) * 1000:.0f} мс")
+            start = time.perf_counter()
+            snapshot = SnapshotStore(db, artifact=artifact).current
+            print(f"{name}: снимок словаря готов за {(time.perf_counter() - start) * 1000:.0f} мс")
+            results[name] = ([glossary.find_terms(post) for post in posts],
+                             [descriptions.search_ids(f"Определение термина {i}") for i in range(5)],
+                             [(entry.record.id, entry.record.definition, entry.name_norm, entry.keys)
+                              for entry in snapshot.ordered])
+        assert results['Из базы'] == results['Из файла словаря']
+        print("Результаты поиска совпадают")
+
+
+def bench_misses(terms_count: int):
+    """Частые запросы без результата: сводка Space-Saving против точного подсчета"""
+    from collections import Counter
+    from missed_queries import SpaceSaving, merge_top
+
+    random.seed(1)
+    stream = [f"запрос {int(random.paretovariate(1.1)) % terms_count}" for _ in range(terms_count * 10)]
+    for capacity in (100, 1000):
+        sketch = SpaceSaving(capacity)
+        start = time.perf_counter()
+        for i, key in enumerate(stream):
+            sketch.add(key, i)
+        elapsed = (time.perf_counter() - start) * 1e6 / len(stream)
+        exact = [key for key, _ in Counter(stream).most_common(50)]
+        found = [miss.query for miss in merge_top([sketch], 50)]
+        print(f"Сводка на {capacity} строк: {elapsed:.2f} мкс на запрос, "
+              f"совпадение топ-50 с точным подсчетом {len(set(found) & set(exact)) / 50:.0%}")
+
+
+def _read_under_writes(read, write, duration: float, readers: int = 4):
+    """Задержки чтения, пока параллельно идет тяжелая запись: (задержки в мс, число записей)"""
+    import threading
+
+    stop = threading.Event()
+    latencies, writes = [], [0]
+
+    def reader(seed: int):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            start = time.perf_counter()
+            read(rng)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    def writer():
+        while not stop.is_set():
+            write()
+            writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), writes[0]
+
+
+def bench_snapshots(terms_count: int):
+    """Чтение словаря во время тяжелой записи: запросы к базе против снимка в памяти"""
+    from change_bus import ChangeBus
+    from dictionary_snapshot import SnapshotStore
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        start = time.perf_counter()
+        store = SnapshotStore(db)
+        print(f"Словарь: {terms_count} терминов, сборка снимка {time.perf_counter() - start:.2f} с")
+        bus = ChangeBus(db, revision=store.current.revision)
+        bus.subscribe_batch(store.apply_changes)
+        added = [0]
+
+        def write():
+            # Массовый импорт пачки терминов и пересчет счетчиков по всей таблице
+            with db.get_connection() as conn:
+                conn.execute('UPDATE terms SET usage_count = usage_count + 1 WHERE id % 7 = ?', (added[0] % 7,))
+            for _ in range(100):
+                db.add_term(f"Импорт {added[0]}", "Определение импортированного термина", "Импорт")
+                added[0] += 1
+            bus.sync()
+
+        def queries(source):
+            def read(rng):
+                i = rng.randrange(terms_count)
+                source().search_terms(f"Термин {i}" if rng.random() < 0.5 else f"синоним {i}")
+                source().get_term_by_id(i + 1)
+                source().get_category_terms(i % 50 + 1)
+            return read
+
+        variants = (
+            ("база", lambda: db),
+            ("снимок", lambda: store.current),
+        )
+        for name, source in variants:
+            for writer, label in ((lambda: time.sleep(0.1), "без записи"), (write, "с записью")):
+                latencies, writes = _read_under_writes(queries(source), writer, duration=5.0)
+                p50 = latencies[len(latencies) // 2]
+                p99 = latencies[int(len(latencies) * 0.99)]
+                print(f"Чтение из {name} {label}: {len(latencies) / 5:.0f} чтений/с, медиана {p50:.1f} мс, "
+                      f"99% {p99:.1f} мс, макс. {latencies[-1]:.0f} мс" +
+                      (f"; импортов за замер: {writes}" if writer is write else ""))
+
+        assert store.current.revision == db.get_revision()
+        assert len(store.current) == len(db.get_term_catalog())
+
+
+def bench_render(terms_count: int):
+    """Оформление ответов: сборка меню на каждый вызов против готового и экранирование карточек"""
+    import re
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    from rendering import MAIN_MENU, escape, render_term_card
+    from term_record import TermRecord
+
+    rows = [[("🎲 Случайный термин", "random"), ("📚 Категории", "categories")],
+            [("💡 Предложить термин", "suggest"), ("📊 Статистика", "stats")],
+            [("🔔 Термин дня", "subscription"), ("📜 Мои запросы", "history")],
+            [("ℹ️ Помощь", "help")]]
+    repeats = 10000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows])
+    built = (time.perf_counter() - start) * 1e6 / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        MAIN_MENU.to_dict()
+    print(f"Главное меню: сборка {built:.1f} мкс, готовое (только сериализация) "
+          f"{(time.perf_counter() - start) * 1e6 / repeats:.1f} мкс")
+
+    # Названия со служебными символами MarkdownV2
+    names = ["Eau de Parfum (EDP)", "Black Opium*", "CK One_Summer", "Tom Ford [Private Blend]", "No.5",
+             "Creed | Aventus", "Ombré Leather `16`", "Эдп (парфюмерная вода) - 50 мл."]
+    terms = [TermRecord(id=i, term=f"{names[i % len(names)]} {i}",
+                        definition=f"Определение (версия {i}) - аромат_{i}!", category_id=1,
+                        category_name="Ароматы (EDP)", examples="", synonyms="EDP, E.d.P.", usage_count=i)
+             for i in range(terms_count)]
+    per_char = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+    for name, escape_text in (("re.sub по символам", lambda text: per_char.sub(r'\\\1', text)),
+                              ("str.translate", escape)):
+        start = time.perf_counter()
+        for term in terms:
+            escape_text(term.term), escape_text(term.definition), escape_text(term.category_name)
+        print(f"Экранирование ({name}): {(time.perf_counter() - start) * 1e6 / terms_count:.2f} мкс на карточку")
+    start = time.perf_counter()
+    for term in terms:
+        render_term_card(term)
+    print(f"Карточка термина целиком: {(time.perf_counter() - start) * 1e6 / terms_count:.2f} мкс")
+
+
+class _SlowStream:
+    """Поток вывода с задержкой записи (медленный stdout хостинга под нагрузкой)"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text: str):
+        time.sleep(self.delay)
+        self.lines += 1
+
+    def flush(self):
+        pass
+
+
+def bench_logging(terms_count: int):
+    """Задержка обработчика поиска: без логов, синхронный вывод и вывод через очередь"""
+    import logging
+    from logging_setup import JsonFormatter, setup_logging, stop_logging
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        print(f"Словарь: {terms_count} терминов, задержка записи в stdout 1 мс")
+        queries = [f"Термин {random.randrange(terms_count)}" for _ in range(1000)]
+        logger = logging.getLogger('bench')
+        root = logging.getLogger()
+
+        def handler(query: str):
+            started = time.perf_counter()
+            results = db.search_terms(query, definitions=False)
+            latency_ms = (time.perf_counter() - started) * 1000
+            logger.info("Поиск термина: %r", query, extra={
+                'event': 'search', 'handler': 'search_terms', 'user': 'bench',
+                'tier': 'dictionary', 'latency_ms': latency_ms, 'results': len(results),
+            })
+
+        def configure(variant: str, stream: _SlowStream):
+            stop_logging()
+            for existing in list(root.handlers):
+                root.removeHandler(existing)
+            if variant == 'queue':
+                setup_logging('INFO', stream=stream)
+            elif variant == 'queue_sampled':
+                setup_logging('INFO', stream=stream, sample_rates={'search': 0.1})
+            elif variant == 'sync':
+                output = logging.StreamHandler(stream)
+                output.setFormatter(JsonFormatter())
+                root.addHandler(output)
+                root.setLevel('INFO')
+            else:
+                root.setLevel('WARNING')
+
+        for variant in ('off', 'sync', 'queue', 'queue_sampled'):
+            stream = _SlowStream(0.001)
+            configure(variant, stream)
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                handler(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            stop_logging()
+            drain = time.perf_counter() - start
+            timings.sort()
+            print(f"{variant}: p50 {timings[len(timings) // 2]:.3f} мс, p99 {timings[int(len(timings) * 0.99)]:.3f} мс, "
+                  f"записано строк {stream.lines}, дозапись очереди при остановке {drain:.2f} с")
+
+
+def bench_history(terms_count: int):
+    """История "Мои запросы": таблица последних N терминов против выборки из журнала поисков"""
+    from user_history import UserHistory
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        users = 20000
+        searches = 1000000
+        with db.get_connection() as conn:
+            conn.executemany(
+                'INSERT INTO search_stats (user_id, term_id, query, found) VALUES (?, ?, ?, 1)',
+                ((random.randrange(users), random.randrange(terms_count) + 1, 'запрос') for _ in range(searches))
+            )
+        print(f"Словарь: {terms_count} терминов, журнал: {searches} поисков {users} пользователей")
+
+        history = UserHistory(db, size=10, idle_ttl=60, max_users=5000)
+        start = time.perf_counter()
+        for i in range(50000):
+            history.add(random.randrange(users), random.randrange(terms_count) + 1, 'термин', now=i * 0.01)
+        elapsed = (time.perf_counter() - start) * 1000 / 50000
+        print(f"Запись просмотра (память + база): {elapsed:.3f} мс, историй в памяти: {len(history)}")
+
+        sample = [random.randrange(users) for _ in range(200)]
+        start = time.perf_counter()
+        for user_id in sample:
+            db.get_history(user_id)
+        print(f"Чтение истории из таблицы: {(time.perf_counter() - start) * 1000 / len(sample):.3f} мс")
+
+        for user_id in sample:
+            history.get(user_id, now=500.0)
+        start = time.perf_counter()
+        for user_id in sample:
+            history.get(user_id, now=500.0)
+        print(f"Чтение истории из памяти: {(time.perf_counter() - start) * 1000 / len(sample):.4f} мс")
+
+        start = time.perf_counter()
+        with db.get_connection() as conn:
+            for user_id in sample[:10]:
+                conn.execute('''
+                    SELECT DISTINCT term_id FROM search_stats 
+                    WHERE user_id = ? AND term_id IS NOT NULL 
+                    ORDER BY id DESC LIMIT 10
+                ''', (user_id,)).fetchall()
+        print(f"Выборка из журнала поисков: {(time.perf_counter() - start) * 1000 / 10:.1f} мс")
+        with db.get_connection() as conn:
+            rows = conn.execute('SELECT COUNT(*) FROM user_history').fetchone()[0]
+        print(f"Строк в user_history: {rows} (не больше 10 на пользователя)")
+
+
+# Оценочный набор поиска: небольшой словарь с настоящими терминами и запросы
+# с терминами, которые пользователь ожидает увидеть (первым или среди первых).
+# Фиксатор популярнее базовых нот, а "база" у него лишь подстрока синонима:
+# ступенчатый поиск выдавал его первым на запрос "база"
+RANKING_TERMS = (
+    # (название, определение, категория, синонимы, запросов)
+    ("Базовые ноты", "Финальная часть аромата, которая раскрывается последней и держится дольше всего",
+     "Структура аромата", "база, base notes", 5),
+    ("Верхние ноты", "Первые ноты, которые ощущаются сразу после нанесения и быстро улетучиваются",
+     "Структура аромата", "топ ноты, head notes", 8),
+    ("Сердечные ноты", "Ноты, которые раскрываются после верхних и задают характер аромата",
+     "Структура аромата", "сердце, heart notes", 3),
+    ("Фиксатор", "Вещество, которое замедляет испарение и делает аромат стойким", "Сырье",
+     "база для стойкости", 40),
+    ("Шипр", "Аккорд из бергамота, дубового мха и лабданума", "Семейства", "chypre", 12),
+    ("Фужер", "Аромат на основе лаванды, кумарина и дубового мха", "Семейства", "fougere", 6),
+    ("Шлейф", "След аромата, который остается в воздухе за человеком", "Характеристики", "sillage", 30),
+    ("Стойкость", "Сколько часов аромат держится на коже", "Характеристики", "longevity", 25),
+    ("EDP", "Eau de Parfum - парфюмерная вода с концентрацией 15-20%", "Концентрации", "парфюмерная вода", 50),
+    ("EDT", "Eau de Toilette - туалетная вода с концентрацией 5-15%", "Концентрации", "туалетная вода", 20),
+    ("Амбра", "Теплый смолистый сладковатый аромат", "Ноты", "amber", 15),
+    ("Мускус", "Чувственная теплая нота с эффектом чистой кожи", "Ноты", "musk", 18),
+    ("Уд", "Смола агарового дерева с густым древесным дымным запахом", "Ноты", "oud, агар", 9),
+    ("Ветивер", "Корень тропической травы с землистым дымным запахом", "Ноты", "vetiver", 4),
+    ("Альдегиды", "Синтетические молекулы с мыльным искрящимся эффектом", "Сырье", "aldehydes", 7),
+    ("Гурманский аромат", "Аромат со съедобными нотами ванили, карамели и шоколада", "Семейства",
+     "гурманика, gourmand", 11),
+    ("Цитрусовые ноты", "Свежие ноты бергамота, лимона и апельсина", "Ноты", "цитрус", 10),
+    ("Пудровый аромат", "Мягкий аромат с нотами ириса и фиалки, похожий на косметическую пудру",
+     "Характеристики", None, 5),
+    ("Распив", "Продажа аромата на разлив в маленькие флаконы", "Жаргон", "отливант", 14),
+    ("Слепая покупка", "Покупка аромата без предварительной пробы", "Жаргон", "blind buy", 6),
+    ("Тестер", "Флакон для пробы аромата в магазине, часто без крышки", "Жаргон", None, 16),
+    ("Базилик", "Пряная зеленая трава с анисовым оттенком", "Ноты", None, 2),
+)
+RANKING_QUERIES = (
+    ("шипр", ("Шипр",)),
+    ("chypre", ("Шипр",)),
+    ("база", ("Базовые ноты",)),
+    ("верхние", ("Верхние ноты",)),
+    ("верх", ("Верхние ноты",)),
+    ("edp", ("EDP",)),
+    ("эдп", ("EDP",)),
+    ("парфюмерная вода", ("EDP",)),
+    ("туалетная", ("EDT",)),
+    ("отливант", ("Распив",)),
+    ("цитрус", ("Цитрусовые ноты",)),
+    ("агар", ("Уд",)),
+    ("ноты", ("Базовые ноты", "Верхние ноты", "Сердечные ноты", "Цитрусовые ноты")),
+    ("бергамот", ("Шипр", "Цитрусовые ноты")),
+    ("дубовый мох", ("Шипр", "Фужер")),
+    ("лаванда и кумарин", ("Фужер",)),
+    ("ваниль карамель", ("Гурманский аромат",)),
+    ("пахнет ирисом и фиалкой", ("Пудровый аромат",)),
+    ("дымный древесный запах", ("Уд", "Ветивер")),
+    ("мыльный", ("Альдегиды",)),
+    ("покупка без пробы", ("Слепая покупка",)),
+    ("нота чистой кожи", ("Мускус",)),
+    ("сколько держится на коже", ("Стойкость",)),
+    ("след в воздухе", ("Шлейф",)),
+    ("стойкий", ("Фиксатор", "Стойкость")),
+)
+
+
+def _relevance(search, queries, k: int = 5):
+    """MRR, доля запросов с ожидаемым термином первым и полнота в первых k"""
+    reciprocal = first = recall = 0.0
+    for query, expected in queries:
+        names = search(query)
+        ranks = [names.index(name) + 1 for name in expected if name in names]
+        reciprocal += 1 / min(ranks) if ranks else 0.0
+        first += bool(names) and names[0] in expected
+        recall += sum(rank <= k for rank in ranks) / min(len(expected), k)
+    count = len(queries)
+    return reciprocal / count, first / count, recall / count
+
+
+def bench_ranking(terms_count: int):
+    """Поиск: единая оценка с кучей top-k против ступеней "первая непустая" - качество и время"""
+    import heapq
+    from description_search import DescriptionIndex
+    from dictionary_snapshot import SnapshotStore
+    from search_ranking import SearchRanker, hit_key
+
+    def tiered(store, descriptions):
+        """Прежний путь обработчика: ступени снимка, затем поиск по описанию"""
+        def search(query, limit=10):
+            results = store.current.search_terms(query, limit)
+            return results or descriptions.search(query, limit)
+        return search
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Качество на оценочном наборе
+        db = PerfumeDatabase(os.path.join(tmp_dir, 'eval.db'))
+        for term, definition, category, synonyms, usage in RANKING_TERMS:
+            term_id = db.add_term(term, definition, category, synonyms=synonyms)
+            with db.get_connection() as conn:
+                conn.execute('UPDATE terms SET usage_count = ? WHERE id = ?', (usage, term_id))
+        store = SnapshotStore(db)
+        descriptions = DescriptionIndex(db)
+        ranker = SearchRanker(store, descriptions)
+        old = tiered(store, descriptions)
+        print(f"Оценочный набор: {len(RANKING_TERMS)} терминов, {len(RANKING_QUERIES)} запросов")
+        for name, search in (("Ступени", lambda q: [t.term for t in old(q)]),
+                             ("Единая оценка", lambda q: [t.term for t in ranker.search(q).records])):
+            mrr, first, recall = _relevance(search, RANKING_QUERIES)
+            print(f"{name}: MRR {mrr:.3f}, нужный термин первым {first:.0%}, полнота в первых 5 {recall:.0%}")
+        for query, expected in RANKING_QUERIES:
+            before = [t.term for t in old(query)][:3]
+            after = [t.term for t in ranker.search(query).records][:3]
+            if before[:1] != after[:1]:
+                print(f"  '{query}': {', '.join(before) or '-'} -> {', '.join(after)}")
+
+        # Время на синтетическом словаре
+        db = build_benchmark_db(os.path.join(tmp_dir, 'bench.db'), terms_count)
+        store = SnapshotStore(db)
+        descriptions = DescriptionIndex(db)
+        descriptions.sync()
+        ranker = SearchRanker(store, descriptions)
+        old = tiered(store, descriptions)
+        random.seed(1)
+        queries = [random.choice((f"Термин {i}", f"синоним {i}", f"ермин {i // 10}", "цитрус амбра", "Терм"))
+                   for i in random.sample(range(terms_count), 300)]
+        print(f"Словарь: {terms_count} терминов, {len(queries)} запросов")
+        for name, search in (("Ступени", old), ("Единая оценка", ranker.search)):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                search(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            print(f"{name}: медиана {latencies[len(latencies) // 2]:.2f} мс, "
+                  f"95% {latencies[int(len(latencies) * 0.95)]:.2f} мс, макс. {latencies[-1]:.1f} мс")
+
+        # Выбор 10 лучших из всех совпадений "Терм": куча против полной сортировки
+        hits = ranker.rank("Терм")
+        for name, select in (("Полная сортировка", lambda: sorted(hits, key=hit_key)[:10]),
+                             ("Куча heapq.nsmallest", lambda: heapq.nsmallest(10, hits, key=hit_key))):
+            start = time.perf_counter()
+            for _ in range(20):
+                top = select()
+            print(f"{name} {len(hits)} совпадений: {(time.perf_counter() - start) * 1000 / 20:.2f} мс")
+        assert [hit.record.id for hit in top] == [hit.record.id for hit in sorted(hits, key=hit_key)[:10]]
+
+        # Страницы по курсору повторяют общую выдачу
+        pages, after = [], None
+        for _ in range(3):
+            page = ranker.search("Терм", limit=10, after=after)
+            pages += [hit.record.id for hit in page.hits]
+            after = page.next_key
+        assert pages == [hit.record.id for hit in sorted(hits, key=hit_key)[:30]]
+
+
+def benchmark_backend(backend, terms_count: int = 2000, queries: int = 200) -> dict:
+    """Измеряет среднее время основных операций хранилища (в миллисекундах)"""
+    timings = {}
+
+    start = time.perf_counter()
+    ids = [
+        backend.add_term(f"Термин {i}", f"Определение номер {i} с нотами", f"Категория {i % 20}",
+                         f"Пример {i}", f"синоним{i}")
+        for i in range(terms_count)
+    ]
+    timings['add_term'] = (time.perf_counter() - start) * 1000 / terms_count
+
+    operations = {
+        'search_exact': lambda i: backend.search_terms(f"термин {i}"),
+        'search_synonym': lambda i: backend.search_terms(f"синоним{i}"),
+        'search_definition': lambda i: backend.search_terms("номер 1"),
+        'search_miss': lambda i: backend.search_terms("несуществующий запрос"),
+        'get_term_by_id': lambda i: backend.get_term_by_id(ids[i % len(ids)]),
+        'get_random_term': lambda i: backend.get_random_term(),
+        'log_search': lambda i: backend.log_search(i, "запрос", ids[i % len(ids)], True),
+        'get_stats': lambda i: backend.get_stats(),
+    }
+    for name, operation in operations.items():
+        start = time.perf_counter()
+        for i in range(queries):
+            operation(i)
+        timings[name] = (time.perf_counter() - start) * 1000 / queries
+
+    return timings
+
+
+def bench_storage(terms_count: int):
+    """Среднее время основных операций хранилища: SQLite и PostgreSQL из DATABASE_URL, если он задан"""
+    from config import DATABASE_URL
+
+    terms_count = min(terms_count, 2000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backends = [('sqlite', lambda: PerfumeDatabase(os.path.join(tmp_dir, 'bench.db')))]
+        if DATABASE_URL:
+            from postgres_backend import PostgresBackend
+            backends.append(('postgres', lambda: PostgresBackend(DATABASE_URL, schema='storage_bench', reset=True)))
+        for name, make_backend in backends:
+            backend = make_backend()
+            print(f"{name}: {terms_count} терминов")
+            for operation, ms in benchmark_backend(backend, terms_count).items():
+                print(f"   {operation}: {ms:.3f} мс")
+            backend.close()
+
+
+BENCHMARKS = {
+    'search_memory': bench_search_memory,
+    'glossary': bench_glossary,
+    'related': bench_related,
+    'describe': bench_describe,
+    'logging': bench_logging,
+    'history': bench_history,
+    'edits': bench_edits,
+    'artifact': bench_artifact,
+    'misses': bench_misses,
+    'render': bench_render,
+    'snapshots': bench_snapshots,
+    'ranking': bench_ranking,
+    'storage': bench_storage,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности бота")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--terms', type=int, default=100000, help="Размер синтетического словаря")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.terms)
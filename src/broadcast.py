@@ -0,0 +1,159 @@
+"""
+Рассылка "Термин дня" подписчикам
+Отправка с ограничением частоты и сохранением прогресса: после перезапуска
+рассылка продолжается с места остановки, а не начинается заново
+"""
+import asyncio
+import logging
+from datetime import datetime, tzinfo
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.ext import ContextTypes
+
+from rate_limiter import AsyncRateLimiter
+from rendering import PARSE_MODE, markdown, render_term_card
+from storage_backend import StorageBackend
+from telegram_api import RAISE_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_TITLE = markdown("🗓 *Термин дня*")
+
+# Статусы доставки
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+
+class Broadcaster:
+    """Рассылка термина дня всем подписчикам
+
+    Текст выбирается и форматируется один раз при создании рассылки и хранится
+    в БД вместе с ней. Подписчики обрабатываются пачками по возрастанию chat_id;
+    результаты каждой пачки сохраняются сразу, поэтому при перезапуске
+    повторно могут уйти только сообщения, отправка которых была прервана.
+
+    Ограничения Telegram: общий лимит бота (около 30 сообщений в секунду)
+    соблюдает AsyncRateLimiter, а в один чат рассылка отправляет одно
+    сообщение, так что лимит на чат затрагивают только повторы после RetryAfter.
+    RetryAfter рассылка обрабатывает сама: OutboundLimiter бота передает его
+    без повтора (RAISE_RETRY_AFTER), и пауза останавливает всех отправителей.
+    """
+
+    def __init__(self, db: StorageBackend, rate: float = 25, concurrency: int = 8,
+                 batch_size: int = 50, max_attempts: int = 3, timezone: tzinfo = None):
+        self.db = db
+        self.timezone = timezone
+        self.concurrency = concurrency
+        self.limiter = AsyncRateLimiter(rate, burst=concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎲 Случайный термин", callback_data="random")],
+            [InlineKeyboardButton("🔕 Отписаться", callback_data="unsubscribe")]
+        ])
+        self._running = asyncio.Lock()
+
+    def prepare(self, broadcast_date: str) -> Optional[Dict]:
+        """Создает рассылку на дату: выбирает случайный термин и готовит текст"""
+        term = self.db.get_random_term()
+        if not term:
+            logger.warning("Рассылка не создана: словарь пуст")
+            return None
+        return self.db.create_broadcast(broadcast_date, term.id, render_term_card(term, BROADCAST_TITLE), PARSE_MODE)
+
+    async def run(self, bot, broadcast_date: str, create: bool = True) -> Dict[str, int]:
+        """Отправляет (или продолжает) рассылку за дату; возвращает счетчики по статусам"""
+        counters = {SENT: 0, BLOCKED: 0, FAILED: 0}
+        if self._running.locked():
+            logger.info("Рассылка уже выполняется")
+            return counters
+
+        async with self._running:
+            broadcast = self.db.get_broadcast(broadcast_date)
+            if broadcast is None and create:
+                broadcast = self.prepare(broadcast_date)
+            if broadcast is None or broadcast['status'] == 'finished':
+                return counters
+
+            logger.info("Рассылка %s: отправка подписчикам", broadcast_date)
+            while True:
+                chat_ids = self.db.get_pending_recipients(broadcast['id'], self.batch_size)
+                if not chat_ids:
+                    break
+                for _, status in await self._send_batch(bot, broadcast, chat_ids):
+                    counters[status] += 1
+
+            self.db.finish_broadcast(broadcast['id'])
+            logger.info("Рассылка %s завершена: %s", broadcast_date, counters)
+            return counters
+
+    async def resume(self, bot) -> Dict[str, int]:
+        """Продолжает последнюю незавершенную рассылку, за какую бы дату она ни была
+
+        Рассылка, прерванная до полуночи, после перезапуска на следующий день
+        доходит до оставшихся подписчиков.
+        """
+        broadcast = self.db.get_unfinished_broadcast()
+        if broadcast is None:
+            return {SENT: 0, BLOCKED: 0, FAILED: 0}
+        return await self.run(bot, broadcast['broadcast_date'], create=False)
+
+    async def _send_batch(self, bot, broadcast: Dict, chat_ids: List[int]) -> List[Tuple[int, str]]:
+        """Отправляет пачку и сохраняет результаты (в том числе при отмене на середине)"""
+        tasks = [asyncio.ensure_future(self._deliver(bot, chat_id, broadcast['text'], broadcast['parse_mode']))
+                 for chat_id in chat_ids]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            results = [
+                (chat_id, task.result())
+                for chat_id, task in zip(chat_ids, tasks)
+                if task.done() and not task.cancelled()
+            ]
+            if results:
+                self.db.record_deliveries(broadcast['id'], results)
+        return results
+
+    async def _deliver(self, bot, chat_id: int, text: str, parse_mode: str) -> str:
+        """Отправляет сообщение одному подписчику в режиме разметки рассылки; возвращает статус доставки"""
+        # rate_limit_args принимает только ExtBot с подключенным слоем исходящих вызовов
+        options = {'rate_limit_args': RAISE_RETRY_AFTER} if getattr(bot, 'rate_limiter', None) else {}
+        async with self.semaphore:
+            for attempt in range(1, self.max_attempts + 1):
+                await self.limiter.acquire()
+                try:
+                    await bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=self.reply_markup,
+                                           **options)
+                    return SENT
+                except RetryAfter as e:
+                    # Лимит превышен: останавливаем всех отправителей, а не только этот
+                    logger.warning("RetryAfter %s с при отправке в чат %s", e.retry_after, chat_id)
+                    self.limiter.pause(e.retry_after)
+                except Forbidden:
+                    # Пользователь заблокировал бота - подписка больше не нужна
+                    self.db.remove_subscriber(chat_id)
+                    return BLOCKED
+                except BadRequest as e:
+                    if 'chat not found' in str(e).lower():
+                        self.db.remove_subscriber(chat_id)
+                        return BLOCKED
+                    logger.error("Ошибка отправки в чат %s: %s", chat_id, e)
+                    return FAILED
+                except (TimedOut, NetworkError) as e:
+                    logger.warning("Сетевая ошибка при отправке в чат %s (попытка %s): %s", chat_id, attempt, e)
+                    await asyncio.sleep(attempt)
+            return FAILED
+
+    async def job_callback(self, context: ContextTypes.DEFAULT_TYPE):
+        """Задача JobQueue: ежедневная рассылка или продолжение прерванной при запуске"""
+        create = context.job.data.get('create', True) if context.job.data else True
+        if create:
+            await self.run(context.bot, datetime.now(self.timezone).date().isoformat())
+        else:
+            await self.resume(context.bot)
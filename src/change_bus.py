@@ -0,0 +1,116 @@
+"""
+Шина изменений словаря внутри процесса
+Производные структуры (индексы поиска, истории пользователей) подписываются
+на изменения терминов и категорий и обновляются точечно, без перестроения
+"""
+import logging
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from storage_backend import StorageBackend, TERM, UPDATE, DELETE, MERGE
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeEvent(NamedTuple):
+    """Изменение словаря из журнала хранилища"""
+    revision: int
+    entity: str
+    action: str
+    entity_id: int
+    target_id: Optional[int] = None
+
+    @property
+    def removed_terms(self) -> Tuple[int, ...]:
+        """Термины, которых больше нет (удаленный или слитый в другой)"""
+        if self.entity == TERM and self.action in (DELETE, MERGE):
+            return (self.entity_id,)
+        return ()
+
+    @property
+    def changed_terms(self) -> Tuple[int, ...]:
+        """Термины, у которых изменились поля (измененный или принявший слияние)"""
+        if self.entity != TERM:
+            return ()
+        if self.action == UPDATE:
+            return (self.entity_id,)
+        if self.action == MERGE:
+            return (self.target_id,)
+        return ()
+
+
+class ChangeBus:
+    """Рассылает подписчикам изменения словаря по журналу хранилища
+
+    Источник событий - журнал dictionary_changes, поэтому изменения видят все
+    процессы (в режиме масштабирования записи выполняет процесс-писатель):
+    sync() читает записи после последней обработанной ревизии и по очереди
+    передает их подписчикам. Процесс, который сам изменил словарь, вызывает
+    sync() сразу; остальные - через poll() не чаще раза в poll_interval секунд.
+
+    Ревизия отсчитывается от момента создания шины: производные структуры
+    строятся из текущего состояния хранилища и получают только последующие
+    изменения. Структуры, загруженные из файла словаря, получают изменения
+    после ревизии файла (параметр revision). Обработка события должна быть идемпотентной - подписчик мог
+    прочитать свежие данные раньше, чем получил событие.
+    """
+
+    def __init__(self, db: StorageBackend, poll_interval: float = 1.0, revision: int = None):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.revision = db.get_revision() if revision is None else revision
+        self._subscribers: List[Tuple[Callable[[ChangeEvent], None], Optional[str]]] = []
+        self._batch_subscribers: List[Callable[[List[ChangeEvent]], None]] = []
+        self._lock = threading.Lock()
+        self._polled_at = time.monotonic()
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None], entity: str = None):
+        """Подписывает обработчик на изменения сущности (None - на все изменения)"""
+        self._subscribers.append((callback, entity))
+
+    def subscribe_batch(self, callback: Callable[[List[ChangeEvent]], None]):
+        """Подписывает обработчик на пачки изменений: все события, прочитанные из журнала за раз
+
+        Для структур, которым дешевле применить много изменений сразу (массовый импорт).
+        """
+        self._batch_subscribers.append(callback)
+
+    def publish(self, event: ChangeEvent):
+        """Передает событие подписчикам; ошибка одного подписчика не мешает остальным"""
+        for callback, entity in self._subscribers:
+            if entity is not None and entity != event.entity:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error("Ошибка обработки изменения %s: %s", event, e)
+
+    def sync(self) -> int:
+        """Читает новые изменения из журнала и рассылает их; возвращает их количество"""
+        with self._lock:
+            self._polled_at = time.monotonic()
+            published = 0
+            while True:
+                rows = self.db.get_changes(after_revision=self.revision)
+                events = [ChangeEvent(*row) for row in rows]
+                for event in events:
+                    self.publish(event)
+                if events:
+                    for callback in self._batch_subscribers:
+                        try:
+                            callback(events)
+                        except Exception as e:
+                            logger.error("Ошибка обработки изменений до ревизии %s: %s", events[-1].revision, e)
+                    self.revision = events[-1].revision
+                published += len(rows)
+                if not rows:
+                    return published
+
+    def poll(self, now: float = None) -> int:
+        """sync(), если с прошлой проверки прошло не меньше poll_interval секунд"""
+        if now is None:
+            now = time.monotonic()
+        if now - self._polled_at < self.poll_interval:
+            return 0
+        return self.sync()
@@ -0,0 +1,349 @@
+"""
+Модуль горизонтального масштабирования бота
+Выбор лидера вместо жесткой блокировки, пул процессов-обработчиков
+и единственный процесс-писатель для SQLite
+"""
+import asyncio
+import fcntl
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from database import PerfumeDatabase
+from storage_backend import create_backend
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые изменяют данные и поэтому выполняются только процессом-писателем
+DATABASE_WRITE_METHODS = ('add_category', 'add_term', 'increment_usage', 'log_search', 'add_suggestion',
+                          'add_subscriber', 'remove_subscriber', 'add_history',
+                          'update_term', 'delete_term', 'merge_terms',
+                          'update_category', 'delete_category', 'merge_categories', 'merge_user_sketches')
+STORAGE_WRITE_METHODS = ('log_search', 'save_user_suggestion')
+
+# Записи, результат которых видит пользователь: обработчик ждет подтверждения писателя
+# и получает результат или исключение. Остальные (счетчики, журналы, истории) не ждут
+ACKNOWLEDGED_METHODS = {
+    'db': {'add_category', 'add_term', 'add_suggestion', 'add_subscriber', 'remove_subscriber',
+           'update_term', 'delete_term', 'merge_terms', 'update_category', 'delete_category', 'merge_categories'},
+    'storage': {'save_user_suggestion'},
+}
+
+# Сколько обработчик ждет подтверждения записи, секунд
+WRITE_ACK_TIMEOUT = 10.0
+
+
+class WriteError(Exception):
+    """Запись не подтверждена: ошибка писателя, которую нельзя передать между процессами, или таймаут"""
+
+
+class LeaderElection:
+    """Выбор лидера через flock на файле блокировки
+
+    Лидер держит эксклюзивную блокировку, остальные экземпляры ждут в резерве
+    и перехватывают лидерство, как только процесс лидера завершится.
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self.lock_fd = None
+
+    def try_acquire(self) -> bool:
+        """Пытается стать лидером без ожидания"""
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (OSError, IOError):
+            os.close(fd)
+            return False
+
+        # Записываем PID лидера для диагностики
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.lock_fd = fd
+        return True
+
+    def wait_for_leadership(self, poll_interval: float = 1.0):
+        """Блокируется до тех пор, пока текущий процесс не станет лидером"""
+        while not self.try_acquire():
+            time.sleep(poll_interval)
+
+    def release(self):
+        """Отказывается от лидерства
+
+        Файл блокировки не удаляется: резервный экземпляр может уже ждать
+        на этом же inode, и удаление привело бы к двум лидерам.
+        """
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+
+class WriteChannel:
+    """Очередь записи процесса-обработчика с подтверждениями
+
+    Запись без подтверждения только кладется в очередь. Подтверждаемая запись
+    ждет ответа писателя в очереди ответов своего процесса; вызовы внутри
+    процесса ждут по очереди, поэтому ответ всегда относится к последнему
+    запросу, а опоздавшие ответы на запросы с истекшим таймаутом пропускаются.
+    call() блокирует поток до ответа (до timeout секунд), поэтому обработчики
+    вызывают подтверждаемые записи через asyncio.to_thread, а не в event loop.
+    """
+
+    def __init__(self, write_queue, reply_queue=None, worker: int = 0, timeout: float = WRITE_ACK_TIMEOUT):
+        self.write_queue = write_queue
+        self.reply_queue = reply_queue
+        self.worker = worker
+        self.timeout = timeout
+        self._request_id = 0
+        self._lock = threading.Lock()
+
+    def send(self, target: str, method: str, args: tuple, kwargs: dict):
+        """Передает запись писателю без ожидания"""
+        self.write_queue.put((target, method, args, kwargs, None))
+
+    def call(self, target: str, method: str, args: tuple, kwargs: dict):
+        """Передает запись писателю и возвращает ее результат (исключение писателя поднимается здесь)"""
+        if self.reply_queue is None:
+            return self.send(target, method, args, kwargs)
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+            self.write_queue.put((target, method, args, kwargs, (self.worker, request_id)))
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    reply_id, ok, value = self.reply_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise WriteError(f"{target}.{method}: писатель не ответил за {self.timeout} с") from None
+                if reply_id == request_id:
+                    break
+        if not ok:
+            raise value
+        return value
+
+
+class ForwardingDatabase(PerfumeDatabase):
+    """База данных процесса-обработчика
+
+    Чтение идет через одно постоянное read-only соединение, а все изменения
+    отправляются в очередь процессу-писателю (см. WriteChannel).
+    """
+
+    def __init__(self, db_path: str, writes: WriteChannel):
+        # Схему создает лидер, поэтому init_database здесь не вызывается
+        self.db_path = db_path
+        self.writes = writes
+        self._read_connection = None
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Возвращает общее read-only соединение процесса"""
+        if self._read_connection is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._read_connection = conn
+        return self._read_connection
+
+    def close(self):
+        """Закрывает read-only соединение"""
+        if self._read_connection is not None:
+            self._read_connection.close()
+            self._read_connection = None
+
+
+def _make_forwarder(target: str, method: str):
+    if method in ACKNOWLEDGED_METHODS[target]:
+        def forward(self, *args, **kwargs):
+            return self.writes.call(target, method, args, kwargs)
+        forward.__doc__ = f"Выполняет {method} в процессе-писателе и возвращает результат"
+    else:
+        def forward(self, *args, **kwargs):
+            self.writes.send(target, method, args, kwargs)
+        forward.__doc__ = f"Передает вызов {method} процессу-писателю"
+    forward.__name__ = method
+    return forward
+
+
+for _method in DATABASE_WRITE_METHODS:
+    setattr(ForwardingDatabase, _method, _make_forwarder('db', _method))
+
+
+class ForwardingStorage:
+    """Внешнее хранилище процесса-обработчика: все записи уходят писателю"""
+
+    def __init__(self, writes: WriteChannel):
+        self.writes = writes
+
+
+for _method in STORAGE_WRITE_METHODS:
+    setattr(ForwardingStorage, _method, _make_forwarder('storage', _method))
+
+
+def _qsize(queue) -> Optional[int]:
+    """Размер multiprocessing-очереди; None, если платформа его не сообщает"""
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        return None
+
+
+class SQLiteWriter:
+    """Единственный писатель: применяет изменения из очереди в процессе лидера
+
+    На подтверждаемые записи отвечает в очередь ответов процесса-обработчика
+    (reply_queues по номеру процесса): результат или исключение.
+    """
+
+    def __init__(self, db: PerfumeDatabase, storage, write_queue, reply_queues: List = ()):
+        self.targets = {'db': db, 'storage': storage}
+        self.write_queue = write_queue
+        self.reply_queues = reply_queues
+        self._thread = None
+
+    def start(self):
+        """Запускает поток записи"""
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Дописывает очередь и останавливает поток"""
+        if self._thread:
+            self.write_queue.put(None)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error("Очередь записи не дописана за %s с, осталось около %s записей",
+                             timeout, _qsize(self.write_queue))
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            target, method, args, kwargs, reply_to = item
+            try:
+                reply = (True, getattr(self.targets[target], method)(*args, **kwargs))
+            except Exception as e:
+                logger.error("Ошибка записи %s.%s: %s", target, method, e)
+                reply = (False, e)
+            if reply_to is not None:
+                self._reply(reply_to, *reply)
+
+    def _reply(self, reply_to: Tuple[int, int], ok: bool, value):
+        worker, request_id = reply_to
+        try:
+            # Очередь сериализует ответ в фоновом потоке и ошибку молча теряет - проверяем заранее
+            pickle.dumps(value)
+        except Exception as e:
+            ok, value = False, WriteError(f"{value!r}: {e}" if ok else f"{type(value).__name__}: {value}")
+        self.reply_queues[worker].put((request_id, ok, value))
+
+
+class WorkerPool:
+    """Пул процессов, обрабатывающих обновления Telegram
+
+    Обновления одного пользователя всегда попадают в один и тот же процесс,
+    поэтому порядок сообщений и ограничение частоты запросов сохраняются.
+    Если db_path не указан, каждый процесс открывает собственное хранилище
+    (серверная СУБД сама принимает конкурентную запись).
+    """
+
+    def __init__(self, size: int, app_factory: Callable, db_path: Optional[str]):
+        self.size = size
+        self.app_factory = app_factory
+        self.db_path = db_path
+        self._context = multiprocessing.get_context('fork')
+        self.write_queue = self._context.Queue()
+        self.reply_queues: List = [self._context.Queue() for _ in range(size)]
+        self.update_queues: List = []
+        self.processes: List = []
+
+    def start(self):
+        """Запускает процессы-обработчики"""
+        for index in range(self.size):
+            update_queue = self._context.Queue()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(index, update_queue, self.write_queue, self.reply_queues[index], self.app_factory,
+                      self.db_path),
+                name=f'bot-worker-{index}',
+                daemon=True
+            )
+            process.start()
+            self.update_queues.append(update_queue)
+            self.processes.append(process)
+        logger.info("Запущено процессов-обработчиков: %s", self.size)
+
+    async def dispatch(self, update, context):
+        """Передает обновление процессу-обработчику вместо локальной обработки"""
+        from telegram.ext import ApplicationHandlerStop
+
+        key = 0
+        if update.effective_user:
+            key = update.effective_user.id
+        elif update.effective_chat:
+            key = update.effective_chat.id
+        self.update_queues[key % self.size].put(update.to_dict())
+        raise ApplicationHandlerStop
+
+    def stop(self, timeout: float = 10.0):
+        """Останавливает процессы после обработки уже переданных обновлений
+
+        timeout - общий срок на все процессы, а не на каждый: процессы завершают
+        работу параллельно, и остановка пула укладывается в бюджет остановки лидера.
+        """
+        for update_queue in self.update_queues:
+            update_queue.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Процесс %s не завершился за %s с и будет остановлен", process.name, timeout)
+                process.terminate()
+
+
+def _worker_main(index: int, update_queue, write_queue, reply_queue, app_factory: Callable, db_path: str):
+    """Точка входа процесса-обработчика"""
+    # Останавливает обработчики лидер (сигналом None в очереди), дождавшись их очередей;
+    # сигнал, отправленный всей группе процессов, не должен прерывать обработку
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, update_queue, write_queue, reply_queue, app_factory, db_path))
+
+
+async def _worker_loop(index: int, update_queue, write_queue, reply_queue, app_factory: Callable, db_path: str):
+    from telegram import Update
+
+    writes = WriteChannel(write_queue, reply_queue, index)
+    if db_path:
+        db = ForwardingDatabase(db_path, writes)
+    else:
+        db = create_backend()
+    storage = ForwardingStorage(writes)
+    app = app_factory(db, storage)
+    loop = asyncio.get_running_loop()
+
+    async with app:
+        await app.start()
+        logger.info("Процесс-обработчик %s готов", index)
+        while True:
+            data: Optional[dict] = await loop.run_in_executor(None, update_queue.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+        await app.stop()
+    # Накопленное в памяти обработчиков уходит в очередь записи до выхода процесса
+    for callback in app.bot_data.get('on_stop', ()):
+        try:
+            callback()
+        except Exception as e:
+            logger.error("Процесс-обработчик %s: ошибка при остановке: %s", index, e)
+    db.close()
@@ -5,11 +5,28 @@
 import sqlite3
 import os
 import json
+import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from config import DATABASE_PATH
+from storage_backend import (StorageBackend, TERM_FIELDS, CATEGORY_FIELDS, TERM, CATEGORY,
+                             CREATE, UPDATE, DELETE, MERGE, MISS_CURSOR, check_fields)
+from term_record import CategoryRecord, TermRecord
+from unique_users import merge_registers
+from text_normalizer import normalize, translit_key, term_keys, merge_synonyms
 
-class PerfumeDatabase:
+# Колонки записи термина в порядке аргументов TermRecord
+LIST_COLUMNS = 't.id, t.term, t.category_id, c.name as category_name, t.synonyms, t.usage_count'
+FULL_COLUMNS = f'{LIST_COLUMNS}, t.definition, t.examples'
+
+# Нормализованные копии полей, по которым выполняется поиск
+NORMALIZED_COLUMNS = ('term_norm', 'synonyms_norm', 'definition_norm')
+
+logger = logging.getLogger(__name__)
+
+class PerfumeDatabase(StorageBackend):
+    """Хранилище словаря на SQLite"""
+    
     def __init__(self, db_path: str = None):
         """Инициализация базы данных"""
         self.db_path = db_path or DATABASE_PATH
@@ -31,6 +48,9 @@ class PerfumeDatabase:
     def init_database(self):
         """Создает таблицы если их нет"""
         with self.get_connection() as conn:
+            # WAL позволяет читателям не блокироваться на единственном писателе
+            conn.execute('PRAGMA journal_mode=WAL')
+            
             # Таблица категорий
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS categories (
@@ -87,112 +107,536 @@ class PerfumeDatabase:
                 )
             ''')
             
+            # Ключи транслитерации терминов и синонимов для поиска ("эдп" -> "edp")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS term_keys (
+                    key TEXT NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    is_synonym INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (key, term_id, is_synonym),
+                    FOREIGN KEY (term_id) REFERENCES terms (id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Подписчики на термин дня
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    chat_id INTEGER PRIMARY KEY,
+                    subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Рассылки термина дня и отметки о доставке (для возобновления после перезапуска)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    broadcast_date TEXT UNIQUE NOT NULL,
+                    term_id INTEGER,
+                    text TEXT NOT NULL,
+                    status TEXT DEFAULT 'running',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    FOREIGN KEY (term_id) REFERENCES terms (id)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    broadcast_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    PRIMARY KEY (broadcast_id, chat_id),
+                    FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Связанные термины: счетчики совместных поисков и готовые списки соседей
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS term_cooccurrence (
+                    term_a INTEGER NOT NULL,
+                    term_b INTEGER NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (term_a, term_b)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS term_neighbors (
+                    term_id INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    neighbor_id INTEGER NOT NULL,
+                    score REAL NOT NULL,
+                    PRIMARY KEY (term_id, rank)
+                ) WITHOUT ROWID
+            ''')
+            
+            # История просмотров: не больше N последних терминов на пользователя.
+            # Строки пользователя лежат рядом в первичном ключе, поэтому чтение
+            # и обрезка истории стоят O(N) независимо от общего числа поисков
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_history (
+                    user_id INTEGER NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    viewed_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, term_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Журнал изменений словаря: номер записи - ревизия, по которой процессы
+            # узнают, какие производные данные (индексы, кэши) нужно обновить
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS dictionary_changes (
+                    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entity TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    entity_id INTEGER NOT NULL,
+                    target_id INTEGER,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Позиции фоновых задач (до какой записи данные уже обработаны)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_cursors (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+            
+            # Сводки HyperLogLog уникальных пользователей по дням
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_sketches (
+                    day TEXT PRIMARY KEY,
+                    registers BLOB NOT NULL
+                )
+            ''')
+            
+            # Сводки неуспешных поисков по дням (частые запросы без результата)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS miss_sketches (
+                    day TEXT PRIMARY KEY,
+                    counters TEXT NOT NULL
+                )
+            ''')
+            
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_term_keys_term_id ON term_keys (term_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_term_cooccurrence_b ON term_cooccurrence (term_b)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_search_stats_date ON search_stats (search_date)')
+            
+            self.migrate_normalized_fields(conn)
+            self.migrate_broadcast_parse_mode(conn)
+            
             conn.commit()
     
+    def migrate_normalized_fields(self, conn: sqlite3.Connection):
+        """Миграция: добавляет нормализованные поля терминов и заполняет пустые"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(terms)')}
+        for column in NORMALIZED_COLUMNS:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE terms ADD COLUMN {column} TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_terms_term_norm ON terms (term_norm)')
+        
+        rows = conn.execute(
+            'SELECT id, term, definition, synonyms FROM terms WHERE term_norm IS NULL'
+        ).fetchall()
+        self._store_normalized_fields(conn, rows)
+    
+    def migrate_broadcast_parse_mode(self, conn: sqlite3.Connection):
+        """Миграция: режим разметки рассылки; рассылки до его появления подготовлены в Markdown"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(broadcasts)')}
+        if 'parse_mode' not in columns:
+            conn.execute("ALTER TABLE broadcasts ADD COLUMN parse_mode TEXT NOT NULL DEFAULT 'Markdown'")
+    
+    def _store_normalized_fields(self, conn: sqlite3.Connection, rows):
+        """Сохраняет нормализованные поля и ключи терминов: строки (id, term, definition, synonyms)"""
+        conn.executemany('''
+            UPDATE terms SET term_norm = ?, synonyms_norm = ?, definition_norm = ? 
+            WHERE id = ?
+        ''', [
+            (normalize(term), normalize(synonyms), normalize(definition), term_id)
+            for term_id, term, definition, synonyms in rows
+        ])
+        conn.executemany('DELETE FROM term_keys WHERE term_id = ?', [(row[0],) for row in rows])
+        conn.executemany(
+            'INSERT INTO term_keys (key, term_id, is_synonym) VALUES (?, ?, ?)',
+            [
+                (key, term_id, is_synonym)
+                for term_id, term, definition, synonyms in rows
+                for key, is_synonym in term_keys(term, synonyms)
+            ]
+        )
+    
+    def rebuild_normalized_fields(self):
+        """Пересчитывает нормализованные поля всех терминов (после массового импорта)"""
+        with self.get_connection() as conn:
+            conn.execute('UPDATE terms SET term_norm = NULL')
+            self.migrate_normalized_fields(conn)
+    
+    @staticmethod
+    def _record_change(conn: sqlite3.Connection, entity: str, action: str, entity_id: int,
+                       target_id: int = None) -> int:
+        """Записывает изменение в журнал в той же транзакции; возвращает ревизию"""
+        cursor = conn.execute(
+            'INSERT INTO dictionary_changes (entity, action, entity_id, target_id) VALUES (?, ?, ?, ?)',
+            (entity, action, entity_id, target_id)
+        )
+        return cursor.lastrowid
+    
+    def _insert_category(self, conn: sqlite3.Connection, name: str, description: str = None) -> int:
+        cursor = conn.execute(
+            'INSERT INTO categories (name, description) VALUES (?, ?)',
+            (name, description)
+        )
+        self._record_change(conn, CATEGORY, CREATE, cursor.lastrowid)
+        return cursor.lastrowid
+    
+    def _category_id(self, conn: sqlite3.Connection, category_name: Optional[str]) -> Optional[int]:
+        """ID категории по названию; новая категория создается"""
+        if not category_name:
+            return None
+        result = conn.execute('SELECT id FROM categories WHERE name = ?', (category_name,)).fetchone()
+        if result:
+            return result['id']
+        return self._insert_category(conn, category_name)
+    
     def add_category(self, name: str, description: str = None) -> int:
         """Добавляет новую категорию"""
         with self.get_connection() as conn:
-            cursor = conn.execute(
-                'INSERT INTO categories (name, description) VALUES (?, ?)',
-                (name, description)
-            )
-            return cursor.lastrowid
+            return self._insert_category(conn, name, description)
     
-    def get_categories(self) -> List[Dict]:
+    def get_categories(self) -> List[CategoryRecord]:
         """Получает все категории"""
         with self.get_connection() as conn:
-            cursor = conn.execute('SELECT * FROM categories ORDER BY name')
-            return [dict(row) for row in cursor.fetchall()]
+            cursor = conn.execute('SELECT id, name, description FROM categories ORDER BY name')
+            return [CategoryRecord(*row) for row in cursor.fetchall()]
+    
+    def get_category(self, category_id: int) -> Optional[CategoryRecord]:
+        """Получает категорию по ID"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT id, name, description FROM categories WHERE id = ?', (category_id,))
+            result = cursor.fetchone()
+            return CategoryRecord(*result) if result else None
+    
+    def get_category_terms(self, category_id: int) -> List[TermRecord]:
+        """Получает термины категории, отсортированные по названию (без текстов)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {LIST_COLUMNS}
+                FROM terms t 
+                LEFT JOIN categories c ON t.category_id = c.id 
+                WHERE t.category_id = ? 
+                ORDER BY t.term
+            ''', (category_id,))
+            return [TermRecord(*row, loader=self.load_term_texts) for row in cursor.fetchall()]
+    
+    def count_terms_by_category(self) -> Dict[int, int]:
+        """Количество терминов в каждой категории одним запросом"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT category_id, COUNT(*) as count 
+                FROM terms 
+                WHERE category_id IS NOT NULL 
+                GROUP BY category_id
+            ''')
+            return {row['category_id']: row['count'] for row in cursor.fetchall()}
     
     def add_term(self, term: str, definition: str, category_name: str = None, 
                  examples: str = None, synonyms: str = None) -> int:
         """Добавляет новый термин"""
         with self.get_connection() as conn:
-            category_id = None
-            if category_name:
-                # Ищем категорию или создаем новую
-                cursor = conn.execute('SELECT id FROM categories WHERE name = ?', (category_name,))
-                result = cursor.fetchone()
-                if result:
-                    category_id = result['id']
-                else:
-                    category_id = self.add_category(category_name)
+            # Ищем категорию или создаем новую
+            category_id = self._category_id(conn, category_name)
             
             cursor = conn.execute('''
                 INSERT INTO terms (term, definition, category_id, examples, synonyms)
                 VALUES (?, ?, ?, ?, ?)
             ''', (term, definition, category_id, examples, synonyms))
+            term_id = cursor.lastrowid
             
-            return cursor.lastrowid
+            # Нормализованные поля считаются один раз при добавлении, а не при каждом поиске
+            self._store_normalized_fields(conn, [(term_id, term, definition, synonyms)])
+            self._record_change(conn, TERM, CREATE, term_id)
+            
+            return term_id
     
-    def search_terms(self, query: str, limit: int = 10) -> List[Dict]:
+    def update_term(self, term_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """Изменяет поля термина (ключи из TERM_FIELDS, None - очистить поле)"""
+        fields = check_fields(fields, TERM_FIELDS)
+        with self.get_connection() as conn:
+            row = conn.execute(
+                'SELECT term, definition, category_id, examples, synonyms FROM terms WHERE id = ?', (term_id,)
+            ).fetchone()
+            if not row:
+                return None
+            values = dict(row)
+            values.update((name, value) for name, value in fields.items() if name != 'category_name')
+            if values['term'] != row['term']:
+                taken = conn.execute('SELECT 1 FROM terms WHERE term = ? AND id != ?', (values['term'], term_id))
+                if taken.fetchone():
+                    raise ValueError(f"Термин '{values['term']}' уже существует")
+            if 'category_name' in fields:
+                values['category_id'] = self._category_id(conn, fields['category_name'])
+            
+            conn.execute('''
+                UPDATE terms 
+                SET term = ?, definition = ?, category_id = ?, examples = ?, synonyms = ?, 
+                    updated_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (values['term'], values['definition'], values['category_id'], values['examples'],
+                  values['synonyms'], term_id))
+            self._store_normalized_fields(conn, [(term_id, values['term'], values['definition'], values['synonyms'])])
+            return self._record_change(conn, TERM, UPDATE, term_id)
+    
+    @staticmethod
+    def _detach_term(conn: sqlite3.Connection, term_id: int):
+        """Удаляет производные данные термина, которые нельзя перенести"""
+        conn.execute('DELETE FROM term_keys WHERE term_id = ?', (term_id,))
+        conn.execute('DELETE FROM term_neighbors WHERE term_id = ? OR neighbor_id = ?', (term_id, term_id))
+        conn.execute('DELETE FROM term_cooccurrence WHERE term_a = ? OR term_b = ?', (term_id, term_id))
+        conn.execute('DELETE FROM user_history WHERE term_id = ?', (term_id,))
+    
+    def delete_term(self, term_id: int) -> Optional[int]:
+        """Удаляет термин вместе с производными данными; журнал поисков сохраняется"""
+        with self.get_connection() as conn:
+            if not conn.execute('SELECT 1 FROM terms WHERE id = ?', (term_id,)).fetchone():
+                return None
+            self._detach_term(conn, term_id)
+            conn.execute('UPDATE search_stats SET term_id = NULL WHERE term_id = ?', (term_id,))
+            conn.execute('UPDATE broadcasts SET term_id = NULL WHERE term_id = ?', (term_id,))
+            conn.execute('DELETE FROM terms WHERE id = ?', (term_id,))
+            return self._record_change(conn, TERM, DELETE, term_id)
+    
+    def merge_terms(self, source_id: int, target_id: int) -> Optional[int]:
+        """Сливает термин source в target и удаляет source"""
+        if source_id == target_id:
+            raise ValueError("Нельзя слить термин сам с собой")
+        with self.get_connection() as conn:
+            source = conn.execute(
+                'SELECT term, synonyms, usage_count FROM terms WHERE id = ?', (source_id,)
+            ).fetchone()
+            target = conn.execute(
+                'SELECT term, definition, synonyms FROM terms WHERE id = ?', (target_id,)
+            ).fetchone()
+            if not source or not target:
+                return None
+            
+            synonyms = merge_synonyms(target['term'], target['synonyms'], source['term'], source['synonyms'])
+            conn.execute('''
+                UPDATE terms 
+                SET synonyms = ?, usage_count = usage_count + ?, updated_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (synonyms, source['usage_count'] or 0, target_id))
+            self._store_normalized_fields(conn, [(target_id, target['term'], target['definition'], synonyms)])
+            
+            conn.execute('UPDATE search_stats SET term_id = ? WHERE term_id = ?', (target_id, source_id))
+            conn.execute('UPDATE broadcasts SET term_id = ? WHERE term_id = ?', (target_id, source_id))
+            # В истории остается более поздний просмотр из двух
+            conn.execute('''
+                INSERT INTO user_history (user_id, term_id, viewed_at) 
+                SELECT user_id, ?, viewed_at FROM user_history WHERE term_id = ? 
+                ON CONFLICT (user_id, term_id) DO UPDATE SET viewed_at = MAX(viewed_at, excluded.viewed_at)
+            ''', (target_id, source_id))
+            # Совместные поиски с source прибавляются к парам с target
+            conn.execute('''
+                INSERT INTO term_cooccurrence (term_a, term_b, count) 
+                SELECT MIN(other, :target), MAX(other, :target), count FROM (
+                    SELECT CASE WHEN term_a = :source THEN term_b ELSE term_a END AS other, count 
+                    FROM term_cooccurrence WHERE term_a = :source OR term_b = :source
+                ) WHERE other != :target 
+                ON CONFLICT (term_a, term_b) DO UPDATE SET count = count + excluded.count
+            ''', {'source': source_id, 'target': target_id})
+            self._detach_term(conn, source_id)
+            conn.execute('DELETE FROM terms WHERE id = ?', (source_id,))
+            return self._record_change(conn, TERM, MERGE, source_id, target_id)
+    
+    def update_category(self, category_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """Изменяет поля категории (ключи из CATEGORY_FIELDS)"""
+        fields = check_fields(fields, CATEGORY_FIELDS)
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT name, description FROM categories WHERE id = ?', (category_id,)).fetchone()
+            if not row:
+                return None
+            values = dict(row)
+            values.update(fields)
+            if values['name'] != row['name']:
+                taken = conn.execute('SELECT 1 FROM categories WHERE name = ? AND id != ?',
+                                     (values['name'], category_id))
+                if taken.fetchone():
+                    raise ValueError(f"Категория '{values['name']}' уже существует")
+            conn.execute('UPDATE categories SET name = ?, description = ? WHERE id = ?',
+                         (values['name'], values['description'], category_id))
+            return self._record_change(conn, CATEGORY, UPDATE, category_id)
+    
+    def delete_category(self, category_id: int) -> Optional[int]:
+        """Удаляет категорию; ее термины остаются без категории"""
+        with self.get_connection() as conn:
+            if not conn.execute('SELECT 1 FROM categories WHERE id = ?', (category_id,)).fetchone():
+                return None
+            conn.execute('UPDATE terms SET category_id = NULL WHERE category_id = ?', (category_id,))
+            conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
+            return self._record_change(conn, CATEGORY, DELETE, category_id)
+    
+    def merge_categories(self, source_id: int, target_id: int) -> Optional[int]:
+        """Переносит термины категории source в target и удаляет source"""
+        if source_id == target_id:
+            raise ValueError("Нельзя слить категорию саму с собой")
+        with self.get_connection() as conn:
+            found = conn.execute('SELECT COUNT(*) FROM categories WHERE id IN (?, ?)', (source_id, target_id))
+            if found.fetchone()[0] != 2:
+                return None
+            conn.execute('UPDATE terms SET category_id = ? WHERE category_id = ?', (target_id, source_id))
+            conn.execute('DELETE FROM categories WHERE id = ?', (source_id,))
+            return self._record_change(conn, CATEGORY, MERGE, source_id, target_id)
+    
+    def get_revision(self) -> int:
+        """Текущая ревизия словаря (номер последнего изменения; 0 - изменений не было)"""
+        with self.get_connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(revision), 0) FROM dictionary_changes').fetchone()[0]
+    
+    def get_changes(self, after_revision: int = 0, limit: int = 1000) -> List[Tuple[int, str, str, int, Optional[int]]]:
+        """Изменения словаря после ревизии по возрастанию"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT revision, entity, action, entity_id, target_id 
+                FROM dictionary_changes WHERE revision > ? ORDER BY revision LIMIT ?
+            ''', (after_revision, limit))
+            return [tuple(row) for row in cursor]
+    
+    def search_terms(self, query: str, limit: int = 10, definitions: bool = True) -> List[TermRecord]:
         """Поиск терминов с разными стратегиями"""
-        query_lower = query.lower().strip()
-        results = []
+        query_norm = normalize(query)
+        if not query_norm:
+            return []
+        query_key = translit_key(query)
         
         with self.get_connection() as conn:
-            # Получаем все термины для поиска в Python (SQLite плохо работает с русскими буквами)
-            cursor = conn.execute('''
-                SELECT t.*, c.name as category_name 
+            # Строки читаются кортежами: записи создаются лишь для результатов
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            
+            # 1. Точное совпадение (по индексу нормализованного названия или ключу транслитерации)
+            row = cursor.execute(f'''
+                SELECT {LIST_COLUMNS}
                 FROM terms t 
                 LEFT JOIN categories c ON t.category_id = c.id 
+                WHERE t.term_norm = ? 
+                   OR t.id IN (SELECT term_id FROM term_keys WHERE key = ? AND is_synonym = 0)
                 ORDER BY t.usage_count DESC, t.term
-            ''')
-            all_terms = [dict(row) for row in cursor.fetchall()]
-            
-            # 1. Точное совпадение
-            for term_data in all_terms:
-                if term_data['term'].lower() == query_lower:
-                    return [term_data]
-            
-            # 2. Поиск по синонимам
-            synonym_results = []
-            for term_data in all_terms:
-                if term_data['synonyms'] and query_lower in term_data['synonyms'].lower():
-                    synonym_results.append(term_data)
+                LIMIT 1
+            ''', (query_norm, query_key)).fetchone()
+            if row:
+                return [TermRecord(*row, loader=self.load_term_texts)]
+            
+            # Поиск подстроки выполняется в Python по заранее нормализованным полям
+            rows = cursor.execute(f'''
+                SELECT {LIST_COLUMNS}, t.term_norm, t.synonyms_norm
+                FROM terms t 
+                LEFT JOIN categories c ON t.category_id = c.id 
+                ORDER BY t.usage_count DESC, t.term
+            ''').fetchall()
+            
+            # 2. Поиск по синонимам (включая написание другим алфавитом)
+            synonym_ids = {
+                term_id for (term_id,) in cursor.execute(
+                    'SELECT term_id FROM term_keys WHERE key = ? AND is_synonym = 1', (query_key,)
+                )
+            }
+            synonym_results = [
+                row for row in rows
+                if row[0] in synonym_ids or (row[7] and query_norm in row[7])
+            ]
             if synonym_results:
-                return synonym_results[:limit]
+                return [TermRecord(*row[:6], loader=self.load_term_texts) for row in synonym_results[:limit]]
             
             # 3. Частичное совпадение в названии
-            partial_results = []
-            for term_data in all_terms:
-                if query_lower in term_data['term'].lower():
-                    partial_results.append(term_data)
+            partial_results = [row for row in rows if query_norm in row[6]]
             if partial_results:
-                return partial_results[:limit]
+                return [TermRecord(*row[:6], loader=self.load_term_texts) for row in partial_results[:limit]]
+            if not definitions:
+                return []
             
-            # 4. Поиск в определениях
+            # 4. Поиск в определениях: тексты читаются потоком, без загрузки всей таблицы
+            cursor.execute(f'''
+                SELECT {LIST_COLUMNS}, t.definition_norm
+                FROM terms t 
+                LEFT JOIN categories c ON t.category_id = c.id 
+                ORDER BY t.usage_count DESC, t.term
+            ''')
             definition_results = []
-            for term_data in all_terms:
-                if query_lower in term_data['definition'].lower():
-                    definition_results.append(term_data)
+            for row in cursor:
+                if query_norm in row[6]:
+                    definition_results.append(TermRecord(*row[:6], loader=self.load_term_texts))
+                    if len(definition_results) == limit:
+                        break
             
-            return definition_results[:limit]
+            return definition_results
     
-    def get_term_by_id(self, term_id: int) -> Optional[Dict]:
-        """Получает термин по ID"""
+    def get_terms_by_ids(self, term_ids: List[int]) -> List[TermRecord]:
+        """Термины в порядке переданных ID (без текстов); несуществующие ID пропускаются"""
+        term_ids = list(term_ids)
+        if not term_ids:
+            return []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            placeholders = ','.join('?' * len(term_ids))
+            rows = cursor.execute(f'''
+                SELECT {LIST_COLUMNS}
+                FROM terms t 
+                LEFT JOIN categories c ON t.category_id = c.id 
+                WHERE t.id IN ({placeholders})
+            ''', term_ids).fetchall()
+        by_id = {row[0]: row for row in rows}
+        return [TermRecord(*by_id[term_id], loader=self.load_term_texts) for term_id in term_ids if term_id in by_id]
+    
+    def get_term_patterns(self, after_id: int = 0) -> List[Tuple[int, str, Optional[str]]]:
+        """Названия и синонимы терминов с ID больше after_id: (id, term, synonyms)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                'SELECT id, term, synonyms FROM terms WHERE id > ? ORDER BY id', (after_id,)
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+    
+    def get_term_documents(self, after_id: int = 0) -> List[Tuple[int, str, str, Optional[str], Optional[str]]]:
+        """Тексты терминов с ID больше after_id: (id, term, definition, examples, synonyms)"""
         with self.get_connection() as conn:
             cursor = conn.execute('''
-                SELECT t.*, c.name as category_name 
+                SELECT id, term, definition, examples, synonyms 
+                FROM terms 
+                WHERE id > ? 
+                ORDER BY id
+            ''', (after_id,))
+            return [tuple(row) for row in cursor]
+    
+    def load_term_texts(self, term_id: int) -> Tuple[Optional[str], Optional[str]]:
+        """Загружает definition и examples термина"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT definition, examples FROM terms WHERE id = ?', (term_id,))
+            result = cursor.fetchone()
+            return (result[0], result[1]) if result else (None, None)
+    
+    def get_term_by_id(self, term_id: int) -> Optional[TermRecord]:
+        """Получает термин по ID"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {FULL_COLUMNS}
                 FROM terms t 
                 LEFT JOIN categories c ON t.category_id = c.id 
                 WHERE t.id = ?
             ''', (term_id,))
             result = cursor.fetchone()
-            return dict(result) if result else None
+            return TermRecord(*result) if result else None
     
-    def get_random_term(self) -> Optional[Dict]:
+    def get_random_term(self) -> Optional[TermRecord]:
         """Получает случайный термин"""
         with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT t.*, c.name as category_name 
+            cursor = conn.execute(f'''
+                SELECT {FULL_COLUMNS}
                 FROM terms t 
                 LEFT JOIN categories c ON t.category_id = c.id 
                 ORDER BY RANDOM() 
                 LIMIT 1
             ''')
             result = cursor.fetchone()
-            return dict(result) if result else None
+            return TermRecord(*result) if result else None
     
     def increment_usage(self, term_id: int):
         """Увеличивает счетчик использования термина"""
@@ -232,6 +676,262 @@ class PerfumeDatabase:
             ''')
             return [dict(row) for row in cursor.fetchall()]
     
+    def get_cursor(self, name: str) -> int:
+        """Позиция фоновой задачи (например, последний обработанный ID); 0 если не задана"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT value FROM job_cursors WHERE name = ?', (name,))
+            result = cursor.fetchone()
+            return result[0] if result else 0
+    
+    def set_cursor(self, name: str, value: int):
+        """Сохраняет позицию фоновой задачи"""
+        with self.get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO job_cursors (name, value) VALUES (?, ?)', (name, value))
+    
+    def get_user_sketches(self, since_day: str) -> Dict[str, bytes]:
+        """Сводки уникальных пользователей за дни начиная с since_day ('YYYY-MM-DD'): день -> регистры"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT day, registers FROM user_sketches WHERE day >= ?', (since_day,))
+            return {row[0]: bytes(row[1]) for row in cursor}
+    
+    def merge_user_sketches(self, sketches: Dict[str, bytes], keep_since: str):
+        """Объединяет сводки пользователей с сохраненными (максимум регистров);
+        сводки за дни раньше keep_since удаляются"""
+        with self.get_connection() as conn:
+            for day, registers in sketches.items():
+                row = conn.execute('SELECT registers FROM user_sketches WHERE day = ?', (day,)).fetchone()
+                if row:
+                    registers = merge_registers(bytes(row[0]), registers)
+                conn.execute('INSERT OR REPLACE INTO user_sketches (day, registers) VALUES (?, ?)', (day, registers))
+            conn.execute('DELETE FROM user_sketches WHERE day < ?', (keep_since,))
+    
+    def get_miss_sketches(self, since_day: str) -> Dict[str, str]:
+        """Сводки неуспешных поисков за дни начиная с since_day ('YYYY-MM-DD'): день -> JSON"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT day, counters FROM miss_sketches WHERE day >= ?', (since_day,))
+            return {row[0]: row[1] for row in cursor}
+    
+    def save_miss_sketches(self, sketches: Dict[str, str], cursor: int, keep_since: str):
+        """Сохраняет сводки по дням и позицию MISS_CURSOR одной транзакцией;
+        сводки за дни раньше keep_since удаляются"""
+        with self.get_connection() as conn:
+            conn.executemany('INSERT OR REPLACE INTO miss_sketches (day, counters) VALUES (?, ?)', sketches.items())
+            conn.execute('DELETE FROM miss_sketches WHERE day < ?', (keep_since,))
+            conn.execute('INSERT OR REPLACE INTO job_cursors (name, value) VALUES (?, ?)', (MISS_CURSOR, cursor))
+    
+    def get_term_searches(self, after_id: int = 0, since: float = None,
+                          limit: int = None) -> List[Tuple[int, int, int, float]]:
+        """Успешные поиски с ID больше after_id (и не раньше since, unix-время):
+        (id, user_id, term_id, время) по возрастанию ID"""
+        sql = '''
+            SELECT id, user_id, term_id, CAST(strftime('%s', search_date) AS REAL) 
+            FROM search_stats 
+            WHERE id > ? AND term_id IS NOT NULL
+        '''
+        params = [after_id]
+        if since is not None:
+            sql += " AND search_date >= datetime(?, 'unixepoch')"
+            params.append(since)
+        sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self.get_connection() as conn:
+            return [tuple(row) for row in conn.execute(sql, params)]
+    
+    def get_search_log(self, after_id: int = 0, limit: int = 500) -> List[Tuple]:
+        """Все поиски с ID больше after_id по возрастанию ID:
+        (id, время UTC 'YYYY-MM-DD HH:MM:SS', user_id, query, found, term_id)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, search_date, user_id, query, found, term_id 
+                FROM search_stats WHERE id > ? ORDER BY id LIMIT ?
+            ''', (after_id, limit))
+            return [(row[0], row[1], row[2], row[3], bool(row[4]), row[5]) for row in cursor]
+    
+    def get_suggestion_log(self, after_id: int = 0, limit: int = 500) -> List[Tuple]:
+        """Предложения терминов с ID больше after_id по возрастанию ID:
+        (id, время UTC, user_id, username, термин, определение, категория)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, created_at, user_id, username, suggested_term, suggested_definition, suggested_category 
+                FROM term_suggestions WHERE id > ? ORDER BY id LIMIT ?
+            ''', (after_id, limit))
+            return [tuple(row) for row in cursor]
+    
+    def add_cooccurrences(self, pairs: List[Tuple[int, int, int]]):
+        """Прибавляет счетчики совместных поисков: тройки (term_a, term_b, count), term_a < term_b"""
+        with self.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO term_cooccurrence (term_a, term_b, count) VALUES (?, ?, ?) 
+                ON CONFLICT (term_a, term_b) DO UPDATE SET count = count + excluded.count
+            ''', pairs)
+    
+    def get_cooccurrences(self, term_ids: List[int]) -> List[Tuple[int, int, int]]:
+        """Счетчики совместных поисков, в которых участвует любой из терминов"""
+        rows = []
+        term_ids = list(term_ids)
+        with self.get_connection() as conn:
+            # Порциями, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(term_ids), 500):
+                chunk = term_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f'''
+                    SELECT term_a, term_b, count FROM term_cooccurrence WHERE term_a IN ({placeholders}) 
+                    UNION 
+                    SELECT term_a, term_b, count FROM term_cooccurrence WHERE term_b IN ({placeholders})
+                ''', chunk + chunk)
+                rows.extend(tuple(row) for row in cursor)
+        return rows
+    
+    def get_term_catalog(self) -> List[Tuple[int, Optional[int], int]]:
+        """Все термины без текстов: (id, category_id, usage_count)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT id, category_id, usage_count FROM terms')
+            return [tuple(row) for row in cursor]
+    
+    def replace_neighbors(self, neighbors: Dict[int, List[Tuple[int, float]]]):
+        """Заменяет списки связанных терминов: {term_id: [(neighbor_id, score), ...]} по убыванию score"""
+        with self.get_connection() as conn:
+            conn.executemany('DELETE FROM term_neighbors WHERE term_id = ?', [(term_id,) for term_id in neighbors])
+            conn.executemany(
+                'INSERT INTO term_neighbors (term_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)',
+                [
+                    (term_id, rank, neighbor_id, score)
+                    for term_id, items in neighbors.items()
+                    for rank, (neighbor_id, score) in enumerate(items)
+                ]
+            )
+    
+    def get_related_terms(self, term_id: int, limit: int = 4) -> List[Tuple[int, str]]:
+        """Связанные термины из готовой таблицы: (id, название)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT t.id, t.term 
+                FROM term_neighbors n 
+                JOIN terms t ON t.id = n.neighbor_id 
+                WHERE n.term_id = ? 
+                ORDER BY n.rank 
+                LIMIT ?
+            ''', (term_id, limit))
+            return [tuple(row) for row in cursor]
+    
+    def add_history(self, user_id: int, term_id: int, viewed_at: float, keep: int = 10):
+        """Добавляет термин в историю пользователя (повторный просмотр поднимает его наверх)
+        и оставляет только keep последних терминов"""
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT INTO user_history (user_id, term_id, viewed_at) VALUES (?, ?, ?) 
+                ON CONFLICT (user_id, term_id) DO UPDATE SET viewed_at = excluded.viewed_at
+            ''', (user_id, term_id, viewed_at))
+            conn.execute('''
+                DELETE FROM user_history 
+                WHERE user_id = ? AND viewed_at < (
+                    SELECT viewed_at FROM user_history WHERE user_id = ? 
+                    ORDER BY viewed_at DESC LIMIT 1 OFFSET ?
+                )
+            ''', (user_id, user_id, keep - 1))
+    
+    def get_history(self, user_id: int, limit: int = 10) -> List[Tuple[int, str]]:
+        """История пользователя от новых к старым: (id, название)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT t.id, t.term 
+                FROM user_history h 
+                JOIN terms t ON t.id = h.term_id 
+                WHERE h.user_id = ? 
+                ORDER BY h.viewed_at DESC 
+                LIMIT ?
+            ''', (user_id, limit))
+            return [tuple(row) for row in cursor]
+    
+    def add_subscriber(self, chat_id: int) -> bool:
+        """Подписывает чат на термин дня; False если подписка уже была"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('INSERT OR IGNORE INTO subscribers (chat_id) VALUES (?)', (chat_id,))
+            return cursor.rowcount > 0
+    
+    def remove_subscriber(self, chat_id: int) -> bool:
+        """Отписывает чат от термина дня; False если подписки не было"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
+            return cursor.rowcount > 0
+    
+    def is_subscribed(self, chat_id: int) -> bool:
+        """Подписан ли чат на термин дня"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('SELECT 1 FROM subscribers WHERE chat_id = ?', (chat_id,))
+            return cursor.fetchone() is not None
+    
+    def get_broadcast(self, broadcast_date: str) -> Optional[Dict]:
+        """Получает рассылку за указанную дату (YYYY-MM-DD)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, broadcast_date, term_id, text, parse_mode, status 
+                FROM broadcasts 
+                WHERE broadcast_date = ?
+            ''', (broadcast_date,))
+            result = cursor.fetchone()
+            return dict(result) if result else None
+    
+    def get_unfinished_broadcast(self) -> Optional[Dict]:
+        """Последняя по дате незавершенная рассылка (None - все завершены)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, broadcast_date, term_id, text, parse_mode, status 
+                FROM broadcasts 
+                WHERE status != 'finished' 
+                ORDER BY broadcast_date DESC 
+                LIMIT 1
+            ''')
+            result = cursor.fetchone()
+            return dict(result) if result else None
+    
+    def create_broadcast(self, broadcast_date: str, term_id: Optional[int], text: str, parse_mode: str) -> Dict:
+        """Создает рассылку с заранее подготовленным текстом и его режимом разметки"""
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT INTO broadcasts (broadcast_date, term_id, text, parse_mode) 
+                VALUES (?, ?, ?, ?)
+            ''', (broadcast_date, term_id, text, parse_mode))
+        return self.get_broadcast(broadcast_date)
+    
+    def get_pending_recipients(self, broadcast_id: int, limit: int = 100) -> List[int]:
+        """Подписчики, которым рассылка еще не доставлена (по возрастанию chat_id)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT s.chat_id 
+                FROM subscribers s 
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM broadcast_deliveries d 
+                    WHERE d.broadcast_id = ? AND d.chat_id = s.chat_id
+                ) 
+                ORDER BY s.chat_id 
+                LIMIT ?
+            ''', (broadcast_id, limit))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def record_deliveries(self, broadcast_id: int, deliveries: List[Tuple[int, str]]):
+        """Сохраняет результаты отправки: пары (chat_id, статус)"""
+        with self.get_connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, chat_id, status) 
+                VALUES (?, ?, ?)
+            ''', [(broadcast_id, chat_id, status) for chat_id, status in deliveries])
+    
+    def finish_broadcast(self, broadcast_id: int):
+        """Отмечает рассылку завершенной"""
+        with self.get_connection() as conn:
+            conn.execute('''
+                UPDATE broadcasts SET status = 'finished', finished_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (broadcast_id,))
+    
+    def ping(self):
+        """Минимальный запрос к базе для проверки готовности; исключение, если база недоступна"""
+        with self.get_connection() as conn:
+            conn.execute('SELECT value FROM job_cursors LIMIT 1').fetchall()
+    
     def get_stats(self) -> Dict:
         """Получает статистику базы данных"""
         with self.get_connection() as conn:
@@ -270,10 +970,6 @@ class PerfumeDatabase:
             
             return stats
     
-    def get_database_stats(self) -> Dict:
-        """Алиас для get_stats() для совместимости"""
-        return self.get_stats()
-    
     def backup_database(self, backup_path: str = None) -> str:
         """Создает резервную копию базы данных"""
         if not backup_path:
@@ -291,21 +987,29 @@ class PerfumeDatabase:
         return backup_path
     
     def close(self):
-        """Закрытие соединения с базой данных (для совместимости)"""
-        # SQLite автоматически закрывает соединения при использовании контекстного менеджера
-        # Этот метод добавлен для совместимости с кодом, который ожидает метод close()
-        pass
+        """Переносит журнал WAL в основной файл базы перед остановкой процесса
+
+        Соединения открываются на каждый запрос, поэтому закрывать нечего, но без
+        контрольной точки последние записи остаются только в database.db-wal:
+        копия одного файла базы (бэкап, перенос на другой диск) их не увидит.
+        """
+        conn = self.get_connection()
+        try:
+            busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            if busy:
+                # Параллельный читатель удерживает журнал - он будет перенесен при следующем открытии
+                logger.warning("Контрольная точка WAL не завершена: база занята")
+        finally:
+            conn.close()
 
 # Функция для инициализации базы данных с начальными данными
-def populate_initial_data(db: PerfumeDatabase):
+def populate_initial_data(db: StorageBackend):
     """Заполняет базу данных начальными терминами"""
     
     # Проверяем, есть ли уже данные
-    with db.get_connection() as conn:
-        cursor = conn.execute('SELECT COUNT(*) as count FROM terms')
-        if cursor.fetchone()['count'] > 0:
-            print("База данных уже содержит термины, пропускаем инициализацию")
-            return
+    if db.get_stats()['total_terms'] > 0:
+        print("База данных уже содержит термины, пропускаем инициализацию")
+        return
     
     print("Заполняем базу данных начальными терминами...")
     
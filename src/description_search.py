@@ -0,0 +1,250 @@
+"""
+Поиск по описанию аромата: "пахнет свежо, цитрусово" -> подходящие термины
+Ранжирование BM25 по определениям, примерам, синонимам и названиям терминов
+"""
+import math
+import threading
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from storage_backend import StorageBackend, CREATE
+from term_record import TermRecord
+from text_normalizer import stem_tokens
+
+# Вес вхождения слова в зависимости от поля термина
+FIELD_WEIGHTS = (
+    ('term', 2.0),
+    ('definition', 1.0),
+    ('examples', 0.5),
+    ('synonyms', 1.5),
+)
+
+
+class _View(NamedTuple):
+    """Опубликованное состояние индекса: массивы numpy, которые после публикации не меняются"""
+    doc_term_ids: np.ndarray
+    doc_lengths: np.ndarray
+    doc_alive: Optional[np.ndarray]   # None - удаленных строк нет
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    docs_count: int
+    length_sum: float
+
+
+def _column(values, dtype) -> np.ndarray:
+    """Столбец для публикации: из файла словаря - без копирования, дописываемый array - копией"""
+    if isinstance(values, memoryview):
+        return np.frombuffer(values, dtype=dtype)
+    return np.array(values, dtype=dtype)
+
+
+class DescriptionIndex:
+    """Разреженная матрица "термин x основа слова" для поиска по описанию
+
+    Матрица хранится по столбцам: для каждой основы - номера документов
+    и взвешенные частоты в компактных массивах array, которые numpy читает
+    без копирования. Новые термины дописываются в конец столбцов, поэтому
+    индекс дополняется без перестроения; IDF и средняя длина документа
+    считаются в момент запроса.
+
+    Измененный или удаленный термин (событие шины изменений) помечается
+    удаленным, а новая версия дописывается отдельной строкой. Удаленные строки
+    не участвуют в ранжировании и средней длине; когда их становится больше
+    четверти индекса (и больше 32, чтобы маленький словарь не перестраивался
+    на каждой правке), он перестраивается, чтобы частоты слов в IDF не учитывали
+    устаревшие тексты.
+
+    Из файла словаря (DictionaryArtifact) столбцы читаются без копирования:
+    несколько процессов делят одну копию в кэше ОС. Столбец копируется
+    в память процесса, только когда в него дописывается новый термин.
+
+    Поиск не берет блокировку и не обращается к базе: писатели (sync и шина
+    изменений, включая новые термины) после каждого изменения публикуют
+    неизменяемое представление заменой одной ссылки, как SnapshotStore.
+    В новое представление копируются только столбцы, в которые дописывались
+    строки, остальные переходят из предыдущего.
+    """
+
+    def __init__(self, db: StorageBackend, k1: float = 1.2, b: float = 0.75, artifact=None):
+        self.db = db
+        self.k1 = k1
+        self.b = b
+        self._artifact = artifact
+        self._lock = threading.Lock()
+        self._view: Optional[_View] = None
+        self._reset()
+
+    def _reset(self):
+        self.doc_term_ids = array('q')
+        self.doc_lengths = array('f')
+        self.doc_alive = array('b')
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.term_docs: Dict[int, int] = {}
+        self.removed_count = 0
+        self.last_term_id = 0
+        # Основы, столбцы которых изменились после публикации (None - публикуются все)
+        self._changed_tokens: Optional[Set[str]] = None
+
+    def _load_artifact(self):
+        """Загружает матрицу из файла словаря, если она еще не загружена"""
+        artifact, self._artifact = self._artifact, None
+        if artifact is None:
+            return
+        # Построчные массивы невелики и меняются при правках, поэтому копируются
+        self.doc_term_ids = array('q', artifact.array('descriptions.doc_term_ids'))
+        self.doc_lengths = array('f', artifact.array('descriptions.doc_lengths'))
+        self.doc_alive = array('b', b'\x01') * len(self.doc_term_ids)
+        self.term_docs = dict(zip(self.doc_term_ids, range(len(self.doc_term_ids))))
+        self.last_term_id = max(self.term_docs, default=0)
+
+        offsets = artifact.array('descriptions.offsets')
+        docs = artifact.array('descriptions.docs')
+        weights = artifact.array('descriptions.weights')
+        self.postings = {
+            token: (docs[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]])
+            for i, token in enumerate(artifact.strings('descriptions.tokens'))
+        }
+        self._changed_tokens = None
+
+    def export(self, builder):
+        """Записывает матрицу в файл словаря (без удаленных строк)"""
+        with self._lock:
+            if self.removed_count:
+                self._reset()
+                self._sync()
+                self._publish()
+            offsets = array('q', [0])
+            docs = array('i')
+            weights = array('f')
+            for column_docs, column_weights in self.postings.values():
+                docs.extend(column_docs)
+                weights.extend(column_weights)
+                offsets.append(len(docs))
+            builder.add_array('descriptions.doc_term_ids', self.doc_term_ids)
+            builder.add_array('descriptions.doc_lengths', self.doc_lengths)
+            builder.add_strings('descriptions.tokens', self.postings)
+            builder.add_array('descriptions.offsets', offsets)
+            builder.add_array('descriptions.docs', docs)
+            builder.add_array('descriptions.weights', weights)
+
+    def sync(self) -> int:
+        """Добавляет в индекс новые термины; возвращает их количество"""
+        with self._lock:
+            self._load_artifact()
+            added = self._sync()
+            self._publish()
+            return added
+
+    def _sync(self) -> int:
+        rows = self.db.get_term_documents(after_id=self.last_term_id)
+        for term_id, term, definition, examples, synonyms in rows:
+            self._add_document(term_id, {'term': term, 'definition': definition,
+                                         'examples': examples, 'synonyms': synonyms})
+        return len(rows)
+
+    def _remove_document(self, term_id: int):
+        """Помечает строку термина удаленной"""
+        doc = self.term_docs.pop(term_id, None)
+        if doc is not None:
+            self.doc_alive[doc] = 0
+            self.doc_lengths[doc] = 0.0
+            self.removed_count += 1
+
+    def apply_change(self, event):
+        """Обработчик шины изменений: заменяет строки измененных и удаленных терминов"""
+        with self._lock:
+            self._load_artifact()
+            for term_id in event.removed_terms:
+                self._remove_document(term_id)
+            for term_id in event.changed_terms:
+                # Термины, которые еще не загружены, _sync() ниже прочитает в актуальном виде
+                if term_id > self.last_term_id:
+                    continue
+                self._remove_document(term_id)
+                term = self.db.get_term_by_id(term_id)
+                if term:
+                    self._add_document(term_id, {'term': term.term, 'definition': term.definition,
+                                                 'examples': term.examples, 'synonyms': term.synonyms})
+            if event.action == CREATE or any(term_id > self.last_term_id for term_id in event.changed_terms):
+                self._sync()
+            if self.removed_count > max(32, len(self) // 4):
+                self._reset()
+                self._sync()
+            self._publish()
+
+    def _publish(self):
+        """Публикует представление для поиска (вызывается под блокировкой писателей)"""
+        previous = self._view
+        if previous is None or self._changed_tokens is None:
+            postings, tokens = {}, self.postings
+        else:
+            postings, tokens = dict(previous.postings), self._changed_tokens
+        for token in tokens:
+            docs, weights = self.postings[token]
+            postings[token] = (_column(docs, np.int32), _column(weights, np.float32))
+        lengths = np.array(self.doc_lengths, dtype=np.float32)
+        alive = np.array(self.doc_alive, dtype=np.int8) if self.removed_count else None
+        self._view = _View(np.array(self.doc_term_ids, dtype=np.int64), lengths, alive, postings,
+                           len(self.term_docs), float(lengths.sum()))
+        self._changed_tokens = set()
+
+    def _add_document(self, term_id: int, fields: Dict[str, str]):
+        """Добавляет строку матрицы для одного термина"""
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS:
+            for token in stem_tokens(fields.get(field)):
+                weights[token] = weights.get(token, 0.0) + weight
+
+        doc = len(self.doc_term_ids)
+        self.doc_term_ids.append(term_id)
+        self.doc_lengths.append(sum(weights.values()))
+        self.doc_alive.append(1)
+        self.term_docs[term_id] = doc
+        for token, weight in weights.items():
+            column = self.postings.get(token)
+            if column is None:
+                column = self.postings[token] = (array('i'), array('f'))
+            elif not isinstance(column[0], array):
+                # Столбец из файла словаря доступен только для чтения
+                column = self.postings[token] = (array('i', column[0]), array('f', column[1]))
+            column[0].append(doc)
+            column[1].append(weight)
+            if self._changed_tokens is not None:
+                self._changed_tokens.add(token)
+        self.last_term_id = max(self.last_term_id, term_id)
+
+    def search_ids(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """Лучшие термины для описания: (ID, оценка BM25) по убыванию оценки"""
+        view = self._view
+        if view is None:
+            # Индекс еще не загружен (обычно его заранее загружает прогрев при запуске)
+            self.sync()
+            view = self._view
+        tokens = [token for token in dict.fromkeys(stem_tokens(query)) if token in view.postings]
+        if not view.docs_count or not tokens:
+            return []
+
+        # Длины удаленных строк обнулены, поэтому среднее считается только по живым
+        lengths = view.doc_lengths
+        length_norm = self.k1 * (1 - self.b + self.b * lengths / (view.length_sum / view.docs_count))
+        scores = np.zeros(len(view.doc_term_ids), dtype=np.float32)
+        for token in tokens:
+            docs, tf = view.postings[token]
+            idf = math.log(1 + (view.docs_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + length_norm[docs])
+        if view.doc_alive is not None:
+            scores *= view.doc_alive
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(view.doc_term_ids[doc]), float(scores[doc])) for doc in candidates]
+
+    def search(self, query: str, limit: int = 10) -> List[TermRecord]:
+        """Лучшие термины для описания в порядке убывания оценки"""
+        return self.db.get_terms_by_ids([term_id for term_id, _ in self.search_ids(query, limit)])
+
+    def __len__(self) -> int:
+        return len(self.term_docs)
@@ -0,0 +1,212 @@
+"""
+Скомпилированный словарь: индексы поиска и тексты снимка в одном бинарном файле
+Процессы открывают файл через mmap вместо чтения всех терминов из базы
+и построения индексов заново, а несколько процессов делят одну копию
+страниц в кэше ОС
+"""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from telegram.ext import ContextTypes
+
+from storage_backend import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FRAGDICT'
+
+# Меняется при любом изменении раскладки файла: файл старого формата не открывается и пересобирается
+FORMAT_VERSION = 2
+
+# Заголовок: сигнатура, версия формата, число секций, ревизия словаря, размер данных, CRC32 данных
+HEADER = struct.Struct('<8sIIQQI')
+
+# Оглавление: имя секции, тип элементов (код array), смещение и размер в байтах
+SECTION = struct.Struct('<64s4sQQ')
+
+# Секции выравниваются, чтобы numpy читал массивы по выровненным адресам
+ALIGNMENT = 8
+
+
+class ArtifactError(ValueError):
+    """Файл словаря поврежден, неполон или другого формата"""
+
+
+class ArtifactBuilder:
+    """Собирает секции файла словаря и атомарно записывает его"""
+
+    def __init__(self):
+        self.sections: Dict[str, array] = {}
+
+    def add_array(self, name: str, values: array):
+        """Добавляет числовой массив"""
+        self.sections[name] = values
+
+    def add_strings(self, name: str, values: Iterable[str]):
+        """Добавляет список строк: UTF-8 подряд и смещения границ"""
+        data = bytearray()
+        offsets = array('q', [0])
+        for value in values:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+        self.sections[f"{name}.data"] = array('B', data)
+        self.sections[f"{name}.offsets"] = offsets
+
+    def write(self, path: str, revision: int) -> int:
+        """Записывает файл во временный рядом и подменяет старый через os.replace
+
+        Процессы, которые уже открыли прежний файл, продолжают читать его:
+        отображение в память держит старую версию до закрытия.
+        Возвращает размер файла.
+        """
+        table = bytearray()
+        payload = bytearray()
+        data_start = HEADER.size + SECTION.size * len(self.sections)
+        for name, values in self.sections.items():
+            payload += bytes(-(data_start + len(payload)) % ALIGNMENT)
+            data = values.tobytes()
+            table += SECTION.pack(name.encode('utf-8'), values.typecode.encode('ascii'),
+                                  data_start + len(payload), len(data))
+            payload += data
+
+        body = bytes(table) + bytes(payload)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, len(self.sections), revision, len(body), zlib.crc32(body))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(header) + len(body)
+
+
+def read_revision(path: str) -> Optional[int]:
+    """Ревизия словаря по заголовку файла (None - файла нет или он другого формата)"""
+    try:
+        with open(path, 'rb') as f:
+            magic, version, _, revision, _, _ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    return revision
+
+
+class DictionaryArtifact:
+    """Открытый только для чтения файл словаря
+
+    Массивы секций - представления memoryview поверх mmap без копирования.
+    Файл остается отображенным, пока живы выданные представления, поэтому
+    объект держат открытым все время работы процесса.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        if len(view) < HEADER.size:
+            raise ArtifactError("файл словаря обрезан")
+        magic, version, sections_count, self.revision, size, checksum = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ArtifactError("это не файл словаря")
+        if version != FORMAT_VERSION:
+            raise ArtifactError(f"формат {version}, ожидается {FORMAT_VERSION}")
+        if len(view) != HEADER.size + size:
+            raise ArtifactError("файл словаря обрезан")
+        if zlib.crc32(view[HEADER.size:]) != checksum:
+            raise ArtifactError("контрольная сумма не совпадает")
+
+        self._sections = {}
+        for i in range(sections_count):
+            name, typecode, offset, length = SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+            self._sections[name.rstrip(b'\0').decode('utf-8')] = (typecode.rstrip(b'\0').decode('ascii'),
+                                                                 offset, length)
+        self.size = len(view)
+
+    def array(self, name: str) -> memoryview:
+        """Массив секции без копирования"""
+        typecode, offset, length = self._sections[name]
+        view = memoryview(self._mmap)[offset:offset + length]
+        return view if typecode == 'B' else view.cast(typecode)
+
+    def strings(self, name: str) -> List[str]:
+        """Список строк секции (строки декодируются, то есть копируются)"""
+        data = self.array(f"{name}.data")
+        offsets = self.array(f"{name}.offsets")
+        return [str(data[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(len(offsets) - 1)]
+
+
+def open_artifact(path: str, db: StorageBackend = None) -> Optional[DictionaryArtifact]:
+    """Открывает файл словаря; при отсутствии или повреждении - None (индексы строятся из базы)
+
+    Файл с ревизией новее базы собран для другой базы и не используется.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        artifact = DictionaryArtifact(path)
+    except (OSError, ArtifactError) as e:
+        logger.warning("Файл словаря %s не используется: %s", path, e)
+        return None
+    if db is not None and artifact.revision > db.get_revision():
+        logger.warning("Файл словаря %s собран для другой базы (ревизия %s), не используется",
+                       path, artifact.revision)
+        return None
+    return artifact
+
+
+def compile_dictionary(db: StorageBackend, path: str) -> int:
+    """Строит индексы из базы и записывает их в файл словаря; возвращает ревизию файла"""
+    from description_search import DescriptionIndex
+    from dictionary_snapshot import export_terms
+    from glossary import GlossaryIndex
+
+    # Ревизия читается до данных: правки во время сборки процессы повторно применят по шине
+    revision = db.get_revision()
+    glossary = GlossaryIndex(db)
+    glossary.sync()
+    descriptions = DescriptionIndex(db)
+    descriptions.sync()
+
+    builder = ArtifactBuilder()
+    glossary.export(builder)
+    descriptions.export(builder)
+    export_terms(db, builder)
+    size = builder.write(path, revision)
+    logger.info("Файл словаря собран: ревизия %s, %s терминов, %.1f МБ",
+                revision, len(glossary.term_names), size / 1024 / 1024)
+    return revision
+
+
+class DictionaryCompiler:
+    """Пересобирает файл словаря, когда ревизия базы уходит вперед"""
+
+    def __init__(self, db: StorageBackend, path: str):
+        self.db = db
+        self.path = path
+
+    def refresh(self) -> bool:
+        """Пересобирает файл, если его нет или он отстал от базы; True - файл пересобран"""
+        if not self.path:
+            return False
+        if read_revision(self.path) == self.db.get_revision():
+            return False
+        try:
+            compile_dictionary(self.db, self.path)
+            return True
+        except Exception as e:
+            logger.error("Ошибка сборки файла словаря: %s", e)
+            return False
+
+    async def job_callback(self, context: ContextTypes.DEFAULT_TYPE):
+        """Задача JobQueue: проверка и пересборка в отдельном потоке"""
+        await asyncio.to_thread(self.refresh)
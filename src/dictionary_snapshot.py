@@ -0,0 +1,516 @@
+"""
+Снимок словаря в памяти для чтения без обращения к базе
+Поиск, карточка термина и списки категорий читают неизменяемый снимок;
+изменения собирают новый снимок и публикуют его заменой одной ссылки
+"""
+import bisect
+import itertools
+import logging
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from change_bus import ChangeEvent
+from storage_backend import StorageBackend, CATEGORY, CREATE
+from term_record import CategoryRecord, TermRecord
+from text_normalizer import normalize, translit_key, term_keys
+
+logger = logging.getLogger(__name__)
+
+
+class TermEntry(NamedTuple):
+    """Термин снимка: запись с текстами и заранее нормализованные поля поиска"""
+    record: TermRecord
+    name_norm: str
+    synonyms_norm: str
+    keys: Tuple[Tuple[str, int], ...]
+
+
+def make_entry(record: TermRecord) -> TermEntry:
+    """Нормализует поля термина один раз - при попадании в снимок"""
+    return TermEntry(record, normalize(record.term), normalize(record.synonyms),
+                     tuple(term_keys(record.term, record.synonyms)))
+
+
+class RankingColumns(NamedTuple):
+    """Столбцы снимка для ранжирования выдачи, по позициям в DictionarySnapshot.ordered"""
+    popularity: np.ndarray     # log(1 + запросов)
+    name_rank: np.ndarray      # место термина в порядке (название, ID)
+    by_name: List[tuple]       # (название, ID) по возрастанию - для продолжения выдачи с курсора
+
+
+# Пустые необязательные поля в файле словаря: биты секции snapshot.nulls
+_NO_EXAMPLES, _NO_SYNONYMS = 1, 2
+
+_TEXT_COLUMNS = ('terms', 'definitions', 'examples', 'synonyms')
+
+
+def export_terms(db: StorageBackend, builder):
+    """Записывает тексты терминов с нормализованными полями и ключами поиска в файл словаря
+
+    Из них SnapshotStore.load собирает снимок без чтения текстов из базы и без
+    повторной нормализации (она и занимает большую часть сборки снимка).
+    """
+    rows = db.get_term_documents()
+    entries = [make_entry(TermRecord(term_id, term, synonyms=synonyms, definition=definition, examples=examples))
+               for term_id, term, definition, examples, synonyms in rows]
+    builder.add_array('snapshot.term_ids', array('q', (row[0] for row in rows)))
+    builder.add_array('snapshot.nulls', array('b', (
+        (_NO_EXAMPLES if examples is None else 0) | (_NO_SYNONYMS if synonyms is None else 0)
+        for _, _, _, examples, synonyms in rows
+    )))
+    for i, name in enumerate(_TEXT_COLUMNS, 1):
+        builder.add_strings(f'snapshot.{name}', (row[i] or '' for row in rows))
+    builder.add_strings('snapshot.name_norm', (entry.name_norm for entry in entries))
+    builder.add_strings('snapshot.synonyms_norm', (entry.synonyms_norm for entry in entries))
+    builder.add_array('snapshot.key_counts', array('i', (len(entry.keys) for entry in entries)))
+    builder.add_array('snapshot.key_synonyms', array('b', (
+        is_synonym for entry in entries for _, is_synonym in entry.keys
+    )))
+    builder.add_strings('snapshot.keys', (key for entry in entries for key, _ in entry.keys))
+
+
+def _order_key(entry: TermEntry) -> tuple:
+    """Порядок выдачи хранилища: популярные выше, затем по названию (ID различает одноименные)"""
+    return -entry.record.usage_count, entry.record.term, entry.record.id
+
+
+class DictionarySnapshot:
+    """Неизменяемый снимок словаря на одну ревизию
+
+    Объект не меняется после создания: читатель берет ссылку на текущий снимок
+    один раз и до конца обработки видит согласованное состояние, даже если
+    тем временем опубликован новый. Повторяет чтения хранилища, которые нужны
+    обработчикам: search_terms (без поиска по определениям), get_term_by_id,
+    get_categories, get_category, get_category_terms, count_terms_by_category.
+    """
+
+    def __init__(self, revision: int, entries: Dict[int, TermEntry], categories: Dict[int, CategoryRecord]):
+        self.revision = revision
+        self.entries = entries
+        self.categories = categories
+        self.sorted_categories = sorted(categories.values(), key=lambda category: category.name)
+
+        self.ordered: List[TermEntry] = sorted(entries.values(), key=_order_key)
+        self.order_keys: List[tuple] = [_order_key(entry) for entry in self.ordered]
+        self.names: Dict[str, List[int]] = {}
+        self.keys: Dict[str, List[int]] = {}
+        self.synonym_keys: Dict[str, List[int]] = {}
+        self.category_terms: Dict[int, List[TermRecord]] = {}
+        for entry in self.ordered:
+            self._index(entry, self.names, self.keys, self.synonym_keys, self.category_terms)
+        for terms in self.category_terms.values():
+            terms.sort(key=lambda term: term.term)
+        self._text = None
+        self._word_tails = None
+        self._columns = None
+
+    @staticmethod
+    def _index(entry: TermEntry, names, keys, synonym_keys, category_terms):
+        term_id = entry.record.id
+        names.setdefault(entry.name_norm, []).append(term_id)
+        for key, is_synonym in entry.keys:
+            (synonym_keys if is_synonym else keys).setdefault(key, []).append(term_id)
+        if entry.record.category_id is not None:
+            category_terms.setdefault(entry.record.category_id, []).append(entry.record)
+
+    def replace(self, changed: Iterable[TermEntry] = (), removed: Iterable[int] = (),
+                categories: Iterable[CategoryRecord] = (), revision: int = None) -> 'DictionarySnapshot':
+        """Новый снимок с замененными, добавленными и удаленными терминами
+
+        Копирование при записи: словари индексов копируются поверхностно, а из
+        списков копируются только те, что затронуты изменением, - остальное
+        новый снимок делит с текущим. Текущий снимок не меняется.
+        """
+        snapshot = DictionarySnapshot.__new__(DictionarySnapshot)
+        snapshot.revision = max(self.revision, revision or 0)
+        snapshot.entries = dict(self.entries)
+        snapshot.categories = self.categories
+        snapshot.sorted_categories = self.sorted_categories
+        categories = list(categories)
+        if categories:
+            snapshot.categories = dict(self.categories)
+            snapshot.categories.update((category.id, category) for category in categories)
+            snapshot.sorted_categories = sorted(snapshot.categories.values(), key=lambda category: category.name)
+        snapshot.ordered = list(self.ordered)
+        snapshot.order_keys = list(self.order_keys)
+        snapshot._text = None
+        snapshot._word_tails = None
+        snapshot._columns = None
+        indexes = (dict(self.names), dict(self.keys), dict(self.synonym_keys), dict(self.category_terms))
+        snapshot.names, snapshot.keys, snapshot.synonym_keys, snapshot.category_terms = indexes
+        copied = set()
+
+        def own(index: dict, key) -> list:
+            """Список индекса, который можно менять: при первом изменении копируется"""
+            if (id(index), key) not in copied:
+                copied.add((id(index), key))
+                index[key] = list(index.get(key, ()))
+            return index[key]
+
+        changed = list(changed)
+        for term_id in [entry.record.id for entry in changed] + list(removed):
+            entry = snapshot.entries.pop(term_id, None)
+            if entry is None:
+                continue
+            position = bisect.bisect_left(snapshot.order_keys, _order_key(entry))
+            del snapshot.ordered[position], snapshot.order_keys[position]
+            touched = [(snapshot.names, entry.name_norm)]
+            touched += [(snapshot.synonym_keys if is_synonym else snapshot.keys, key) for key, is_synonym in entry.keys]
+            for index, key in touched:
+                items = own(index, key)
+                items[:] = [item for item in items if item != term_id]
+                if not items:
+                    del index[key]
+                    copied.discard((id(index), key))
+            if entry.record.category_id is not None:
+                terms = own(snapshot.category_terms, entry.record.category_id)
+                terms[:] = [term for term in terms if term.id != term_id]
+
+        changed_categories = set()
+        for entry in changed:
+            snapshot.entries[entry.record.id] = entry
+            key = _order_key(entry)
+            position = bisect.bisect_left(snapshot.order_keys, key)
+            snapshot.ordered.insert(position, entry)
+            snapshot.order_keys.insert(position, key)
+            for index, index_key in [(snapshot.names, entry.name_norm)] + [
+                    (snapshot.synonym_keys if is_synonym else snapshot.keys, key) for key, is_synonym in entry.keys]:
+                own(index, index_key).append(entry.record.id)
+            if entry.record.category_id is not None:
+                own(snapshot.category_terms, entry.record.category_id).append(entry.record)
+                changed_categories.add(entry.record.category_id)
+        for category_id in changed_categories:
+            snapshot.category_terms[category_id].sort(key=lambda term: term.term)
+        for category_id in [category_id for category_id, terms in snapshot.category_terms.items() if not terms]:
+            del snapshot.category_terms[category_id]
+        return snapshot
+
+    def search_terms(self, query: str, limit: int = 10) -> List[TermRecord]:
+        """Поиск по названию, синонимам и части названия - те же ступени, что в хранилище"""
+        query_norm = normalize(query)
+        if not query_norm:
+            return []
+        query_key = translit_key(query)
+
+        # 1. Точное совпадение названия или ключа транслитерации
+        exact = self.names.get(query_norm, []) + self.keys.get(query_key, [])
+        if exact:
+            best = min(exact, key=lambda term_id: (-self.entries[term_id].record.usage_count,
+                                                   self.entries[term_id].record.term))
+            return [self.entries[best].record]
+
+        # 2. Синонимы (включая написание другим алфавитом)
+        synonym_ids = set(self.synonym_keys.get(query_key, ()))
+        results = self._scan(lambda entry: entry.record.id in synonym_ids or
+                             (entry.synonyms_norm and query_norm in entry.synonyms_norm), limit)
+        if results:
+            return results
+
+        # 3. Частичное совпадение в названии
+        return self._scan(lambda entry: query_norm in entry.name_norm, limit)
+
+    def find_substring(self, query_norm: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Позиции (в ordered) терминов, в названии и в синонимах которых встречается нормализованная строка
+
+        Поиск идет по склеенным через перевод строки полям всех терминов:
+        редкое совпадение находит str.find без цикла Python по словарю, а его
+        позиция переводится в термин бисекцией по началам полей. Когда совпадений
+        набирается много (короткий запрос вроде "терм"), поиск переходит на
+        проверку поля за полем в списковом выражении - это быстрее бисекции на
+        каждое совпадение. Склеенный текст строится заранее (prepare_search);
+        нормализованные поля перевода строки не содержат.
+        """
+        return tuple(self._find(text, starts, values, query_norm) for text, starts, values in self._search_text())
+
+    def _search_text(self):
+        if self._text is None:
+            self._text = tuple(self._join(field) for field in ('name_norm', 'synonyms_norm'))
+        return self._text
+
+    def _join(self, field: str) -> Tuple[str, List[int], List[str]]:
+        values = [getattr(entry, field) for entry in self.ordered]
+        starts = list(itertools.accumulate((len(value) + 1 for value in values), initial=0))
+        return '\n'.join(values), starts, values
+
+    @staticmethod
+    def _find(text: str, starts: List[int], values: List[str], query_norm: str) -> np.ndarray:
+        found = []
+        position = text.find(query_norm)
+        while position != -1:
+            if len(found) * 8 > len(values):
+                return np.flatnonzero([query_norm in value for value in values])
+            index = bisect.bisect_right(starts, position) - 1
+            found.append(index)
+            # Следующее совпадение ищется уже в поле следующего термина
+            position = text.find(query_norm, starts[index + 1])
+        return np.array(found, dtype=np.intp)
+
+    def find_word_start(self, query_norm: str) -> np.ndarray:
+        """Позиции терминов, у которых с нормализованной строки начинается название или слово названия
+
+        Хвосты названий с начала каждого слова отсортированы: подходящие
+        образуют непрерывный диапазон, который находит бисекция.
+        """
+        tails, positions = self._tails()
+        start = bisect.bisect_left(tails, query_norm)
+        return positions[start:bisect.bisect_left(tails, query_norm + '\U0010ffff', start)]
+
+    def _tails(self):
+        if self._word_tails is None:
+            tails = []
+            for position, entry in enumerate(self.ordered):
+                name = entry.name_norm
+                tails.append((name, position))
+                space = name.find(' ')
+                while space != -1:
+                    tails.append((name[space + 1:], position))
+                    space = name.find(' ', space + 1)
+            tails.sort()
+            self._word_tails = ([tail for tail, _ in tails],
+                                np.array([position for _, position in tails], dtype=np.intp))
+        return self._word_tails
+
+    def position(self, term_id: int) -> Optional[int]:
+        """Позиция термина в ordered (None - термина в снимке нет)"""
+        entry = self.entries.get(term_id)
+        if entry is None:
+            return None
+        return bisect.bisect_left(self.order_keys, _order_key(entry))
+
+    def ranking_columns(self) -> RankingColumns:
+        """Столбцы для ранжирования выдачи (строятся один раз на снимок, см. prepare_search)"""
+        if self._columns is None:
+            ordered = self.ordered
+            by_name = sorted(range(len(ordered)), key=lambda i: (ordered[i].record.term, ordered[i].record.id))
+            name_rank = np.empty(len(ordered), dtype=np.int64)
+            name_rank[by_name] = np.arange(len(ordered))
+            usage = np.fromiter((entry.record.usage_count for entry in ordered), dtype=np.float64, count=len(ordered))
+            self._columns = RankingColumns(np.log1p(usage), name_rank,
+                                           [(ordered[i].record.term, ordered[i].record.id) for i in by_name])
+        return self._columns
+
+    def prepare_search(self) -> 'DictionarySnapshot':
+        """Строит склеенный текст, хвосты названий и столбцы ранжирования
+
+        Без вызова они строятся при первом поиске по снимку; SnapshotStore
+        вызывает его до публикации, в потоке писателя, чтобы первый поиск
+        по новому снимку не ждал их построения.
+        """
+        self._search_text()
+        self._tails()
+        self.ranking_columns()
+        return self
+
+    def _scan(self, match, limit: int) -> List[TermRecord]:
+        results = []
+        for entry in self.ordered:
+            if match(entry):
+                results.append(entry.record)
+                if len(results) == limit:
+                    break
+        return results
+
+    def get_term_by_id(self, term_id: int) -> Optional[TermRecord]:
+        entry = self.entries.get(term_id)
+        return entry.record if entry else None
+
+    def get_categories(self) -> List[CategoryRecord]:
+        return list(self.sorted_categories)
+
+    def get_category(self, category_id: int) -> Optional[CategoryRecord]:
+        return self.categories.get(category_id)
+
+    def get_category_terms(self, category_id: int) -> List[TermRecord]:
+        return list(self.category_terms.get(category_id, ()))
+
+    def count_terms_by_category(self) -> Dict[int, int]:
+        return {category_id: len(terms) for category_id, terms in self.category_terms.items()}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SnapshotStore:
+    """Текущий снимок словаря и его обновление копированием при записи
+
+    Читатели берут store.current без блокировок: публикация нового снимка -
+    одно присваивание ссылки, атомарное для интерпретатора. Писатели (шина
+    изменений, обновление счетчиков) строят новый снимок из текущего, заменяя
+    только затронутые термины, и публикуют его; между собой писатели
+    упорядочены блокировкой, которую читатели не берут. Прежний снимок
+    освобождается сборщиком мусора, когда завершится последний обработчик,
+    взявший на него ссылку.
+
+    Изменения приходят пачками с шины (subscribe_batch): на пачку публикуется
+    один новый снимок. Термины и новые категории заменяются точечно, остальные
+    изменения категорий (переименование, удаление, слияние) пересобирают снимок
+    из хранилища. Счетчики запросов (порядок выдачи и "📊 Запросов" в карточке)
+    обновляются фоновой задачей раз в refresh_interval секунд.
+    """
+
+    def __init__(self, db: StorageBackend, refresh_interval: float = 300, artifact=None):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self._write_lock = threading.Lock()
+        self._refreshing = False
+        self._refreshed_at = time.monotonic()
+        if artifact is None:
+            self.current = self.build().prepare_search()
+        else:
+            self.current = self.load(artifact).prepare_search()
+            self._catch_up()
+
+    def build(self) -> DictionarySnapshot:
+        """Собирает снимок из хранилища целиком"""
+        started = time.perf_counter()
+        # Ревизия читается до данных: изменения во время сборки шина применит повторно
+        revision = self.db.get_revision()
+        snapshot = self._assemble(revision, self.db.get_term_documents())
+        logger.info("Снимок словаря собран: %s терминов за %.0f мс", len(snapshot),
+                    (time.perf_counter() - started) * 1000)
+        return snapshot
+
+    def load(self, artifact) -> DictionarySnapshot:
+        """Собирает снимок на ревизию файла словаря (DictionaryArtifact)
+
+        Тексты, нормализованные поля и ключи терминов читаются из файла; из базы -
+        только категории и счетчики запросов (get_term_catalog, без текстов).
+        Термины, удаленные после сборки файла, в каталоге уже отсутствуют и пропускаются.
+        """
+        started = time.perf_counter()
+        nulls = artifact.array('snapshot.nulls')
+        texts = [artifact.strings(f'snapshot.{name}') for name in _TEXT_COLUMNS]
+        key_flags = artifact.array('snapshot.key_synonyms')
+        keys = list(zip(artifact.strings('snapshot.keys'), key_flags))
+        key_starts = list(itertools.accumulate(artifact.array('snapshot.key_counts'), initial=0))
+        rows = zip(artifact.array('snapshot.term_ids'), *texts, nulls,
+                   artifact.strings('snapshot.name_norm'), artifact.strings('snapshot.synonyms_norm'),
+                   zip(key_starts, key_starts[1:]))
+        documents = (
+            (term_id, term, definition, None if null & _NO_EXAMPLES else examples,
+             None if null & _NO_SYNONYMS else synonyms, (name_norm, synonyms_norm, tuple(keys[start:end])))
+            for term_id, term, definition, examples, synonyms, null, name_norm, synonyms_norm, (start, end) in rows
+        )
+        snapshot = self._assemble(artifact.revision, documents)
+        logger.info("Снимок словаря загружен из файла (ревизия %s): %s терминов за %.0f мс",
+                    artifact.revision, len(snapshot), (time.perf_counter() - started) * 1000)
+        return snapshot
+
+    def _assemble(self, revision: int, documents) -> DictionarySnapshot:
+        categories = {category.id: category for category in self.db.get_categories()}
+        catalog = {term_id: (category_id, usage_count) for term_id, category_id, usage_count
+                   in self.db.get_term_catalog()}
+        entries = {}
+        for term_id, term, definition, examples, synonyms, *normalized in documents:
+            if term_id not in catalog:
+                continue
+            category_id, usage_count = catalog[term_id]
+            category = categories.get(category_id)
+            record = TermRecord(term_id, term, category_id, category.name if category else None,
+                                synonyms, usage_count, definition, examples)
+            # Из файла словаря поля приходят уже нормализованными
+            entries[term_id] = TermEntry(record, *normalized[0]) if normalized else make_entry(record)
+        return DictionarySnapshot(revision, entries, categories)
+
+    def _catch_up(self):
+        """Применяет изменения из журнала после ревизии снимка (снимок загружен из отставшего файла)"""
+        while True:
+            rows = self.db.get_changes(after_revision=self.current.revision)
+            if not rows:
+                return
+            self.apply_changes([ChangeEvent(*row) for row in rows])
+
+    def _publish(self, snapshot: DictionarySnapshot):
+        self.current = snapshot.prepare_search()
+
+    def replace_terms(self, changed: Iterable[TermRecord] = (), removed: Iterable[int] = (),
+                      categories: Iterable[CategoryRecord] = (), revision: int = None) -> DictionarySnapshot:
+        """Публикует снимок, в котором заменены, добавлены или удалены отдельные термины и добавлены категории"""
+        changed = [make_entry(record) for record in changed]
+        with self._write_lock:
+            snapshot = self.current.replace(changed, removed, categories, revision)
+            self._publish(snapshot)
+            return snapshot
+
+    def rebuild(self) -> DictionarySnapshot:
+        """Пересобирает снимок из хранилища и публикует его"""
+        with self._write_lock:
+            snapshot = self.build()
+            self._publish(snapshot)
+            return snapshot
+
+    def apply_changes(self, events):
+        """Обработчик шины изменений (пачкой): один новый снимок на все изменения пачки"""
+        events = [event for event in events if event.revision > self.current.revision]
+        if not events:
+            return
+        if any(event.entity == CATEGORY and event.action != CREATE for event in events):
+            # Переименование, удаление или слияние категорий затрагивает все их термины
+            self.rebuild()
+            return
+
+        changed_ids, removed_ids, category_ids = {}, set(), []
+        for event in events:
+            if event.entity == CATEGORY:
+                category_ids.append(event.entity_id)
+                continue
+            for term_id in event.removed_terms:
+                removed_ids.add(term_id)
+                changed_ids.pop(term_id, None)
+            for term_id in event.changed_terms + ((event.entity_id,) if event.action == CREATE else ()):
+                changed_ids[term_id] = None
+                removed_ids.discard(term_id)
+        # Термины читаются в актуальном виде; исчезнувшие к этому моменту удаляются из снимка
+        changed = []
+        for term_id in changed_ids:
+            term = self.db.get_term_by_id(term_id)
+            if term:
+                changed.append(term)
+            else:
+                removed_ids.add(term_id)
+        categories = [category for category in map(self.db.get_category, category_ids) if category]
+        self.replace_terms(changed, removed_ids, categories, events[-1].revision)
+
+    def refresh_usage(self) -> DictionarySnapshot:
+        """Новый снимок с актуальными счетчиками запросов (тексты и ключи не пересчитываются)"""
+        catalog = {term_id: usage_count for term_id, _, usage_count in self.db.get_term_catalog()}
+        with self._write_lock:
+            base = self.current
+            entries = {}
+            for term_id, entry in base.entries.items():
+                usage_count = catalog.get(term_id, entry.record.usage_count)
+                if usage_count != entry.record.usage_count:
+                    record = entry.record
+                    entry = entry._replace(record=TermRecord(
+                        record.id, record.term, record.category_id, record.category_name, record.synonyms,
+                        usage_count, record.definition, record.examples))
+                entries[term_id] = entry
+            snapshot = DictionarySnapshot(base.revision, entries, base.categories)
+            self._publish(snapshot)
+            return snapshot
+
+    def maybe_refresh(self, now: float = None):
+        """Запускает обновление счетчиков в фоновом потоке, если подошел срок
+
+        Вызывается из обработчика обновлений и не ждет пересборки: до ее
+        завершения читатели продолжают работать с текущим снимком.
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._refreshing or now - self._refreshed_at < self.refresh_interval:
+            return
+        self._refreshing = True
+        self._refreshed_at = now
+        threading.Thread(target=self._refresh_in_background, name='snapshot-refresh', daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh_usage()
+        except Exception as e:
+            logger.error("Ошибка обновления снимка словаря: %s", e)
+        finally:
+            self._refreshing = False
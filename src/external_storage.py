@@ -1,90 +1,123 @@
 """
 Модуль для сохранения важных данных во внешних сервисах
 """
+import asyncio
 import json
 import os
+import threading
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict
+
+from telegram.ext import ContextTypes
 
 class ExternalStorage:
-    """Класс для сохранения данных во внешних сервисах"""
-    
-    def __init__(self):
-        self.log_file = "data/user_data.json"
+    """Класс для сохранения данных во внешних сервисах
+
+    Записи копятся в памяти, а файл перезаписывается отложенно: задача
+    JobQueue (job_callback) раз в несколько секунд пишет его в отдельном
+    потоке, не задерживая event loop. Сброс на диск (fsync) выполняет только
+    flush(durable=True) при остановке бота.
+    """
+
+    def __init__(self, log_file: str = "data/user_data.json"):
+        self.log_file = log_file
+        # Изменение данных в памяти и их запись не должны пересекаться между потоками
+        self._lock = threading.Lock()
+        self._dirty = False
         self.ensure_log_file()
-    
+        self._data = self._load()
+
     def ensure_log_file(self):
         """Создает файл для логирования если его нет"""
-        os.makedirs("data", exist_ok=True)
+        os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
         if not os.path.exists(self.log_file):
-            with open(self.log_file, 'w', encoding='utf-8') as f:
-                json.dump({"searches": [], "suggestions": []}, f, ensure_ascii=False, indent=2)
-    
-    def log_search(self, user_id: int, query: str, found: bool = False):
-        """Логирует поисковый запрос"""
+            self._save({"searches": [], "suggestions": []}, durable=True)
+
+    def _load(self) -> Dict:
         try:
             with open(self.log_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            
-            search_entry = {
-                "timestamp": datetime.now().isoformat(),
-                "user_id": user_id,
-                "query": query,
-                "found": found
-            }
-            
-            data["searches"].append(search_entry)
-            
-            # Оставляем только последние 1000 записей
-            if len(data["searches"]) > 1000:
-                data["searches"] = data["searches"][-1000:]
-            
-            with open(self.log_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                
+            data.setdefault("searches", [])
+            data.setdefault("suggestions", [])
+            return data
         except Exception as e:
-            print(f"Ошибка логирования поиска: {e}")
-    
-    def save_user_suggestion(self, user_id: int, username: str, term: str, definition: str):
-        """Сохраняет предложение пользователя"""
+            print(f"Ошибка чтения {self.log_file}: {e}")
+            return {"searches": [], "suggestions": []}
+
+    def _save(self, data: Dict, durable: bool = False):
+        """Атомарно перезаписывает файл: остановка процесса посреди записи не обрежет его
+
+        Данные пишутся во временный файл рядом и подменяют старый через os.replace,
+        поэтому на диске всегда либо прежняя, либо новая версия целиком.
+        durable - дождаться записи на диск (fsync), чтобы файл пережил и сбой питания.
+        """
+        tmp_file = f"{self.log_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, self.log_file)
+
+    def flush(self, durable: bool = False) -> bool:
+        """Записывает накопленные изменения в файл; True - файл перезаписан"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            # Копия списков: запись идет без блокировки, пока обработчики добавляют новые записи
+            data = {key: list(value) for key, value in self._data.items()}
+            self._dirty = False
         try:
-            with open(self.log_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            suggestion_entry = {
-                "timestamp": datetime.now().isoformat(),
-                "user_id": user_id,
-                "username": username,
-                "term": term,
-                "definition": definition,
-                "status": "pending"
-            }
-            
-            data["suggestions"].append(suggestion_entry)
-            
-            with open(self.log_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                
+            self._save(data, durable=durable)
             return True
-            
         except Exception as e:
-            print(f"Ошибка сохранения предложения: {e}")
+            print(f"Ошибка записи {self.log_file}: {e}")
+            with self._lock:
+                self._dirty = True
             return False
-    
+
+    async def job_callback(self, context: ContextTypes.DEFAULT_TYPE):
+        """Задача JobQueue: запись накопленных изменений в отдельном потоке"""
+        await asyncio.to_thread(self.flush)
+
+    def log_search(self, user_id: int, query: str, found: bool = False):
+        """Логирует поисковый запрос"""
+        search_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "user_id": user_id,
+            "query": query,
+            "found": found
+        }
+        with self._lock:
+            searches = self._data["searches"]
+            searches.append(search_entry)
+
+            # Оставляем только последние 1000 записей
+            if len(searches) > 1000:
+                del searches[:-1000]
+            self._dirty = True
+
+    def save_user_suggestion(self, user_id: int, username: str, term: str, definition: str):
+        """Сохраняет предложение пользователя"""
+        suggestion_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "user_id": user_id,
+            "username": username,
+            "term": term,
+            "definition": definition,
+            "status": "pending"
+        }
+        with self._lock:
+            self._data["suggestions"].append(suggestion_entry)
+            self._dirty = True
+        return True
+
     def get_suggestions_count(self) -> int:
         """Получает количество предложений"""
-        try:
-            with open(self.log_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return len([s for s in data["suggestions"] if s.get("status") == "pending"])
-        except:
-            return 0
-    
+        with self._lock:
+            return len([s for s in self._data["suggestions"] if s.get("status") == "pending"])
+
     def get_searches_count(self) -> int:
         """Получает количество поисков"""
-        try:
-            with open(self.log_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return len(data["searches"])
-        except:
-            return 0
+        with self._lock:
+            return len(self._data["searches"])
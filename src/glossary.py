@@ -0,0 +1,136 @@
+"""
+Режим "глоссарий текста": поиск всех известных терминов в длинном сообщении
+"""
+import threading
+from array import array
+from typing import Dict, List, Tuple
+
+from aho_corasick import AhoCorasick
+from storage_backend import StorageBackend
+from text_normalizer import translit_key, split_synonyms
+
+# Слишком короткие строки дают ложные срабатывания внутри обычного текста
+MIN_PATTERN_LENGTH = 3
+
+
+class GlossaryIndex:
+    """Индекс терминов и синонимов словаря на основе автомата Ахо-Корасик
+
+    Индекс дополняется по мере появления новых терминов: sync() читает
+    только термины с ID больше последнего загруженного. Измененные, удаленные
+    и слитые термины приходят событиями шины изменений (apply_change): их
+    строки убираются из автомата и добавляются заново без перестроения.
+
+    Если передан файл словаря (DictionaryArtifact), готовый автомат читается
+    из него при первом обращении, а из базы дочитываются только термины новее файла.
+    """
+
+    def __init__(self, db: StorageBackend, artifact=None):
+        self.db = db
+        self.automaton = AhoCorasick()
+        self.term_names: Dict[int, str] = {}
+        self.term_patterns: Dict[int, List[str]] = {}
+        self.last_term_id = 0
+        self._artifact = artifact
+        self._lock = threading.Lock()
+
+    def _load_artifact(self):
+        """Загружает автомат из файла словаря, если он еще не загружен"""
+        artifact, self._artifact = self._artifact, None
+        if artifact is None:
+            return
+        self.automaton = AhoCorasick.load(artifact, 'glossary.automaton')
+        term_ids = artifact.array('glossary.term_ids')
+        self.term_names = dict(zip(term_ids, artifact.strings('glossary.term_names')))
+        self.term_patterns = {term_id: [] for term_id in term_ids}
+        for term_id, pattern in zip(artifact.array('glossary.pattern_term_ids'),
+                                    artifact.strings('glossary.patterns')):
+            self.term_patterns[term_id].append(pattern)
+        self.last_term_id = max(self.term_names, default=0)
+
+    def export(self, builder):
+        """Записывает автомат, названия и строки терминов в файл словаря"""
+        with self._lock:
+            self.automaton.export(builder, 'glossary.automaton')
+            builder.add_array('glossary.term_ids', array('q', self.term_names))
+            builder.add_strings('glossary.term_names', self.term_names.values())
+            builder.add_array('glossary.pattern_term_ids', array('q', (
+                term_id for term_id, patterns in self.term_patterns.items() for _ in patterns
+            )))
+            builder.add_strings('glossary.patterns', (
+                pattern for patterns in self.term_patterns.values() for pattern in patterns
+            ))
+
+    def sync(self) -> int:
+        """Добавляет в автомат новые термины; возвращает их количество"""
+        with self._lock:
+            self._load_artifact()
+            rows = self.db.get_term_patterns(after_id=self.last_term_id)
+            for term_id, term, synonyms in rows:
+                self.add_term(term_id, term, synonyms)
+            return len(rows)
+
+    def add_term(self, term_id: int, term: str, synonyms: str = None):
+        """Добавляет термин и его синонимы в автомат"""
+        patterns = []
+        for pattern in [term] + split_synonyms(synonyms):
+            pattern = translit_key(pattern)
+            if len(pattern) >= MIN_PATTERN_LENGTH:
+                self.automaton.add(pattern, term_id)
+                patterns.append(pattern)
+        self.term_names[term_id] = term
+        self.term_patterns[term_id] = patterns
+        self.last_term_id = max(self.last_term_id, term_id)
+
+    def remove_term(self, term_id: int):
+        """Убирает строки термина из автомата"""
+        for pattern in self.term_patterns.pop(term_id, ()):
+            self.automaton.discard(pattern, term_id)
+        self.term_names.pop(term_id, None)
+
+    def apply_change(self, event):
+        """Обработчик шины изменений: обновляет строки измененных и удаленных терминов"""
+        with self._lock:
+            self._load_artifact()
+            for term_id in event.removed_terms:
+                self.remove_term(term_id)
+            for term_id in event.changed_terms:
+                # Термины, которые еще не загружены, sync() прочитает в актуальном виде
+                if term_id > self.last_term_id:
+                    continue
+                self.remove_term(term_id)
+                term = self.db.get_term_by_id(term_id)
+                if term:
+                    self.add_term(term.id, term.term, term.synonyms)
+
+    def find_terms(self, text: str, limit: int = 20) -> List[Tuple[int, str]]:
+        """Находит термины в тексте за один проход: список (ID, название) в порядке появления
+
+        Сравнение идет по ключам транслитерации, поэтому "ЭДП" в тексте найдет EDP.
+        Учитываются только совпадения целыми словами; из пересекающихся
+        совпадений выбирается самое длинное.
+        """
+        self.sync()
+        text = translit_key(text)
+        length = len(text)
+
+        matches = [
+            (start, end, term_id)
+            for start, end, term_id in self.automaton.iter_matches(text)
+            if (start == 0 or text[start - 1] == ' ') and (end == length or text[end] == ' ')
+        ]
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+
+        found = []
+        seen = set()
+        covered_until = 0
+        for start, end, term_id in matches:
+            if start < covered_until:
+                continue
+            covered_until = end
+            if term_id not in seen:
+                seen.add(term_id)
+                found.append((term_id, self.term_names[term_id]))
+                if len(found) == limit:
+                    break
+        return found
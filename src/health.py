@@ -0,0 +1,214 @@
+"""
+Проверки живости и готовности бота для HTTP-порта health-проверки
+Измерения выполняют фоновые задачи, а запрос /healthz или /readyz только
+читает последние значения, поэтому ответ не зависит от event loop и базы
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseCheck(NamedTuple):
+    """Результат последней проверки хранилища (заменяется целиком, читается без блокировки)"""
+    rtt: float
+    checked_at: float
+    error: Optional[str]
+
+
+class HealthMonitor:
+    """Состояние процесса для проб живости (/healthz) и готовности (/readyz)
+
+    - heartbeat: задача в event loop просыпается каждые interval секунд и
+      записывает время и задержку пробуждения; если heartbeat давно не
+      обновлялся, event loop завис;
+    - время последнего обработанного обновления (обработчик в группе -2);
+    - время ответа базы: отдельный поток раз в db_interval секунд выполняет
+      db.ping(), чтобы залоченная база не задерживала ни event loop, ни пробу;
+      у каждого хранилища (add_database, по одному на словарь) свой поток,
+      поэтому зависшая база одного словаря не скрывает состояние остальных;
+    - глубина очередей (например, очереди записи лидера в режиме масштабирования);
+    - прогрев кэшей: готовность ждет завершения всех зарегистрированных прогревов.
+    """
+
+    def __init__(self, db=None, interval: float = 0.5, db_interval: float = 5.0, stall_after: float = 10.0,
+                 max_db_rtt: float = 1.0, max_queue_depth: int = 1000):
+        self.interval = interval
+        self.db_interval = db_interval
+        self.stall_after = stall_after
+        self.max_db_rtt = max_db_rtt
+        self.max_queue_depth = max_queue_depth
+        self.started_at = time.monotonic()
+
+        self.last_beat: Optional[float] = None
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self.last_update: Optional[float] = None
+        self.databases: Dict[str, object] = {}
+        self.db_checks: Dict[str, DatabaseCheck] = {}
+
+        self.queues: Dict[str, Callable[[], int]] = {}
+        self.warmups: Dict[str, bool] = {}
+        self.shutting_down = False
+        self._tasks = []
+        self._stop = threading.Event()
+        if db is not None:
+            self.add_database('db', db)
+
+    # --- Источники измерений ---
+
+    def add_database(self, name: str, db):
+        """Регистрирует хранилище, от ответа которого зависит готовность (до start)"""
+        self.databases[name] = db
+
+    def start(self):
+        """Запускает heartbeat в текущем event loop и потоки проверки хранилищ (из post_init)"""
+        self._tasks.append(asyncio.get_running_loop().create_task(self._heartbeat()))
+        for name, db in self.databases.items():
+            threading.Thread(target=self._watch_db, args=(name, db), name=f'health-db-{name}', daemon=True).start()
+
+    def begin_shutdown(self):
+        """Процесс останавливается: готовность снимается, живость сохраняется"""
+        self.shutting_down = True
+
+    def stop(self):
+        self._stop.set()
+        for task in self._tasks:
+            task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.loop_lag = max(0.0, now - start - self.interval)
+            self.max_loop_lag = max(self.max_loop_lag * 0.99, self.loop_lag)
+            self.last_beat = now
+
+    def _watch_db(self, name: str, db):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            error = None
+            try:
+                db.ping()
+            except Exception as e:
+                error = str(e)
+            now = time.monotonic()
+            self.db_checks[name] = DatabaseCheck(now - start, now, error)
+            self._stop.wait(self.db_interval)
+
+    async def track_update(self, update, context):
+        """Обработчик в группе -2: отмечает время каждого входящего обновления"""
+        self.last_update = time.monotonic()
+
+    def add_queue(self, name: str, depth: Callable[[], int]):
+        """Регистрирует очередь, глубина которой влияет на готовность"""
+        self.queues[name] = depth
+
+    def warm_up(self, name: str, func: Callable):
+        """Запускает прогрев кэша в отдельном потоке (из работающего event loop)
+
+        До завершения прогрева процесс не готов. Ошибка прогрева не блокирует
+        готовность навсегда: кэш достроится при первом запросе.
+        """
+        self.warmups[name] = False
+        self._tasks.append(asyncio.get_running_loop().create_task(self._warm_up(name, func)))
+
+    async def _warm_up(self, name: str, func: Callable):
+        start = time.monotonic()
+        try:
+            await asyncio.to_thread(func)
+            logger.info("Прогрев %s: %.2f с", name, time.monotonic() - start)
+        except Exception as e:
+            logger.error("Ошибка прогрева %s: %s", name, e)
+        finally:
+            self.warmups[name] = True
+
+    # --- Пробы ---
+
+    @staticmethod
+    def _age(moment: Optional[float], now: float) -> Optional[float]:
+        return None if moment is None else round(now - moment, 3)
+
+    def snapshot(self) -> Dict:
+        """Текущее состояние: только чтение сохраненных значений"""
+        now = time.monotonic()
+        depths = {}
+        for name, depth in self.queues.items():
+            try:
+                depths[name] = depth()
+            except (NotImplementedError, OSError):
+                depths[name] = None
+        databases = {}
+        for name in self.databases:
+            check = self.db_checks.get(name)
+            databases[name] = {
+                'rtt_ms': None if check is None else round(check.rtt * 1000, 2),
+                'checked_age_s': None if check is None else self._age(check.checked_at, now),
+                'error': None if check is None else check.error,
+            }
+        return {
+            'uptime_s': round(now - self.started_at, 1),
+            'heartbeat_age_s': self._age(self.last_beat, now),
+            'loop_lag_ms': round(self.loop_lag * 1000, 2),
+            'max_loop_lag_ms': round(self.max_loop_lag * 1000, 2),
+            'last_update_age_s': self._age(self.last_update, now),
+            'databases': databases,
+            'queues': depths,
+            'warm': dict(self.warmups),
+        }
+
+    def _liveness_problems(self, state: Dict) -> list:
+        heartbeat_age = state['heartbeat_age_s']
+        # До запуска event loop процесс еще стартует и считается живым (но не готовым)
+        if heartbeat_age is not None and heartbeat_age > self.stall_after:
+            return [f'event loop не отвечает {heartbeat_age:.0f} с']
+        return []
+
+    def liveness(self) -> Tuple[bool, Dict]:
+        state = self.snapshot()
+        problems = self._liveness_problems(state)
+        state['problems'] = problems
+        return not problems, state
+
+    def readiness(self) -> Tuple[bool, Dict]:
+        state = self.snapshot()
+        problems = self._liveness_problems(state)
+        if self.shutting_down:
+            problems.append('остановка')
+        if state['heartbeat_age_s'] is None:
+            problems.append('event loop еще не запущен')
+        for name, check in state['databases'].items():
+            if check['error']:
+                problems.append(f"ошибка базы {name}: {check['error']}")
+            elif check['rtt_ms'] is None:
+                problems.append(f'база {name} еще не проверена')
+            elif check['rtt_ms'] > self.max_db_rtt * 1000:
+                problems.append(f"медленный ответ базы {name}: {check['rtt_ms']:.0f} мс")
+            elif check['checked_age_s'] > self.db_interval + self.stall_after:
+                # Поток проверки завис на запросе к базе (например, база заблокирована)
+                problems.append(f"проверка базы {name} не завершается {check['checked_age_s']:.0f} с")
+        for name, depth in state['queues'].items():
+            if depth is not None and depth > self.max_queue_depth:
+                problems.append(f'очередь {name}: {depth}')
+        for name, done in state['warm'].items():
+            if not done:
+                problems.append(f'прогрев {name}')
+        state['problems'] = problems
+        return not problems, state
+
+    def handle_request(self, path: str) -> Optional[Tuple[int, str, bytes]]:
+        """Ответ на /healthz и /readyz: (код, Content-Type, тело); None для других путей"""
+        path = path.split('?', 1)[0]
+        if path == '/healthz':
+            ok, state = self.liveness()
+        elif path == '/readyz':
+            ok, state = self.readiness()
+        else:
+            return None
+        state['status'] = 'ok' if ok else 'fail'
+        return (200 if ok else 503), 'application/json', json.dumps(state, ensure_ascii=False).encode()
@@ -0,0 +1,171 @@
+"""
+Неблокирующее структурированное логирование
+Обработчики бота только кладут запись в очередь; форматирование и вывод
+выполняет фоновый поток QueueListener
+"""
+import atexit
+import datetime
+import decimal
+import enum
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Атрибуты LogRecord, которые не являются дополнительными полями (extra)
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Значения, которые не меняются после вызова логгера: их можно подставить в сообщение позже
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, type(None), decimal.Decimal, enum.Enum,
+                    datetime.date, datetime.time, datetime.timedelta)
+
+_listener: Optional[QueueListener] = None
+_settings: Dict = {}
+_salt = b''
+
+
+def hash_user_id(user_id: Optional[int]) -> Optional[str]:
+    """Обезличенный идентификатор пользователя для логов (стабилен в пределах одной соли)"""
+    if user_id is None:
+        return None
+    return hashlib.blake2b(str(user_id).encode(), key=_salt, digest_size=6).hexdigest()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _is_immutable(value) -> bool:
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _IMMUTABLE_TYPES)
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке
+
+    Стандартный QueueHandler.prepare() подставляет аргументы в сообщение до
+    постановки в очередь, то есть в event loop. Очередь здесь внутрипроцессная,
+    поэтому запись с неизменяемыми аргументами (строки, числа, даты и кортежи
+    из них) передается как есть, а getMessage() вызывает уже поток вывода.
+
+    Список, словарь или другой изменяемый объект в аргументах мог бы
+    измениться до вывода, поэтому такое сообщение форматируется сразу, как
+    в стандартном обработчике. Поля extra передаются без копирования: в них
+    кладут значения, которые после вызова логгера не меняются.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args:
+            values = args.values() if isinstance(args, dict) else args
+            if not all(_is_immutable(value) for value in values):
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает каждую N-ю запись массовых событий уровня INFO и ниже
+
+    Событие задается полем extra={'event': ...}; предупреждения и ошибки не прореживаются.
+    В пропущенную запись добавляется поле sampled=N, чтобы по логам можно было оценить объем.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {event: max(1, round(1 / rate)) for event, rate in rates.items() if rate > 0}
+        self.dropped = {event for event, rate in rates.items() if rate <= 0}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno > logging.INFO:
+            return True
+        if event in self.dropped:
+            return False
+        every = self.every.get(event)
+        if every is None or every == 1:
+            return True
+        with self._lock:
+            count = self._counters.get(event, 0)
+            self._counters[event] = count + 1
+        if count % every:
+            return False
+        record.sampled = every
+        return True
+
+
+def setup_logging(level: str = 'INFO', json_format: bool = True, sample_rates: Dict[str, float] = None,
+                  salt: str = '', stream=None) -> QueueListener:
+    """Настраивает корневой логгер: очередь в вызывающем потоке, вывод в фоновом
+
+    Повторный вызов перенастраивает логирование (например, в дочернем процессе).
+    """
+    global _listener, _salt
+    _settings.update(level=level, json_format=json_format, sample_rates=sample_rates, salt=salt, stream=stream)
+    _salt = hashlib.blake2b(salt.encode(), digest_size=16).digest()
+
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(
+        JsonFormatter() if json_format
+        else logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+
+    log_queue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Дописывает очередь логов и останавливает поток вывода"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    """Поток вывода не наследуется при fork - дочерний процесс запускает свой"""
+    global _listener
+    if _listener is not None:
+        _listener = None
+        setup_logging(**_settings)
+
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,225 @@
+"""
+Частые запросы без результата: чего не хватает в словаре
+Неуспешные поиски из журнала сворачиваются в сводки Space-Saving по дням,
+поэтому отчет "топ за неделю" не группирует весь журнал поисков SQL-запросом
+"""
+import asyncio
+import heapq
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from telegram.ext import ContextTypes
+
+from storage_backend import StorageBackend, MISS_CURSOR
+from text_normalizer import normalize
+
+logger = logging.getLogger(__name__)
+
+
+class SpaceSaving:
+    """Сводка Space-Saving: приблизительно самые частые строки потока в ограниченной памяти
+
+    Хранится не больше capacity строк. Новая строка при заполненной сводке
+    вытесняет строку с наименьшим счетчиком и наследует его с пометкой
+    погрешности: истинная частота лежит между count - error и count.
+    Строки сгруппированы по значению счетчика, а счетчики растут на единицу,
+    поэтому добавление и поиск минимума - O(1).
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        # Последний поиск по строке: по нему кнопка отчета находит исходный запрос
+        self.samples: Dict[str, int] = {}
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._min = 0
+
+    def add(self, key: str, sample: int = None):
+        """Учитывает одно появление строки"""
+        count = self.counts.get(key)
+        if count is not None:
+            bucket = self._buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[count]
+        elif len(self.counts) < self.capacity:
+            count = 0
+            self.errors[key] = 0
+        else:
+            bucket = self._buckets[self._min]
+            evicted, _ = bucket.popitem()
+            if not bucket:
+                del self._buckets[self._min]
+            del self.counts[evicted], self.errors[evicted]
+            self.samples.pop(evicted, None)
+            count = self.errors[key] = self._min
+
+        self.counts[key] = count + 1
+        self._buckets.setdefault(count + 1, {})[key] = None
+        if sample is not None:
+            self.samples[key] = sample
+        # Минимум либо 1 (новая строка), либо сдвигается вслед за единственной строкой с минимальным счетчиком
+        if count == 0:
+            self._min = 1
+        elif self._min not in self._buckets:
+            self._min = count + 1
+
+    @property
+    def floor(self) -> int:
+        """Наибольшая возможная частота строки, которой нет в сводке"""
+        return self._min if len(self.counts) >= self.capacity else 0
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'capacity': self.capacity,
+            'items': [[key, count, self.errors[key], self.samples.get(key)] for key, count in self.counts.items()]
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> 'SpaceSaving':
+        state = json.loads(data)
+        sketch = cls(state['capacity'])
+        for key, count, error, sample in state['items']:
+            sketch.counts[key] = count
+            sketch.errors[key] = error
+            if sample is not None:
+                sketch.samples[key] = sample
+            sketch._buckets.setdefault(count, {})[key] = None
+        sketch._min = min(sketch._buckets, default=0)
+        return sketch
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+class Miss(NamedTuple):
+    """Строка отчета: нормализованный запрос, оценка частоты сверху, погрешность, ID последнего поиска"""
+    query: str
+    count: int
+    error: int
+    sample: Optional[int]
+
+
+def merge_top(sketches: Iterable[SpaceSaving], limit: int) -> List[Miss]:
+    """Самые частые строки нескольких сводок (например, дней недели)
+
+    Строка, которой нет в заполненной сводке, могла встретиться в ней до floor
+    раз: это прибавляется и к оценке, и к погрешности.
+    """
+    sketches = list(sketches)
+    totals: Dict[str, List] = {}
+    for sketch in sketches:
+        for key, count in sketch.counts.items():
+            total = totals.setdefault(key, [0, 0, None])
+            total[0] += count
+            total[1] += sketch.errors[key]
+            sample = sketch.samples.get(key)
+            if sample and sample > (total[2] or 0):
+                total[2] = sample
+    for sketch in sketches:
+        floor = sketch.floor
+        if floor:
+            for key, total in totals.items():
+                if key not in sketch.counts:
+                    total[0] += floor
+                    total[1] += floor
+    top = heapq.nlargest(limit, totals.items(), key=lambda item: (item[1][0], -item[1][1]))
+    return [Miss(key, count, error, sample) for key, (count, error, sample) in top]
+
+
+class MissTracker:
+    """Сводки неуспешных поисков по дням (UTC) поверх журнала поисков
+
+    update() дочитывает журнал после сохраненной позиции, поэтому каждый
+    поиск учитывается один раз и за O(1). save() записывает измененные дни
+    вместе с позицией одной транзакцией. Сохраняет только лидер (задача
+    JobQueue); процессы-обработчики при отчете подгружают сохраненное и
+    дочитывают хвост журнала в памяти.
+    """
+
+    def __init__(self, db: StorageBackend, capacity: int = 1000, keep_days: int = 35, batch_size: int = 5000):
+        self.db = db
+        self.capacity = capacity
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.sketches: Dict[str, SpaceSaving] = {}
+        self.cursor = 0
+        self._loaded = False
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _since(self, days: int, today: date = None) -> str:
+        today = today or datetime.now(timezone.utc).date()
+        return (today - timedelta(days=days - 1)).isoformat()
+
+    def _load(self):
+        self.cursor = self.db.get_cursor(MISS_CURSOR)
+        self.sketches = {
+            day: SpaceSaving.from_json(data)
+            for day, data in self.db.get_miss_sketches(self._since(self.keep_days)).items()
+        }
+        self._dirty.clear()
+        self._loaded = True
+
+    def _update(self) -> int:
+        if not self._loaded:
+            self._load()
+        misses = 0
+        while True:
+            rows = self.db.get_search_log(after_id=self.cursor, limit=self.batch_size)
+            for search_id, searched_at, _, query, found, _ in rows:
+                key = normalize(query)
+                if not found and key:
+                    day = searched_at[:10]
+                    sketch = self.sketches.get(day)
+                    if sketch is None:
+                        sketch = self.sketches[day] = SpaceSaving(self.capacity)
+                    sketch.add(key, search_id)
+                    self._dirty.add(day)
+                    misses += 1
+            if rows:
+                self.cursor = rows[-1][0]
+            if len(rows) < self.batch_size:
+                return misses
+
+    def update(self) -> int:
+        """Дочитывает журнал поисков; возвращает число новых неуспешных поисков"""
+        with self._lock:
+            return self._update()
+
+    def refresh(self) -> int:
+        """Подгружает сохраненные другим процессом сводки, если они новее, и дочитывает журнал"""
+        with self._lock:
+            if self._loaded and self.db.get_cursor(MISS_CURSOR) > self.cursor:
+                self._load()
+            return self._update()
+
+    def save(self):
+        """Сохраняет измененные дни и позицию в журнале, удаляет устаревшие дни"""
+        with self._lock:
+            keep_since = self._since(self.keep_days)
+            for day in [day for day in self.sketches if day < keep_since]:
+                del self.sketches[day]
+            dirty = {day: self.sketches[day].to_json() for day in self._dirty if day in self.sketches}
+            self.db.save_miss_sketches(dirty, self.cursor, keep_since)
+            self._dirty.clear()
+
+    def top(self, days: int = 7, limit: int = 50, today: date = None) -> List[Miss]:
+        """Самые частые неуспешные запросы за последние days дней"""
+        with self._lock:
+            since = self._since(days, today)
+            return merge_top((sketch for day, sketch in self.sketches.items() if day >= since), limit)
+
+    async def job_callback(self, context: ContextTypes.DEFAULT_TYPE):
+        """Задача JobQueue: дочитывание журнала и сохранение сводок в отдельном потоке"""
+        def update_and_save():
+            misses = self.update()
+            self.save()
+            return misses
+        misses = await asyncio.to_thread(update_and_save)
+        if misses:
+            logger.info("Сводки неуспешных поисков: учтено %s запросов", misses)
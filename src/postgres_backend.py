@@ -0,0 +1,973 @@
+"""
+Хранилище словаря на PostgreSQL
+Асинхронный пул соединений asyncpg и триграммные индексы для поиска
+"""
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from storage_backend import (StorageBackend, TERM_FIELDS, CATEGORY_FIELDS, TERM, CATEGORY,
+                             CREATE, UPDATE, DELETE, MERGE, MISS_CURSOR, check_fields)
+from term_record import CategoryRecord, TermRecord
+from unique_users import merge_registers
+from text_normalizer import normalize, translit_key, term_keys, merge_synonyms
+
+logger = logging.getLogger(__name__)
+
+# Колонки записи термина в порядке аргументов TermRecord
+LIST_COLUMNS = 't.id, t.term, t.category_id, c.name as category_name, t.synonyms, t.usage_count'
+FULL_COLUMNS = f'{LIST_COLUMNS}, t.definition, t.examples'
+
+
+def escape_like(query: str) -> str:
+    """Экранирует спецсимволы LIKE, чтобы запрос искался буквально"""
+    return query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def start_loop() -> Tuple[asyncio.AbstractEventLoop, threading.Thread]:
+    """Запускает event loop для пулов asyncpg в фоновом потоке"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name='postgres-loop', daemon=True)
+    thread.start()
+    return loop, thread
+
+
+class PostgresBackend(StorageBackend):
+    """Хранилище словаря на PostgreSQL
+
+    Запросы выполняются корутинами asyncpg на собственном event loop в фоновом
+    потоке. Синхронные методы интерфейса лишь ждут результат, поэтому один пул
+    соединений можно использовать из любого потока процесса. Несколько словарей
+    процесса (схемы одной базы) передают общий loop и делят один фоновый поток.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 schema: str = None, reset: bool = False, loop: asyncio.AbstractEventLoop = None):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError("Для STORAGE_BACKEND=postgres установите пакет asyncpg")
+
+        if not dsn:
+            raise RuntimeError("Для STORAGE_BACKEND=postgres укажите DATABASE_URL")
+
+        self.schema = schema
+        self._thread = None
+        self._loop = loop
+        if loop is None:
+            self._loop, self._thread = start_loop()
+
+        if schema:
+            # Отдельная схема изолирует проверки (reset) или словарь от остальных данных
+            self._run(self._prepare_schema(asyncpg, dsn, schema, reset))
+
+        server_settings = {'search_path': schema} if schema else None
+        self._pool = self._run(self._create_pool(
+            asyncpg, dsn, min_size=min_size, max_size=max_size, server_settings=server_settings
+        ))
+        self._run(self._init_database())
+
+    def _run(self, coro):
+        """Выполняет корутину на event loop хранилища и ждет результат"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    @staticmethod
+    async def _create_pool(asyncpg, dsn: str, **kwargs):
+        # Пул создается внутри event loop хранилища и привязывается к нему
+        return await asyncpg.create_pool(dsn, **kwargs)
+
+    @staticmethod
+    async def _prepare_schema(asyncpg, dsn: str, schema: str, reset: bool):
+        conn = await asyncpg.connect(dsn)
+        try:
+            if reset:
+                await conn.execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+            await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        finally:
+            await conn.close()
+
+    async def _init_database(self):
+        """Создает таблицы и индексы если их нет"""
+        async with self._pool.acquire() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS categories (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    description TEXT,
+                    created_at TIMESTAMPTZ DEFAULT now()
+                );
+
+                CREATE TABLE IF NOT EXISTS terms (
+                    id SERIAL PRIMARY KEY,
+                    term TEXT UNIQUE NOT NULL,
+                    definition TEXT NOT NULL,
+                    category_id INTEGER REFERENCES categories (id),
+                    examples TEXT,
+                    synonyms TEXT,
+                    usage_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMPTZ DEFAULT now(),
+                    updated_at TIMESTAMPTZ DEFAULT now()
+                );
+
+                CREATE TABLE IF NOT EXISTS search_stats (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    term_id INTEGER REFERENCES terms (id),
+                    query TEXT NOT NULL,
+                    found BOOLEAN DEFAULT FALSE,
+                    search_date TIMESTAMPTZ DEFAULT now()
+                );
+
+                CREATE TABLE IF NOT EXISTS term_suggestions (
+                    id SERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    username TEXT,
+                    suggested_term TEXT NOT NULL,
+                    suggested_definition TEXT NOT NULL,
+                    suggested_category TEXT,
+                    suggested_examples TEXT,
+                    status TEXT DEFAULT 'pending',
+                    admin_comment TEXT,
+                    created_at TIMESTAMPTZ DEFAULT now(),
+                    reviewed_at TIMESTAMPTZ
+                );
+
+                CREATE TABLE IF NOT EXISTS term_keys (
+                    key TEXT NOT NULL,
+                    term_id INTEGER NOT NULL REFERENCES terms (id),
+                    is_synonym BOOLEAN NOT NULL DEFAULT FALSE,
+                    PRIMARY KEY (key, term_id, is_synonym)
+                );
+
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    chat_id BIGINT PRIMARY KEY,
+                    subscribed_at TIMESTAMPTZ DEFAULT now()
+                );
+
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id SERIAL PRIMARY KEY,
+                    broadcast_date TEXT UNIQUE NOT NULL,
+                    term_id INTEGER REFERENCES terms (id),
+                    text TEXT NOT NULL,
+                    status TEXT DEFAULT 'running',
+                    created_at TIMESTAMPTZ DEFAULT now(),
+                    finished_at TIMESTAMPTZ
+                );
+
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    broadcast_id INTEGER NOT NULL REFERENCES broadcasts (id),
+                    chat_id BIGINT NOT NULL,
+                    status TEXT NOT NULL,
+                    PRIMARY KEY (broadcast_id, chat_id)
+                );
+
+                CREATE TABLE IF NOT EXISTS term_cooccurrence (
+                    term_a INTEGER NOT NULL,
+                    term_b INTEGER NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (term_a, term_b)
+                );
+
+                CREATE TABLE IF NOT EXISTS term_neighbors (
+                    term_id INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    neighbor_id INTEGER NOT NULL,
+                    score DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (term_id, rank)
+                );
+
+                CREATE TABLE IF NOT EXISTS user_history (
+                    user_id BIGINT NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    viewed_at DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (user_id, term_id)
+                );
+
+                CREATE TABLE IF NOT EXISTS dictionary_changes (
+                    revision BIGSERIAL PRIMARY KEY,
+                    entity TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    entity_id INTEGER NOT NULL,
+                    target_id INTEGER,
+                    changed_at TIMESTAMPTZ DEFAULT now()
+                );
+
+                CREATE TABLE IF NOT EXISTS job_cursors (
+                    name TEXT PRIMARY KEY,
+                    value BIGINT NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS user_sketches (
+                    day TEXT PRIMARY KEY,
+                    registers BYTEA NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS miss_sketches (
+                    day TEXT PRIMARY KEY,
+                    counters TEXT NOT NULL
+                );
+
+                ALTER TABLE terms ADD COLUMN IF NOT EXISTS term_norm TEXT;
+                ALTER TABLE terms ADD COLUMN IF NOT EXISTS synonyms_norm TEXT;
+                ALTER TABLE terms ADD COLUMN IF NOT EXISTS definition_norm TEXT;
+                -- Рассылки до появления режима разметки подготовлены в Markdown
+                ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS parse_mode TEXT NOT NULL DEFAULT 'Markdown';
+
+                CREATE INDEX IF NOT EXISTS terms_term_norm_idx ON terms (term_norm);
+                CREATE INDEX IF NOT EXISTS terms_category_idx ON terms (category_id);
+                CREATE INDEX IF NOT EXISTS search_stats_date_idx ON search_stats (search_date);
+                CREATE INDEX IF NOT EXISTS term_keys_term_id_idx ON term_keys (term_id);
+                CREATE INDEX IF NOT EXISTS term_cooccurrence_b_idx ON term_cooccurrence (term_b);
+            ''')
+
+            # Миграция: заполняем нормализованные поля терминов, добавленных до их появления
+            rows = await conn.fetch(
+                'SELECT id, term, definition, synonyms FROM terms WHERE term_norm IS NULL'
+            )
+            for row in rows:
+                await self._store_normalized_fields(conn, row['id'], row['term'], row['definition'], row['synonyms'])
+
+            # Триграммные индексы ускоряют поиск подстроки (LIKE '%...%')
+            try:
+                await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            except Exception as e:
+                logger.warning("pg_trgm недоступен, поиск подстроки будет без индекса: %s", e)
+                return
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS terms_term_norm_trgm_idx
+                    ON terms USING gin (term_norm gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS terms_synonyms_norm_trgm_idx
+                    ON terms USING gin (synonyms_norm gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS terms_definition_norm_trgm_idx
+                    ON terms USING gin (definition_norm gin_trgm_ops);
+            ''')
+
+    async def _fetch(self, sql: str, *args) -> List[Dict]:
+        async with self._pool.acquire() as conn:
+            return [dict(row) for row in await conn.fetch(sql, *args)]
+
+    async def _fetchrow(self, sql: str, *args) -> Optional[Dict]:
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow(sql, *args)
+            return dict(row) if row else None
+
+    async def _fetch_terms(self, sql: str, *args) -> List[TermRecord]:
+        async with self._pool.acquire() as conn:
+            return [TermRecord(*row) for row in await conn.fetch(sql, *args)]
+
+    async def _fetch_term(self, sql: str, *args) -> Optional[TermRecord]:
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow(sql, *args)
+            return TermRecord(*row) if row else None
+
+    async def _fetchval(self, sql: str, *args):
+        async with self._pool.acquire() as conn:
+            return await conn.fetchval(sql, *args)
+
+    async def _executemany(self, sql: str, args: List[Tuple]):
+        async with self._pool.acquire() as conn:
+            await conn.executemany(sql, args)
+
+    @staticmethod
+    async def _record_change(conn, entity: str, action: str, entity_id: int, target_id: int = None) -> int:
+        """Записывает изменение в журнал в той же транзакции; возвращает ревизию"""
+        return await conn.fetchval('''
+            INSERT INTO dictionary_changes (entity, action, entity_id, target_id)
+            VALUES ($1, $2, $3, $4)
+            RETURNING revision
+        ''', entity, action, entity_id, target_id)
+
+    async def _category_id(self, conn, category_name: Optional[str]) -> Optional[int]:
+        """ID категории по названию; новая категория создается"""
+        if not category_name:
+            return None
+        row = await conn.fetchrow('''
+            INSERT INTO categories (name) VALUES ($1)
+            ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+            RETURNING id, xmax = 0 AS inserted
+        ''', category_name)
+        if row['inserted']:
+            await self._record_change(conn, CATEGORY, CREATE, row['id'])
+        return row['id']
+
+    async def _add_category(self, name: str, description: str) -> int:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                category_id = await conn.fetchval(
+                    'INSERT INTO categories (name, description) VALUES ($1, $2) RETURNING id',
+                    name, description
+                )
+                await self._record_change(conn, CATEGORY, CREATE, category_id)
+                return category_id
+
+    def add_category(self, name: str, description: str = None) -> int:
+        """Добавляет новую категорию"""
+        return self._run(self._add_category(name, description))
+
+    def get_categories(self) -> List[CategoryRecord]:
+        """Получает все категории"""
+        rows = self._run(self._fetch('SELECT id, name, description FROM categories ORDER BY name'))
+        return [CategoryRecord(**row) for row in rows]
+
+    def get_category(self, category_id: int) -> Optional[CategoryRecord]:
+        """Получает категорию по ID"""
+        row = self._run(self._fetchrow('SELECT id, name, description FROM categories WHERE id = $1', category_id))
+        return CategoryRecord(**row) if row else None
+
+    def get_category_terms(self, category_id: int) -> List[TermRecord]:
+        """Получает термины категории, отсортированные по названию (без текстов)"""
+        terms = self._run(self._fetch_terms(f'''
+            SELECT {LIST_COLUMNS}
+            FROM terms t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.category_id = $1
+            ORDER BY t.term
+        ''', category_id))
+        for term in terms:
+            term._loader = self.load_term_texts
+        return terms
+
+    def get_term_patterns(self, after_id: int = 0) -> List[Tuple[int, str, Optional[str]]]:
+        """Названия и синонимы терминов с ID больше after_id: (id, term, synonyms)"""
+        rows = self._run(self._fetch(
+            'SELECT id, term, synonyms FROM terms WHERE id > $1 ORDER BY id', after_id
+        ))
+        return [(row['id'], row['term'], row['synonyms']) for row in rows]
+
+    def get_term_documents(self, after_id: int = 0) -> List[Tuple[int, str, str, Optional[str], Optional[str]]]:
+        """Тексты терминов с ID больше after_id: (id, term, definition, examples, synonyms)"""
+        rows = self._run(self._fetch('''
+            SELECT id, term, definition, examples, synonyms
+            FROM terms
+            WHERE id > $1
+            ORDER BY id
+        ''', after_id))
+        return [(row['id'], row['term'], row['definition'], row['examples'], row['synonyms']) for row in rows]
+
+    def load_term_texts(self, term_id: int) -> Tuple[Optional[str], Optional[str]]:
+        """Загружает definition и examples термина"""
+        row = self._run(self._fetchrow('SELECT definition, examples FROM terms WHERE id = $1', term_id))
+        return (row['definition'], row['examples']) if row else (None, None)
+
+    def count_terms_by_category(self) -> Dict[int, int]:
+        """Количество терминов в каждой категории одним запросом"""
+        rows = self._run(self._fetch('''
+            SELECT category_id, COUNT(*) as count
+            FROM terms
+            WHERE category_id IS NOT NULL
+            GROUP BY category_id
+        '''))
+        return {row['category_id']: row['count'] for row in rows}
+
+    @staticmethod
+    async def _store_normalized_fields(conn, term_id: int, term: str, definition: str, synonyms: Optional[str]):
+        """Сохраняет нормализованные поля и ключи одного термина"""
+        await conn.execute('''
+            UPDATE terms SET term_norm = $1, synonyms_norm = $2, definition_norm = $3
+            WHERE id = $4
+        ''', normalize(term), normalize(synonyms), normalize(definition), term_id)
+        await conn.execute('DELETE FROM term_keys WHERE term_id = $1', term_id)
+        await conn.executemany(
+            'INSERT INTO term_keys (key, term_id, is_synonym) VALUES ($1, $2, $3)',
+            [(key, term_id, bool(is_synonym)) for key, is_synonym in term_keys(term, synonyms)]
+        )
+
+    async def _add_term(self, term, definition, category_name, examples, synonyms) -> int:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # Ищем категорию или создаем новую
+                category_id = await self._category_id(conn, category_name)
+                term_id = await conn.fetchval('''
+                    INSERT INTO terms (term, definition, category_id, examples, synonyms)
+                    VALUES ($1, $2, $3, $4, $5)
+                    RETURNING id
+                ''', term, definition, category_id, examples, synonyms)
+                await self._store_normalized_fields(conn, term_id, term, definition, synonyms)
+                await self._record_change(conn, TERM, CREATE, term_id)
+                return term_id
+
+    def add_term(self, term: str, definition: str, category_name: str = None,
+                 examples: str = None, synonyms: str = None) -> int:
+        """Добавляет новый термин"""
+        return self._run(self._add_term(term, definition, category_name, examples, synonyms))
+
+    async def _update_term(self, term_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    'SELECT term, definition, category_id, examples, synonyms FROM terms WHERE id = $1 FOR UPDATE',
+                    term_id
+                )
+                if not row:
+                    return None
+                values = dict(row)
+                values.update((name, value) for name, value in fields.items() if name != 'category_name')
+                if values['term'] != row['term'] and await conn.fetchval(
+                        'SELECT TRUE FROM terms WHERE term = $1 AND id != $2', values['term'], term_id):
+                    raise ValueError(f"Термин '{values['term']}' уже существует")
+                if 'category_name' in fields:
+                    values['category_id'] = await self._category_id(conn, fields['category_name'])
+
+                await conn.execute('''
+                    UPDATE terms
+                    SET term = $1, definition = $2, category_id = $3, examples = $4, synonyms = $5,
+                        updated_at = now()
+                    WHERE id = $6
+                ''', values['term'], values['definition'], values['category_id'], values['examples'],
+                    values['synonyms'], term_id)
+                await self._store_normalized_fields(conn, term_id, values['term'], values['definition'],
+                                                    values['synonyms'])
+                return await self._record_change(conn, TERM, UPDATE, term_id)
+
+    def update_term(self, term_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """Изменяет поля термина (ключи из TERM_FIELDS, None - очистить поле)"""
+        return self._run(self._update_term(term_id, check_fields(fields, TERM_FIELDS)))
+
+    @staticmethod
+    async def _detach_term(conn, term_id: int):
+        """Удаляет производные данные термина, которые нельзя перенести"""
+        await conn.execute('DELETE FROM term_keys WHERE term_id = $1', term_id)
+        await conn.execute('DELETE FROM term_neighbors WHERE term_id = $1 OR neighbor_id = $1', term_id)
+        await conn.execute('DELETE FROM term_cooccurrence WHERE term_a = $1 OR term_b = $1', term_id)
+        await conn.execute('DELETE FROM user_history WHERE term_id = $1', term_id)
+
+    async def _delete_term(self, term_id: int) -> Optional[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval('SELECT TRUE FROM terms WHERE id = $1 FOR UPDATE', term_id):
+                    return None
+                await self._detach_term(conn, term_id)
+                await conn.execute('UPDATE search_stats SET term_id = NULL WHERE term_id = $1', term_id)
+                await conn.execute('UPDATE broadcasts SET term_id = NULL WHERE term_id = $1', term_id)
+                await conn.execute('DELETE FROM terms WHERE id = $1', term_id)
+                return await self._record_change(conn, TERM, DELETE, term_id)
+
+    def delete_term(self, term_id: int) -> Optional[int]:
+        """Удаляет термин вместе с производными данными; журнал поисков сохраняется"""
+        return self._run(self._delete_term(term_id))
+
+    async def _merge_terms(self, source_id: int, target_id: int) -> Optional[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                rows = {
+                    row['id']: row for row in await conn.fetch('''
+                        SELECT id, term, definition, synonyms, usage_count FROM terms
+                        WHERE id = ANY($1::int[]) ORDER BY id FOR UPDATE
+                    ''', [source_id, target_id])
+                }
+                if len(rows) != 2:
+                    return None
+                source, target = rows[source_id], rows[target_id]
+
+                synonyms = merge_synonyms(target['term'], target['synonyms'], source['term'], source['synonyms'])
+                await conn.execute('''
+                    UPDATE terms
+                    SET synonyms = $1, usage_count = usage_count + $2, updated_at = now()
+                    WHERE id = $3
+                ''', synonyms, source['usage_count'] or 0, target_id)
+                await self._store_normalized_fields(conn, target_id, target['term'], target['definition'], synonyms)
+
+                await conn.execute('UPDATE search_stats SET term_id = $1 WHERE term_id = $2', target_id, source_id)
+                await conn.execute('UPDATE broadcasts SET term_id = $1 WHERE term_id = $2', target_id, source_id)
+                # В истории остается более поздний просмотр из двух
+                await conn.execute('''
+                    INSERT INTO user_history (user_id, term_id, viewed_at)
+                    SELECT user_id, $1, viewed_at FROM user_history WHERE term_id = $2
+                    ON CONFLICT (user_id, term_id)
+                    DO UPDATE SET viewed_at = GREATEST(user_history.viewed_at, EXCLUDED.viewed_at)
+                ''', target_id, source_id)
+                # Совместные поиски с source прибавляются к парам с target
+                await conn.execute('''
+                    INSERT INTO term_cooccurrence (term_a, term_b, count)
+                    SELECT LEAST(other, $2), GREATEST(other, $2), count FROM (
+                        SELECT CASE WHEN term_a = $1 THEN term_b ELSE term_a END AS other, count
+                        FROM term_cooccurrence WHERE term_a = $1 OR term_b = $1
+                    ) pairs WHERE other != $2
+                    ON CONFLICT (term_a, term_b) DO UPDATE SET count = term_cooccurrence.count + EXCLUDED.count
+                ''', source_id, target_id)
+                await self._detach_term(conn, source_id)
+                await conn.execute('DELETE FROM terms WHERE id = $1', source_id)
+                return await self._record_change(conn, TERM, MERGE, source_id, target_id)
+
+    def merge_terms(self, source_id: int, target_id: int) -> Optional[int]:
+        """Сливает термин source в target и удаляет source"""
+        if source_id == target_id:
+            raise ValueError("Нельзя слить термин сам с собой")
+        return self._run(self._merge_terms(source_id, target_id))
+
+    async def _update_category(self, category_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    'SELECT name, description FROM categories WHERE id = $1 FOR UPDATE', category_id
+                )
+                if not row:
+                    return None
+                values = dict(row)
+                values.update(fields)
+                if values['name'] != row['name'] and await conn.fetchval(
+                        'SELECT TRUE FROM categories WHERE name = $1 AND id != $2', values['name'], category_id):
+                    raise ValueError(f"Категория '{values['name']}' уже существует")
+                await conn.execute('UPDATE categories SET name = $1, description = $2 WHERE id = $3',
+                                   values['name'], values['description'], category_id)
+                return await self._record_change(conn, CATEGORY, UPDATE, category_id)
+
+    def update_category(self, category_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """Изменяет поля категории (ключи из CATEGORY_FIELDS)"""
+        return self._run(self._update_category(category_id, check_fields(fields, CATEGORY_FIELDS)))
+
+    async def _delete_category(self, category_id: int) -> Optional[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval('SELECT TRUE FROM categories WHERE id = $1 FOR UPDATE', category_id):
+                    return None
+                await conn.execute('UPDATE terms SET category_id = NULL WHERE category_id = $1', category_id)
+                await conn.execute('DELETE FROM categories WHERE id = $1', category_id)
+                return await self._record_change(conn, CATEGORY, DELETE, category_id)
+
+    def delete_category(self, category_id: int) -> Optional[int]:
+        """Удаляет категорию; ее термины остаются без категории"""
+        return self._run(self._delete_category(category_id))
+
+    async def _merge_categories(self, source_id: int, target_id: int) -> Optional[int]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                found = await conn.fetch(
+                    'SELECT id FROM categories WHERE id = ANY($1::int[]) ORDER BY id FOR UPDATE',
+                    [source_id, target_id]
+                )
+                if len(found) != 2:
+                    return None
+                await conn.execute('UPDATE terms SET category_id = $1 WHERE category_id = $2', target_id, source_id)
+                await conn.execute('DELETE FROM categories WHERE id = $1', source_id)
+                return await self._record_change(conn, CATEGORY, MERGE, source_id, target_id)
+
+    def merge_categories(self, source_id: int, target_id: int) -> Optional[int]:
+        """Переносит термины категории source в target и удаляет source"""
+        if source_id == target_id:
+            raise ValueError("Нельзя слить категорию саму с собой")
+        return self._run(self._merge_categories(source_id, target_id))
+
+    def get_revision(self) -> int:
+        """Текущая ревизия словаря (номер последнего изменения; 0 - изменений не было)"""
+        return self._run(self._fetchval('SELECT COALESCE(MAX(revision), 0) FROM dictionary_changes'))
+
+    def get_changes(self, after_revision: int = 0, limit: int = 1000) -> List[Tuple[int, str, str, int, Optional[int]]]:
+        """Изменения словаря после ревизии по возрастанию"""
+        rows = self._run(self._fetch('''
+            SELECT revision, entity, action, entity_id, target_id
+            FROM dictionary_changes WHERE revision > $1 ORDER BY revision LIMIT $2
+        ''', after_revision, limit))
+        return [(row['revision'], row['entity'], row['action'], row['entity_id'], row['target_id'])
+                for row in rows]
+
+    async def _search_terms(self, query: str, limit: int, definitions: bool) -> List[TermRecord]:
+        query_norm = normalize(query)
+        if not query_norm:
+            return []
+        query_key = translit_key(query)
+        pattern = f"%{escape_like(query_norm)}%"
+        base_sql = f'''
+            SELECT {FULL_COLUMNS}
+            FROM terms t
+            LEFT JOIN categories c ON t.category_id = c.id
+        '''
+        order_sql = 'ORDER BY t.usage_count DESC, t.term LIMIT $2'
+
+        async with self._pool.acquire() as conn:
+            # 1. Точное совпадение (нормализованное название или ключ транслитерации)
+            row = await conn.fetchrow(f'''
+                {base_sql}
+                WHERE t.term_norm = $1
+                   OR t.id IN (SELECT term_id FROM term_keys WHERE key = $2 AND NOT is_synonym)
+                ORDER BY t.usage_count DESC, t.term
+                LIMIT 1
+            ''', query_norm, query_key)
+            if row:
+                return [TermRecord(*row)]
+
+            # 2. Синонимы (подстрока или ключ транслитерации)
+            rows = await conn.fetch(f'''
+                {base_sql}
+                WHERE t.synonyms_norm LIKE $1 ESCAPE '\\'
+                   OR t.id IN (SELECT term_id FROM term_keys WHERE key = $3 AND is_synonym)
+                {order_sql}
+            ''', pattern, limit, query_key)
+            if rows:
+                return [TermRecord(*row) for row in rows]
+
+            # 3. Часть названия, 4. определения - до первого непустого уровня
+            columns = ('t.term_norm', 't.definition_norm') if definitions else ('t.term_norm',)
+            for column in columns:
+                rows = await conn.fetch(
+                    f"{base_sql} WHERE {column} LIKE $1 ESCAPE '\\' {order_sql}",
+                    pattern, limit
+                )
+                if rows:
+                    return [TermRecord(*row) for row in rows]
+        return []
+
+    def search_terms(self, query: str, limit: int = 10, definitions: bool = True) -> List[TermRecord]:
+        """Поиск терминов с разными стратегиями"""
+        return self._run(self._search_terms(query, limit, definitions))
+
+    def get_terms_by_ids(self, term_ids: List[int]) -> List[TermRecord]:
+        """Термины в порядке переданных ID (без текстов); несуществующие ID пропускаются"""
+        term_ids = list(term_ids)
+        if not term_ids:
+            return []
+        terms = self._run(self._fetch_terms(f'''
+            SELECT {LIST_COLUMNS}
+            FROM terms t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.id = ANY($1::int[])
+        ''', term_ids))
+        by_id = {term.id: term for term in terms}
+        for term in terms:
+            term._loader = self.load_term_texts
+        return [by_id[term_id] for term_id in term_ids if term_id in by_id]
+
+    def get_term_by_id(self, term_id: int) -> Optional[TermRecord]:
+        """Получает термин по ID"""
+        return self._run(self._fetch_term(f'''
+            SELECT {FULL_COLUMNS}
+            FROM terms t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.id = $1
+        ''', term_id))
+
+    def get_random_term(self) -> Optional[TermRecord]:
+        """Получает случайный термин"""
+        return self._run(self._fetch_term(f'''
+            SELECT {FULL_COLUMNS}
+            FROM terms t
+            LEFT JOIN categories c ON t.category_id = c.id
+            ORDER BY random()
+            LIMIT 1
+        '''))
+
+    def increment_usage(self, term_id: int):
+        """Увеличивает счетчик использования термина"""
+        self._run(self._fetchval(
+            'UPDATE terms SET usage_count = usage_count + 1 WHERE id = $1', term_id
+        ))
+
+    def log_search(self, user_id: int, query: str, term_id: int = None, found: bool = False):
+        """Логирует поисковый запрос"""
+        self._run(self._fetchval('''
+            INSERT INTO search_stats (user_id, term_id, query, found)
+            VALUES ($1, $2, $3, $4)
+        ''', user_id, term_id, query, found))
+
+    def add_suggestion(self, user_id: int, username: str, term: str, definition: str,
+                       category: str = None, examples: str = None) -> int:
+        """Добавляет предложение нового термина от пользователя"""
+        return self._run(self._fetchval('''
+            INSERT INTO term_suggestions
+            (user_id, username, suggested_term, suggested_definition,
+             suggested_category, suggested_examples)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING id
+        ''', user_id, username, term, definition, category, examples))
+
+    def get_pending_suggestions(self) -> List[Dict]:
+        """Получает все ожидающие модерации предложения"""
+        return self._run(self._fetch('''
+            SELECT * FROM term_suggestions
+            WHERE status = 'pending'
+            ORDER BY created_at DESC
+        '''))
+
+    def get_cursor(self, name: str) -> int:
+        """Позиция фоновой задачи (например, последний обработанный ID); 0 если не задана"""
+        value = self._run(self._fetchval('SELECT value FROM job_cursors WHERE name = $1', name))
+        return value or 0
+
+    def set_cursor(self, name: str, value: int):
+        """Сохраняет позицию фоновой задачи"""
+        self._run(self._fetchval('''
+            INSERT INTO job_cursors (name, value) VALUES ($1, $2)
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+        ''', name, value))
+
+    def get_user_sketches(self, since_day: str) -> Dict[str, bytes]:
+        """Сводки уникальных пользователей за дни начиная с since_day ('YYYY-MM-DD'): день -> регистры"""
+        rows = self._run(self._fetch('SELECT day, registers FROM user_sketches WHERE day >= $1', since_day))
+        return {row['day']: bytes(row['registers']) for row in rows}
+
+    async def _merge_user_sketches(self, sketches: Dict[str, bytes], keep_since: str):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                for day, registers in sketches.items():
+                    # Строка создается заранее, чтобы блокировка FOR UPDATE сериализовала процессы
+                    await conn.execute('''
+                        INSERT INTO user_sketches (day, registers) VALUES ($1, $2) ON CONFLICT (day) DO NOTHING
+                    ''', day, registers)
+                    stored = await conn.fetchval('SELECT registers FROM user_sketches WHERE day = $1 FOR UPDATE', day)
+                    await conn.execute('UPDATE user_sketches SET registers = $2 WHERE day = $1',
+                                       day, merge_registers(bytes(stored), registers))
+                await conn.execute('DELETE FROM user_sketches WHERE day < $1', keep_since)
+
+    def merge_user_sketches(self, sketches: Dict[str, bytes], keep_since: str):
+        """Объединяет сводки пользователей с сохраненными (максимум регистров);
+        сводки за дни раньше keep_since удаляются"""
+        self._run(self._merge_user_sketches(sketches, keep_since))
+
+    def get_miss_sketches(self, since_day: str) -> Dict[str, str]:
+        """Сводки неуспешных поисков за дни начиная с since_day ('YYYY-MM-DD'): день -> JSON"""
+        rows = self._run(self._fetch('SELECT day, counters FROM miss_sketches WHERE day >= $1', since_day))
+        return {row['day']: row['counters'] for row in rows}
+
+    async def _save_miss_sketches(self, sketches: Dict[str, str], cursor: int, keep_since: str):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany('''
+                    INSERT INTO miss_sketches (day, counters) VALUES ($1, $2)
+                    ON CONFLICT (day) DO UPDATE SET counters = EXCLUDED.counters
+                ''', list(sketches.items()))
+                await conn.execute('DELETE FROM miss_sketches WHERE day < $1', keep_since)
+                await conn.execute('''
+                    INSERT INTO job_cursors (name, value) VALUES ($1, $2)
+                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+                ''', MISS_CURSOR, cursor)
+
+    def save_miss_sketches(self, sketches: Dict[str, str], cursor: int, keep_since: str):
+        """Сохраняет сводки по дням и позицию MISS_CURSOR одной транзакцией;
+        сводки за дни раньше keep_since удаляются"""
+        self._run(self._save_miss_sketches(sketches, cursor, keep_since))
+
+    def get_term_searches(self, after_id: int = 0, since: float = None,
+                          limit: int = None) -> List[Tuple[int, int, int, float]]:
+        """Успешные поиски с ID больше after_id (и не раньше since, unix-время):
+        (id, user_id, term_id, время) по возрастанию ID"""
+        sql = '''
+            SELECT id, user_id, term_id, extract(epoch FROM search_date)::float8 AS searched_at
+            FROM search_stats
+            WHERE id > $1 AND term_id IS NOT NULL
+        '''
+        params = [after_id]
+        if since is not None:
+            params.append(since)
+            sql += f' AND search_date >= to_timestamp(${len(params)})'
+        sql += ' ORDER BY id'
+        if limit is not None:
+            params.append(limit)
+            sql += f' LIMIT ${len(params)}'
+        rows = self._run(self._fetch(sql, *params))
+        return [(row['id'], row['user_id'], row['term_id'], row['searched_at']) for row in rows]
+
+    def get_search_log(self, after_id: int = 0, limit: int = 500) -> List[Tuple]:
+        """Все поиски с ID больше after_id по возрастанию ID:
+        (id, время UTC 'YYYY-MM-DD HH:MM:SS', user_id, query, found, term_id)"""
+        rows = self._run(self._fetch('''
+            SELECT id, to_char(search_date AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS') AS searched_at,
+                   user_id, query, found, term_id
+            FROM search_stats WHERE id > $1 ORDER BY id LIMIT $2
+        ''', after_id, limit))
+        return [(row['id'], row['searched_at'], row['user_id'], row['query'], bool(row['found']), row['term_id'])
+                for row in rows]
+
+    def get_suggestion_log(self, after_id: int = 0, limit: int = 500) -> List[Tuple]:
+        """Предложения терминов с ID больше after_id по возрастанию ID:
+        (id, время UTC, user_id, username, термин, определение, категория)"""
+        rows = self._run(self._fetch('''
+            SELECT id, to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS') AS created,
+                   user_id, username, suggested_term, suggested_definition, suggested_category
+            FROM term_suggestions WHERE id > $1 ORDER BY id LIMIT $2
+        ''', after_id, limit))
+        return [(row['id'], row['created'], row['user_id'], row['username'], row['suggested_term'],
+                 row['suggested_definition'], row['suggested_category']) for row in rows]
+
+    def add_cooccurrences(self, pairs: List[Tuple[int, int, int]]):
+        """Прибавляет счетчики совместных поисков: тройки (term_a, term_b, count), term_a < term_b"""
+        self._run(self._executemany('''
+            INSERT INTO term_cooccurrence (term_a, term_b, count) VALUES ($1, $2, $3)
+            ON CONFLICT (term_a, term_b) DO UPDATE SET count = term_cooccurrence.count + EXCLUDED.count
+        ''', pairs))
+
+    def get_cooccurrences(self, term_ids: List[int]) -> List[Tuple[int, int, int]]:
+        """Счетчики совместных поисков, в которых участвует любой из терминов"""
+        rows = self._run(self._fetch('''
+            SELECT term_a, term_b, count FROM term_cooccurrence WHERE term_a = ANY($1::int[])
+            UNION
+            SELECT term_a, term_b, count FROM term_cooccurrence WHERE term_b = ANY($1::int[])
+        ''', list(term_ids)))
+        return [(row['term_a'], row['term_b'], row['count']) for row in rows]
+
+    def get_term_catalog(self) -> List[Tuple[int, Optional[int], int]]:
+        """Все термины без текстов: (id, category_id, usage_count)"""
+        rows = self._run(self._fetch('SELECT id, category_id, usage_count FROM terms'))
+        return [(row['id'], row['category_id'], row['usage_count'] or 0) for row in rows]
+
+    async def _replace_neighbors(self, neighbors: Dict[int, List[Tuple[int, float]]]):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('DELETE FROM term_neighbors WHERE term_id = ANY($1::int[])', list(neighbors))
+                await conn.executemany(
+                    'INSERT INTO term_neighbors (term_id, rank, neighbor_id, score) VALUES ($1, $2, $3, $4)',
+                    [
+                        (term_id, rank, neighbor_id, score)
+                        for term_id, items in neighbors.items()
+                        for rank, (neighbor_id, score) in enumerate(items)
+                    ]
+                )
+
+    def replace_neighbors(self, neighbors: Dict[int, List[Tuple[int, float]]]):
+        """Заменяет списки связанных терминов: {term_id: [(neighbor_id, score), ...]} по убыванию score"""
+        self._run(self._replace_neighbors(neighbors))
+
+    def get_related_terms(self, term_id: int, limit: int = 4) -> List[Tuple[int, str]]:
+        """Связанные термины из готовой таблицы: (id, название)"""
+        rows = self._run(self._fetch('''
+            SELECT t.id, t.term
+            FROM term_neighbors n
+            JOIN terms t ON t.id = n.neighbor_id
+            WHERE n.term_id = $1
+            ORDER BY n.rank
+            LIMIT $2
+        ''', term_id, limit))
+        return [(row['id'], row['term']) for row in rows]
+
+    async def _add_history(self, user_id: int, term_id: int, viewed_at: float, keep: int):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('''
+                    INSERT INTO user_history (user_id, term_id, viewed_at) VALUES ($1, $2, $3)
+                    ON CONFLICT (user_id, term_id) DO UPDATE SET viewed_at = EXCLUDED.viewed_at
+                ''', user_id, term_id, viewed_at)
+                await conn.execute('''
+                    DELETE FROM user_history
+                    WHERE user_id = $1 AND viewed_at < (
+                        SELECT viewed_at FROM user_history WHERE user_id = $1
+                        ORDER BY viewed_at DESC LIMIT 1 OFFSET $2
+                    )
+                ''', user_id, keep - 1)
+
+    def add_history(self, user_id: int, term_id: int, viewed_at: float, keep: int = 10):
+        """Добавляет термин в историю пользователя (повторный просмотр поднимает его наверх)
+        и оставляет только keep последних терминов"""
+        self._run(self._add_history(user_id, term_id, viewed_at, keep))
+
+    def get_history(self, user_id: int, limit: int = 10) -> List[Tuple[int, str]]:
+        """История пользователя от новых к старым: (id, название)"""
+        rows = self._run(self._fetch('''
+            SELECT t.id, t.term
+            FROM user_history h
+            JOIN terms t ON t.id = h.term_id
+            WHERE h.user_id = $1
+            ORDER BY h.viewed_at DESC
+            LIMIT $2
+        ''', user_id, limit))
+        return [(row['id'], row['term']) for row in rows]
+
+    def add_subscriber(self, chat_id: int) -> bool:
+        """Подписывает чат на термин дня; False если подписка уже была"""
+        return self._run(self._fetchval(
+            'INSERT INTO subscribers (chat_id) VALUES ($1) ON CONFLICT DO NOTHING RETURNING TRUE', chat_id
+        )) is not None
+
+    def remove_subscriber(self, chat_id: int) -> bool:
+        """Отписывает чат от термина дня; False если подписки не было"""
+        return self._run(self._fetchval(
+            'DELETE FROM subscribers WHERE chat_id = $1 RETURNING TRUE', chat_id
+        )) is not None
+
+    def is_subscribed(self, chat_id: int) -> bool:
+        """Подписан ли чат на термин дня"""
+        return self._run(self._fetchval(
+            'SELECT TRUE FROM subscribers WHERE chat_id = $1', chat_id
+        )) is not None
+
+    def get_broadcast(self, broadcast_date: str) -> Optional[Dict]:
+        """Получает рассылку за указанную дату (YYYY-MM-DD)"""
+        return self._run(self._fetchrow('''
+            SELECT id, broadcast_date, term_id, text, parse_mode, status
+            FROM broadcasts
+            WHERE broadcast_date = $1
+        ''', broadcast_date))
+
+    def get_unfinished_broadcast(self) -> Optional[Dict]:
+        """Последняя по дате незавершенная рассылка (None - все завершены)"""
+        return self._run(self._fetchrow('''
+            SELECT id, broadcast_date, term_id, text, parse_mode, status
+            FROM broadcasts
+            WHERE status != 'finished'
+            ORDER BY broadcast_date DESC
+            LIMIT 1
+        '''))
+
+    def create_broadcast(self, broadcast_date: str, term_id: Optional[int], text: str, parse_mode: str) -> Dict:
+        """Создает рассылку с заранее подготовленным текстом и его режимом разметки"""
+        return self._run(self._fetchrow('''
+            INSERT INTO broadcasts (broadcast_date, term_id, text, parse_mode)
+            VALUES ($1, $2, $3, $4)
+            RETURNING id, broadcast_date, term_id, text, parse_mode, status
+        ''', broadcast_date, term_id, text, parse_mode))
+
+    def get_pending_recipients(self, broadcast_id: int, limit: int = 100) -> List[int]:
+        """Подписчики, которым рассылка еще не доставлена (по возрастанию chat_id)"""
+        rows = self._run(self._fetch('''
+            SELECT s.chat_id
+            FROM subscribers s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM broadcast_deliveries d
+                WHERE d.broadcast_id = $1 AND d.chat_id = s.chat_id
+            )
+            ORDER BY s.chat_id
+            LIMIT $2
+        ''', broadcast_id, limit))
+        return [row['chat_id'] for row in rows]
+
+    def record_deliveries(self, broadcast_id: int, deliveries: List[Tuple[int, str]]):
+        """Сохраняет результаты отправки: пары (chat_id, статус)"""
+        self._run(self._executemany('''
+            INSERT INTO broadcast_deliveries (broadcast_id, chat_id, status)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (broadcast_id, chat_id) DO UPDATE SET status = EXCLUDED.status
+        ''', [(broadcast_id, chat_id, status) for chat_id, status in deliveries]))
+
+    def finish_broadcast(self, broadcast_id: int):
+        """Отмечает рассылку завершенной"""
+        self._run(self._fetchval('''
+            UPDATE broadcasts SET status = 'finished', finished_at = now()
+            WHERE id = $1
+        ''', broadcast_id))
+
+    async def _get_stats(self) -> Dict:
+        async with self._pool.acquire() as conn:
+            stats = {}
+            stats['total_terms'] = await conn.fetchval('SELECT COUNT(*) FROM terms')
+            stats['total_categories'] = await conn.fetchval('SELECT COUNT(*) FROM categories')
+            rows = await conn.fetch('''
+                SELECT term, usage_count
+                FROM terms
+                WHERE usage_count > 0
+                ORDER BY usage_count DESC
+                LIMIT 5
+            ''')
+            stats['popular_terms'] = [dict(row) for row in rows]
+            stats['searches_week'] = await conn.fetchval('''
+                SELECT COUNT(*) FROM search_stats
+                WHERE search_date > now() - interval '7 days'
+            ''')
+            stats['pending_suggestions'] = await conn.fetchval(
+                "SELECT COUNT(*) FROM term_suggestions WHERE status = 'pending'"
+            )
+            return stats
+
+    def ping(self):
+        """Минимальный запрос к базе для проверки готовности; исключение, если база недоступна"""
+        self._run(self._fetchval('SELECT 1'))
+
+    def get_stats(self) -> Dict:
+        """Получает статистику базы данных"""
+        return self._run(self._get_stats())
+
+    def close(self):
+        """Закрывает пул соединений и event loop хранилища (общий loop останавливает владелец)"""
+        if self._loop.is_running():
+            self._run(self._pool.close())
+            if self._thread:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
@@ -0,0 +1,302 @@
+"""
+Профилирование работающего бота по запросу
+Сессия cProfile, семплирование стеков или снимок tracemalloc на N секунд,
+задержка event loop за время сессии; управление через HTTP-порт health-проверки
+"""
+import asyncio
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sampling', 'memory')
+MAX_SECONDS = 300
+TOP_FUNCTIONS = 30
+
+
+class ProfilingError(Exception):
+    """Сессию нельзя запустить: уже идет другая, неверные параметры или бот не запущен"""
+
+
+class ProfilingSession:
+    """Параметры и результаты одной сессии профилирования"""
+
+    def __init__(self, mode: str, seconds: float):
+        self.mode = mode
+        self.seconds = seconds
+        self.started_at = time.time()
+        self.finished = False
+        self.error: Optional[str] = None
+        self.lags: List[float] = []
+        self.summary = ''
+        self.pstats_data: Optional[bytes] = None
+        self.folded: Optional[str] = None
+
+
+class Profiler:
+    """Профилировщик event loop бота
+
+    Пока сессия не запущена, ничего не работает: нет ни хуков трассировки,
+    ни потока семплирования, ни tracemalloc. Одновременно идет одна сессия,
+    результат последней хранится до запуска следующей.
+
+    - cprofile: детерминированный профиль потока event loop, файл pstats;
+    - sampling: стеки потока event loop каждые sample_interval секунд,
+      файл в формате folded stacks (flamegraph.pl, speedscope). Поток
+      семплирования получает GIL не чаще sys.getswitchinterval() (5 мс),
+      поэтому видны прежде всего участки, надолго блокирующие event loop;
+      короткие вызовы точнее покажет cprofile;
+    - memory: аллокации за время сессии, которые еще живы, по модулям.
+    """
+
+    def __init__(self, sample_interval: float = 0.005, lag_interval: float = 0.05):
+        self.sample_interval = sample_interval
+        self.lag_interval = lag_interval
+        self.session: Optional[ProfilingSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def attach(self, loop: asyncio.AbstractEventLoop = None):
+        """Запоминает event loop бота; вызывается из потока event loop (post_init)"""
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+
+    @property
+    def running(self) -> bool:
+        return self.session is not None and not self.session.finished
+
+    def start(self, mode: str, seconds: float) -> ProfilingSession:
+        """Запускает сессию в фоновом потоке и сразу возвращает ее"""
+        if mode not in MODES:
+            raise ProfilingError(f"Неизвестный режим '{mode}', доступны: {', '.join(MODES)}")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ProfilingError(f"Длительность должна быть от 0 до {MAX_SECONDS} секунд")
+        if self._loop is None:
+            raise ProfilingError("Event loop бота еще не запущен")
+        with self._lock:
+            if self.running:
+                raise ProfilingError(f"Уже идет сессия {self.session.mode}")
+            self.session = ProfilingSession(mode, seconds)
+        threading.Thread(target=self._run, args=(self.session,), name='profiler', daemon=True).start()
+        logger.info("Профилирование %s на %s с", mode, seconds)
+        return self.session
+
+    def _run(self, session: ProfilingSession):
+        deadline = time.monotonic() + session.seconds
+        lag_watch = asyncio.run_coroutine_threadsafe(self._watch_lag(session, deadline), self._loop)
+        try:
+            if session.mode == 'cprofile':
+                self._run_cprofile(session, deadline)
+            elif session.mode == 'sampling':
+                self._run_sampling(session, deadline)
+            else:
+                self._run_memory(session, deadline)
+            lag_watch.result(timeout=5)
+            session.summary = self._lag_summary(session) + session.summary
+        except Exception as e:
+            logger.exception("Ошибка профилирования")
+            session.error = str(e)
+        finally:
+            session.finished = True
+
+    def _call_in_loop(self, func: Callable):
+        """Выполняет функцию в потоке event loop и ждет результата"""
+        future = Future()
+
+        def call():
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+
+        self._loop.call_soon_threadsafe(call)
+        return future.result(timeout=10)
+
+    async def _watch_lag(self, session: ProfilingSession, deadline: float):
+        """Задержка event loop: насколько позже запланированного просыпается sleep"""
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            session.lags.append(max(0.0, time.perf_counter() - start - self.lag_interval))
+
+    @staticmethod
+    def _lag_summary(session: ProfilingSession) -> str:
+        lags = sorted(session.lags)
+        if not lags:
+            return "Задержка event loop: нет замеров\n\n"
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        return (f"Режим: {session.mode}, {session.seconds} с\n"
+                f"Задержка event loop: замеров {len(lags)}, средняя {sum(lags) / len(lags) * 1000:.1f} мс, "
+                f"p99 {p99 * 1000:.1f} мс, максимум {lags[-1] * 1000:.1f} мс\n\n")
+
+    def _run_cprofile(self, session: ProfilingSession, deadline: float):
+        profile = cProfile.Profile()
+        self._call_in_loop(profile.enable)
+        try:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+        finally:
+            self._call_in_loop(profile.disable)
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        session.summary = stream.getvalue()
+        # Тот же формат, что пишет Stats.dump_stats: читается pstats, snakeviz, gprof2dot
+        session.pstats_data = marshal.dumps(stats.stats)
+
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _run_sampling(self, session: ProfilingSession, deadline: float):
+        stacks = Counter()
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(self._frame_label(frame))
+                frame = frame.f_back
+            del frame
+            if labels:
+                stacks[';'.join(reversed(labels))] += 1
+            time.sleep(self.sample_interval)
+
+        session.folded = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        session.summary = self._sampling_summary(stacks)
+
+    @staticmethod
+    def _sampling_summary(stacks: Counter) -> str:
+        """Топ функций по доле семплов: собственное время и время с вызванными"""
+        total = sum(stacks.values())
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+
+        lines = [f"Семплов: {total}", "", "Собственное время:"]
+        lines += [f"{count / total:7.1%}  {label}" for label, count in own.most_common(TOP_FUNCTIONS)]
+        lines += ["", "С учетом вызванных функций:"]
+        lines += [f"{count / total:7.1%}  {label}" for label, count in inclusive.most_common(TOP_FUNCTIONS)]
+        return '\n'.join(lines) + '\n' if total else "Семплов нет\n"
+
+    def _run_memory(self, session: ProfilingSession, deadline: float):
+        # Если tracemalloc уже включен (например, PYTHONTRACEMALLOC), не выключаем его
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start()
+        try:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+        by_module: Dict[str, Tuple[int, int]] = {}
+        for stat in snapshot.statistics('filename'):
+            module = self._module_name(stat.traceback[0].filename)
+            size, count = by_module.get(module, (0, 0))
+            by_module[module] = (size + stat.size, count + stat.count)
+
+        top = sorted(by_module.items(), key=lambda item: item[1][0], reverse=True)[:TOP_FUNCTIONS]
+        lines = ["Живые аллокации за время сессии по модулям:"]
+        lines += [f"{size / 1024:10.1f} КБ  {count:8d} блоков  {module}" for module, (size, count) in top]
+        session.summary = '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _module_name(filename: str) -> str:
+        """Модули бота - по имени файла (database.py), библиотеки - по пакету (telegram)"""
+        parts = filename.replace('\\', '/').split('/')
+        if 'site-packages' in parts:
+            index = parts.index('site-packages')
+            return parts[index + 1] if index + 1 < len(parts) else filename
+        return parts[-1]
+
+    def status(self) -> str:
+        session = self.session
+        if session is None:
+            return "Сессий профилирования не было\n"
+        if not session.finished:
+            elapsed = time.time() - session.started_at
+            return f"Идет сессия {session.mode}: {elapsed:.0f} из {session.seconds} с\n"
+        if session.error:
+            return f"Сессия {session.mode} завершилась ошибкой: {session.error}\n"
+        return session.summary
+
+
+def check_token(token: Optional[str], headers) -> Optional[int]:
+    """Проверка заголовка "Authorization: Bearer <токен>" служебных эндпоинтов
+
+    None - доступ разрешен; иначе код ответа: 404, если токен не настроен
+    (эндпоинт отключен), 403 - при неверном токене.
+    """
+    if not token:
+        return 404
+    supplied = headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        return 403
+    return None
+
+
+def handle_request(profiler: Profiler, token: Optional[str], method: str, path: str,
+                   headers) -> Optional[Tuple[int, str, bytes, Optional[str]]]:
+    """Обработка запросов /debug/profile* на HTTP-порту health-проверки
+
+    Возвращает (код, Content-Type, тело, имя файла) или None, если путь не относится
+    к профилированию. Без PROFILING_TOKEN эндпоинты отключены. Токен передается
+    заголовком "Authorization: Bearer <токен>".
+
+    POST /debug/profile/start?mode=cprofile|sampling|memory&seconds=30
+    GET  /debug/profile          - состояние и сводка последней сессии
+    GET  /debug/profile/pstats   - файл pstats (режим cprofile)
+    GET  /debug/profile/folded   - folded stacks для flamegraph (режим sampling)
+    """
+    url = urlsplit(path)
+    if not url.path.startswith('/debug/profile'):
+        return None
+
+    def text(status: int, message: str):
+        return status, 'text/plain; charset=utf-8', message.encode(), None
+
+    denied = check_token(token, headers)
+    if denied is not None:
+        return text(denied, "Not found\n" if denied == 404 else "Forbidden\n")
+
+    if method == 'POST' and url.path == '/debug/profile/start':
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            session = profiler.start(params.get('mode', 'sampling'), float(params.get('seconds', 30)))
+        except (ProfilingError, ValueError) as e:
+            return text(409 if profiler.running else 400, f"{e}\n")
+        return text(202, f"Сессия {session.mode} запущена на {session.seconds} с\n")
+
+    if method != 'GET':
+        return text(405, "Method not allowed\n")
+
+    session = profiler.session
+    if url.path == '/debug/profile':
+        return text(200, profiler.status())
+    if session is None or not session.finished:
+        return text(409, profiler.status())
+    if url.path == '/debug/profile/pstats' and session.pstats_data is not None:
+        return 200, 'application/octet-stream', session.pstats_data, 'bot.pstats'
+    if url.path == '/debug/profile/folded' and session.folded is not None:
+        return 200, 'text/plain; charset=utf-8', session.folded.encode(), 'bot.folded'
+    return text(404, "Для последней сессии такого результата нет\n")
@@ -0,0 +1,116 @@
+"""
+Модуль ограничения частоты запросов пользователей (token bucket)
+Защищает бота от флуда: один пользователь не может замедлить работу для остальных
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """Корзина токенов одного пользователя"""
+    __slots__ = ('tokens', 'updated_at', 'warned')
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.warned = False
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов по user_id
+
+    Каждому активному пользователю соответствует одна корзина фиксированного размера.
+    Корзины хранятся в порядке последнего обращения, поэтому простаивающие
+    пользователи вытесняются с начала словаря за амортизированное O(1).
+    """
+
+    def __init__(self, rate: float, burst: int, idle_ttl: float = 600, max_users: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self._buckets: 'OrderedDict[int, TokenBucket]' = OrderedDict()
+
+    def allow(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Списывает токен; возвращает False если пользователь превысил лимит"""
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+            self._buckets[user_id] = bucket
+        else:
+            self._buckets.move_to_end(user_id)
+            elapsed = now - bucket.updated_at
+            if elapsed > 0:
+                bucket.tokens = min(self.burst, bucket.tokens + elapsed * self.rate)
+                bucket.updated_at = now
+
+        self._evict_idle(now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            return True
+        return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """Нужно ли отправить предупреждение (одно на каждую серию ограничений)"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket.warned:
+            return False
+        bucket.warned = True
+        return True
+
+    def _evict_idle(self, now: float):
+        """Удаляет корзины пользователей, которые давно не писали"""
+        buckets = self._buckets
+        while buckets:
+            user_id, bucket = next(iter(buckets.items()))
+            if len(buckets) <= self.max_users and now - bucket.updated_at < self.idle_ttl:
+                break
+            buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AsyncRateLimiter:
+    """Общий лимит исходящих сообщений для корутин одного event loop
+
+    Корутины ждут своей очереди через acquire(), поэтому при любом числе
+    параллельных отправок бот не превышает rate сообщений в секунду.
+    pause() останавливает всех отправителей, например по ответу RetryAfter.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ждет, пока можно будет отправить следующее сообщение"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Приостанавливает все отправки на указанное время"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated_at = self._paused_until
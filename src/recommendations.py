@@ -0,0 +1,168 @@
+"""
+Связанные термины: рекомендации на основе совместных поисков
+Тяжелый расчет выполняется фоновой задачей, а карточка термина читает
+готовый список соседей одним запросом по индексу
+"""
+import asyncio
+import heapq
+import logging
+import math
+from collections import Counter, defaultdict, deque
+from typing import Dict, Iterable, List, Tuple
+
+from telegram.ext import ContextTypes
+
+from storage_backend import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# Поиски одного пользователя в пределах этого окна считаются одной сессией
+SESSION_GAP = 30 * 60
+
+# Надбавка за общую категорию: термин без совместных поисков получает соседей из своей категории
+CATEGORY_BONUS = 0.1
+
+SEARCH_CURSOR = 'related_terms_search_id'
+TERM_CURSOR = 'related_terms_term_id'
+
+
+class RelatedTermsIndexer:
+    """Инкрементальный расчет таблицы связанных терминов
+
+    Совместные поиски хранятся как разреженная симметричная матрица
+    (term_a < term_b, count) и только дополняются: каждая задача читает
+    поиски после сохраненной позиции и пересчитывает соседей лишь для
+    затронутых и новых терминов.
+
+    Близость двух терминов - косинусная мера по числу совместных поисков
+    (нормировка на популярность usage_count) плюс надбавка за общую категорию.
+    """
+
+    def __init__(self, db: StorageBackend, neighbors_count: int = 8,
+                 session_gap: float = SESSION_GAP, batch_size: int = 10000):
+        self.db = db
+        self.neighbors_count = neighbors_count
+        self.session_gap = session_gap
+        self.batch_size = batch_size
+
+    def update(self) -> int:
+        """Обрабатывает новые поиски и термины; возвращает число пересчитанных терминов"""
+        touched = set()
+        while True:
+            search_cursor = self.db.get_cursor(SEARCH_CURSOR)
+            searches = self.db.get_term_searches(after_id=search_cursor, limit=self.batch_size)
+            if not searches:
+                break
+            pairs = self.count_session_pairs(searches, search_cursor)
+            if pairs:
+                self.db.add_cooccurrences([(a, b, count) for (a, b), count in pairs.items()])
+                for a, b in pairs:
+                    touched.add(a)
+                    touched.add(b)
+            self.db.set_cursor(SEARCH_CURSOR, searches[-1][0])
+
+        catalog = self._load_catalog()
+        term_cursor = self.db.get_cursor(TERM_CURSOR)
+        touched.update(term_id for term_id in catalog if term_id > term_cursor)
+        self._recompute(touched, catalog)
+        if catalog:
+            self.db.set_cursor(TERM_CURSOR, max(term_cursor, max(catalog)))
+        return len(touched)
+
+    def rebuild(self) -> int:
+        """Пересчитывает соседей всех терминов (после массового изменения категорий)"""
+        catalog = self._load_catalog()
+        self._recompute(catalog.keys(), catalog)
+        return len(catalog)
+
+    def count_session_pairs(self, searches: List[Tuple[int, int, int, float]],
+                            cursor: int) -> Counter:
+        """Пары терминов, найденных одним пользователем в пределах сессии
+
+        Каждая пара учитывается при обработке более позднего поиска, поэтому
+        для новых поисков нужны и предыдущие поиски пользователя из окна сессии.
+        """
+        last_id = searches[-1][0]
+        since = min(searched_at for _, _, _, searched_at in searches) - self.session_gap
+        history = [row for row in self.db.get_term_searches(since=since) if row[0] <= last_id]
+
+        by_user = defaultdict(list)
+        for search_id, user_id, term_id, searched_at in history:
+            by_user[user_id].append((searched_at, search_id, term_id))
+
+        pairs = Counter()
+        for user_searches in by_user.values():
+            user_searches.sort()
+            window = deque()
+            for searched_at, search_id, term_id in user_searches:
+                while window and searched_at - window[0][0] > self.session_gap:
+                    window.popleft()
+                if search_id > cursor:
+                    for other in {other for _, _, other in window if other != term_id}:
+                        pairs[(min(term_id, other), max(term_id, other))] += 1
+                window.append((searched_at, search_id, term_id))
+        return pairs
+
+    def _load_catalog(self) -> Dict[int, Tuple[int, int]]:
+        """Термины словаря: {id: (category_id, usage_count)}"""
+        return {
+            term_id: (category_id, usage_count or 0)
+            for term_id, category_id, usage_count in self.db.get_term_catalog()
+        }
+
+    def _recompute(self, term_ids: Iterable[int], catalog: Dict[int, Tuple[int, int]]):
+        """Пересчитывает и сохраняет top-K соседей для указанных терминов"""
+        term_ids = [term_id for term_id in term_ids if term_id in catalog]
+        if not term_ids:
+            return
+        wanted = set(term_ids)
+
+        # Строки разреженной матрицы для пересчитываемых терминов
+        rows = defaultdict(dict)
+        for a, b, count in self.db.get_cooccurrences(term_ids):
+            if a in wanted:
+                rows[a][b] = count
+            if b in wanted:
+                rows[b][a] = count
+
+        # Кандидаты из категории: самые популярные термины каждой категории
+        by_category = defaultdict(list)
+        for term_id, (category_id, usage_count) in catalog.items():
+            if category_id is not None:
+                by_category[category_id].append((usage_count, -term_id))
+        category_top = {
+            category_id: [-neg_id for _, neg_id in heapq.nlargest(self.neighbors_count + 1, members)]
+            for category_id, members in by_category.items()
+        }
+
+        neighbors = {}
+        for term_id in term_ids:
+            category_id, usage_count = catalog[term_id]
+            scores = {}
+            for other, count in rows[term_id].items():
+                if other in catalog:
+                    popularity = math.sqrt(max(usage_count, count) * max(catalog[other][1], count))
+                    scores[other] = count / popularity
+            for other in category_top.get(category_id, ()):
+                if other != term_id:
+                    scores[other] = scores.get(other, 0.0)
+            for other in scores:
+                if category_id is not None and catalog[other][0] == category_id:
+                    scores[other] += CATEGORY_BONUS
+
+            best = heapq.nlargest(
+                self.neighbors_count, scores.items(),
+                key=lambda item: (item[1], catalog[item[0]][1], -item[0])
+            )
+            neighbors[term_id] = [(other, round(score, 6)) for other, score in best]
+
+        # Сохраняем порциями, чтобы не держать длинную транзакцию записи
+        items = list(neighbors.items())
+        for start in range(0, len(items), 1000):
+            self.db.replace_neighbors(dict(items[start:start + 1000]))
+
+    async def job_callback(self, context: ContextTypes.DEFAULT_TYPE):
+        """Задача JobQueue: периодический пересчет в отдельном потоке"""
+        updated = await asyncio.to_thread(self.update)
+        if updated:
+            logger.info("Связанные термины пересчитаны для %s терминов", updated)
@@ -0,0 +1,303 @@
+"""
+Оформление сообщений бота
+Все тексты отправляются в разметке MarkdownV2: статичные экраны и клавиатуры
+собираются один раз при импорте, а пользовательские строки (запросы, названия
+терминов, имена) экранируются при подстановке за один проход str.translate
+"""
+import re
+from typing import Dict, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from term_record import CategoryRecord, TermRecord
+
+PARSE_MODE = 'MarkdownV2'
+
+# Символы, которые MarkdownV2 требует экранировать в обычном тексте
+_SPECIAL = '_*[]()~`>#+-=|{}.!\\'
+_ESCAPE = str.maketrans({char: '\\' + char for char in _SPECIAL})
+# Внутри `кода` и ```блоков``` экранируются только обратная кавычка и обратная косая черта
+_ESCAPE_CODE = str.maketrans({'`': '\\`', '\\': '\\\\'})
+
+# Разметка шаблонов: блоки кода, код в строке, жирный шрифт и поля для подстановки
+_TEMPLATE_TOKENS = re.compile(r'(```.*?```|`[^`\n]*`|\*)', re.S)
+_FIELD = re.compile(r'\{(\w+)\}')
+
+
+def escape(text) -> str:
+    """Экранирует строку для вставки в текст MarkdownV2"""
+    return str(text).translate(_ESCAPE)
+
+
+def escape_code(text) -> str:
+    """Экранирует строку для вставки внутрь `кода`"""
+    return str(text).translate(_ESCAPE_CODE)
+
+
+def markdown(source: str) -> str:
+    """Переводит доверенный шаблон в MarkdownV2
+
+    В шаблоне пишется привычная разметка: *жирный*, `код` и ```блок кода```;
+    все остальное экранируется. Для пользовательских строк - escape().
+    """
+    result = []
+    for i, part in enumerate(_TEMPLATE_TOKENS.split(source)):
+        if i % 2 == 0:
+            result.append(escape(part))
+        elif part.startswith('```'):
+            result.append('```' + escape_code(part[3:-3]) + '```')
+        elif part.startswith('`'):
+            result.append('`' + escape_code(part[1:-1]) + '`')
+        else:
+            result.append(part)
+    return ''.join(result)
+
+
+class Template:
+    """Шаблон с полями {name}: разметка переводится в MarkdownV2 один раз при создании,
+    значения полей экранируются при каждом render()"""
+
+    def __init__(self, source: str):
+        self.parts = _FIELD.split(source)
+        for i in range(0, len(self.parts), 2):
+            self.parts[i] = markdown(self.parts[i])
+
+    def render(self, **values) -> str:
+        parts = self.parts
+        return ''.join(part if i % 2 == 0 else escape(values[part]) for i, part in enumerate(parts))
+
+
+def _markup(*rows) -> InlineKeyboardMarkup:
+    """Клавиатура из рядов пар (текст, callback_data)"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row]
+                                 for row in rows])
+
+
+# Готовые клавиатуры (объекты telegram неизменяемы, поэтому общие для всех ответов)
+MENU_BUTTON = InlineKeyboardButton("🏠 Главное меню", callback_data="start")
+MAIN_MENU = _markup(
+    [("🎲 Случайный термин", "random"), ("📚 Категории", "categories")],
+    [("💡 Предложить термин", "suggest"), ("📊 Статистика", "stats")],
+    [("🔔 Термин дня", "subscription"), ("📜 Мои запросы", "history")],
+    [("ℹ️ Помощь", "help")],
+)
+BACK_TO_MENU = InlineKeyboardMarkup([[MENU_BUTTON]])
+
+WELCOME = Template("""
+🌸 Добро пожаловать в *Парфюмерный календарь*!
+
+Привет, {name}! Я помогу вам разобраться в мире парфюмерии.
+
+📚 *Как использовать:*
+• Просто напишите любой парфюмерный термин для поиска
+• Нажимайте на кнопки для быстрого доступа к функциям
+• Изучайте случайные термины
+• Предлагайте новые термины для словаря
+""")
+
+MENU_HINT = markdown(
+    "💡 *Как вернуться к главному меню:*\n"
+    "📱 На телефоне: нажмите ☰ (три полоски) слева от строки ввода\n"
+    "💻 На компьютере: напишите `/start` или `/help`"
+)
+
+MAIN_MENU_TEXT = Template("""
+🌸 *Парфюмерный календарь*
+
+Привет, {name}! Чем могу помочь?
+
+🔍 Напишите любой парфюмерный термин или выберите действие:
+""")
+
+HELP = markdown("""
+📖 *Справка по боту "Парфюмерный календарь"*
+
+🔍 *Поиск терминов:*
+Просто напишите мне любое слово или термин из мира парфюмерии, и я объясню его значение.
+
+Примеры: "верхние ноты", "beast mode", "атомайзер"
+
+📋 *Функции бота:*
+🏠 Главное меню - возврат к основным функциям
+ℹ️ Справка - как пользоваться ботом
+🎲 Случайный термин - изучение новых понятий
+📚 Категории - просмотр терминов по темам
+💡 Предложить термин - добавление новых слов
+📊 Статистика - информация о базе данных
+📜 Мои запросы - последние просмотренные термины
+
+🎯 *Поиск работает по:*
+• Точному названию термина
+• Синонимам и альтернативным названиям
+• Частичным совпадениям
+• Описанию аромата ("пахнет свежо, цитрусово")
+
+💡 *Хотите помочь?*
+Используйте кнопку "💡 Предложить термин" чтобы предложить новый термин или улучшение существующего.
+
+❓ *Не нашли термин?*
+Напишите администратору канала @your_admin или воспользуйтесь кнопкой "💡 Предложить термин"
+""")
+
+HELP_SHORT = markdown("""
+📖 *Как пользоваться ботом:*
+
+🔍 *Поиск:* Просто напишите термин
+💡 *Предложить:* Нажмите кнопку "💡 Предложить термин"
+🎲 *Изучать:* Нажимайте "Случайный термин"
+📚 *Категории:* Просматривайте по темам
+📜 *История:* Кнопка "Мои запросы" - последние термины
+
+*Примеры запросов:*
+• "верхние ноты"
+• "beast mode"
+• "атомайзер"
+• "флэнкер"
+""")
+
+SUGGEST = markdown("""
+💡 *Предложите новый термин!*
+
+Отправьте сообщение в формате:
+```
+Название термина
+Объяснение термина
+Категория (необязательно)
+Примеры использования (необязательно)
+```
+
+*Пример:*
+```
+Винтаж
+Старый, редкий аромат из прошлых лет
+Жаргон
+"Этот винтаж 80-х годов стоит целое состояние"
+```
+
+Можно прислать сначала только название - тогда я спрошу объяснение.
+Ваше предложение будет рассмотрено администратором.
+
+Чтобы отменить, отправьте /cancel или нажмите "🏠 Главное меню".
+""")
+SUGGEST_DEFINITION = Template(
+    "✏️ Термин *{term}*\n\n"
+    "Теперь отправьте объяснение. Следующими строками можно указать категорию и примеры."
+)
+SUGGEST_INVALID = Template("❌ {error}\n\nИсправьте сообщение и отправьте еще раз или /cancel для отмены.")
+SUGGEST_SAVED = Template("✅ Спасибо! Предложение *{term}* отправлено на модерацию.")
+SUGGEST_PENDING = Template("Предложение *{term}* уже ждет рассмотрения. Спасибо!")
+SUGGEST_CANCELLED = markdown("Предложение отменено.")
+
+NOT_FOUND = Template(
+    "❌ Термин '*{query}*' не найден.\n\n"
+    "💡 Попробуйте:\n"
+    "• Проверить написание\n"
+    "• Использовать синонимы\n"
+    "• Посмотреть категории через кнопку \"📚 Категории\"\n"
+    "• Предложить новый термин: кнопка \"💡 Предложить термин\""
+)
+
+SEARCH_RESULTS = Template("🔍 По запросу '*{query}*' найдено {count} терминов:\n\n")
+DESCRIPTION_RESULTS = Template("🔍 Под описание '*{query}*' подходят термины:\n\n")
+SEARCH_MORE_BUTTON = "➡️ Показать еще"
+SEARCH_EXPIRED = markdown("⌛ Результаты поиска устарели. Отправьте запрос еще раз.")
+HISTORY = markdown("📜 *Мои запросы*\n\nПоследние термины, которые вы смотрели:")
+HISTORY_EMPTY = markdown("📜 *Мои запросы*\n\n"
+                         "Здесь появятся термины, которые вы найдете. Напишите название термина, чтобы начать.")
+SUBSCRIPTION = Template(
+    "🔔 *Термин дня*\n\n"
+    "Каждый день в {time} я присылаю один парфюмерный термин с объяснением.\n\n"
+)
+SUBSCRIBED = markdown("✅ Вы подписаны на рассылку.")
+NOT_SUBSCRIBED = markdown("Вы пока не подписаны.")
+
+STATS = Template("""
+📊 *Статистика парфюмерного словаря*
+
+📚 Всего терминов: *{terms}*
+🏷️ Категорий: *{categories}*
+🔍 Поисков за неделю: *{searches}*
+👥 Пользователей: сегодня *{day}*, за 7 дней *{week}*, за 30 дней *{month}*
+💡 Ожидает модерации: *{pending}*
+
+🔥 *Популярные термины:*
+""")
+STATS_EMPTY = markdown("Пока нет данных о популярности терминов")
+
+
+def render_term_card(term: TermRecord, title: str = None) -> str:
+    """Текст карточки термина; title - уже готовая разметка (например, markdown("*Термин дня*"))"""
+    # Заголовок (для рассылки - с пометкой "Термин дня")
+    text = f"{title}\n\n" if title else ""
+    text += f"📚 *{escape(term.term)}*\n\n"
+
+    # Определение
+    text += f"📖 {escape(term.definition)}\n\n"
+
+    # Категория
+    if term.category_name:
+        text += f"🏷️ *Категория:* {escape(term.category_name)}\n"
+
+    # Примеры
+    if term.examples:
+        text += f"💡 *Примеры:* {escape(term.examples)}\n"
+
+    # Синонимы
+    if term.synonyms:
+        text += f"🔄 *Синонимы:* {escape(term.synonyms)}\n"
+
+    # Статистика использования
+    if term.usage_count > 0:
+        text += f"📊 *Запросов:* {term.usage_count}\n"
+
+    return text
+
+
+def render_search_results(query: str, terms: List[TermRecord], by_description: bool,
+                          total: Optional[int] = None, offset: int = 0) -> str:
+    """Страница найденных терминов; нумерация продолжается с offset + 1"""
+    if by_description:
+        text = DESCRIPTION_RESULTS.render(query=query)
+    else:
+        text = SEARCH_RESULTS.render(query=query, count=len(terms) if total is None else total)
+    for i, term in enumerate(terms, offset + 1):
+        text += f"{i}\\. *{escape(term.term)}*"
+        if term.category_name:
+            text += f" \\({escape(term.category_name)}\\)"
+        text += "\n"
+    return text
+
+
+def render_categories(categories: List[CategoryRecord], counts: Dict[int, int]) -> str:
+    """Список категорий с числом терминов"""
+    text = markdown("📚 *Категории терминов:*\n\n")
+    for category in categories:
+        text += f"🏷️ *{escape(category.name)}* \\({counts.get(category.id, 0)} терминов\\)\n"
+        if category.description:
+            text += f"   {escape(category.description)}\n"
+        text += "\n"
+    return text
+
+
+def render_category_terms(category: CategoryRecord, terms: List[TermRecord], limit: int = 15) -> str:
+    """Термины категории (не больше limit)"""
+    if not terms:
+        return f"📚 *{escape(category.name)}*\n\n" + markdown("В этой категории пока нет терминов.")
+    text = f"📚 *{escape(category.name)}* \\({len(terms)} терминов\\)\n\n"
+    for term in terms[:limit]:
+        text += f"• {escape(term.term)}\n"
+    if len(terms) > limit:
+        text += markdown(f"\n... и еще {len(terms) - limit} терминов")
+    return text
+
+
+def render_stats(stats: Dict, users: Dict[str, int], popular_limit: Optional[int] = None) -> str:
+    """Экран статистики: словарь, поиски, уникальные пользователи и популярные термины"""
+    text = STATS.render(terms=stats['total_terms'], categories=stats['total_categories'],
+                        searches=stats['searches_week'], pending=stats['pending_suggestions'], **users)
+    popular = stats.get('popular_terms') or []
+    if not popular:
+        return text + STATS_EMPTY
+    for i, term in enumerate(popular[:popular_limit], 1):
+        text += f"{i}\\. {escape(term['term'])} \\({term['usage_count']} запросов\\)\n"
+    return text
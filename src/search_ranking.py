@@ -0,0 +1,258 @@
+"""
+Единое ранжирование поиска по словарю
+Точное совпадение, начало названия, синонимы, подстрока, описание (BM25)
+и популярность складываются в одну оценку; лучшие термины выбираются
+частичной сортировкой, а "Показать еще" продолжает выдачу без уже показанных
+"""
+import bisect
+import itertools
+import math
+import time
+from collections import OrderedDict
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from term_record import TermRecord
+from text_normalizer import normalize, translit_key
+
+# Сигналы совпадения
+EXACT = 'exact'                # название целиком или его написание другим алфавитом
+SYNONYM = 'synonym'            # синоним целиком (тоже с транслитерацией)
+PREFIX = 'prefix'              # название или слово названия начинается с запроса
+SYNONYM_PART = 'synonym_part'  # запрос внутри синонима
+SUBSTRING = 'substring'        # запрос внутри названия
+DEFINITION = 'definition'      # BM25 по определению, примерам, синонимам и названию
+
+# Вес сигнала в оценке. Из названия и из синонимов берется по одному (сильнейшему)
+# сигналу; DEFINITION умножается на долю от оценки BM25 лучшего термина
+SIGNAL_WEIGHTS = {
+    EXACT: 100.0,
+    SYNONYM: 60.0,
+    PREFIX: 40.0,
+    DEFINITION: 30.0,
+    SYNONYM_PART: 20.0,
+    SUBSTRING: 15.0,
+}
+# Популярность: log(1 + запросов) как доля от самого популярного термина словаря
+POPULARITY_WEIGHT = 5.0
+
+# Коды сигналов названия и синонимов в массивах оценки (0 - совпадения нет)
+NAME_SIGNALS = (None, SUBSTRING, PREFIX, EXACT)
+SYNONYM_SIGNALS = (None, SYNONYM_PART, SYNONYM)
+_NAME_WEIGHTS = np.array([SIGNAL_WEIGHTS.get(signal, 0.0) for signal in NAME_SIGNALS])
+_SYNONYM_WEIGHTS = np.array([SIGNAL_WEIGHTS.get(signal, 0.0) for signal in SYNONYM_SIGNALS])
+
+
+class Hit(NamedTuple):
+    """Найденный термин: запись, оценка и самый весомый сигнал"""
+    record: TermRecord
+    score: float
+    signal: str
+
+
+def hit_key(hit: Hit) -> tuple:
+    """Порядок выдачи: оценка по убыванию, затем название и ID - ключ курсора"""
+    return -hit.score, hit.record.term, hit.record.id
+
+
+class SearchPage(NamedTuple):
+    """Страница выдачи: термины, всего найдено и курсор следующей страницы (None - это последняя)"""
+    hits: List[Hit]
+    total: int
+    next_key: Optional[tuple]
+
+    @property
+    def records(self) -> List[TermRecord]:
+        return [hit.record for hit in self.hits]
+
+    @property
+    def by_description(self) -> bool:
+        """Все термины найдены только по описанию"""
+        return bool(self.hits) and all(hit.signal == DEFINITION for hit in self.hits)
+
+
+class SearchRanker:
+    """Поиск по снимку словаря и индексу описаний с единой оценкой
+
+    Каждый термин, совпавший хоть по одному сигналу, получает сумму весов
+    сигналов: лексическое совпадение названия не отменяет сильного совпадения
+    по описанию, как это было со ступенями "первая непустая выигрывает".
+    Названия и синонимы проверяются по нормализованным полям снимка
+    (DictionarySnapshot.find_substring), описания - через DescriptionIndex
+    (definition_candidates лучших по BM25, без блокировок и запросов к базе).
+
+    Оценки считаются массивами numpy по позициям терминов в снимке: на
+    короткий запрос совпадают тысячи терминов, и цикл Python по ним стоил
+    дольше самого поиска. Из найденных limit лучших выбирает np.partition,
+    упорядочиваются только они; записи Hit строятся для показанных терминов.
+    """
+
+    def __init__(self, snapshots, descriptions=None, definition_candidates: int = 50):
+        self.snapshots = snapshots
+        self.descriptions = descriptions
+        self.definition_candidates = definition_candidates
+
+    def rank(self, query: str) -> List[Hit]:
+        """Все найденные термины с оценками (без упорядочивания)"""
+        scored = self._score(query)
+        return [self._hit(scored, position) for position in scored.matched]
+
+    def search(self, query: str, limit: int = 10, after: tuple = None, exclude: Iterable[int] = ()) -> SearchPage:
+        """Страница из limit лучших терминов
+
+        after - ключ последнего показанного термина (hit_key): продолжение
+        выдачи по тому же снимку. exclude - ID уже показанных терминов: они
+        пропускаются, и выдача продолжается и после публикации нового снимка,
+        где оценки (популярность) уже другие.
+        """
+        scored = self._score(query)
+        name_rank = scored.columns.name_rank
+        positions = scored.matched
+        excluded = [position for position in map(scored.snapshot.position, exclude) if position is not None]
+        if excluded:
+            positions = positions[~np.isin(positions, excluded)]
+        order = -scored.scores[positions]
+        if after is not None:
+            # Ключ (-оценка, название, ID) больше курсора; название и ID сравниваются по месту в by_name
+            rank = bisect.bisect_right(scored.columns.by_name, (after[1], after[2]))
+            later = (order > after[0]) | ((order == after[0]) & (name_rank[positions] >= rank))
+            positions, order = positions[later], order[later]
+
+        # Один лишний термин показывает, есть ли следующая страница
+        count = limit + 1
+        if len(positions) > count:
+            best = order <= np.partition(order, count - 1)[count - 1]
+            positions, order = positions[best], order[best]
+        top = positions[np.lexsort((name_rank[positions], order))[:count]]
+        hits = [self._hit(scored, position) for position in top[:limit]]
+        next_key = hit_key(hits[-1]) if len(top) > limit else None
+        return SearchPage(hits, len(scored.matched), next_key)
+
+    def _score(self, query: str) -> '_Scored':
+        """Сигналы совпадения и оценки терминов снимка; matched - позиции найденных"""
+        snapshot = self.snapshots.current
+        columns = snapshot.ranking_columns()
+        size = len(snapshot.ordered)
+        name = np.zeros(size, dtype=np.int8)
+        synonym = np.zeros(size, dtype=np.int8)
+        definition = np.zeros(size)
+        query_norm = normalize(query)
+        if not query_norm:
+            return _Scored(snapshot, columns, name, synonym, definition, definition, np.flatnonzero(name))
+        query_key = translit_key(query)
+
+        # Сильнейший сигнал названия и синонимов каждого термина
+        in_names, in_synonyms = snapshot.find_substring(query_norm)
+        name[in_names] = NAME_SIGNALS.index(SUBSTRING)
+        name[snapshot.find_word_start(query_norm)] = NAME_SIGNALS.index(PREFIX)
+        synonym[in_synonyms] = SYNONYM_SIGNALS.index(SYNONYM_PART)
+        for term_id in itertools.chain(snapshot.names.get(query_norm, ()), snapshot.keys.get(query_key, ())):
+            name[snapshot.position(term_id)] = NAME_SIGNALS.index(EXACT)
+        for term_id in snapshot.synonym_keys.get(query_key, ()):
+            synonym[snapshot.position(term_id)] = SYNONYM_SIGNALS.index(SYNONYM)
+
+        # Доля от оценки BM25 лучшего по описанию термина
+        if self.descriptions is not None:
+            ranked = self.descriptions.search_ids(query, self.definition_candidates)
+            if ranked and ranked[0][1] > 0:
+                best = ranked[0][1]
+                for term_id, score in ranked:
+                    position = snapshot.position(term_id)
+                    # Индекс описаний уже знает термин, а снимок еще нет (или наоборот для удаленного)
+                    if position is not None:
+                        definition[position] = score / best
+
+        top_usage = snapshot.ordered[0].record.usage_count if snapshot.ordered else 0
+        popularity = POPULARITY_WEIGHT / math.log1p(top_usage) if top_usage > 0 else 0.0
+        scores = (_NAME_WEIGHTS[name] + _SYNONYM_WEIGHTS[synonym] + SIGNAL_WEIGHTS[DEFINITION] * definition
+                  + popularity * columns.popularity)
+        matched = np.flatnonzero(name | synonym | (definition > 0))
+        return _Scored(snapshot, columns, name, synonym, definition, scores, matched)
+
+    @staticmethod
+    def _hit(scored: '_Scored', position) -> Hit:
+        """Запись выдачи по позиции в снимке: оценка и самый весомый сигнал"""
+        signals = [(SIGNAL_WEIGHTS[signal], signal)
+                   for signal in (NAME_SIGNALS[scored.name[position]], SYNONYM_SIGNALS[scored.synonym[position]])
+                   if signal]
+        if scored.definition[position]:
+            signals.append((SIGNAL_WEIGHTS[DEFINITION] * scored.definition[position], DEFINITION))
+        return Hit(scored.snapshot.ordered[position].record, float(scored.scores[position]), max(signals)[1])
+
+
+class _Scored(NamedTuple):
+    """Сигналы одного запроса к одному снимку - массивы по позициям терминов в снимке"""
+    snapshot: object
+    columns: object
+    name: np.ndarray         # код из NAME_SIGNALS
+    synonym: np.ndarray      # код из SYNONYM_SIGNALS
+    definition: np.ndarray   # доля от оценки BM25 лучшего термина
+    scores: np.ndarray
+    matched: np.ndarray
+
+
+class Cursor(NamedTuple):
+    """Продолжение выдачи для кнопки "Показать еще"
+
+    Хранит ID показанных терминов, а не оценку последнего: между страницами
+    снимок может смениться (правка словаря, обновление счетчиков запросов),
+    и оценка, посчитанная по прежнему снимку, с новыми уже не сравнима -
+    термины пропускались бы или показывались дважды.
+    """
+    user_id: int
+    query: str
+    seen: Tuple[int, ...]   # ID уже показанных терминов по порядку
+
+    @property
+    def shown(self) -> int:
+        """Сколько терминов уже показано - с этого номера продолжается нумерация"""
+        return len(self.seen)
+
+
+class SearchCursors:
+    """Курсоры "Показать еще" в памяти с вытеснением
+
+    В callback_data кнопки попадает только номер курсора: запрос может не
+    уместиться в 64 байта, которые Telegram допускает для кнопки. Курсор
+    старше idle_ttl секунд забывается, а всего в памяти не больше max_cursors
+    курсоров - старые вытесняются с начала словаря, как истории в UserHistory.
+    Обновления одного пользователя в режиме масштабирования попадают в один процесс-обработчик вместе с курсорами.
+    """
+
+    def __init__(self, idle_ttl: float = 1800, max_cursors: int = 10000):
+        self.idle_ttl = idle_ttl
+        self.max_cursors = max_cursors
+        self._cursors: 'OrderedDict[int, Tuple[Cursor, float]]' = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def save(self, cursor: Cursor, now: Optional[float] = None) -> int:
+        """Запоминает курсор; возвращает его номер для callback_data"""
+        if now is None:
+            now = time.monotonic()
+        cursor_id = next(self._ids)
+        self._cursors[cursor_id] = (cursor, now)
+        self._evict_idle(now)
+        return cursor_id
+
+    def get(self, user_id: int, cursor_id: int, now: Optional[float] = None) -> Optional[Cursor]:
+        """Курсор пользователя или None, если он забыт (или кнопку нажал другой пользователь)"""
+        if now is None:
+            now = time.monotonic()
+        self._evict_idle(now)
+        item = self._cursors.get(cursor_id)
+        if item is None or item[0].user_id != user_id:
+            return None
+        return item[0]
+
+    def _evict_idle(self, now: float):
+        """Удаляет устаревшие курсоры"""
+        cursors = self._cursors
+        while cursors:
+            _, saved_at = next(iter(cursors.values()))
+            if len(cursors) <= self.max_cursors and now - saved_at < self.idle_ttl:
+                break
+            cursors.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._cursors)
@@ -0,0 +1,174 @@
+"""
+Выгрузка журнала поисков и предложений терминов в Google Sheets
+Фоновая задача читает новые записи из базы по сохраненной позиции и
+дописывает их в таблицу пачками: один вызов API на пачку строк
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from gspread.exceptions import WorksheetNotFound
+from telegram.ext import ContextTypes
+
+from storage_backend import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа Sheets API, при которых запрос стоит повторить
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class SheetFeed:
+    """Лист таблицы и источник его строк в базе"""
+
+    def __init__(self, title: str, cursor: str, reader: str, header: List[str]):
+        self.title = title
+        self.cursor = cursor
+        self.reader = reader
+        self.header = header
+
+
+FEEDS = (
+    SheetFeed('Поиски', 'sheets_searches_id', 'get_search_log',
+              ['id', 'время (UTC)', 'user_id', 'запрос', 'найден', 'term_id']),
+    SheetFeed('Предложения', 'sheets_suggestions_id', 'get_suggestion_log',
+              ['id', 'время (UTC)', 'user_id', 'username', 'термин', 'определение', 'категория']),
+)
+
+
+def is_transient(error: Exception) -> bool:
+    """Временная ошибка: сеть (в т.ч. requests) или код ответа из RETRY_STATUSES"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, OSError)
+
+
+def open_spreadsheet(spreadsheet_id: str, credentials: str):
+    """Открывает таблицу от имени сервисного аккаунта (JSON ключа или путь к файлу)"""
+    import gspread
+
+    if os.path.exists(credentials):
+        client = gspread.service_account(filename=credentials)
+    else:
+        client = gspread.service_account_from_dict(json.loads(credentials))
+    return client.open_by_key(spreadsheet_id)
+
+
+class SheetsSync:
+    """Инкрементальная выгрузка журналов в таблицу
+
+    Для каждого листа в job_cursors хранится ID последней выгруженной записи.
+    Позиция сдвигается только после успешной записи пачки, а первая колонка
+    листа - ID записи, поэтому повторная выгрузка после сбоя распознается:
+    - при первом запуске процесса позиция сверяется с последним ID на листе
+      (процесс мог упасть между записью пачки и сохранением позиции);
+    - перед повтором неудачной записи строки, уже попавшие на лист
+      (ответ потерян по таймауту), отбрасываются.
+
+    Строки пишутся с value_input_option='RAW': запрос пользователя вида
+    "=IMPORTXML(...)" сохраняется как текст, а не как формула.
+    """
+
+    def __init__(self, db: StorageBackend, spreadsheet_factory: Callable, batch_size: int = 500,
+                 max_attempts: int = 5, backoff: float = 1.0, sleep: Callable[[float], None] = time.sleep):
+        self.db = db
+        self.spreadsheet_factory = spreadsheet_factory
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sleep = sleep
+        self._spreadsheet = None
+        self._worksheets: Dict[str, object] = {}
+
+    def sync(self) -> Dict[str, int]:
+        """Выгружает новые записи всех листов; возвращает число выгруженных строк по листам"""
+        if self._spreadsheet is None:
+            self._spreadsheet = self._with_retry(self.spreadsheet_factory)
+        return {feed.title: self._sync_feed(feed) for feed in FEEDS}
+
+    def _sync_feed(self, feed: SheetFeed) -> int:
+        if feed.title not in self._worksheets:
+            self._worksheets[feed.title] = self._open_worksheet(feed)
+        worksheet = self._worksheets[feed.title]
+
+        exported = 0
+        reader = getattr(self.db, feed.reader)
+        while True:
+            rows = reader(after_id=self.db.get_cursor(feed.cursor), limit=self.batch_size)
+            if not rows:
+                return exported
+            self._append(worksheet, [list(row) for row in rows])
+            self.db.set_cursor(feed.cursor, rows[-1][0])
+            exported += len(rows)
+
+    def _open_worksheet(self, feed: SheetFeed):
+        """Находит или создает лист и сверяет позицию с последним ID на листе"""
+        try:
+            worksheet = self._with_retry(self._spreadsheet.worksheet, feed.title)
+        except WorksheetNotFound:
+            worksheet = self._with_retry(self._spreadsheet.add_worksheet, feed.title, 1000, len(feed.header))
+
+        last_id = self._with_retry(self._last_sheet_id, worksheet)
+        if last_id is None:
+            self._with_retry(worksheet.append_rows, [feed.header], value_input_option='RAW')
+        elif last_id > self.db.get_cursor(feed.cursor):
+            logger.warning("Лист '%s' опережает позицию выгрузки, продолжаем с ID %s", feed.title, last_id)
+            self.db.set_cursor(feed.cursor, last_id)
+        return worksheet
+
+    @staticmethod
+    def _last_sheet_id(worksheet) -> Optional[int]:
+        """Наибольший ID в первой колонке; None - лист пуст (нет даже заголовка)"""
+        values = worksheet.col_values(1)
+        if not values:
+            return None
+        return max((int(value) for value in values if str(value).isdigit()), default=0)
+
+    def _append(self, worksheet, rows: List[List]):
+        """Дописывает пачку строк одним вызовом с повторами без дублей"""
+        for attempt in range(self.max_attempts):
+            try:
+                if attempt:
+                    # Предыдущая попытка могла дойти до таблицы, потеряв ответ
+                    last_id = self._last_sheet_id(worksheet) or 0
+                    rows = [row for row in rows if row[0] > last_id]
+                    if not rows:
+                        return
+                worksheet.append_rows(rows, value_input_option='RAW')
+                return
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_attempts - 1:
+                    raise
+                self._pause(attempt, e)
+
+    def _with_retry(self, func: Callable, *args, **kwargs):
+        """Вызов API с повторами при временных ошибках"""
+        for attempt in range(self.max_attempts):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_attempts - 1:
+                    raise
+                self._pause(attempt, e)
+
+    def _pause(self, attempt: int, error: Exception):
+        # Экспоненциальная пауза со случайной добавкой, чтобы не повторять запросы синхронно
+        delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+        logger.warning("Sheets API: %s, повтор через %.1f с", error, delay)
+        self.sleep(delay)
+
+    async def job_callback(self, context: ContextTypes.DEFAULT_TYPE):
+        """Задача JobQueue: выгрузка в отдельном потоке, чтобы не блокировать event loop"""
+        try:
+            exported = await asyncio.to_thread(self.sync)
+        except Exception as e:
+            # Позиция не сдвинута - недовыгруженные записи уйдут при следующем запуске
+            logger.error("Ошибка выгрузки в Google Sheets: %s", e)
+            return
+        if any(exported.values()):
+            logger.info("Выгружено в Google Sheets: %s", exported)
@@ -0,0 +1,127 @@
+"""
+Плавная остановка бота по SIGTERM
+Порядок: прекратить прием обновлений, дождаться обработчиков (с ограничением
+по времени), дописать очереди и журналы, закрыть базу; длительность каждого
+этапа попадает в лог
+"""
+import asyncio
+import functools
+import logging
+import signal
+import time
+from typing import Callable, List, Optional, Tuple
+
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+
+class GracefulShutdown:
+    """Координатор остановки процесса-лидера
+
+    Render посылает SIGTERM при каждом деплое и через 30 секунд завершает
+    процесс принудительно. Обработчик сигнала останавливает run_polling/run_webhook
+    штатным путем PTB (updater.stop -> Application.stop, который дорабатывает
+    очередь обновлений и ждет задач JobQueue). Долгие задачи, обернутые
+    в cancellable(), отменяются, если не успели завершиться за drain_timeout:
+    они рассчитаны на продолжение после перезапуска.
+
+    Этапы после ожидания обработчиков регистрируются через add_step и
+    выполняются по порядку в run_steps(); ошибка одного этапа не отменяет
+    остальные. Этапы с ожиданием берут срок из remaining(), чтобы вся остановка
+    уложилась в total_timeout с момента сигнала.
+    """
+
+    def __init__(self, drain_timeout: float = 15.0, total_timeout: float = 25.0):
+        self.drain_timeout = drain_timeout
+        self.total_timeout = total_timeout
+        self.signaled_at: Optional[float] = None
+        self.phases: List[Tuple[str, float, bool]] = []
+        self._steps: List[Tuple[str, Callable]] = []
+        self._on_signal: List[Callable] = []
+        self._cancellable = {}
+        self._watchdog = None
+        self._last_mark: Optional[float] = None
+
+    @property
+    def stopping(self) -> bool:
+        return self.signaled_at is not None
+
+    def remaining(self, minimum: float = 1.0) -> float:
+        """Сколько секунд осталось от общего бюджета остановки (не меньше minimum)"""
+        if self.signaled_at is None:
+            return self.total_timeout
+        return max(minimum, self.signaled_at + self.total_timeout - time.monotonic())
+
+    def install(self, application: Application, on_signal: Callable = None):
+        """Перехватывает SIGTERM в event loop приложения (вызывается из post_init)"""
+        if on_signal:
+            self._on_signal.append(on_signal)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._handle_signal, application)
+
+    def _handle_signal(self, application: Application):
+        if self.stopping:
+            return
+        self.signaled_at = self._last_mark = time.monotonic()
+        logger.info("Получен SIGTERM: останавливаем прием обновлений")
+        for callback in self._on_signal:
+            callback()
+        self._watchdog = asyncio.get_running_loop().create_task(self._cancel_after_deadline())
+        application.stop_running()
+
+    async def _cancel_after_deadline(self):
+        await asyncio.sleep(self.drain_timeout)
+        for task, name in list(self._cancellable.items()):
+            logger.warning("Задача %s не завершилась за %s с и будет прервана", name, self.drain_timeout)
+            task.cancel()
+
+    def cancellable(self, callback: Callable) -> Callable:
+        """Оборачивает задачу JobQueue, которую можно прервать при остановке"""
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            task = asyncio.current_task()
+            self._cancellable[task] = callback.__qualname__
+            try:
+                return await callback(*args, **kwargs)
+            except asyncio.CancelledError:
+                if not self.stopping:
+                    raise
+                logger.info("Задача %s прервана остановкой и продолжится после перезапуска", callback.__qualname__)
+            finally:
+                self._cancellable.pop(task, None)
+        return wrapper
+
+    def drained(self):
+        """Обработчики и задачи завершены (вызывается из post_stop, пока event loop работает)"""
+        if self._watchdog:
+            self._watchdog.cancel()
+            self._watchdog = None
+        self.mark('drain')
+
+    def mark(self, phase: str, ok: bool = True):
+        """Завершает этап: длительность с предыдущей отметки"""
+        now = time.monotonic()
+        if self._last_mark is None:
+            self._last_mark = now
+        self.phases.append((phase, now - self._last_mark, ok))
+        self._last_mark = now
+
+    def add_step(self, name: str, func: Callable):
+        """Регистрирует этап остановки (выполняется в порядке регистрации)"""
+        self._steps.append((name, func))
+
+    def run_steps(self):
+        """Выполняет зарегистрированные этапы, замеряя каждый"""
+        for name, func in self._steps:
+            try:
+                func()
+                self.mark(name)
+            except Exception as e:
+                logger.error("Ошибка этапа остановки %s: %s", name, e)
+                self.mark(name, ok=False)
+
+    def report(self) -> str:
+        """Итог остановки: этапы с длительностью и общее время с момента сигнала"""
+        parts = [f"{name} {seconds * 1000:.0f} мс{'' if ok else ' (ошибка)'}" for name, seconds, ok in self.phases]
+        total = f", всего {time.monotonic() - self.signaled_at:.2f} с" if self.signaled_at else ""
+        return "; ".join(parts) + total
@@ -0,0 +1,298 @@
+"""
+Интерфейс хранилища словаря
+Позволяет запускать бота на SQLite или на серверной СУБД без изменения обработчиков
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from term_record import CategoryRecord, TermRecord
+
+
+# Поля, которые можно изменить через update_term и update_category
+TERM_FIELDS = ('term', 'definition', 'category_name', 'examples', 'synonyms')
+CATEGORY_FIELDS = ('name', 'description')
+# Обязательные поля нельзя очистить
+REQUIRED_FIELDS = ('term', 'definition', 'name')
+
+# Журнал изменений словаря: сущности и действия
+TERM = 'term'
+CATEGORY = 'category'
+CREATE, UPDATE, DELETE, MERGE = 'create', 'update', 'delete', 'merge'
+
+# Позиция сводок неуспешных поисков в журнале поисков (сохраняется вместе со сводками)
+MISS_CURSOR = 'missed_queries_search_id'
+
+
+def check_fields(fields: Dict[str, Optional[str]], allowed: Tuple[str, ...]) -> Dict[str, Optional[str]]:
+    """Проверяет изменяемые поля; пустые строки считаются очисткой поля (None)"""
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    fields = {name: (value.strip() or None) if isinstance(value, str) else value for name, value in fields.items()}
+    for name in REQUIRED_FIELDS:
+        if name in fields and not fields[name]:
+            raise ValueError(f"Поле {name} не может быть пустым")
+    return fields
+
+
+class StorageBackend(ABC):
+    """Базовый класс хранилища терминов, категорий, статистики и предложений"""
+
+    @abstractmethod
+    def add_category(self, name: str, description: str = None) -> int:
+        """Добавляет новую категорию"""
+
+    @abstractmethod
+    def get_categories(self) -> List[CategoryRecord]:
+        """Получает все категории"""
+
+    @abstractmethod
+    def get_category(self, category_id: int) -> Optional[CategoryRecord]:
+        """Получает категорию по ID"""
+
+    @abstractmethod
+    def get_category_terms(self, category_id: int) -> List[TermRecord]:
+        """Получает термины категории, отсортированные по названию
+
+        Поля definition и examples могут загружаться лениво при первом обращении.
+        """
+
+    @abstractmethod
+    def count_terms_by_category(self) -> Dict[int, int]:
+        """Количество терминов в каждой категории одним запросом"""
+
+    @abstractmethod
+    def add_term(self, term: str, definition: str, category_name: str = None,
+                 examples: str = None, synonyms: str = None) -> int:
+        """Добавляет новый термин"""
+
+    @abstractmethod
+    def update_term(self, term_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """Изменяет поля термина (ключи из TERM_FIELDS, None - очистить поле)
+
+        Возвращает ревизию изменения или None, если термина нет; ValueError,
+        если название занято другим термином или обязательное поле пустое.
+        """
+
+    @abstractmethod
+    def delete_term(self, term_id: int) -> Optional[int]:
+        """Удаляет термин вместе с производными данными (ключи, соседи, истории);
+        журнал поисков сохраняется без ссылки на термин. Ревизия или None"""
+
+    @abstractmethod
+    def merge_terms(self, source_id: int, target_id: int) -> Optional[int]:
+        """Сливает термин source в target: название и синонимы source становятся
+        синонимами target, переносятся счетчик, поиски, истории и совместные
+        поиски; source удаляется. Ревизия или None, если одного из терминов нет"""
+
+    @abstractmethod
+    def update_category(self, category_id: int, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """Изменяет поля категории (ключи из CATEGORY_FIELDS); ревизия или None"""
+
+    @abstractmethod
+    def delete_category(self, category_id: int) -> Optional[int]:
+        """Удаляет категорию; ее термины остаются без категории. Ревизия или None"""
+
+    @abstractmethod
+    def merge_categories(self, source_id: int, target_id: int) -> Optional[int]:
+        """Переносит термины категории source в target и удаляет source; ревизия или None"""
+
+    @abstractmethod
+    def get_revision(self) -> int:
+        """Текущая ревизия словаря (номер последнего изменения; 0 - изменений не было)"""
+
+    @abstractmethod
+    def get_changes(self, after_revision: int = 0, limit: int = 1000) -> List[Tuple[int, str, str, int, Optional[int]]]:
+        """Изменения словаря после ревизии по возрастанию:
+        (ревизия, сущность TERM/CATEGORY, действие CREATE/UPDATE/DELETE/MERGE, ID, ID цели слияния)"""
+
+    @abstractmethod
+    def search_terms(self, query: str, limit: int = 10, definitions: bool = True) -> List[TermRecord]:
+        """Поиск терминов с разными стратегиями
+
+        definitions=False отключает последний уровень - поиск подстроки в определениях
+        (бот вместо него использует поиск по описанию).
+        """
+
+    @abstractmethod
+    def get_terms_by_ids(self, term_ids: List[int]) -> List[TermRecord]:
+        """Термины в порядке переданных ID (без текстов); несуществующие ID пропускаются"""
+
+    @abstractmethod
+    def get_term_patterns(self, after_id: int = 0) -> List[Tuple[int, str, Optional[str]]]:
+        """Названия и синонимы терминов с ID больше after_id: (id, term, synonyms)"""
+
+    @abstractmethod
+    def get_term_documents(self, after_id: int = 0) -> List[Tuple[int, str, str, Optional[str], Optional[str]]]:
+        """Тексты терминов с ID больше after_id: (id, term, definition, examples, synonyms)"""
+
+    @abstractmethod
+    def get_term_by_id(self, term_id: int) -> Optional[TermRecord]:
+        """Получает термин по ID"""
+
+    @abstractmethod
+    def get_random_term(self) -> Optional[TermRecord]:
+        """Получает случайный термин"""
+
+    @abstractmethod
+    def increment_usage(self, term_id: int):
+        """Увеличивает счетчик использования термина"""
+
+    @abstractmethod
+    def log_search(self, user_id: int, query: str, term_id: int = None, found: bool = False):
+        """Логирует поисковый запрос"""
+
+    @abstractmethod
+    def add_suggestion(self, user_id: int, username: str, term: str, definition: str,
+                       category: str = None, examples: str = None) -> int:
+        """Добавляет предложение нового термина от пользователя"""
+
+    @abstractmethod
+    def get_pending_suggestions(self) -> List[Dict]:
+        """Получает все ожидающие модерации предложения"""
+
+    @abstractmethod
+    def get_cursor(self, name: str) -> int:
+        """Позиция фоновой задачи (например, последний обработанный ID); 0 если не задана"""
+
+    @abstractmethod
+    def set_cursor(self, name: str, value: int):
+        """Сохраняет позицию фоновой задачи"""
+
+    @abstractmethod
+    def get_user_sketches(self, since_day: str) -> Dict[str, bytes]:
+        """Сводки уникальных пользователей за дни начиная с since_day ('YYYY-MM-DD'): день -> регистры"""
+
+    @abstractmethod
+    def merge_user_sketches(self, sketches: Dict[str, bytes], keep_since: str):
+        """Объединяет сводки пользователей с сохраненными (максимум регистров);
+        сводки за дни раньше keep_since удаляются"""
+
+    @abstractmethod
+    def get_miss_sketches(self, since_day: str) -> Dict[str, str]:
+        """Сводки неуспешных поисков за дни начиная с since_day ('YYYY-MM-DD'): день -> JSON"""
+
+    @abstractmethod
+    def save_miss_sketches(self, sketches: Dict[str, str], cursor: int, keep_since: str):
+        """Сохраняет сводки по дням и позицию MISS_CURSOR одной транзакцией;
+        сводки за дни раньше keep_since удаляются"""
+
+    @abstractmethod
+    def get_term_searches(self, after_id: int = 0, since: float = None,
+                          limit: int = None) -> List[Tuple[int, int, int, float]]:
+        """Успешные поиски с ID больше after_id (и не раньше since, unix-время):
+        (id, user_id, term_id, время) по возрастанию ID"""
+
+    @abstractmethod
+    def get_search_log(self, after_id: int = 0, limit: int = 500) -> List[Tuple]:
+        """Все поиски с ID больше after_id по возрастанию ID:
+        (id, время UTC 'YYYY-MM-DD HH:MM:SS', user_id, query, found, term_id)"""
+
+    @abstractmethod
+    def get_suggestion_log(self, after_id: int = 0, limit: int = 500) -> List[Tuple]:
+        """Предложения терминов с ID больше after_id по возрастанию ID:
+        (id, время UTC, user_id, username, термин, определение, категория)"""
+
+    @abstractmethod
+    def add_cooccurrences(self, pairs: List[Tuple[int, int, int]]):
+        """Прибавляет счетчики совместных поисков: тройки (term_a, term_b, count), term_a < term_b"""
+
+    @abstractmethod
+    def get_cooccurrences(self, term_ids: List[int]) -> List[Tuple[int, int, int]]:
+        """Счетчики совместных поисков, в которых участвует любой из терминов"""
+
+    @abstractmethod
+    def get_term_catalog(self) -> List[Tuple[int, Optional[int], int]]:
+        """Все термины без текстов: (id, category_id, usage_count)"""
+
+    @abstractmethod
+    def replace_neighbors(self, neighbors: Dict[int, List[Tuple[int, float]]]):
+        """Заменяет списки связанных терминов: {term_id: [(neighbor_id, score), ...]} по убыванию score"""
+
+    @abstractmethod
+    def get_related_terms(self, term_id: int, limit: int = 4) -> List[Tuple[int, str]]:
+        """Связанные термины из готовой таблицы: (id, название)"""
+
+    @abstractmethod
+    def add_history(self, user_id: int, term_id: int, viewed_at: float, keep: int = 10):
+        """Добавляет термин в историю пользователя (повторный просмотр поднимает его наверх)
+        и оставляет только keep последних терминов"""
+
+    @abstractmethod
+    def get_history(self, user_id: int, limit: int = 10) -> List[Tuple[int, str]]:
+        """История пользователя от новых к старым: (id, название)"""
+
+    @abstractmethod
+    def add_subscriber(self, chat_id: int) -> bool:
+        """Подписывает чат на термин дня; False если подписка уже была"""
+
+    @abstractmethod
+    def remove_subscriber(self, chat_id: int) -> bool:
+        """Отписывает чат от термина дня; False если подписки не было"""
+
+    @abstractmethod
+    def is_subscribed(self, chat_id: int) -> bool:
+        """Подписан ли чат на термин дня"""
+
+    @abstractmethod
+    def get_broadcast(self, broadcast_date: str) -> Optional[Dict]:
+        """Получает рассылку за указанную дату (YYYY-MM-DD)"""
+
+    @abstractmethod
+    def get_unfinished_broadcast(self) -> Optional[Dict]:
+        """Последняя по дате незавершенная рассылка (None - все завершены)"""
+
+    @abstractmethod
+    def create_broadcast(self, broadcast_date: str, term_id: Optional[int], text: str, parse_mode: str) -> Dict:
+        """Создает рассылку с заранее подготовленным текстом и его режимом разметки
+
+        Текст отправляется с тем режимом, в котором подготовлен: рассылка,
+        продолженная после смены разметки бота, не ломается.
+        """
+
+    @abstractmethod
+    def get_pending_recipients(self, broadcast_id: int, limit: int = 100) -> List[int]:
+        """Подписчики, которым рассылка еще не доставлена (по возрастанию chat_id)"""
+
+    @abstractmethod
+    def record_deliveries(self, broadcast_id: int, deliveries: List[Tuple[int, str]]):
+        """Сохраняет результаты отправки: пары (chat_id, статус)"""
+
+    @abstractmethod
+    def finish_broadcast(self, broadcast_id: int):
+        """Отмечает рассылку завершенной"""
+
+    @abstractmethod
+    def get_stats(self) -> Dict:
+        """Получает статистику базы данных"""
+
+    @abstractmethod
+    def ping(self):
+        """Минимальный запрос к базе для проверки готовности; исключение, если база недоступна"""
+
+    def get_database_stats(self) -> Dict:
+        """Алиас для get_stats() для совместимости"""
+        return self.get_stats()
+
+    def close(self):
+        """Освобождает ресурсы хранилища"""
+
+
+def create_backend(database: str = None, pool_size: int = None, loop=None) -> StorageBackend:
+    """Создает хранилище согласно настройке STORAGE_BACKEND
+
+    database - файл SQLite или схема PostgreSQL словаря (по умолчанию DATABASE_PATH
+    и схема из DATABASE_URL), pool_size - предел соединений пула PostgreSQL,
+    loop - общий event loop пулов PostgreSQL нескольких словарей процесса.
+    """
+    from config import STORAGE_BACKEND, DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+
+    if STORAGE_BACKEND == 'postgres':
+        from postgres_backend import PostgresBackend
+        max_size = pool_size or DB_POOL_MAX_SIZE
+        return PostgresBackend(DATABASE_URL, min_size=min(DB_POOL_MIN_SIZE, max_size), max_size=max_size,
+                               schema=database, loop=loop)
+    if STORAGE_BACKEND == 'sqlite':
+        from database import PerfumeDatabase
+        return PerfumeDatabase(database)
+    raise ValueError(f"Неизвестное хранилище: {STORAGE_BACKEND}")
@@ -0,0 +1,197 @@
+"""
+Прием предложений новых терминов
+После кнопки "💡 Предложить термин" сообщения пользователя разбираются как
+предложение, а не как поиск. Черновики живут только в памяти процесса
+и в базу попадают уже готовыми предложениями
+"""
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from telegram import Message
+from telegram.ext import filters
+
+from storage_backend import StorageBackend
+from text_normalizer import normalize
+
+# Ограничения полей предложения (символов)
+TERM_MIN_LENGTH = 2
+TERM_MAX_LENGTH = 100
+DEFINITION_MIN_LENGTH = 10
+DEFINITION_MAX_LENGTH = 1000
+CATEGORY_MAX_LENGTH = 50
+EXAMPLES_MAX_LENGTH = 1000
+
+# Шаги разговора
+AWAIT_TEXT = 'text'              # ждем сообщение целиком (или только название)
+AWAIT_DEFINITION = 'definition'  # название уже получено, ждем объяснение
+
+
+class SuggestionError(ValueError):
+    """Сообщение не подходит как предложение; текст ошибки показывается пользователю"""
+
+
+class Suggestion(NamedTuple):
+    """Готовое предложение: поля в порядке аргументов add_suggestion после имени пользователя"""
+    term: str
+    definition: str
+    category: Optional[str] = None
+    examples: Optional[str] = None
+
+
+class Draft:
+    """Незаконченное предложение одного пользователя"""
+    __slots__ = ('step', 'term', 'touched_at')
+
+    def __init__(self, touched_at: float):
+        self.step = AWAIT_TEXT
+        self.term = None
+        self.touched_at = touched_at
+
+
+def _check_length(value: str, name: str, min_length: int, max_length: int):
+    if len(value) < min_length:
+        raise SuggestionError(f"{name} слишком короткое (нужно хотя бы {min_length} символов)")
+    if len(value) > max_length:
+        raise SuggestionError(f"{name} слишком длинное (не больше {max_length} символов)")
+
+
+def parse_term(line: str) -> str:
+    """Проверяет название термина"""
+    term = ' '.join(line.split()).strip('"«»')
+    if term.startswith('/'):
+        raise SuggestionError("Название термина не может начинаться с /")
+    _check_length(term, "Название", TERM_MIN_LENGTH, TERM_MAX_LENGTH)
+    return term
+
+
+def parse_suggestion(text: str, term: str = None) -> Suggestion:
+    """Разбирает сообщение с предложением
+
+    Строки по порядку: название, объяснение, категория, примеры (все оставшиеся
+    строки). Если название уже известно (term), сообщение начинается с объяснения.
+    Пустые строки пропускаются.
+    """
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    if term is None:
+        if len(lines) < 2:
+            raise SuggestionError("Нужны хотя бы две строки: название и объяснение")
+        term = parse_term(lines.pop(0))
+    if not lines:
+        raise SuggestionError("Не хватает объяснения термина")
+
+    definition = lines[0]
+    _check_length(definition, "Объяснение", DEFINITION_MIN_LENGTH, DEFINITION_MAX_LENGTH)
+    if normalize(definition) == normalize(term):
+        raise SuggestionError("Объяснение повторяет название")
+
+    category = lines[1] if len(lines) > 1 else None
+    if category:
+        _check_length(category, "Название категории", 1, CATEGORY_MAX_LENGTH)
+    examples = '\n'.join(lines[2:]) or None
+    if examples:
+        _check_length(examples, "Примеры", 1, EXAMPLES_MAX_LENGTH)
+    return Suggestion(term, definition, category, examples)
+
+
+class SuggestionIntake:
+    """Разговоры о предложениях: черновики пользователей в памяти с вытеснением
+
+    Черновик пользователя, не писавшего боту idle_ttl секунд, забывается,
+    а всего в памяти не больше max_drafts черновиков - старые вытесняются
+    с начала словаря, как истории в UserHistory. В режиме масштабирования
+    обновления одного пользователя всегда попадают в один процесс-обработчик,
+    поэтому черновики между процессами не делятся.
+    """
+
+    def __init__(self, db: StorageBackend, idle_ttl: float = 900, max_drafts: int = 10000):
+        self.db = db
+        self.idle_ttl = idle_ttl
+        self.max_drafts = max_drafts
+        self._drafts: 'OrderedDict[int, Draft]' = OrderedDict()
+        self.filter = ActiveIntakeFilter(self)
+
+    def start(self, user_id: int, now: Optional[float] = None):
+        """Начинает прием предложения (заново, если черновик уже был)"""
+        if now is None:
+            now = time.monotonic()
+        self._drafts.pop(user_id, None)
+        self._drafts[user_id] = Draft(now)
+        self._evict_idle(now)
+
+    def cancel(self, user_id: int) -> bool:
+        """Забывает черновик; True - черновик был"""
+        return self._drafts.pop(user_id, None) is not None
+
+    def active(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Ждет ли бот от пользователя предложение"""
+        if now is None:
+            now = time.monotonic()
+        self._evict_idle(now)
+        return user_id in self._drafts
+
+    def pending_term(self, user_id: int) -> Optional[str]:
+        """Название из черновика, если объяснение еще не прислано"""
+        draft = self._drafts.get(user_id)
+        return draft.term if draft else None
+
+    def submit(self, user_id: int, text: str, now: Optional[float] = None) -> Optional[Suggestion]:
+        """Принимает очередное сообщение пользователя
+
+        Возвращает готовое предложение (черновик при этом забывается) или None,
+        если пришло только название и бот ждет объяснение. SuggestionError -
+        сообщение не подходит; черновик остается, и пользователь может исправить его.
+        """
+        if now is None:
+            now = time.monotonic()
+        draft = self._drafts.get(user_id)
+        if draft is None:
+            raise SuggestionError("Время на предложение истекло, нажмите \"💡 Предложить термин\" еще раз")
+        self._drafts.move_to_end(user_id)
+        draft.touched_at = now
+
+        if draft.step == AWAIT_TEXT and len(text.strip().splitlines()) == 1:
+            draft.term = parse_term(text)
+            draft.step = AWAIT_DEFINITION
+            return None
+
+        suggestion = parse_suggestion(text, draft.term)
+        del self._drafts[user_id]
+        if suggestion.category:
+            suggestion = suggestion._replace(category=self._known_category(suggestion.category))
+        return suggestion
+
+    def _known_category(self, name: str) -> str:
+        """Название существующей категории, если пользователь написал его иначе (регистр, ё)"""
+        key = normalize(name)
+        for category in self.db.get_categories():
+            if normalize(category.name) == key:
+                return category.name
+        return name
+
+    def _evict_idle(self, now: float):
+        """Удаляет черновики пользователей, которые давно не писали боту"""
+        drafts = self._drafts
+        while drafts:
+            draft = next(iter(drafts.values()))
+            if len(drafts) <= self.max_drafts and now - draft.touched_at < self.idle_ttl:
+                break
+            drafts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._drafts)
+
+
+class ActiveIntakeFilter(filters.MessageFilter):
+    """Фильтр сообщений пользователей, от которых бот ждет предложение
+
+    Стоит перед обработчиком поиска, поэтому такие сообщения не доходят до поиска
+    и не попадают в журнал поисков.
+    """
+
+    def __init__(self, intake: SuggestionIntake):
+        super().__init__(name='ActiveIntakeFilter')
+        self.intake = intake
+
+    def filter(self, message: Message) -> bool:
+        return message.from_user is not None and self.intake.active(message.from_user.id)
@@ -0,0 +1,254 @@
+"""
+Исходящие вызовы Telegram Bot API
+Настройка пула соединений, повторы при ошибках, подавление повторных правок
+сообщений и метрики по методам API
+"""
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+
+import httpx
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Методы правки сообщений: повторная правка тем же содержимым не отправляется
+EDIT_METHODS = frozenset({'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'})
+
+# Методы, которые безопасно повторять при обрыве соединения (повтор не создаст дубликат)
+IDEMPOTENT_METHODS = EDIT_METHODS | {
+    'answerCallbackQuery', 'getMe', 'getChat', 'setMyCommands', 'deleteWebhook', 'setWebhook',
+}
+
+NOT_MODIFIED = 'message is not modified'
+
+# Сколько сообщений запоминает подавление повторных правок (по умолчанию на бота)
+MAX_TRACKED_MESSAGES = 10000
+
+# rate_limit_args вызова, который сам обрабатывает RetryAfter: исключение не повторяется,
+# а сразу передается вызывающему (рассылка по нему останавливает всех своих отправителей)
+RAISE_RETRY_AFTER = {'raise_retry_after': True}
+
+
+def http2_available() -> bool:
+    """Установлен ли пакет h2, необходимый httpx для HTTP/2"""
+    return importlib.util.find_spec('h2') is not None
+
+
+class TunedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest с настраиваемым временем жизни простаивающих соединений
+
+    По умолчанию httpx закрывает соединение после 5 секунд простоя, и при
+    редких запросах каждый вызов API платит за новое TLS-соединение.
+    """
+
+    def __init__(self, keepalive_expiry: float = 60.0, **kwargs):
+        self._keepalive_expiry = keepalive_expiry
+        super().__init__(**kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self._keepalive_expiry,
+        )
+        return super()._build_client()
+
+
+class SharedHTTPXRequest(TunedHTTPXRequest):
+    """Один клиент Bot API на несколько ботов процесса
+
+    Каждый бот вызывает initialize и shutdown своего клиента; соединения
+    закрываются только после shutdown последнего бота. Токен входит в URL
+    каждого вызова, поэтому боты могут делить одни и те же соединения.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.users = 0
+
+    async def initialize(self):
+        self.users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self.users = max(0, self.users - 1)
+        if not self.users:
+            await super().shutdown()
+
+
+def build_request(pool_size: int, keepalive_expiry: float = 60.0, http2: bool = None,
+                  read_timeout: float = 10.0, shared: bool = False) -> HTTPXRequest:
+    """Создает клиент Bot API; HTTP/2 включается, если установлен пакет h2
+
+    shared - клиент передается нескольким ботам (см. SharedHTTPXRequest).
+    """
+    if http2 is None:
+        http2 = http2_available()
+    request_class = SharedHTTPXRequest if shared else TunedHTTPXRequest
+    return request_class(
+        keepalive_expiry=keepalive_expiry,
+        connection_pool_size=pool_size,
+        read_timeout=read_timeout,
+        pool_timeout=5.0,
+        http_version='2' if http2 else '1.1',
+    )
+
+
+class MethodStats:
+    """Счетчики одного метода API"""
+    __slots__ = ('calls', 'failures', 'retries', 'suppressed', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.suppressed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """Слой исходящих вызовов для ExtBot (подключается через Application.builder().rate_limiter)
+
+    - правка сообщения тем же содержимым не отправляется: хранится хэш
+      последнего отрисованного содержимого каждого сообщения (LRU);
+    - ответ "message is not modified" считается успешным и не доходит до error_handler;
+    - RetryAfter до max_retry_after секунд и сетевые ошибки повторяются с паузой
+      (сетевые - только для методов, повтор которых не создаст дубликат);
+      вызов с rate_limit_args=RAISE_RETRY_AFTER получает RetryAfter без повтора;
+    - по каждому методу считаются вызовы, ошибки, повторы и время ответа.
+    """
+
+    def __init__(self, max_retries: int = 3, max_retry_after: float = 30.0,
+                 backoff: float = 0.5, max_tracked_messages: int = MAX_TRACKED_MESSAGES):
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.backoff = backoff
+        self.max_tracked_messages = max_tracked_messages
+        self.stats: Dict[str, MethodStats] = {}
+        self._rendered: 'OrderedDict[tuple, str]' = OrderedDict()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _message_key(data: Dict[str, Any]) -> Optional[tuple]:
+        if data.get('inline_message_id'):
+            return ('inline', data['inline_message_id'])
+        if data.get('chat_id') is not None and data.get('message_id') is not None:
+            return (str(data['chat_id']), int(data['message_id']))
+        return None
+
+    @staticmethod
+    def _content_hash(endpoint: str, data: Dict[str, Any]) -> str:
+        """Хэш отображаемого содержимого правки (текст, разметка, клавиатура)"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(endpoint.encode())
+        for key in sorted(data):
+            if key in ('chat_id', 'message_id', 'inline_message_id'):
+                continue
+            value = data[key]
+            value = value.to_json() if hasattr(value, 'to_json') else repr(value)
+            digest.update(f"\0{key}={value}".encode())
+        return digest.hexdigest()
+
+    def _remember(self, key: tuple, content_hash: str):
+        self._rendered[key] = content_hash
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_tracked_messages:
+            self._rendered.popitem(last=False)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], list]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Any],
+    ) -> Union[bool, Dict[str, Any], list]:
+        stats = self.stats.get(endpoint)
+        if stats is None:
+            stats = self.stats[endpoint] = MethodStats()
+
+        raise_retry_after = isinstance(rate_limit_args, dict) and rate_limit_args.get('raise_retry_after', False)
+        edit_key = content_hash = None
+        if endpoint in EDIT_METHODS:
+            edit_key = self._message_key(data)
+            if edit_key is not None:
+                content_hash = self._content_hash(endpoint, data)
+                if self._rendered.get(edit_key) == content_hash:
+                    stats.suppressed += 1
+                    return True
+
+        attempt = 0
+        while True:
+            stats.calls += 1
+            start = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                stats.failures += 1
+                if raise_retry_after or attempt >= self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                logger.warning("%s: RetryAfter %s с", endpoint, e.retry_after)
+                delay = e.retry_after
+            except BadRequest as e:
+                if edit_key is not None and NOT_MODIFIED in str(e).lower():
+                    # Сообщение уже выглядит так - запоминаем содержимое и считаем правку успешной
+                    stats.suppressed += 1
+                    self._remember(edit_key, content_hash)
+                    return True
+                stats.failures += 1
+                raise
+            except (TimedOut, NetworkError) as e:
+                stats.failures += 1
+                if attempt >= self.max_retries or endpoint not in IDEMPOTENT_METHODS:
+                    raise
+                logger.warning("%s: сетевая ошибка, повтор %s: %s", endpoint, attempt + 1, e)
+                delay = self.backoff * 2 ** attempt
+            except Exception:
+                stats.failures += 1
+                raise
+            else:
+                if edit_key is not None:
+                    self._remember(edit_key, content_hash)
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+            stats.retries += 1
+
+    @property
+    def tracked_messages(self) -> int:
+        """Сколько сообщений запомнено для подавления повторных правок"""
+        return len(self._rendered)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Метрики по методам: вызовы, ошибки, повторы, подавленные правки, время ответа (мс)"""
+        return {
+            endpoint: {
+                'calls': stats.calls,
+                'failures': stats.failures,
+                'retries': stats.retries,
+                'suppressed': stats.suppressed,
+                'avg_ms': stats.total_time * 1000 / stats.calls if stats.calls else 0.0,
+                'max_ms': stats.max_time * 1000,
+            }
+            for endpoint, stats in sorted(self.stats.items())
+        }
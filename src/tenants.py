@@ -0,0 +1,328 @@
+"""
+Несколько словарей в одном процессе
+Каждый словарь обслуживает свой бот со своей базой. Процесс делит между ними
+клиент Bot API, event loop пулов PostgreSQL, пул потоков фоновых задач и
+память кэшей (по весам словарей); счетчики по словарям отдаются на /tenants
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import types
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from profiling import check_token
+from storage_backend import StorageBackend, create_backend
+
+logger = logging.getLogger(__name__)
+
+# Имя словаря входит в имена файлов и схемы PostgreSQL
+TENANT_NAME = re.compile(r'^[a-z0-9_]{1,32}$')
+DEFAULT_TENANT = 'default'
+
+
+class Tenant(NamedTuple):
+    """Словарь процесса: бот, база и файл словаря"""
+    name: str
+    token: str
+    database: Optional[str]  # файл SQLite или схема PostgreSQL (None - DATABASE_PATH / схема из DATABASE_URL)
+    artifact_path: str       # скомпилированный файл словаря ('' - без файла)
+    weight: float = 1.0      # доля памяти кэшей процесса
+    user_data_path: str = 'data/user_data.json'  # журнал поисков и предложений
+
+
+class CacheBudget(NamedTuple):
+    """Пределы кэшей в памяти одного словаря (или всего процесса)"""
+    history_users: int     # UserHistory.max_users
+    drafts: int            # SuggestionIntake.max_drafts
+    rate_limit_users: int  # RateLimiter.max_users
+    tracked_messages: int  # OutboundLimiter.max_tracked_messages
+    search_cursors: int    # SearchCursors.max_cursors
+    db_pool_size: int      # соединений пула PostgreSQL
+    index_bytes: int       # снимок словаря и индексы поиска (проверяется при запуске)
+
+    def split(self, weights: Sequence[float]) -> List['CacheBudget']:
+        """Делит пределы процесса между словарями пропорционально весам, но не меньше MIN_BUDGET
+
+        Сумма долей не превышает предел процесса: словари, чья доля по весу
+        меньше нижней границы, получают границу, а остаток делится между
+        остальными по весам. Если самих границ на все словари больше
+        предела - ValueError (настройку нужно исправить, а не превысить предел).
+        """
+        if len(weights) == 1:
+            return [self]
+        columns = [
+            _split_limit(field, limit, minimum, weights)
+            for field, limit, minimum in zip(self._fields, self, MIN_BUDGET)
+        ]
+        return [CacheBudget(*shares) for shares in zip(*columns)]
+
+
+def _split_limit(field: str, limit: int, minimum: int, weights: Sequence[float]) -> List[int]:
+    """Доли одного предела: пропорционально весам, не меньше minimum, в сумме не больше limit"""
+    if minimum * len(weights) > limit:
+        raise ValueError(f"{field}: {len(weights)} словарей требуют не меньше {minimum * len(weights)}, "
+                         f"предел процесса {limit}")
+    floored = set()
+    while True:
+        remaining = limit - minimum * len(floored)
+        total = sum(weight for i, weight in enumerate(weights) if i not in floored)
+        shares = [minimum if i in floored else int(remaining * weight / total) for i, weight in enumerate(weights)]
+        below = {i for i, share in enumerate(shares) if share < minimum}
+        if not below:
+            return shares
+        floored |= below
+
+
+# Нижняя граница доли словаря: маленький словарь не остается совсем без кэшей
+MIN_BUDGET = CacheBudget(history_users=100, drafts=100, rate_limit_users=1000, tracked_messages=1000,
+                         search_cursors=100, db_pool_size=1, index_bytes=16 * 1024 * 1024)
+
+# Объекты без данных словаря: не обходятся при оценке памяти
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType)
+
+
+def memory_size(*objects, exclude: Sequence = ()) -> int:
+    """Оценка памяти объектов вместе со всем, на что они ссылаются (байт)
+
+    Общие объекты считаются один раз. Массивы numpy и array учитываются
+    вместе с данными, если владеют ими; представления поверх файла словаря
+    (mmap) - без данных: страницы файла делят процессы через кэш ОС.
+    Объекты из exclude (например, хранилище) и функции не обходятся.
+    """
+    seen = {id(item) for item in exclude}
+    stack = list(objects)
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _OPAQUE):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, bytearray, int, float, array, memoryview)) or \
+                hasattr(obj, '__array_interface__'):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            stack.extend(getattr(obj, '__dict__', {}).values())
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return total
+
+
+def load_tenants(spec: str, token: str, database: Optional[str], artifact_path: str,
+                 postgres: bool = False, user_data_path: str = 'data/user_data.json') -> List[Tenant]:
+    """Словари процесса из настройки TENANTS
+
+    spec - JSON-список или путь к JSON-файлу; пустое значение - один словарь
+    с token, database, artifact_path и user_data_path (режим одного словаря).
+    По умолчанию база словаря лежит рядом с database (data/<name>.db), файл
+    словаря - рядом с artifact_path (data/<name>.bin), журнал - рядом
+    с user_data_path (data/<name>_user_data.json), а в PostgreSQL словарь
+    получает схему со своим именем. Ошибки настройки - ValueError.
+    """
+    if not spec.strip():
+        return [Tenant(DEFAULT_TENANT, token, database, artifact_path, user_data_path=user_data_path)]
+
+    if spec.lstrip().startswith('['):
+        items = json.loads(spec)
+    else:
+        with open(spec, encoding='utf-8') as file:
+            items = json.load(file)
+    if not isinstance(items, list) or not items:
+        raise ValueError("TENANTS: ожидается непустой JSON-список словарей")
+
+    database_dir = os.path.dirname(database or '')
+    artifact_dir = os.path.dirname(artifact_path)
+    user_data_dir = os.path.dirname(user_data_path)
+    tenants = []
+    for index, item in enumerate(items):
+        name = str(item.get('name', ''))
+        if not TENANT_NAME.match(name):
+            raise ValueError(f"TENANTS[{index}]: имя словаря - строчные латинские буквы, цифры и _ (до 32 символов)")
+        if not item.get('token'):
+            raise ValueError(f"Словарь {name}: не указан token")
+        weight = float(item.get('weight', 1.0))
+        if weight <= 0:
+            raise ValueError(f"Словарь {name}: weight должен быть больше нуля")
+
+        tenant_database = item.get('database') or (name if postgres else os.path.join(database_dir, f'{name}.db'))
+        tenant_artifact = item.get('artifact', os.path.join(artifact_dir, f'{name}.bin') if artifact_path else '')
+        tenant_user_data = item.get('user_data') or os.path.join(user_data_dir, f'{name}_user_data.json')
+        tenants.append(Tenant(name, item['token'], tenant_database, tenant_artifact, weight, tenant_user_data))
+
+    for field in ('name', 'token', 'database', 'user_data_path'):
+        values = [getattr(tenant, field) for tenant in tenants]
+        if len(set(values)) != len(values):
+            raise ValueError(f"TENANTS: значения {field} словарей повторяются")
+    artifacts = [tenant.artifact_path for tenant in tenants if tenant.artifact_path]
+    if len(set(artifacts)) != len(artifacts):
+        raise ValueError("TENANTS: файлы словарей (artifact) повторяются")
+    return tenants
+
+
+class TenantEntry:
+    """Словарь во время работы: хранилище, бот, приложение и счетчик обновлений"""
+    __slots__ = ('tenant', 'budget', 'database', 'bot', 'app', 'updates', 'index_bytes')
+
+    def __init__(self, tenant: Tenant, budget: CacheBudget, database: StorageBackend):
+        self.tenant = tenant
+        self.budget = budget
+        self.database = database
+        self.bot = None
+        self.app = None
+        self.updates = 0
+        self.index_bytes: Optional[int] = None
+
+    def measure_indexes(self) -> int:
+        """Загружает индексы бота и оценивает память снимка, глоссария и поиска по описанию
+
+        Вызывается при запуске, до приема обновлений: обход объектов не берет блокировок.
+        """
+        bot = self.bot
+        bot.glossary.sync()
+        bot.descriptions.sync()
+        self.index_bytes = memory_size(bot.snapshots.current, bot.glossary, bot.descriptions,
+                                       exclude=(self.database, bot.db))
+        return self.index_bytes
+
+    async def track_update(self, update, context):
+        """Считает обновления словаря (регистрируется раньше остальных обработчиков)"""
+        self.updates += 1
+
+    def stats(self) -> dict:
+        """Размер словаря, заполнение кэшей и вызовы Bot API; только данные в памяти, без базы"""
+        state = {'name': self.tenant.name, 'weight': self.tenant.weight, 'updates': self.updates}
+        bot = self.bot
+        if bot is None:
+            return state
+        snapshot = bot.snapshots.current
+        state.update(
+            revision=snapshot.revision,
+            terms=len(snapshot.ordered),
+            categories=len(snapshot.sorted_categories),
+            caches={
+                'history': {'size': len(bot.history), 'limit': self.budget.history_users},
+                'drafts': {'size': len(bot.intake), 'limit': self.budget.drafts},
+                'rate_limit': {'size': len(bot.rate_limiter), 'limit': self.budget.rate_limit_users},
+                'search_cursors': {'size': len(bot.cursors), 'limit': self.budget.search_cursors},
+                'indexes_mb': {'size': None if self.index_bytes is None else round(self.index_bytes / 2 ** 20, 1),
+                               'limit': round(self.budget.index_bytes / 2 ** 20, 1)},
+            },
+        )
+        limiter = self.app.bot.rate_limiter if self.app else None
+        if limiter is not None:
+            methods = limiter.snapshot().values()
+            state['api'] = {
+                'calls': sum(item['calls'] for item in methods),
+                'failures': sum(item['failures'] for item in methods),
+                'tracked_messages': {'size': limiter.tracked_messages, 'limit': limiter.max_tracked_messages},
+            }
+        return state
+
+
+class TenantRegistry:
+    """Словари процесса по имени
+
+    Первый зарегистрированный словарь - основной: его приложение запускается
+    через run_polling/run_webhook и владеет сигналами и остановкой процесса.
+    Приложения остальных словарей запускаются в том же event loop из post_init
+    основного (start_additional) и останавливаются из его post_stop
+    (stop_additional), поэтому задачи JobQueue всех словарей делят один пул
+    потоков asyncio.to_thread, а соединения Bot API - общий клиент.
+    Пулы PostgreSQL словарей работают на одном фоновом event loop.
+    """
+
+    def __init__(self, postgres: bool = False):
+        self.entries: Dict[str, TenantEntry] = {}
+        self._loop = None
+        self._thread = None
+        if postgres:
+            from postgres_backend import start_loop
+            self._loop, self._thread = start_loop()
+
+    def add(self, tenant: Tenant, budget: CacheBudget) -> TenantEntry:
+        """Регистрирует словарь и открывает его хранилище"""
+        if tenant.name in self.entries:
+            raise ValueError(f"Словарь {tenant.name} уже зарегистрирован")
+        database = create_backend(tenant.database, pool_size=budget.db_pool_size, loop=self._loop)
+        entry = self.entries[tenant.name] = TenantEntry(tenant, budget, database)
+        return entry
+
+    def remove(self, name: str):
+        """Снимает словарь (например, не уместившийся в память) и закрывает его хранилище"""
+        entry = self.entries.pop(name)
+        entry.database.close()
+
+    def get(self, name: str) -> Optional[TenantEntry]:
+        return self.entries.get(name)
+
+    @property
+    def primary(self) -> TenantEntry:
+        return next(iter(self.entries.values()))
+
+    @property
+    def additional(self) -> List[TenantEntry]:
+        return list(self.entries.values())[1:]
+
+    def __iter__(self) -> Iterator[TenantEntry]:
+        return iter(self.entries.values())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def start_additional(self, on_start=None):
+        """Запускает приложения дополнительных словарей (порядок как в run_polling)"""
+        for entry in self.additional:
+            app = entry.app
+            await app.initialize()
+            if on_start:
+                await on_start(app)
+            await app.updater.start_polling(drop_pending_updates=True)
+            await app.start()
+            logger.info("Словарь %s запущен", entry.tenant.name)
+
+    async def stop_additional(self):
+        """Останавливает прием обновлений всех дополнительных словарей, затем дорабатывает их очереди"""
+        apps = [entry.app for entry in self.additional if entry.app and entry.app.running]
+        await asyncio.gather(*(app.updater.stop() for app in apps if app.updater.running))
+        await asyncio.gather(*(app.stop() for app in apps))
+        await asyncio.gather(*(app.shutdown() for app in apps))
+
+    def close(self):
+        """Закрывает хранилища словарей и общий event loop PostgreSQL"""
+        for entry in self.entries.values():
+            try:
+                entry.database.close()
+            except Exception as e:
+                logger.error("Ошибка закрытия хранилища словаря %s: %s", entry.tenant.name, e)
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> List[dict]:
+        # Копия: HTTP сервер отвечает, пока словари еще регистрируются
+        return [entry.stats() for entry in list(self.entries.values())]
+
+    def handle_request(self, path: str, headers=None, token: Optional[str] = None) -> Optional[Tuple[int, str, bytes]]:
+        """Ответ на /tenants: (код, Content-Type, тело); None для других путей
+
+        Доступ по токену, как у профилирования: без токена эндпоинт отключен (404),
+        токен передается заголовком "Authorization: Bearer <токен>".
+        """
+        if path.split('?', 1)[0] != '/tenants':
+            return None
+        denied = check_token(token, headers or {})
+        if denied is not None:
+            return denied, 'text/plain; charset=utf-8', b"Not found\n" if denied == 404 else b"Forbidden\n"
+        return 200, 'application/json', json.dumps(self.stats(), ensure_ascii=False).encode()
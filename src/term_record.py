@@ -0,0 +1,71 @@
+"""
+Компактные записи терминов и категорий
+Используются вместо словарей на каждую строку результата запроса
+"""
+from typing import Callable, NamedTuple, Optional, Tuple
+
+# Признак того, что текстовые поля термина еще не загружены
+_NOT_LOADED = object()
+
+
+class CategoryRecord(NamedTuple):
+    """Категория терминов"""
+    id: int
+    name: str
+    description: Optional[str] = None
+
+
+class TermRecord:
+    """Запись термина
+
+    Списки (результаты поиска, термины категории) показывают только название
+    и категорию, поэтому длинные поля definition и examples могут не загружаться
+    сразу: при первом обращении они читаются через loader одним запросом по ID.
+    """
+    __slots__ = ('id', 'term', 'category_id', 'category_name', 'synonyms', 'usage_count',
+                 '_definition', '_examples', '_loader')
+
+    def __init__(self, id: int, term: str, category_id: Optional[int] = None,
+                 category_name: Optional[str] = None, synonyms: Optional[str] = None,
+                 usage_count: int = 0, definition=_NOT_LOADED, examples=_NOT_LOADED,
+                 loader: Optional[Callable[[int], Tuple[str, Optional[str]]]] = None):
+        self.id = id
+        self.term = term
+        self.category_id = category_id
+        self.category_name = category_name
+        self.synonyms = synonyms
+        self.usage_count = usage_count or 0
+        self._definition = definition
+        self._examples = examples
+        self._loader = loader
+
+    def _load_texts(self):
+        """Догружает definition и examples"""
+        if self._loader is None:
+            raise ValueError(f"Текст термина {self.id} не загружен и загрузчик не задан")
+        definition, examples = self._loader(self.id)
+        if self._definition is _NOT_LOADED:
+            self._definition = definition
+        if self._examples is _NOT_LOADED:
+            self._examples = examples
+        self._loader = None
+
+    @property
+    def definition(self) -> str:
+        if self._definition is _NOT_LOADED:
+            self._load_texts()
+        return self._definition
+
+    @property
+    def examples(self) -> Optional[str]:
+        if self._examples is _NOT_LOADED:
+            self._load_texts()
+        return self._examples
+
+    @property
+    def is_loaded(self) -> bool:
+        """Загружены ли текстовые поля"""
+        return self._definition is not _NOT_LOADED and self._examples is not _NOT_LOADED
+
+    def __repr__(self) -> str:
+        return f"TermRecord(id={self.id!r}, term={self.term!r})"
@@ -0,0 +1,127 @@
+"""
+Нормализация текста для поиска
+Общие правила для построения индексов и для обработки запросов
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Optional
+
+# Кириллица -> латиница (упрощенная транслитерация для ключей сравнения)
+_CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n',
+    'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f',
+    'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'i',
+    'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+}
+
+# Приведение латинских вариантов написания к одному ключу
+_LATIN_FOLDING = [
+    ('ph', 'f'), ('kh', 'h'), ('ck', 'k'), ('x', 'ks'),
+    ('c', 'k'), ('q', 'k'), ('w', 'v'), ('y', 'i'),
+]
+
+# Окончания и суффиксы, отбрасываемые при упрощенном стемминге (сначала длинные)
+_RUSSIAN_SUFFIXES = sorted([
+    'ся', 'сь', 'ость', 'ости', 'есть', 'ическ', 'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ом', 'ем', 'ах', 'ях', 'ов', 'ев',
+    'ей', 'ую', 'юю', 'их', 'ых', 'ам', 'ям', 'ть', 'ет', 'ут', 'ют', 'ит', 'ат', 'ят', 'ал', 'ла', 'ли',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+_MIN_STEM_LENGTH = 3
+
+# Служебные слова, не несущие смысла для поиска по описанию
+STOP_WORDS = frozenset({
+    'и', 'в', 'во', 'на', 'с', 'со', 'к', 'по', 'из', 'у', 'о', 'об', 'от', 'до', 'за', 'для',
+    'не', 'но', 'а', 'или', 'как', 'что', 'это', 'очень', 'так', 'же', 'бы', 'ли', 'то',
+    'мне', 'я', 'он', 'она', 'оно', 'они', 'его', 'ее', 'их', 'который', 'которые', 'чтобы',
+    'the', 'a', 'an', 'of', 'and', 'or', 'in', 'on', 'to', 'with',
+})
+
+_TRANSLIT_TABLE = str.maketrans(_CYRILLIC_TO_LATIN)
+_DOUBLE_LETTERS = re.compile(r'([a-z])\1+')
+_SYNONYM_SEPARATORS = re.compile(r'[,;]')
+
+
+@lru_cache(maxsize=None)
+def _is_separator(char: str) -> bool:
+    """Пунктуация, символы и пробелы считаются разделителями слов"""
+    return unicodedata.category(char)[0] in 'PSZC'
+
+
+def normalize(text: Optional[str]) -> str:
+    """Нормализует текст: регистр, ё/е, пунктуация и пробелы
+
+    "Ёмкость,  EDP!" -> "емкость edp"
+    """
+    if not text:
+        return ''
+    text = text.casefold().replace('ё', 'е')
+    return ' '.join(''.join(' ' if _is_separator(char) else char for char in text).split())
+
+
+def translit_key(text: Optional[str]) -> str:
+    """Ключ для сравнения написаний кириллицей и латиницей
+
+    "Эдп" и "EDP" -> "edp", "травало" и "travalo" -> "travalo"
+    """
+    key = normalize(text).translate(_TRANSLIT_TABLE)
+    for source, target in _LATIN_FOLDING:
+        key = key.replace(source, target)
+    return _DOUBLE_LETTERS.sub(r'\1', key)
+
+
+def split_synonyms(synonyms: Optional[str]) -> List[str]:
+    """Разбивает строку синонимов на отдельные варианты"""
+    if not synonyms:
+        return []
+    return [synonym.strip() for synonym in _SYNONYM_SEPARATORS.split(synonyms) if synonym.strip()]
+
+
+def merge_synonyms(term: str, synonyms: Optional[str], *extra: Optional[str]) -> Optional[str]:
+    """Синонимы термина после слияния: свои и добавленные варианты без повторов
+
+    Варианты, совпадающие с названием или друг с другом по ключу транслитерации,
+    отбрасываются: merge_synonyms("EDP", "парфюмерная вода", "Эдп", "Parfum") -> "парфюмерная вода, Parfum"
+    """
+    seen = {translit_key(term)}
+    merged = []
+    for value in (synonyms,) + extra:
+        for synonym in split_synonyms(value):
+            key = translit_key(synonym)
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(synonym)
+    return ', '.join(merged) or None
+
+
+def term_keys(term: str, synonyms: Optional[str]) -> List[tuple]:
+    """Ключи транслитерации термина: пары (ключ, является ли синонимом)"""
+    keys = {(translit_key(term), 0)}
+    for synonym in split_synonyms(synonyms):
+        keys.add((translit_key(synonym), 1))
+    return [(key, is_synonym) for key, is_synonym in keys if key]
+
+
+def stem(word: str) -> str:
+    """Упрощенная основа русского слова: отбрасывает до трех окончаний и суффиксов
+
+    "свежо", "свежий", "свежая" -> "свеж"; "цитрусовый" -> "цитрус"
+    """
+    for _ in range(3):
+        for suffix in _RUSSIAN_SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM_LENGTH:
+                word = word[:-len(suffix)]
+                break
+        else:
+            break
+    return word
+
+
+def stem_tokens(text: Optional[str]) -> List[str]:
+    """Основы значимых слов текста (без служебных слов и чисел)"""
+    return [
+        stem(word) for word in normalize(text).split()
+        if word not in STOP_WORDS and not word.isdigit()
+    ]
@@ -0,0 +1,93 @@
+"""
+Личная история запросов: последние просмотренные термины пользователя
+Активные пользователи читают историю из памяти, запись сразу уходит в базу
+"""
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from storage_backend import StorageBackend
+
+
+class HistoryEntry:
+    """История одного пользователя в памяти: (id, название) от новых к старым"""
+    __slots__ = ('items', 'touched_at')
+
+    def __init__(self, items: List[Tuple[int, str]], touched_at: float):
+        self.items = items
+        self.touched_at = touched_at
+
+
+class UserHistory:
+    """LRU историй активных пользователей с записью в базу (write-through)
+
+    В памяти хранится не больше max_users историй по size терминов; истории
+    пользователей, не обращавшихся к боту idle_ttl секунд, вытесняются с начала
+    словаря, как корзины в RateLimiter. Промах кэша - одно чтение из базы
+    по первичному ключу (не больше size строк).
+
+    В режиме масштабирования обновления одного пользователя всегда попадают
+    в один процесс-обработчик, поэтому кэши процессов не расходятся.
+    """
+
+    def __init__(self, db: StorageBackend, size: int = 10, idle_ttl: float = 1800, max_users: int = 10000):
+        self.db = db
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self._entries: 'OrderedDict[int, HistoryEntry]' = OrderedDict()
+
+    def _entry(self, user_id: int, now: float) -> HistoryEntry:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = HistoryEntry(self.db.get_history(user_id, self.size), now)
+            self._entries[user_id] = entry
+        else:
+            self._entries.move_to_end(user_id)
+            entry.touched_at = now
+        self._evict_idle(now)
+        return entry
+
+    def add(self, user_id: int, term_id: int, term: str, now: Optional[float] = None):
+        """Записывает просмотр термина: в начало истории, без повторов"""
+        if now is None:
+            now = time.monotonic()
+        entry = self._entry(user_id, now)
+        items = [item for item in entry.items if item[0] != term_id]
+        items.insert(0, (term_id, term))
+        entry.items = items[:self.size]
+        self.db.add_history(user_id, term_id, time.time(), keep=self.size)
+
+    def get(self, user_id: int, now: Optional[float] = None) -> List[Tuple[int, str]]:
+        """История пользователя от новых к старым: (id, название)"""
+        if now is None:
+            now = time.monotonic()
+        return list(self._entry(user_id, now).items)
+
+    def apply_change(self, event):
+        """Обработчик шины изменений: забывает истории, в которых есть затронутые термины
+
+        Хранилище само переносит и удаляет строки истории при слиянии и удалении,
+        поэтому такие истории достаточно перечитать при следующем обращении.
+        """
+        term_ids = set(event.removed_terms + event.changed_terms)
+        if not term_ids:
+            return
+        stale = [
+            user_id for user_id, entry in self._entries.items()
+            if any(term_id in term_ids for term_id, _ in entry.items)
+        ]
+        for user_id in stale:
+            del self._entries[user_id]
+
+    def _evict_idle(self, now: float):
+        """Удаляет истории пользователей, которые давно не обращались к боту"""
+        entries = self._entries
+        while entries:
+            entry = next(iter(entries.values()))
+            if len(entries) <= self.max_users and now - entry.touched_at < self.idle_ttl:
+                break
+            entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,27 @@
+"""
+Общие настройки тестов
+Модули бота импортируются из src/ и корня репозитория, как в main.py
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [path for path in (os.path.join(ROOT, 'src'), ROOT) if path not in sys.path]
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Пустая база SQLite во временной папке"""
+    from database import PerfumeDatabase
+    return PerfumeDatabase(str(tmp_path / 'test.db'))
+
+
+@pytest.fixture
+def stub():
+    """Заглушка Bot API на свободном порту"""
+    from stub_bot_api import StubBotAPI
+    stub = StubBotAPI().start()
+    yield stub
+    stub.stop()
@@ -0,0 +1,79 @@
+"""
+Локальная заглушка Google Sheets для тестов синхронизации без сети
+Повторяет часть API gspread, которой пользуется SheetsSync
+"""
+import threading
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+from typing import Dict, List
+
+from gspread.exceptions import WorksheetNotFound
+
+
+class FakeAPIError(Exception):
+    """Ошибка API с кодом ответа, как у gspread.exceptions.APIError (поле response.status_code)"""
+
+    def __init__(self, status_code: int, message: str = ''):
+        super().__init__(f"{status_code}: {message}")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class FakeWorksheet:
+    """Лист таблицы в памяти"""
+
+    def __init__(self, spreadsheet: 'FakeSpreadsheet', title: str):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows: List[List] = []
+
+    def append_rows(self, values: List[List], value_input_option: str = 'RAW', **kwargs):
+        self.spreadsheet.call('append_rows')
+        failure = self.spreadsheet.pop_failure('append_rows')
+        if failure and not failure.applied:
+            raise failure.error
+        self.rows.extend([list(row) for row in values])
+        if failure:
+            # Запрос выполнен, но ответ потерян (таймаут после записи)
+            raise failure.error
+        return {'updates': {'updatedRows': len(values)}}
+
+    def col_values(self, col: int) -> List:
+        self.spreadsheet.call('col_values')
+        failure = self.spreadsheet.pop_failure('col_values')
+        if failure:
+            raise failure.error
+        # gspread возвращает отображаемые значения ячеек - строки
+        return [str(row[col - 1]) for row in self.rows if len(row) >= col]
+
+
+class FakeSpreadsheet:
+    """Таблица в памяти: spreadsheet = FakeSpreadsheet(); SheetsSync(db, lambda: spreadsheet)"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.worksheets: Dict[str, FakeWorksheet] = {}
+        self._failures = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def fail_next(self, method: str, error: Exception, applied: bool = False):
+        """Следующий вызов метода завершится ошибкой; applied=True - данные при этом записаны"""
+        self._failures[method].append(SimpleNamespace(error=error, applied=applied))
+
+    def pop_failure(self, method: str):
+        with self._lock:
+            return self._failures[method].popleft() if self._failures[method] else None
+
+    def call(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.call('worksheet')
+        if title not in self.worksheets:
+            raise WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26) -> FakeWorksheet:
+        self.call('add_worksheet')
+        self.worksheets[title] = FakeWorksheet(self, title)
+        return self.worksheets[title]
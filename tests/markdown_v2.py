@@ -0,0 +1,59 @@
+"""
+Проверка разметки MarkdownV2 в тестах
+Разбор повторяет правила Telegram для подмножества разметки, которое использует бот
+"""
+from rendering import _SPECIAL
+
+# Названия, на которых ломается неэкранированная разметка: звездочки, подчеркивания,
+# скобки, точки, апострофы, обратная косая черта и прочие служебные символы MarkdownV2
+TRICKY_NAMES = [
+    "Eau de Parfum (EDP)", "L'Eau d'Issey", "Acqua di Giò", "Chanel N°5", "No.5", "Sauvage!",
+    "Black Opium*", "*", "**", "CK One_Summer", "__init__", "Tom Ford [Private Blend]",
+    "Tom Ford F*cking Fabulous", "Dior Homme #2", "Light Blue > Intense", "Creed | Aventus",
+    "1 + 1 = 2", "Mont~Blanc", "Baccarat Rouge 540 {Extrait}", "Ombré Leather `16`", "back\\slash",
+    "Dolce&Gabbana <Girl>", "Kenzo Flower - L'Absolue", "Maison Margiela 'REPLICA' Jazz Club",
+    "Juliette Has A Gun: Not a Perfume", "Ex Nihilo ‼️ Fleur Narcotique", "Byredo Mojave Ghost.",
+    "[link](http://example.com)", "_*[]()~`>#+-=|{}.!\\", "Эдп (парфюмерная вода) - 50 мл.",
+]
+
+
+def parse_markdown_v2(text: str) -> str:
+    """Разбирает подмножество MarkdownV2, которое использует бот, как это делает Telegram
+
+    Возвращает видимый текст; неэкранированный служебный символ вне разметки
+    или незакрытая разметка - ValueError (Telegram ответил бы "can't parse entities").
+    """
+    result = []
+    bold = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            if i + 1 >= len(text) or text[i + 1] not in _SPECIAL:
+                raise ValueError(f"лишняя обратная косая черта в позиции {i}")
+            result.append(text[i + 1])
+            i += 2
+        elif text.startswith('```', i) or char == '`':
+            fence = '```' if text.startswith('```', i) else '`'
+            i += len(fence)
+            while not text.startswith(fence, i):
+                if i >= len(text):
+                    raise ValueError("незакрытый код")
+                if text[i] == '\\' and i + 1 < len(text) and text[i + 1] in '`\\':
+                    i += 1
+                elif text[i] in '`\\':
+                    raise ValueError(f"неэкранированный символ в коде в позиции {i}")
+                result.append(text[i])
+                i += 1
+            i += len(fence)
+        elif char == '*':
+            bold = not bold
+            i += 1
+        elif char in _SPECIAL:
+            raise ValueError(f"неэкранированный символ {char!r} в позиции {i}")
+        else:
+            result.append(char)
+            i += 1
+    if bold:
+        raise ValueError("незакрытый жирный шрифт")
+    return ''.join(result)
@@ -0,0 +1,113 @@
+"""
+Локальная заглушка Telegram Bot API для тестов без сети
+Поддерживает getMe, getUpdates, sendMessage, editMessageText, ответы об ошибках и учет соединений
+"""
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+
+class StubBotAPI:
+    """Заглушка Bot API в отдельном потоке: bot = Bot(token, base_url=stub.base_url)"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.received = Counter()
+        self.parse_modes = Counter()
+        self.connections = set()
+        self.blocked_chats = set()
+        self.messages: Dict[tuple, str] = {}
+        self._failures = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def fail_next(self, method: str, error_code: int, description: str, parameters: Optional[Dict] = None):
+        """Следующий вызов метода завершится указанной ошибкой"""
+        response = {'ok': False, 'error_code': error_code, 'description': description}
+        if parameters:
+            response['parameters'] = parameters
+        self._failures[method].append(response)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/bot"
+
+    def start(self) -> 'StubBotAPI':
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1, чтобы клиент мог переиспользовать соединение
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                params = {key: values[0] for key, values in parse_qs(body).items()}
+                response = stub.handle(method, params, self.client_address)
+
+                payload = json.dumps(response).encode()
+                self.send_response(200 if response['ok'] else response['error_code'])
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def handle(self, method: str, params: Dict[str, str], client_address) -> Dict:
+        """Ответ заглушки на вызов метода"""
+        with self._lock:
+            self.calls[method] += 1
+            self.connections.add(client_address)
+            if self._failures[method]:
+                return self._failures[method].popleft()
+
+            if method == 'getMe':
+                return {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}}
+
+            if method == 'sendMessage':
+                chat_id = int(params['chat_id'])
+                if chat_id in self.blocked_chats:
+                    return {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+                self.received[chat_id] += 1
+                self.parse_modes[params.get('parse_mode')] += 1
+                message_id = sum(self.received.values())
+                self.messages[(chat_id, message_id)] = params.get('text', '') + params.get('reply_markup', '')
+                return {'ok': True, 'result': self._message(chat_id, message_id, params)}
+
+            if method == 'editMessageText':
+                key = (int(params['chat_id']), int(params['message_id']))
+                content = params.get('text', '') + params.get('reply_markup', '')
+                if self.messages.get(key) == content:
+                    return {'ok': False, 'error_code': 400,
+                            'description': 'Bad Request: message is not modified: specified new message content '
+                                           'and reply markup are exactly the same as a current content and reply '
+                                           'markup of the message'}
+                self.messages[key] = content
+                return {'ok': True, 'result': self._message(key[0], key[1], params)}
+
+            if method == 'getUpdates':
+                return {'ok': True, 'result': []}
+
+            return {'ok': True, 'result': True}
+
+    @staticmethod
+    def _message(chat_id: int, message_id: int, params: Dict[str, str]) -> Dict:
+        return {'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
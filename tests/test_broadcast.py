@@ -0,0 +1,121 @@
+"""Рассылка "Термин дня" на заглушке Bot API"""
+import asyncio
+import sqlite3
+
+import pytest
+from telegram import Bot
+from telegram.ext import ExtBot
+
+from broadcast import Broadcaster
+from database import PerfumeDatabase, populate_initial_data
+from telegram_api import OutboundLimiter
+
+SUBSCRIBERS = 300
+DATE = '2026-01-01'
+
+
+@pytest.fixture
+def subscribed(db, stub):
+    populate_initial_data(db)
+    for chat_id in range(1, SUBSCRIBERS + 1):
+        db.add_subscriber(chat_id)
+    stub.blocked_chats = set(range(1, SUBSCRIBERS + 1, 37))
+    return db
+
+
+async def interrupt_halfway(broadcaster: Broadcaster, bot, stub):
+    """Первый запуск прерывается примерно на середине рассылки"""
+    task = asyncio.create_task(broadcaster.run(bot, DATE))
+    while not task.done() and sum(stub.received.values()) < SUBSCRIBERS // 2:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_resume_after_interruption(subscribed, stub):
+    db = subscribed
+    stub.fail_next('sendMessage', 429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+    broadcaster = Broadcaster(db, rate=100, concurrency=8, batch_size=25)
+
+    async def run():
+        async with Bot('123:stub', base_url=stub.base_url) as bot:
+            await interrupt_halfway(broadcaster, bot, stub)
+            assert db.get_broadcast(DATE)['status'] != 'finished'
+            # Повторный запуск (как после рестарта) продолжает с места остановки
+            return await broadcaster.run(bot, DATE)
+
+    counters = asyncio.run(run())
+    duplicates = sum(count - 1 for count in stub.received.values() if count > 1)
+    assert len(stub.received) == SUBSCRIBERS - len(stub.blocked_chats)
+    assert duplicates <= broadcaster.concurrency
+    assert counters['failed'] == 0
+    assert not any(db.is_subscribed(chat_id) for chat_id in stub.blocked_chats)
+    assert db.get_broadcast(DATE)['status'] == 'finished'
+
+
+def test_resume_after_midnight(subscribed, stub):
+    # Рассылка прервана вечером, бот перезапущен уже на следующий день
+    db = subscribed
+    broadcaster = Broadcaster(db, rate=100, concurrency=8, batch_size=25)
+
+    async def run():
+        async with Bot('123:stub', base_url=stub.base_url) as bot:
+            await interrupt_halfway(broadcaster, bot, stub)
+            db.finish_broadcast(db.create_broadcast('2025-12-31', None, "Вчерашняя", 'Markdown')['id'])
+            # Задача запуска (create=False) ищет незавершенную рассылку, а не рассылку за сегодня
+            return await broadcaster.resume(bot)
+
+    counters = asyncio.run(run())
+    assert counters['sent'] > 0
+    assert len(stub.received) == SUBSCRIBERS - len(stub.blocked_chats)
+    assert db.get_broadcast(DATE)['status'] == 'finished'
+    assert db.get_unfinished_broadcast() is None
+
+
+def test_retry_after_pauses_all_senders_through_ext_bot(subscribed, stub):
+    # Бот как в продакшене: ExtBot со слоем исходящих вызовов
+    db = subscribed
+    stub.fail_next('sendMessage', 429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+    broadcaster = Broadcaster(db, rate=100, concurrency=8, batch_size=25)
+    pauses = []
+    pause = broadcaster.limiter.pause
+    broadcaster.limiter.pause = lambda seconds: pauses.append(seconds) or pause(seconds)
+    outbound = OutboundLimiter(backoff=0.01)
+
+    async def run():
+        async with ExtBot('123:stub', base_url=stub.base_url, rate_limiter=outbound) as bot:
+            return await broadcaster.run(bot, DATE)
+
+    counters = asyncio.run(run())
+    # RetryAfter дошел до рассылки, а не повторился внутри ExtBot
+    assert pauses == [1]
+    assert outbound.snapshot()['sendMessage']['retries'] == 0
+    assert counters['failed'] == 0 and len(stub.received) == SUBSCRIBERS - len(stub.blocked_chats)
+
+
+def test_broadcast_prepared_before_markup_change_keeps_its_mode(tmp_path, stub):
+    # Рассылка подготовлена до появления режима разметки: текст в Markdown
+    path = str(tmp_path / 'legacy.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, broadcast_date TEXT UNIQUE NOT NULL, term_id INTEGER,
+                text TEXT NOT NULL, status TEXT DEFAULT 'running', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        conn.execute("INSERT INTO broadcasts (broadcast_date, text) VALUES (?, ?)", (DATE, "*Шипр* - семейство"))
+    db = PerfumeDatabase(path)
+    populate_initial_data(db)
+    for chat_id in range(1, 11):
+        db.add_subscriber(chat_id)
+    broadcaster = Broadcaster(db, rate=100, concurrency=4, batch_size=5)
+
+    async def run():
+        async with Bot('123:stub', base_url=stub.base_url) as bot:
+            await broadcaster.run(bot, DATE)
+            await broadcaster.run(bot, '2026-01-02')
+
+    asyncio.run(run())
+    assert db.get_broadcast(DATE)['parse_mode'] == 'Markdown'
+    assert stub.parse_modes == {'Markdown': 10, 'MarkdownV2': 10}
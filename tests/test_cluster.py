@@ -0,0 +1,78 @@
+"""Запись процессов-обработчиков через единственного писателя: подтверждения и ошибки"""
+import asyncio
+import queue
+
+import pytest
+
+from cluster import ForwardingDatabase, ForwardingStorage, SQLiteWriter, WriteChannel, WriteError
+from database import populate_initial_data
+
+
+class Storage:
+    def __init__(self):
+        self.searches = []
+
+    def log_search(self, user_id, query, found=False):
+        self.searches.append(query)
+
+    def save_user_suggestion(self, user_id, username, term, definition):
+        return True
+
+
+@pytest.fixture
+def channel(db):
+    populate_initial_data(db)
+    write_queue, reply_queue = queue.Queue(), queue.Queue()
+    storage = Storage()
+    writer = SQLiteWriter(db, storage, write_queue, [reply_queue])
+    writer.start()
+    yield WriteChannel(write_queue, reply_queue, timeout=5), storage
+    writer.stop()
+
+
+def test_user_facing_writes_return_results(db, channel):
+    writes, storage = channel
+    worker_db = ForwardingDatabase(db.db_path, writes)
+    term_id = worker_db.add_term("Шипр", "Семейство ароматов", "Семейства")
+    assert isinstance(term_id, int) and worker_db.get_term_by_id(term_id).term == "Шипр"
+    assert worker_db.add_subscriber(42) and not worker_db.add_subscriber(42)
+    with pytest.raises(ValueError):
+        worker_db.merge_terms(term_id, term_id)
+    assert ForwardingStorage(writes).save_user_suggestion(42, "user", "Шипр", "Семейство") is True
+
+    # Журналы не ждут писателя
+    assert ForwardingStorage(writes).log_search(42, "шипр") is None
+    writes.call('db', 'add_subscriber', (43,), {})
+    assert storage.searches == ["шипр"]
+    worker_db.close()
+
+
+def test_timeout_and_late_reply():
+    write_queue, reply_queue = queue.Queue(), queue.Queue()
+    writes = WriteChannel(write_queue, reply_queue, timeout=0.05)
+    with pytest.raises(WriteError):
+        writes.call('db', 'add_subscriber', (42,), {})
+    # Ответ на запрос с истекшим таймаутом пропускается
+    reply_queue.put((1, True, True))
+    reply_queue.put((2, True, False))
+    assert writes.call('db', 'add_subscriber', (42,), {}) is False
+    assert [write_queue.get()[4] for _ in range(2)] == [(0, 1), (0, 2)]
+
+
+def test_waiting_for_ack_does_not_block_event_loop():
+    write_queue, reply_queue = queue.Queue(), queue.Queue()
+    writes = WriteChannel(write_queue, reply_queue, timeout=5)
+
+    async def scenario():
+        ticks = 0
+        call = asyncio.create_task(asyncio.to_thread(writes.call, 'db', 'add_subscriber', (42,), {}))
+        # Пока запись ждет ответа, event loop обслуживает другие задачи
+        while write_queue.empty():
+            await asyncio.sleep(0.01)
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        reply_queue.put((1, True, True))
+        return ticks, await call
+
+    assert asyncio.run(scenario()) == (5, True)
@@ -0,0 +1,67 @@
+"""Скомпилированный файл словаря: индексы из файла и правки поверх него"""
+import os
+
+import pytest
+
+from change_bus import ChangeBus
+from description_search import DescriptionIndex
+from dictionary_artifact import DictionaryCompiler, open_artifact, read_revision
+from dictionary_snapshot import SnapshotStore
+from glossary import GlossaryIndex
+from storage_backend import TERM
+
+
+@pytest.fixture
+def compiled(db, tmp_path):
+    db.add_term("Шипр", "Аромат с дубовым мхом и бергамотом", "Семейства", synonyms="chypre")
+    db.add_term("Фужер", "Аромат с лавандой и кумарином", "Семейства")
+    path = str(tmp_path / 'dictionary.bin')
+    compiler = DictionaryCompiler(db, path)
+    assert compiler.refresh() and not compiler.refresh()
+    return compiler, path
+
+
+def test_indexes_from_file_with_later_terms(db, compiled):
+    compiler, path = compiled
+    artifact = open_artifact(path, db)
+    glossary, descriptions = GlossaryIndex(db, artifact), DescriptionIndex(db, artifact=artifact)
+    changes = ChangeBus(db, revision=artifact.revision)
+    changes.subscribe(descriptions.apply_change, TERM)
+    assert [name for _, name in glossary.find_terms("шипр или фужер")] == ["Шипр", "Фужер"]
+    assert [term.term for term in descriptions.search("мох и бергамот")] == ["Шипр"]
+
+    # Новые термины дочитываются из базы поверх файла (индекс описаний - по шине изменений)
+    db.add_term("Амбра", "Теплый сладковатый аромат морского происхождения", "Ноты")
+    changes.sync()
+    assert [name for _, name in glossary.find_terms("серая амбра")] == ["Амбра"]
+    assert [term.term for term in descriptions.search("морского происхождения")] == ["Амбра"]
+    assert compiler.refresh() and read_revision(path) == db.get_revision()
+
+
+def test_snapshot_from_file_with_later_changes(db, compiled, monkeypatch):
+    _, path = compiled
+    chypre = db.search_terms("Шипр")[0].id
+    fougere = db.search_terms("Фужер")[0].id
+    db.update_term(chypre, {'definition': "Аккорд дубового мха"})
+    db.delete_term(fougere)
+    db.add_term("Амбра", "Теплый сладковатый аромат", "Ноты", synonyms="ambergris")
+
+    def entries(store):
+        return [(entry.record.id, entry.record.term, entry.record.definition, entry.record.examples,
+                 entry.record.synonyms, entry.record.category_name, entry.name_norm, entry.keys)
+                for entry in store.current.ordered]
+
+    expected = entries(SnapshotStore(db))
+    # Тексты берутся из файла, из базы читаются только изменения после его ревизии
+    with monkeypatch.context() as patch:
+        patch.setattr(db, 'get_term_documents', None)
+        store = SnapshotStore(db, artifact=open_artifact(path, db))
+    assert entries(store) == expected and store.current.revision == db.get_revision()
+
+
+def test_corrupted_file_is_rejected(db, compiled):
+    _, path = compiled
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+    assert open_artifact(path, db) is None
@@ -0,0 +1,80 @@
+"""Снимок словаря в памяти: совпадение с хранилищем и копирование при записи"""
+import pytest
+
+from change_bus import ChangeBus
+from dictionary_snapshot import DictionarySnapshot, SnapshotStore
+
+
+def assert_same_as_rebuilt(snapshot: DictionarySnapshot):
+    """Снимок, полученный копированием при записи, совпадает с собранным заново"""
+    rebuilt = DictionarySnapshot(snapshot.revision, snapshot.entries, snapshot.categories)
+    assert snapshot.ordered == rebuilt.ordered and snapshot.order_keys == rebuilt.order_keys
+    for name in ('names', 'keys', 'synonym_keys'):
+        assert {key: sorted(ids) for key, ids in getattr(snapshot, name).items()} == \
+            {key: sorted(ids) for key, ids in getattr(rebuilt, name).items()}, name
+    assert snapshot.category_terms == rebuilt.category_terms
+
+
+@pytest.fixture
+def terms(db):
+    chypre = db.add_term("Шипр", "Аромат с дубовым мхом и бергамотом", "Семейства", synonyms="chypre")
+    db.add_term("Шипровый фужер", "Шипр с лавандой", "Семейства")
+    edp = db.add_term("EDP", "Парфюмерная вода", "Концентрации", synonyms="парфюмерная вода")
+    return chypre, edp
+
+
+@pytest.fixture
+def store(db, terms):
+    store = SnapshotStore(db)
+    store.bus = ChangeBus(db, revision=store.current.revision)
+    store.bus.subscribe_batch(store.apply_changes)
+    return store
+
+
+@pytest.mark.parametrize('query', ["шипр", "Chypre", "Эдп", "парфюмерная", "фужер", "нет такого", ""])
+def test_tiers_match_storage(db, store, query):
+    expected = [term.id for term in db.search_terms(query, definitions=False)]
+    assert [term.id for term in store.current.search_terms(query)] == expected
+
+
+def test_reads_match_storage(db, store, terms):
+    chypre, _ = terms
+    assert store.current.get_term_by_id(chypre).definition == "Аромат с дубовым мхом и бергамотом"
+    assert [c.name for c in store.current.get_categories()] == [c.name for c in db.get_categories()]
+    assert store.current.count_terms_by_category() == db.count_terms_by_category()
+
+
+def test_old_reader_keeps_its_snapshot(db, store, terms):
+    chypre, edp = terms
+    reader = store.current
+    db.update_term(chypre, {'term': "Шипр классический"})
+    db.delete_term(edp)
+    db.add_term("Амбра", "Теплый сладковатый аромат", "Ноты")
+    store.bus.sync()
+    assert reader.get_term_by_id(chypre).term == "Шипр" and reader.get_term_by_id(edp)
+    assert store.current.get_term_by_id(chypre).term == "Шипр классический"
+    assert store.current.get_term_by_id(edp) is None
+    assert [term.term for term in store.current.search_terms("амбра")] == ["Амбра"]
+    assert store.current.revision == db.get_revision()
+    assert_same_as_rebuilt(store.current)
+
+
+def test_bulk_import_publishes_one_snapshot(db, store):
+    published = []
+    store._publish = lambda snapshot: published.append(snapshot) or setattr(store, 'current', snapshot)
+    term_ids = [db.add_term(f"Термин {i}", "Определение", "Новая категория") for i in range(50)]
+    store.bus.sync()
+    assert len(published) == 1
+    category_id = store.current.get_term_by_id(term_ids[-1]).category_id
+    assert len(store.current.get_category_terms(category_id)) == 50
+    assert_same_as_rebuilt(store.current)
+
+
+def test_category_rename_and_usage_refresh(db, store, terms):
+    chypre, _ = terms
+    category_id = store.current.get_term_by_id(chypre).category_id
+    db.update_category(category_id, {'name': "Ольфакторные семейства"})
+    store.bus.sync()
+    assert store.current.get_term_by_id(chypre).category_name == "Ольфакторные семейства"
+    db.increment_usage(chypre)
+    assert store.refresh_usage().get_term_by_id(chypre).usage_count == 1
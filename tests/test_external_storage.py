@@ -0,0 +1,49 @@
+"""Журнал поисков и предложений: отложенная запись и fsync только при остановке"""
+import json
+import os
+
+import pytest
+
+from external_storage import ExternalStorage
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return ExternalStorage()
+
+
+def read(storage):
+    with open(storage.log_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_search_is_written_later_without_fsync(storage, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    for i in range(1005):
+        storage.log_search(42, f"запрос {i}", found=bool(i % 2))
+    storage.save_user_suggestion(42, "user", "Шипр", "Аккорд дубового мха")
+    assert read(storage) == {"searches": [], "suggestions": []}
+
+    assert storage.flush() and not storage.flush()
+    data = read(storage)
+    assert len(data["searches"]) == 1000 and data["searches"][-1]["query"] == "запрос 1004"
+    assert storage.get_suggestions_count() == 1 and not synced
+
+
+def test_shutdown_flush_syncs_to_disk(storage, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    storage.log_search(42, "шипр", found=True)
+    assert storage.flush(durable=True) and len(synced) == 1
+    assert ExternalStorage().get_searches_count() == 1
+
+
+def test_each_dictionary_has_own_file(tmp_path):
+    perfume = ExternalStorage(str(tmp_path / 'logs' / 'perfume_user_data.json'))
+    wine = ExternalStorage(str(tmp_path / 'logs' / 'wine_user_data.json'))
+    perfume.log_search(1, "шипр")
+    perfume.flush()
+    wine.flush()
+    assert read(perfume)["searches"] and read(wine) == {"searches": [], "suggestions": []}
@@ -0,0 +1,91 @@
+"""Автомат Ахо-Корасик и режим "глоссарий текста" """
+import random
+
+from aho_corasick import AhoCorasick
+from change_bus import ChangeBus
+from glossary import GlossaryIndex
+from storage_backend import TERM
+
+
+def matches(automaton, text):
+    return sorted(automaton.iter_matches(text))
+
+
+def automaton_of(patterns):
+    automaton = AhoCorasick()
+    for pattern, value in patterns:
+        automaton.add(pattern, value)
+    return automaton
+
+
+def test_overlapping_matches():
+    automaton = automaton_of([('he', 1), ('she', 2), ('his', 3), ('hers', 4), ('he', 5)])
+    assert matches(automaton, "ushers") == [(1, 4, 2), (2, 4, 1), (2, 4, 5), (2, 6, 4)]
+    assert matches(automaton, "ahishe") == [(1, 4, 3), (3, 6, 2), (4, 6, 1), (4, 6, 5)]
+    assert len(automaton) == 4
+
+
+def test_incremental_changes_match_fresh_build():
+    rng = random.Random(7)
+    alphabet = 'абвг'
+    patterns = {(''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))), value) for value in range(40)}
+    automaton = automaton_of(patterns)
+    text = ''.join(rng.choice(alphabet) for _ in range(300))
+    matches(automaton, text)
+
+    # Добавления и удаления после построения, как по событиям шины изменений
+    removed = set(rng.sample(sorted(patterns), 15))
+    added = {(''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))), value) for value in range(40, 60)}
+    for pattern, value in removed:
+        automaton.discard(pattern, value)
+    for pattern, value in added:
+        automaton.add(pattern, value)
+    automaton.discard('нет такой', 1)
+
+    final = (patterns - removed) | added
+    assert matches(automaton, text) == matches(automaton_of(final), text)
+    assert len(automaton) == len({pattern for pattern, _ in final})
+
+
+def test_whole_words_in_cyrillic_and_latin(db):
+    chypre = db.add_term("Шипр", "Семейство ароматов", "Семейства", synonyms="chypre")
+    edp = db.add_term("EDP", "Парфюмерная вода", "Концентрации")
+    db.add_term("Уд", "Смола агарового дерева", "Сырье")
+    glossary = GlossaryIndex(db)
+
+    # Синоним латиницей и название кириллицей - один термин; "ЭДП" совпадает с EDP
+    assert glossary.find_terms("Классический CHYPRE, он же шипр, в концентрации ЭДП.") == [
+        (chypre, "Шипр"), (edp, "EDP")]
+    # Часть слова не считается, слишком короткие названия не ищутся
+    assert glossary.find_terms("Шипровый уд и edpx") == []
+
+
+def test_longest_match_wins(db):
+    moss = db.add_term("Мох", "Лишайник", "Сырье")
+    oakmoss = db.add_term("Дубовый мох", "Лишайник с дуба", "Сырье")
+    oak = db.add_term("Дубовый", "Прилагательное", "Разное")
+    glossary = GlossaryIndex(db)
+    assert glossary.find_terms("Дубовый мох") == [(oakmoss, "Дубовый мох")]
+    assert glossary.find_terms("мох, дубовый мох и дубовый лист") == [
+        (moss, "Мох"), (oakmoss, "Дубовый мох"), (oak, "Дубовый")]
+
+
+def test_change_events_match_fresh_index(db):
+    ids = [db.add_term(f"Аккорд {name}", "Определение", "Аккорды", synonyms=f"{name} accord")
+           for name in ("амбровый", "кожаный", "цветочный", "древесный")]
+    glossary = GlossaryIndex(db)
+    changes = ChangeBus(db)
+    changes.subscribe(glossary.apply_change, TERM)
+    glossary.sync()
+
+    db.update_term(ids[0], {'term': "Амбра", 'synonyms': "ambergris"})
+    db.delete_term(ids[1])
+    db.merge_terms(ids[2], ids[3])
+    new = db.add_term("Фужер", "Аккорд лаванды", "Аккорды")
+    changes.sync()
+
+    text = ("Аккорд амбровый, амбра и ambergris; аккорд кожаный; цветочный accord и аккорд древесный, "
+            "а также фужер")
+    fresh = GlossaryIndex(db).find_terms(text)
+    assert glossary.find_terms(text) == fresh
+    assert {term_id for term_id, _ in fresh} == {ids[0], ids[3], new}
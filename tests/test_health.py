@@ -0,0 +1,75 @@
+"""Пробы живости и готовности на синтетической нагрузке"""
+import asyncio
+import threading
+import time
+
+from health import HealthMonitor
+
+
+class SlowDatabase:
+    delay = 0.0
+
+    def ping(self):
+        time.sleep(self.delay)
+
+
+def test_probes():
+    async def scenario():
+        db = SlowDatabase()
+        monitor = HealthMonitor(db, interval=0.05, db_interval=0.05, stall_after=0.5, max_db_rtt=0.1)
+        monitor.start()
+        monitor.add_queue('writes', lambda: 5)
+        monitor.warm_up('glossary', lambda: time.sleep(0.1))
+        assert monitor.handle_request('/readyz')[0] == 503
+        await asyncio.sleep(0.3)
+        assert monitor.handle_request('/healthz')[0] == 200
+        status, _, body = monitor.handle_request('/readyz')
+        assert status == 200, body.decode()
+
+        # Медленная база: не готов, но жив
+        db.delay = 0.3
+        await asyncio.sleep(0.5)
+        assert monitor.handle_request('/readyz')[0] == 503
+        assert monitor.handle_request('/healthz')[0] == 200
+        db.delay = 0.0
+        await asyncio.sleep(0.4)
+        assert monitor.handle_request('/readyz')[0] == 200
+
+        # Зависший event loop: проба из другого потока отвечает 503, а не таймаутом
+        result = {}
+        probe = threading.Thread(target=lambda: (time.sleep(0.8), result.update(
+            status=monitor.handle_request('/healthz')[0])))
+        probe.start()
+        time.sleep(1.0)
+        probe.join()
+        assert result['status'] == 503
+        await asyncio.sleep(0.2)
+        assert monitor.handle_request('/healthz')[0] == 200
+
+        # Остановка: балансировщик перестает направлять трафик, процесс жив
+        monitor.begin_shutdown()
+        assert monitor.handle_request('/readyz')[0] == 503
+        assert monitor.handle_request('/healthz')[0] == 200
+        monitor.stop()
+
+    asyncio.run(scenario())
+
+
+class BrokenDatabase:
+    def ping(self):
+        raise OSError("database is locked")
+
+
+def test_every_database_is_probed():
+    async def scenario():
+        monitor = HealthMonitor(interval=0.05, db_interval=0.05)
+        monitor.add_database('perfume', SlowDatabase())
+        monitor.add_database('wine', BrokenDatabase())
+        monitor.start()
+        await asyncio.sleep(0.2)
+        ready, state = monitor.readiness()
+        assert not ready and state['problems'] == ['ошибка базы wine: database is locked']
+        assert state['databases']['perfume']['error'] is None
+        monitor.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,93 @@
+"""Структурированное логирование: отложенное форматирование, прореживание, JSON и fork"""
+import io
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+import logging_setup
+from logging_setup import JsonFormatter, SamplingFilter, setup_logging, stop_logging
+
+
+@pytest.fixture
+def root_logger():
+    """Возвращает корневому логгеру обработчики и уровень pytest после теста"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    stop_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def make_record(msg='событие', args=(), level=logging.INFO, **extra):
+    record = logging.LogRecord('bot', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_mutable_arguments_are_formatted_at_call_time(root_logger):
+    stream = io.StringIO()
+    setup_logging(stream=stream)
+    queries = ['шипр']
+    logging.getLogger('bot').info("Запросы: %s, всего %d", queries, 1)
+    queries.append('фужер')
+    logging.getLogger('bot').info("Словарь: %(terms)s", {'terms': 5})
+    stop_logging()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line['msg'] for line in lines] == ["Запросы: ['шипр'], всего 1", "Словарь: 5"]
+
+
+def test_sampling_keeps_every_nth_info_record():
+    sampler = SamplingFilter({'search': 0.25, 'noise': 0})
+    records = [make_record(event='search') for _ in range(8)]
+    kept = [record for record in records if sampler.filter(record)]
+    assert kept == [records[0], records[4]] and all(record.sampled == 4 for record in kept)
+    assert not sampler.filter(make_record(event='noise'))
+    # Предупреждения и записи без события не прореживаются
+    warnings = [make_record(event='search', level=logging.WARNING) for _ in range(4)]
+    assert all(sampler.filter(record) for record in warnings)
+    assert not any(hasattr(record, 'sampled') for record in warnings)
+    assert sampler.filter(make_record())
+
+
+def test_json_formatter_includes_extra_fields():
+    record = make_record("Поиск: %s", ('шипр',), event='search', user='ab12', results=3)
+    try:
+        raise ValueError("сбой")
+    except ValueError:
+        record.exc_info = sys.exc_info()
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['msg'] == "Поиск: шипр" and entry['level'] == 'INFO' and entry['logger'] == 'bot'
+    assert (entry['event'], entry['user'], entry['results']) == ('search', 'ab12', 3)
+    assert 'ValueError: сбой' in entry['exc']
+    assert 'args' not in entry and 'msecs' not in entry
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="нужен fork")
+def test_child_process_restarts_output_thread(root_logger, tmp_path):
+    path = tmp_path / 'log.jsonl'
+    with open(path, 'w', encoding='utf-8') as stream:
+        setup_logging(stream=stream)
+        logging.getLogger('bot').info("родитель")
+        # Очередь дописывается до fork, чтобы буфер потока не унаследовался
+        stop_logging()
+        setup_logging(stream=stream)
+        pid = os.fork()
+        if pid == 0:
+            # Поток вывода родителя в дочернем процессе не существует - запущен новый
+            code = 0 if logging_setup._listener is not None and logging_setup._listener._thread.is_alive() else 1
+            logging.getLogger('bot').info("потомок")
+            stop_logging()
+            stream.flush()
+            os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        stop_logging()
+    assert os.waitstatus_to_exitcode(status) == 0
+    messages = [json.loads(line)['msg'] for line in path.read_text(encoding='utf-8').splitlines()]
+    assert messages == ["родитель", "потомок"]
@@ -0,0 +1,31 @@
+"""Сводки неуспешных поисков (Space-Saving)"""
+import random
+from collections import Counter
+
+from missed_queries import Miss, SpaceSaving, merge_top
+
+
+def test_sketch_bounds_on_zipf_stream():
+    # Сводка на 100 строк против точного подсчета на потоке с распределением Ципфа
+    random.seed(1)
+    stream = [f"запрос {int(random.paretovariate(1.1))}" for _ in range(100000)]
+    sketch = SpaceSaving(100)
+    for i, key in enumerate(stream):
+        sketch.add(key, i)
+    exact = Counter(stream)
+    assert len(sketch) == 100
+    for key, count in sketch.counts.items():
+        assert count - sketch.errors[key] <= exact[key] <= count
+    top = [miss.query for miss in merge_top([sketch], 10)]
+    assert top == [key for key, _ in exact.most_common(10)]
+    assert SpaceSaving.from_json(sketch.to_json()).counts == sketch.counts
+
+
+def test_merge_days_keeps_error_of_evicted_query():
+    # Объединение дней: строка, вытесненная из одного дня, получает погрешность
+    day1, day2 = SpaceSaving(2), SpaceSaving(2)
+    for key in ["шипр", "шипр", "фужер", "амбра"]:
+        day1.add(key)
+    for key in ["шипр", "уд"]:
+        day2.add(key)
+    assert merge_top([day1, day2], 2) == [Miss("шипр", 3, 0, None), Miss("амбра", 3, 2, None)]
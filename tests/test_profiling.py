@@ -0,0 +1,46 @@
+"""Профилирование по запросу на синтетической нагрузке"""
+import asyncio
+import marshal
+
+import pytest
+
+from profiling import MODES, Profiler, handle_request
+
+
+def busy(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_session_sees_workload(mode):
+    async def workload(profiler: Profiler):
+        profiler.attach()
+        kept = []
+        profiler.start(mode, 0.5)
+        while profiler.running:
+            busy(300000)
+            kept.append(bytearray(1024))
+            await asyncio.sleep(0.001)
+        return kept
+
+    profiler = Profiler()
+    asyncio.run(workload(profiler))
+    session = profiler.session
+    assert session.error is None
+    if mode == 'cprofile':
+        assert 'busy' in {name for _, _, name in marshal.loads(session.pstats_data)}
+    elif mode == 'sampling':
+        assert 'test_profiling.py:busy' in session.folded
+    else:
+        assert 'test_profiling.py' in session.summary
+
+
+def test_endpoints_require_token():
+    profiler = Profiler()
+    headers = {'Authorization': 'Bearer secret'}
+    assert handle_request(profiler, None, 'GET', '/debug/profile', headers)[0] == 404
+    assert handle_request(profiler, 'secret', 'GET', '/debug/profile', {})[0] == 403
+    # Результата еще нет: сессия не запускалась
+    assert handle_request(profiler, 'secret', 'GET', '/debug/profile/pstats', headers)[0] == 409
+    assert handle_request(profiler, 'secret', 'POST', '/debug/profile/start?mode=perf', headers)[0] == 400
+    assert handle_request(profiler, 'secret', 'GET', '/', headers) is None
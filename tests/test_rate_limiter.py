@@ -0,0 +1,64 @@
+"""Ограничение частоты: корзины пользователей и общий лимит отправки"""
+import asyncio
+import time
+
+from rate_limiter import AsyncRateLimiter, RateLimiter
+
+
+def test_burst_then_refill():
+    limiter = RateLimiter(rate=2, burst=3)
+    assert [limiter.allow(1, now=0) for _ in range(4)] == [True, True, True, False]
+    # За полсекунды набирается один токен
+    assert limiter.allow(1, now=0.5) and not limiter.allow(1, now=0.5)
+    # Долгая пауза не копит больше burst токенов
+    assert sum(limiter.allow(1, now=100) for _ in range(5)) == 3
+    # У другого пользователя своя корзина
+    assert limiter.allow(2, now=100)
+
+
+def test_warns_once_per_series():
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.allow(1, now=0) and not limiter.allow(1, now=0)
+    assert limiter.should_warn(1) and not limiter.should_warn(1)
+    assert not limiter.allow(1, now=0.5) and not limiter.should_warn(1)
+    # После разрешенного запроса следующая серия ограничений снова предупреждается
+    assert limiter.allow(1, now=2) and not limiter.allow(1, now=2)
+    assert limiter.should_warn(1)
+    assert not limiter.should_warn(3)
+
+
+def test_evicts_idle_and_oldest_users():
+    limiter = RateLimiter(rate=1, burst=2, idle_ttl=60, max_users=3)
+    for user_id in range(3):
+        limiter.allow(user_id, now=0)
+    limiter.allow(0, now=10)
+    # Четвертый пользователь вытесняет того, кто обращался раньше всех
+    limiter.allow(3, now=10)
+    assert len(limiter) == 3 and 1 not in limiter._buckets and 0 in limiter._buckets
+    # Простаивающие дольше idle_ttl удаляются при следующем обращении
+    limiter.allow(4, now=65)
+    assert sorted(limiter._buckets) == [0, 3, 4]
+    limiter.allow(4, now=200)
+    assert list(limiter._buckets) == [4]
+
+
+def test_async_limiter_rate_and_pause():
+    limiter = AsyncRateLimiter(rate=50, burst=1)
+
+    async def acquire(times):
+        started = time.monotonic()
+        for _ in range(times):
+            await limiter.acquire()
+        return time.monotonic() - started
+
+    async def scenario():
+        # Первый токен есть сразу, остальные - по одному в 20 мс
+        spaced = await acquire(6)
+        limiter.pause(0.2)
+        # Пауза останавливает всех отправителей, а не одного
+        paused = await asyncio.gather(acquire(1), acquire(1))
+        return spaced, paused
+
+    spaced, paused = asyncio.run(scenario())
+    assert spaced >= 0.09
+    assert min(paused) >= 0.19
@@ -0,0 +1,54 @@
+"""Разметка MarkdownV2: экраны и ответы с пользовательскими названиями"""
+import pytest
+
+from markdown_v2 import TRICKY_NAMES, parse_markdown_v2
+from rendering import (HELP, HELP_SHORT, HISTORY, HISTORY_EMPTY, MAIN_MENU_TEXT, MENU_HINT, NOT_FOUND,
+                       NOT_SUBSCRIBED, SEARCH_EXPIRED, SUBSCRIBED, SUBSCRIPTION, SUGGEST, SUGGEST_CANCELLED,
+                       SUGGEST_DEFINITION, SUGGEST_INVALID, SUGGEST_PENDING, SUGGEST_SAVED, WELCOME, escape,
+                       escape_code, markdown, render_categories, render_category_terms, render_search_results,
+                       render_stats, render_term_card)
+from term_record import CategoryRecord, TermRecord
+
+CATEGORY = CategoryRecord(1, "Ноты (база)", "Нижние_ноты.")
+TERMS = [TermRecord(id=i, term=name, definition=f"Определение {name}", category_id=1,
+                    category_name=CATEGORY.name, examples=name, synonyms=name, usage_count=i)
+         for i, name in enumerate(TRICKY_NAMES, 1)]
+
+
+@pytest.mark.parametrize('screen', [
+    WELCOME.render(name="*Ольга_"), MENU_HINT, MAIN_MENU_TEXT.render(name="[Оля]"), HELP, HELP_SHORT,
+    SUGGEST, SUGGEST_DEFINITION.render(term="Black Opium*"), SUGGEST_CANCELLED,
+    SUGGEST_INVALID.render(error="Объяснение слишком короткое (нужно хотя бы 10 символов)"),
+    SUGGEST_SAVED.render(term="_"), SUGGEST_PENDING.render(term="No.5"),
+    HISTORY, HISTORY_EMPTY, SUBSCRIPTION.render(time="10:00") + SUBSCRIBED, NOT_SUBSCRIBED, SEARCH_EXPIRED,
+])
+def test_static_screens(screen):
+    parse_markdown_v2(screen)
+
+
+@pytest.mark.parametrize('term', TERMS, ids=lambda term: str(term.id))
+def test_user_text_is_escaped(term):
+    card = parse_markdown_v2(render_term_card(term, markdown("🗓 *Термин дня*")))
+    assert term.term in card and "Термин дня" in card
+    assert f"'{term.term}'" in parse_markdown_v2(NOT_FOUND.render(query=term.term))
+    assert parse_markdown_v2(escape(term.term)) == term.term
+    assert parse_markdown_v2(f"`{escape_code(term.term)}`") == term.term
+
+
+def test_lists():
+    assert "Eau de Parfum (EDP)" in parse_markdown_v2(render_search_results("(", TERMS, by_description=False))
+    assert "Black Opium*" in parse_markdown_v2(render_search_results("*", TERMS, by_description=True))
+    assert "11. Eau de Parfum (EDP)" in parse_markdown_v2(
+        render_search_results("(", TERMS[:10], False, total=25, offset=10))
+    assert "Нижние_ноты." in parse_markdown_v2(render_categories([CATEGORY], {1: len(TERMS)}))
+    assert "__init__" in parse_markdown_v2(render_category_terms(CATEGORY, TERMS))
+    parse_markdown_v2(render_category_terms(CATEGORY, []))
+    stats = {'total_terms': 1, 'total_categories': 1, 'searches_week': 0, 'pending_suggestions': 0,
+             'popular_terms': [{'term': name, 'usage_count': 1} for name in TRICKY_NAMES]}
+    assert "Sauvage!" in parse_markdown_v2(render_stats(stats, {'day': 1, 'week': 2, 'month': 3}))
+
+
+@pytest.mark.parametrize('broken', ["Sauvage!", "*Black Opium", "`code", "a\\b"])
+def test_checker_rejects_unescaped_markup(broken):
+    with pytest.raises(ValueError):
+        parse_markdown_v2(broken)
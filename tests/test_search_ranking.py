@@ -0,0 +1,127 @@
+"""Единое ранжирование поиска и курсоры "Показать еще" """
+import pytest
+
+from change_bus import ChangeBus
+from description_search import DescriptionIndex
+from dictionary_snapshot import SnapshotStore
+from search_ranking import EXACT, PREFIX, Cursor, SearchCursors, SearchRanker, hit_key
+from storage_backend import TERM
+
+
+@pytest.fixture
+def terms(db):
+    return dict(
+        base=db.add_term("Базовые ноты", "Финальная часть аромата, которая звучит дольше всего",
+                         "Структура", synonyms="база, base notes"),
+        fixative=db.add_term("Фиксатор", "Вещество, замедляющее испарение", "Сырье", synonyms="основа базы"),
+        chypre=db.add_term("Шипр", "Аккорд дубового мха, бергамота и лабданума", "Семейства", synonyms="chypre"),
+        fougere=db.add_term("Шипровый фужер", "Фужер с дубовым мхом", "Семейства"),
+        amber=db.add_term("Амбра", "Теплый смолистый аромат, похожий на дубовый мох в шипрах", "Ноты"),
+    )
+
+
+@pytest.fixture
+def ranker(db, terms):
+    return SearchRanker(SnapshotStore(db), DescriptionIndex(db))
+
+
+def ids(page):
+    return [hit.record.id for hit in page.hits]
+
+
+def test_exact_synonym_above_synonym_part(ranker, terms):
+    assert ids(ranker.search("база"))[:2] == [terms['base'], terms['fixative']]
+
+
+def test_exact_name_first(ranker, terms):
+    page = ranker.search("шипр")
+    assert page.hits[0].signal == EXACT
+    assert ids(page) == [terms['chypre'], terms['fougere'], terms['amber']]
+    assert ids(ranker.search("chypre"))[0] == terms['chypre']
+
+
+def test_description_only(ranker, terms):
+    page = ranker.search("дубовый мох")
+    assert {terms['chypre'], terms['amber']} <= set(ids(page)) and page.by_description
+
+
+def test_keyset_pages(ranker):
+    # Страницы по курсору: без повторов и пропусков
+    whole = ids(ranker.search("шипр", limit=10))
+    first = ranker.search("шипр", limit=2)
+    second = ranker.search("шипр", limit=2, after=first.next_key)
+    assert ids(first) + ids(second) == whole and second.next_key is None
+    assert first.total == second.total == 3
+
+
+def test_pages_of_catch_all_query_follow_full_ranking(db):
+    # Равная популярность у многих терминов: порядок внутри оценки - по названию и ID
+    for i in range(60):
+        term_id = db.add_term(f"Термин {(i * 7) % 60}", f"Определение {i}", "Разное")
+        with db.get_connection() as conn:
+            conn.execute('UPDATE terms SET usage_count = ? WHERE id = ?', (i % 4, term_id))
+    ranker = SearchRanker(SnapshotStore(db), DescriptionIndex(db))
+    expected = [hit.record.id for hit in sorted(ranker.rank("терм"), key=hit_key)]
+    pages, after = [], None
+    while True:
+        page = ranker.search("терм", limit=7, after=after)
+        pages += ids(page)
+        assert page.total == 60 and all(hit.signal == PREFIX for hit in page.hits)
+        after = page.next_key
+        if after is None:
+            break
+    assert pages == expected
+
+
+def test_pages_survive_usage_refresh(db):
+    # Между страницами обновляются счетчики запросов: оценки непоказанных и показанных терминов меняются
+    term_ids = [db.add_term(f"Термин {i}", f"Определение {i}", "Разное") for i in range(30)]
+    store = SnapshotStore(db)
+    ranker = SearchRanker(store, DescriptionIndex(db))
+    seen = []
+    while True:
+        page = ranker.search("терм", limit=7, exclude=seen)
+        seen += ids(page)
+        if page.next_key is None:
+            break
+        with db.get_connection() as conn:
+            # Последний по выдаче термин становится самым популярным, а показанный - наоборот
+            last = ranker.search("терм", limit=30).hits[-1].record.id
+            conn.execute('UPDATE terms SET usage_count = usage_count + 100 WHERE id = ?', (last,))
+            conn.execute('UPDATE terms SET usage_count = 0 WHERE id = ?', (seen[0],))
+        store.refresh_usage()
+    # Каждый термин показан ровно один раз
+    assert sorted(seen) == sorted(term_ids)
+
+
+def test_description_search_does_not_lock_or_query_db(db, terms, monkeypatch):
+    descriptions = DescriptionIndex(db)
+    descriptions.sync()
+    changes = ChangeBus(db)
+    changes.subscribe(descriptions.apply_change, TERM)
+
+    # Поиск читает опубликованное представление: писатель держит блокировку, база недоступна
+    def no_db(*args, **kwargs):
+        raise AssertionError("поиск обратился к базе")
+    with descriptions._lock, monkeypatch.context() as patch:
+        patch.setattr(db, 'get_term_documents', no_db)
+        assert descriptions.search_ids("дубовый мох")
+
+    # Новые и измененные термины приходят по шине изменений
+    fern = db.add_term("Папоротник", "Зеленый аккорд лаванды и кумарина", "Ноты")
+    db.update_term(terms['amber'], {'definition': "Теплый смолистый аромат"})
+    changes.sync()
+    assert [term_id for term_id, _ in descriptions.search_ids("лаванда")] == [fern]
+    assert terms['amber'] not in {term_id for term_id, _ in descriptions.search_ids("дубовый мох")}
+
+
+def test_cursors_expire_and_are_per_user():
+    cursors = SearchCursors(idle_ttl=60, max_cursors=2)
+    seen = (1, 2)
+    cursor_id = cursors.save(Cursor(1, "шипр", seen), now=0)
+    assert cursors.get(1, cursor_id, now=1).seen == seen and cursors.get(1, cursor_id, now=1).shown == 2
+    assert cursors.get(2, cursor_id, now=1) is None
+    assert cursors.get(1, cursor_id, now=61) is None
+    for _ in range(3):
+        cursors.save(Cursor(1, "шипр", seen), now=100)
+    assert len(cursors) == 2
@@ -0,0 +1,69 @@
+"""Выгрузка в Google Sheets на заглушке таблицы: без дублей после сбоев и перезапуска"""
+import pytest
+
+from fake_sheets import FakeAPIError, FakeSpreadsheet
+from sheets_sync import SheetsSync
+
+
+@pytest.fixture
+def spreadsheet():
+    return FakeSpreadsheet()
+
+
+@pytest.fixture
+def sync(db, spreadsheet):
+    """Синхронизация после первой выгрузки 1235 поисков и одного предложения"""
+    for i in range(1234):
+        db.log_search(i % 7, f"запрос {i}", found=False)
+    db.log_search(1, '=IMPORTXML("http://example.com")', found=False)
+    db.add_suggestion(1, 'user', 'Шипр', 'Семейство ароматов', 'Семейства')
+    sync = SheetsSync(db, lambda: spreadsheet, sleep=lambda delay: None)
+    assert sync.sync() == {'Поиски': 1235, 'Предложения': 1}
+    return sync
+
+
+def exported_ids(spreadsheet):
+    """ID выгруженных поисков; проверяет, что строки не повторяются"""
+    ids = [row[0] for row in spreadsheet.worksheets['Поиски'].rows[1:]]
+    assert ids == sorted(set(ids))
+    return ids
+
+
+def test_first_sync_in_batches(sync, spreadsheet):
+    searches = spreadsheet.worksheets['Поиски'].rows
+    assert len(searches) == 1236 and searches[0][0] == 'id'
+    assert spreadsheet.calls['append_rows'] == 2 + 3 + 1  # заголовки и пачки по 500
+    # Формулы выгружаются как текст
+    assert searches[1235][3].startswith('=IMPORTXML')
+
+
+def test_temporary_error_is_retried(db, sync, spreadsheet):
+    db.log_search(1, 'шипр', found=False)
+    spreadsheet.fail_next('append_rows', FakeAPIError(429, 'Quota exceeded'))
+    assert sync.sync()['Поиски'] == 1
+    assert len(exported_ids(spreadsheet)) == 1236
+
+
+def test_timeout_after_write_does_not_duplicate(db, sync, spreadsheet):
+    db.log_search(1, 'фужер', found=False)
+    spreadsheet.fail_next('append_rows', TimeoutError('read timeout'), applied=True)
+    assert sync.sync()['Поиски'] == 1
+    assert len(exported_ids(spreadsheet)) == 1236
+
+
+def test_crash_before_saving_position(db, sync, spreadsheet):
+    # Падение между записью и сохранением позиции: после перезапуска дублей нет
+    db.log_search(1, 'амбра', found=False)
+    restarted = SheetsSync(db, lambda: spreadsheet, sleep=lambda delay: None)
+    db.set_cursor('sheets_searches_id', db.get_cursor('sheets_searches_id') - 100)
+    assert restarted.sync()['Поиски'] == 1
+    assert len(exported_ids(spreadsheet)) == 1236
+
+
+def test_permanent_error_keeps_position(db, sync, spreadsheet):
+    db.log_search(1, 'кожа', found=False)
+    spreadsheet.fail_next('append_rows', FakeAPIError(403, 'Forbidden'))
+    with pytest.raises(FakeAPIError):
+        sync.sync()
+    assert sync.sync()['Поиски'] == 1
+    assert len(exported_ids(spreadsheet)) == 1236
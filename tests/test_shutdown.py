@@ -0,0 +1,53 @@
+"""Последовательность остановки по SIGTERM без Telegram"""
+import asyncio
+import os
+import signal
+import time
+
+from shutdown import GracefulShutdown
+
+
+class FakeApplication:
+    def __init__(self):
+        self.stopped = asyncio.Event()
+
+    def stop_running(self):
+        self.stopped.set()
+
+
+def test_drain_then_steps():
+    async def scenario():
+        shutdown = GracefulShutdown(drain_timeout=0.3, total_timeout=2.0)
+        app = FakeApplication()
+        readiness = []
+        shutdown.install(app, on_signal=lambda: readiness.append('draining'))
+        finished = []
+
+        @shutdown.cancellable
+        async def long_job():
+            await asyncio.sleep(0.05)
+            finished.append('short part')
+            await asyncio.sleep(60)
+
+        job = asyncio.create_task(long_job())
+        await asyncio.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGTERM)
+        await app.stopped.wait()
+        assert readiness == ['draining'] and shutdown.stopping
+
+        # Application.stop() ждет задачу, пока ее не прервет сторож
+        await job
+        shutdown.drained()
+        assert 0.25 < shutdown.phases[0][1] < 1.0, shutdown.phases
+        assert finished == ['short part'] and 1.0 < shutdown.remaining() < 1.8
+        return shutdown
+
+    shutdown = asyncio.run(scenario())
+    shutdown.add_step('flush', lambda: time.sleep(0.02))
+    shutdown.add_step('broken', lambda: 1 / 0)
+    shutdown.add_step('close', lambda: None)
+    shutdown.run_steps()
+    assert [(name, ok) for name, _, ok in shutdown.phases] == [
+        ('drain', True), ('flush', True), ('broken', False), ('close', True)
+    ]
+    assert 'broken' in shutdown.report()
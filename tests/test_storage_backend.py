@@ -0,0 +1,288 @@
+"""Соответствие хранилищ интерфейсу StorageBackend
+
+PostgreSQL проверяется, если задан TEST_DATABASE_URL (схема conformance_check пересоздается).
+"""
+import os
+import time
+
+import pytest
+
+from storage_backend import CATEGORY, CREATE, DELETE, MERGE, MISS_CURSOR, TERM, UPDATE
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def backend(request, tmp_path):
+    """Пустое хранилище каждого вида"""
+    if request.param == 'sqlite':
+        from database import PerfumeDatabase
+        backend = PerfumeDatabase(str(tmp_path / 'check.db'))
+    else:
+        dsn = os.getenv('TEST_DATABASE_URL')
+        if not dsn:
+            pytest.skip("TEST_DATABASE_URL не задан")
+        from postgres_backend import PostgresBackend
+        backend = PostgresBackend(dsn, schema='conformance_check', reset=True)
+    yield backend
+    backend.close()
+
+
+def test_conformance(backend):
+    assert backend.get_stats()['total_terms'] == 0, "Проверка требует пустого хранилища"
+    backend.ping()
+    assert backend.get_random_term() is None
+    assert backend.search_terms('ноты') == []
+
+    base_id = backend.add_term("Базовые ноты", "Финальная часть аромата", "Структура аромата",
+                               "Сандал, мускус", "база, base notes")
+    top_id = backend.add_term("Верхние ноты", "Ароматы, которые ощущаются сразу", "Структура аромата",
+                              "Цитрус", "топ ноты, head notes")
+    edp_id = backend.add_term("EDP", "Eau de Parfum - парфюмерная вода", "Концентрации",
+                              None, "парфюмерная вода")
+    lone_id = backend.add_term("Шлейф", "След аромата, который остается за человеком")
+
+    # Поиск: точное совпадение, синонимы, часть названия, определение
+    assert [t.id for t in backend.search_terms('edp')] == [edp_id]
+    assert [t.id for t in backend.search_terms('base notes')] == [base_id]
+    assert [t.id for t in backend.search_terms('ноты')] == [top_id]
+    assert [t.id for t in backend.search_terms('ерхн')] == [top_id]
+    assert [t.id for t in backend.search_terms('след аромата')] == [lone_id]
+    assert [t.id for t in backend.search_terms('аромат')] == [base_id, top_id, lone_id]
+    assert len(backend.search_terms('аромат', limit=1)) == 1
+    assert backend.search_terms('100%') == []
+
+    # Нормализация: регистр, пунктуация, ё/е и написание другим алфавитом
+    assert [t.id for t in backend.search_terms('  ВЕРХНИЕ   ноты!')] == [top_id]
+    assert [t.id for t in backend.search_terms('Эдп')] == [edp_id]
+    assert [t.id for t in backend.search_terms('хеад нотес')] == [top_id]
+    assert [t.id for t in backend.search_terms('base-notes')] == [base_id]
+    assert [t.id for t in backend.search_terms('шлёйф')] == [lone_id]
+    assert backend.search_terms(' ?! ') == []
+    assert backend.search_terms('след аромата', definitions=False) == []
+    assert [t.id for t in backend.search_terms('ерхн', definitions=False)] == [top_id]
+
+    assert [t.id for t in backend.get_terms_by_ids([lone_id, 10 ** 6, base_id])] == [lone_id, base_id]
+    assert backend.get_terms_by_ids([lone_id])[0].definition == "След аромата, который остается за человеком"
+    assert backend.get_terms_by_ids([]) == []
+    assert backend.get_term_documents(after_id=edp_id) == [
+        (lone_id, "Шлейф", "След аромата, который остается за человеком", None, None)
+    ]
+    assert len(backend.get_term_documents()) == 4
+
+    assert backend.get_term_patterns() == [
+        (base_id, "Базовые ноты", "база, base notes"), (top_id, "Верхние ноты", "топ ноты, head notes"),
+        (edp_id, "EDP", "парфюмерная вода"), (lone_id, "Шлейф", None)
+    ]
+    assert backend.get_term_patterns(after_id=edp_id) == [(lone_id, "Шлейф", None)]
+
+    term = backend.get_term_by_id(base_id)
+    assert term.term == "Базовые ноты" and term.category_name == "Структура аромата"
+    assert term.examples == "Сандал, мускус" and term.usage_count == 0
+    assert backend.get_term_by_id(lone_id).category_name is None
+    assert backend.get_term_by_id(10 ** 6) is None
+    assert backend.get_random_term().id in (base_id, top_id, edp_id, lone_id)
+
+    # Популярность влияет на порядок результатов
+    backend.increment_usage(top_id)
+    backend.increment_usage(top_id)
+    assert [t.id for t in backend.search_terms('аромат')] == [top_id, base_id, lone_id]
+    assert backend.get_term_by_id(top_id).usage_count == 2
+
+    categories = backend.get_categories()
+    assert [c.name for c in categories] == ["Концентрации", "Структура аромата"]
+    structure_id = categories[1].id
+    assert backend.get_category(structure_id).name == "Структура аромата"
+    assert backend.get_category(10 ** 6) is None
+    category_terms = backend.get_category_terms(structure_id)
+    assert [t.term for t in category_terms] == ["Базовые ноты", "Верхние ноты"]
+    assert category_terms[0].definition == "Финальная часть аромата"
+    assert backend.count_terms_by_category() == {categories[0].id: 1, structure_id: 2}
+
+    backend.log_search(1, 'ноты', top_id, found=True)
+    backend.log_search(1, 'шипр', found=False)
+    suggestion_id = backend.add_suggestion(1, 'user', 'Шипр', 'Семейство ароматов', 'Семейства')
+    assert suggestion_id
+    pending = backend.get_pending_suggestions()
+    assert [s['suggested_term'] for s in pending] == ['Шипр']
+
+    # Связанные термины: совместные поиски в сессии и соседи по категории
+    from missed_queries import MissTracker
+    from unique_users import UniqueUsers
+    from recommendations import RelatedTermsIndexer
+    backend.log_search(1, 'edp', edp_id, found=True)
+    backend.log_search(2, 'шлейф', lone_id, found=True)
+    backend.log_search(2, 'эдп', edp_id, found=True)
+    searches = backend.get_term_searches()
+    assert [row[2] for row in searches] == [top_id, edp_id, lone_id, edp_id]
+    assert backend.get_term_searches(after_id=searches[1][0], limit=1)[0][0] == searches[2][0]
+    assert len(backend.get_term_searches(since=time.time() - 3600)) == 4
+    assert backend.get_term_searches(since=time.time() + 3600) == []
+    assert backend.get_cursor('missing') == 0
+
+    # Сводки уникальных пользователей: повторное сохранение объединяется максимумом регистров
+    assert backend.get_user_sketches('2000-01-01') == {}
+    backend.merge_user_sketches({'2026-01-01': bytes([1, 0, 3]), '2026-01-02': bytes([2, 2])}, keep_since='2000-01-01')
+    backend.merge_user_sketches({'2026-01-02': bytes([0, 5])}, keep_since='2026-01-02')
+    assert backend.get_user_sketches('2000-01-01') == {'2026-01-02': bytes([2, 5])}
+    audience = UniqueUsers(backend, precision=8)
+    for user_id in (1, 2, 3, 2):
+        audience.add(user_id)
+    assert audience.counts() == {'day': 3, 'week': 3, 'month': 3}
+    audience.flush()
+    audience.add(4)
+    assert audience.counts() == {'day': 4, 'week': 4, 'month': 4}
+
+    # Сводки неуспешных поисков: дни и позиция в журнале сохраняются вместе
+    assert backend.get_miss_sketches('2000-01-01') == {}
+    backend.save_miss_sketches({'2026-01-01': '{"old": 1}', '2026-01-02': '{"new": 1}'}, 5, keep_since='2026-01-02')
+    assert backend.get_miss_sketches('2000-01-01') == {'2026-01-02': '{"new": 1}'}
+    assert backend.get_cursor(MISS_CURSOR) == 5
+    backend.save_miss_sketches({}, 0, keep_since='2026-01-03')
+    assert backend.get_miss_sketches('2000-01-01') == {} and backend.get_cursor(MISS_CURSOR) == 0
+    misses = MissTracker(backend)
+    assert misses.update() == 1 and [miss.query for miss in misses.top(days=1)] == ['шипр']
+    misses.save()
+    assert backend.get_cursor(MISS_CURSOR) == misses.cursor == backend.get_search_log()[-1][0]
+    reloaded = MissTracker(backend)
+    assert reloaded.update() == 0 and reloaded.top(days=1) == misses.top(days=1)
+
+    indexer = RelatedTermsIndexer(backend, neighbors_count=2)
+    assert indexer.update() == 4
+    assert sorted(backend.get_cooccurrences([edp_id])) == sorted([
+        (min(top_id, edp_id), max(top_id, edp_id), 1), (min(edp_id, lone_id), max(edp_id, lone_id), 1)
+    ])
+    assert backend.get_related_terms(edp_id) == [(lone_id, "Шлейф"), (top_id, "Верхние ноты")]
+    assert backend.get_related_terms(top_id) == [(edp_id, "EDP"), (base_id, "Базовые ноты")]
+    assert backend.get_related_terms(base_id) == [(top_id, "Верхние ноты")]
+    assert backend.get_related_terms(edp_id, limit=1) == [(lone_id, "Шлейф")]
+    assert indexer.update() == 0
+    backend.log_search(1, 'база', base_id, found=True)
+    assert indexer.update() == 3
+    assert backend.get_cursor('related_terms_search_id') == backend.get_term_searches()[-1][0]
+
+    # История просмотров: последние keep различных терминов, повторный просмотр - наверх
+    for viewed_at, term_id in enumerate([top_id, edp_id, base_id, edp_id, lone_id], 1):
+        backend.add_history(7, term_id, float(viewed_at), keep=3)
+    assert backend.get_history(7) == [(lone_id, "Шлейф"), (edp_id, "EDP"), (base_id, "Базовые ноты")]
+    assert backend.get_history(7, limit=1) == [(lone_id, "Шлейф")]
+    assert backend.get_history(8) == []
+
+    # Журналы для выгрузки во внешние таблицы
+    log = backend.get_search_log()
+    assert len(log) == 6 and log[-1][2:] == (1, 'база', True, base_id)
+    assert log[0][0] < log[1][0] and len(log[0][1]) == 19 and log[0][1][:2] == '20'
+    assert [row[0] for row in backend.get_search_log(after_id=log[4][0], limit=1)] == [log[5][0]]
+    assert any(row[4] is False for row in log)
+    suggestions = backend.get_suggestion_log()
+    assert [row[2:] for row in suggestions] == [(1, 'user', 'Шипр', 'Семейство ароматов', 'Семейства')]
+    assert backend.get_suggestion_log(after_id=suggestions[0][0]) == []
+
+    # Подписки и возобновляемая рассылка
+    assert backend.add_subscriber(30) and backend.add_subscriber(10) and backend.add_subscriber(20)
+    assert not backend.add_subscriber(10)
+    assert backend.is_subscribed(20) and not backend.is_subscribed(40)
+    assert backend.get_broadcast('2026-01-01') is None
+    broadcast = backend.create_broadcast('2026-01-01', base_id, 'Термин дня', 'MarkdownV2')
+    assert backend.get_broadcast('2026-01-01') == broadcast and broadcast['status'] == 'running'
+    assert broadcast['text'] == 'Термин дня' and broadcast['term_id'] == base_id
+    assert broadcast['parse_mode'] == 'MarkdownV2'
+    assert backend.get_unfinished_broadcast() == broadcast
+    assert backend.get_pending_recipients(broadcast['id'], limit=2) == [10, 20]
+    backend.record_deliveries(broadcast['id'], [(10, 'sent'), (20, 'failed')])
+    assert backend.get_pending_recipients(broadcast['id']) == [30]
+    assert backend.remove_subscriber(30) and not backend.remove_subscriber(30)
+    assert backend.get_pending_recipients(broadcast['id']) == []
+    backend.finish_broadcast(broadcast['id'])
+    assert backend.get_broadcast('2026-01-01')['status'] == 'finished'
+    assert backend.get_unfinished_broadcast() is None
+
+    stats = backend.get_stats()
+    assert stats['total_terms'] == 4 and stats['total_categories'] == 2
+    assert stats['searches_week'] == 6 and stats['pending_suggestions'] == 1
+    assert stats['popular_terms'] == [{'term': "Верхние ноты", 'usage_count': 2}]
+    assert backend.get_database_stats() == stats
+
+    # Редактирование словаря: каждое изменение - новая ревизия в журнале
+    revision = backend.get_revision()
+    assert revision > 0 and backend.get_changes(after_revision=revision) == []
+    assert backend.update_term(10 ** 6, {'definition': 'Нет такого'}) is None
+    for bad_fields in ({'term': 'Шлейф'}, {'definition': ' '}, {'rating': '5'}):
+        try:
+            backend.update_term(edp_id, bad_fields)
+            raise AssertionError(f"ожидалась ошибка для {bad_fields}")
+        except ValueError:
+            pass
+    assert backend.get_changes(after_revision=revision) == []
+
+    backend.update_term(edp_id, {'definition': 'Парфюмерная вода', 'synonyms': 'парфюм, eau de parfum',
+                                 'category_name': 'Концентрации парфюма'})
+    assert [t.id for t in backend.search_terms('eau de parfum')] == [edp_id]
+    assert backend.search_terms('парфюмерная вода', definitions=False) == []
+    edp = backend.get_term_by_id(edp_id)
+    assert edp.definition == 'Парфюмерная вода' and edp.category_name == 'Концентрации парфюма'
+    backend.update_term(lone_id, {'term': 'Шлейф аромата', 'examples': 'Тянется за человеком'})
+    assert backend.get_term_by_id(lone_id).examples == 'Тянется за человеком'
+    assert backend.update_term(lone_id, {'examples': None}) and backend.get_term_by_id(lone_id).examples is None
+    assert backend.get_history(7)[0] == (lone_id, "Шлейф аромата")
+
+    # Слияние: синонимы, счетчик, поиски, истории, рассылки и совместные поиски переходят к target
+    backend.increment_usage(base_id)
+    pair = lambda a, b: (min(a, b), max(a, b))
+    counts = {(a, b): count for a, b, count in backend.get_cooccurrences([base_id, top_id])}
+    expected_pair_count = counts.get(pair(top_id, edp_id), 0) + counts.get(pair(base_id, edp_id), 0)
+    assert backend.merge_terms(base_id, 10 ** 6) is None
+    try:
+        backend.merge_terms(top_id, top_id)
+        raise AssertionError("ожидалась ошибка слияния с самим собой")
+    except ValueError:
+        pass
+    assert backend.merge_terms(base_id, top_id)
+    assert backend.get_term_by_id(base_id) is None
+    top = backend.get_term_by_id(top_id)
+    assert top.synonyms == "топ ноты, head notes, Базовые ноты, база, base notes" and top.usage_count == 3
+    assert [t.id for t in backend.search_terms('base notes')] == [top_id]
+    assert [t.id for t in backend.search_terms('Базовые ноты')] == [top_id]
+    assert backend.get_history(7) == [(lone_id, "Шлейф аромата"), (edp_id, "EDP"), (top_id, "Верхние ноты")]
+    assert base_id not in {row[2] for row in backend.get_term_searches()}
+    assert backend.get_broadcast('2026-01-01')['term_id'] == top_id
+    merged_counts = {(a, b): count for a, b, count in backend.get_cooccurrences([top_id])}
+    assert merged_counts[pair(top_id, edp_id)] == expected_pair_count
+    assert all(base_id not in key for key in merged_counts)
+    assert all(term_id != base_id for term_id, _ in backend.get_related_terms(top_id))
+
+    # Удаление: производные данные удаляются, журнал поисков остается без ссылки на термин
+    assert backend.delete_term(10 ** 6) is None
+    assert backend.delete_term(lone_id)
+    assert backend.get_term_by_id(lone_id) is None and backend.search_terms('шлейф') == []
+    assert backend.get_history(7) == [(edp_id, "EDP"), (top_id, "Верхние ноты")]
+    assert all(term_id != lone_id for term_id, _ in backend.get_related_terms(edp_id))
+    assert len(backend.get_search_log()) == 6
+    assert lone_id not in {row[2] for row in backend.get_term_searches()}
+
+    # Категории: переименование, слияние и удаление (термины остаются без категории)
+    categories = {category.name: category.id for category in backend.get_categories()}
+    concentrations_id, new_id = categories["Концентрации"], categories["Концентрации парфюма"]
+    assert backend.update_category(10 ** 6, {'name': 'Нет такой'}) is None
+    try:
+        backend.update_category(structure_id, {'name': 'Концентрации'})
+        raise AssertionError("ожидалась ошибка: название категории занято")
+    except ValueError:
+        pass
+    backend.update_category(structure_id, {'name': 'Строение аромата', 'description': 'Пирамида нот'})
+    assert backend.get_category(structure_id) == (structure_id, 'Строение аромата', 'Пирамида нот')
+    assert backend.get_term_by_id(top_id).category_name == 'Строение аромата'
+    assert backend.merge_categories(new_id, concentrations_id)
+    assert backend.get_category(new_id) is None and backend.get_term_by_id(edp_id).category_id == concentrations_id
+    assert backend.delete_category(structure_id) and backend.delete_category(structure_id) is None
+    assert backend.get_term_by_id(top_id).category_name is None
+    assert backend.count_terms_by_category() == {concentrations_id: 1}
+
+    changes = backend.get_changes(after_revision=revision)
+    assert [(entity, action) for _, entity, action, _, _ in changes] == [
+        (CATEGORY, CREATE), (TERM, UPDATE), (TERM, UPDATE), (TERM, UPDATE), (TERM, MERGE), (TERM, DELETE),
+        (CATEGORY, UPDATE), (CATEGORY, MERGE), (CATEGORY, DELETE)
+    ]
+    assert changes[4][3:] == (base_id, top_id) and changes[-1][0] == backend.get_revision()
+    assert [row[0] for row in backend.get_changes(after_revision=changes[1][0], limit=2)] == [
+        changes[2][0], changes[3][0]
+    ]
+    assert backend.get_stats()['total_terms'] == 2
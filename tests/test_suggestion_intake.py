@@ -0,0 +1,49 @@
+"""Прием предложений терминов: разбор сообщения и черновики в памяти"""
+import pytest
+
+from suggestion_intake import (DEFINITION_MAX_LENGTH, Suggestion, SuggestionError, SuggestionIntake,
+                               parse_suggestion)
+
+
+def test_parse_full_and_short_forms():
+    assert parse_suggestion("Винтаж\nСтарый, редкий аромат из прошлых лет\nЖаргон\n\"Этот винтаж стоит целое состояние\"") \
+        == Suggestion("Винтаж", "Старый, редкий аромат из прошлых лет", "Жаргон", "\"Этот винтаж стоит целое состояние\"")
+    assert parse_suggestion("\n  «Шипр» \n\nАккорд дубового мха и бергамота\n") \
+        == Suggestion("Шипр", "Аккорд дубового мха и бергамота")
+
+
+@pytest.mark.parametrize('text', [
+    "Винтаж",
+    "/start\nАккорд дубового мха",
+    "Винтаж\nСтарый",
+    "Ш\nАккорд дубового мха и бергамота",
+    "Винтаж\n" + "о" * (DEFINITION_MAX_LENGTH + 1),
+])
+def test_parse_rejects_invalid(text):
+    with pytest.raises(SuggestionError):
+        parse_suggestion(text)
+
+
+@pytest.fixture
+def intake(db):
+    db.add_term("Шипр", "Аромат с дубовым мхом и бергамотом", "Семейства")
+    return SuggestionIntake(db, idle_ttl=60, max_drafts=2)
+
+
+def test_name_then_definition(intake):
+    # Сначала название, затем объяснение; категория приводится к существующей
+    intake.start(1, now=0)
+    assert intake.submit(1, "Фужер", now=1) is None and intake.pending_term(1) == "Фужер"
+    with pytest.raises(SuggestionError):
+        intake.submit(1, "Коротко", now=2)
+    assert intake.submit(1, "Аромат с лавандой и кумарином\nсемейства", now=3) \
+        == Suggestion("Фужер", "Аромат с лавандой и кумарином", "Семейства")
+    assert not intake.active(1, now=3)
+
+
+def test_drafts_evicted_by_idle_time_and_count(intake):
+    intake.start(2, now=10)
+    assert intake.active(2, now=69) and not intake.active(2, now=70)
+    for user_id in (3, 4, 5):
+        intake.start(user_id, now=100)
+    assert len(intake) == 2 and not intake.active(3, now=100)
@@ -0,0 +1,73 @@
+"""Слой исходящих вызовов Bot API на локальной заглушке"""
+import asyncio
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ExtBot
+
+from telegram_api import OutboundLimiter, build_request
+
+MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Главное меню", callback_data="start")]])
+
+
+def test_repeated_edit_is_suppressed_and_retry_after_retried(stub):
+    async def run():
+        limiter = OutboundLimiter(backoff=0.01)
+        async with ExtBot('123:stub', base_url=stub.base_url, request=build_request(4),
+                          rate_limiter=limiter) as bot:
+            message = await bot.send_message(42, "Категории", reply_markup=MARKUP)
+
+            # Двойное нажатие одной кнопки: вторая правка не уходит в API
+            await bot.edit_message_text("Термин", 42, message.message_id, reply_markup=MARKUP)
+            await bot.edit_message_text("Термин", 42, message.message_id, reply_markup=MARKUP)
+            assert stub.calls['editMessageText'] == 1
+
+            # RetryAfter повторяется автоматически
+            stub.fail_next('editMessageText', 429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+            await bot.edit_message_text("Категории", 42, message.message_id, reply_markup=MARKUP)
+            assert stub.messages[(42, message.message_id)].startswith("Категории")
+        stats = limiter.snapshot()['editMessageText']
+        assert stats['suppressed'] == 1 and stats['retries'] == 1 and stats['failures'] == 1
+        return message
+
+    asyncio.run(run())
+
+
+def test_not_modified_after_restart_is_not_an_error(stub):
+    async def run():
+        async with ExtBot('123:stub', base_url=stub.base_url) as bot:
+            message = await bot.send_message(42, "Категории", reply_markup=MARKUP)
+        # После перезапуска хэши неизвестны: ответ "message is not modified" считается успешным
+        limiter = OutboundLimiter()
+        async with ExtBot('123:stub', base_url=stub.base_url, rate_limiter=limiter) as bot:
+            assert await bot.edit_message_text("Категории", 42, message.message_id, reply_markup=MARKUP)
+        assert limiter.snapshot()['editMessageText']['suppressed'] == 1
+
+    asyncio.run(run())
+
+
+def test_keepalive_reuses_connection(stub):
+    async def calls(keepalive_expiry: float) -> int:
+        stub.connections.clear()
+        async with ExtBot('123:stub', base_url=stub.base_url,
+                          request=build_request(4, keepalive_expiry=keepalive_expiry)) as bot:
+            for _ in range(20):
+                await bot.get_me()
+        return len(stub.connections)
+
+    assert asyncio.run(calls(60)) == 1
+    assert asyncio.run(calls(0)) > 1
+
+
+def test_shared_client_outlives_first_bot(stub):
+    # Два бота на одном клиенте: shutdown первого не закрывает соединения второго
+    async def run():
+        shared = build_request(4, shared=True)
+        async with ExtBot('123:stub', base_url=stub.base_url, request=shared) as first:
+            async with ExtBot('456:stub', base_url=stub.base_url, request=shared) as second:
+                await first.get_me()
+                await second.get_me()
+            await first.get_me()
+        return shared
+
+    shared = asyncio.run(run())
+    assert shared.users == 0 and len(stub.connections) == 1
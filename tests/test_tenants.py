@@ -0,0 +1,94 @@
+"""Несколько словарей в одном процессе: настройка TENANTS, доли кэшей, реестр"""
+import json
+
+import pytest
+
+from tenants import DEFAULT_TENANT, MIN_BUDGET, CacheBudget, Tenant, TenantRegistry, load_tenants, memory_size
+
+SPEC = json.dumps([{'name': 'perfume', 'token': '1:a'},
+                   {'name': 'wine', 'token': '2:b', 'database': 'wine/terms.db', 'weight': 0.5}])
+
+
+def test_single_dictionary_without_spec():
+    assert load_tenants('', '1:a', 'data/database.db', 'data/dictionary.bin') == \
+        [Tenant(DEFAULT_TENANT, '1:a', 'data/database.db', 'data/dictionary.bin')]
+
+
+def test_defaults_next_to_main_files():
+    assert load_tenants(SPEC, '', 'data/database.db', 'data/dictionary.bin') == [
+        Tenant('perfume', '1:a', 'data/perfume.db', 'data/perfume.bin', 1.0, 'data/perfume_user_data.json'),
+        Tenant('wine', '2:b', 'wine/terms.db', 'data/wine.bin', 0.5, 'data/wine_user_data.json'),
+    ]
+    assert load_tenants(SPEC, '', 'data/database.db', '', postgres=True)[0] == \
+        Tenant('perfume', '1:a', 'perfume', '', 1.0, 'data/perfume_user_data.json')
+
+
+@pytest.mark.parametrize('spec', [
+    '[]',
+    '[{"name": "Wine", "token": "1"}]',
+    '[{"name": "wine"}]',
+    '[{"name": "a", "token": "1"}, {"name": "b", "token": "1"}]',
+    '[{"name": "a", "token": "1", "user_data": "log.json"}, {"name": "b", "token": "2", "user_data": "log.json"}]',
+])
+def test_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        load_tenants(spec, '', 'data/database.db', '')
+
+
+def test_budget_split_by_weight():
+    # Маленький словарь получает не меньше нижней границы
+    budget = CacheBudget(history_users=10000, drafts=10000, rate_limit_users=100000,
+                         tracked_messages=10000, search_cursors=10000, db_pool_size=10,
+                         index_bytes=1024 * 2 ** 20)
+    large, small, tiny = budget.split([2, 1, 0.01])
+    # Граница маленького словаря вычитается из долей остальных, а не добавляется сверху
+    assert large.history_users == 6600 and small.history_users == 3300 and tiny == MIN_BUDGET
+    assert budget.split([1]) == [budget]
+
+
+def test_budget_split_never_exceeds_process_limits():
+    budget = CacheBudget(history_users=10000, drafts=10000, rate_limit_users=100000,
+                         tracked_messages=100000, search_cursors=10000, db_pool_size=40,
+                         index_bytes=1024 * 2 ** 20)
+    weights = [10, 5] + [0.1] * 30
+    shares = budget.split(weights)
+    for field, limit, minimum in zip(CacheBudget._fields, budget, MIN_BUDGET):
+        column = [getattr(share, field) for share in shares]
+        assert sum(column) <= limit and min(column) >= minimum, field
+    # 30 маленьких словарей получают по 16 МБ, остаток делится между большими по весам
+    assert shares[2].index_bytes == MIN_BUDGET.index_bytes
+    assert abs(shares[0].index_bytes - 2 * shares[1].index_bytes) <= 1
+
+    # Нижних границ на все словари больше, чем памяти процесса: настройка отклоняется
+    with pytest.raises(ValueError, match='index_bytes'):
+        budget._replace(db_pool_size=100).split([1] * 65)
+
+
+def test_memory_size_counts_shared_objects_once():
+    import array
+    column = array.array('q', range(100000))
+    size = memory_size({'a': column, 'b': [column, column]})
+    assert 800000 < memory_size(column) < size < memory_size(column) + 1000
+    assert memory_size({'a': column}, exclude=(column,)) < 1000
+
+
+def test_registry(tmp_path):
+    registry = TenantRegistry()
+    spec = SPEC.replace('wine/terms.db', str(tmp_path / 'wine.db'))
+    for tenant in load_tenants(spec, '', str(tmp_path / 'database.db'), ''):
+        entry = registry.add(tenant, MIN_BUDGET)
+        entry.database.add_term(f"Термин {tenant.name}", "Определение термина", "Категория")
+    try:
+        assert registry.primary.tenant.name == 'perfume'
+        assert [entry.tenant.name for entry in registry.additional] == ['wine']
+        assert all(entry.database.get_stats()['total_terms'] == 1 for entry in registry)
+        headers = {'Authorization': 'Bearer secret'}
+        status, _, body = registry.handle_request('/tenants', headers, 'secret')
+        assert status == 200 and [item['name'] for item in json.loads(body)] == ['perfume', 'wine']
+        assert registry.handle_request('/tenants', headers, None)[0] == 404
+        assert registry.handle_request('/tenants', {'Authorization': 'Bearer wrong'}, 'secret')[0] == 403
+        assert registry.handle_request('/healthz', headers, 'secret') is None
+        registry.remove('wine')
+        assert [entry.tenant.name for entry in registry] == ['perfume']
+    finally:
+        registry.close()
@@ -0,0 +1,53 @@
+"""Уникальные пользователи: сводки HyperLogLog"""
+import pytest
+
+from unique_users import HyperLogLog, UniqueUsers
+
+
+@pytest.mark.parametrize('users', [0, 10, 1000, 100000])
+def test_estimate_error(users):
+    sketch = HyperLogLog(14)
+    for user_id in range(users):
+        sketch.add(user_id * 7919 + 1)
+    assert abs(sketch.count() - users) <= max(1, users * 0.03), sketch.count()
+
+
+def test_union_of_overlapping_days():
+    monday, tuesday = HyperLogLog(12), HyperLogLog(12)
+    for user_id in range(3000):
+        monday.add(user_id)
+    for user_id in range(2000, 5000):
+        tuesday.add(user_id)
+    week = HyperLogLog.union([bytes(monday.registers), bytes(tuesday.registers)], 12).count()
+    assert abs(week - 5000) <= 5000 * 0.05
+
+
+class SketchStore:
+    def __init__(self):
+        self.sketches = {}
+        self.fail = False
+
+    def merge_user_sketches(self, sketches, keep_since):
+        if self.fail:
+            raise OSError("база недоступна")
+        self.sketches.update(sketches)
+
+    def get_user_sketches(self, since):
+        return dict(self.sketches)
+
+
+def test_add_does_not_touch_database():
+    store = SketchStore()
+    audience = UniqueUsers(store, precision=12)
+    for user_id in range(50):
+        audience.add(user_id)
+    day = audience.counts()['day']
+    assert store.sketches == {} and abs(day - 50) <= 2
+
+    # Неудачное сохранение не теряет сводку, следующее - сохраняет
+    store.fail = True
+    with pytest.raises(OSError):
+        audience.flush()
+    store.fail = False
+    audience.flush()
+    assert len(store.sketches) == 1 and audience.counts()['day'] == day
@@ -0,0 +1,63 @@
+"""Личная история запросов: кэш в памяти и строки в базе"""
+import pytest
+
+from change_bus import ChangeBus
+from storage_backend import TERM
+from user_history import UserHistory
+
+
+@pytest.fixture
+def term_ids(db):
+    return [db.add_term(f"Термин {i}", f"Определение {i}", "Разное") for i in range(6)]
+
+
+def test_database_keeps_last_entries(db, term_ids):
+    for viewed_at, term_id in enumerate(term_ids):
+        db.add_history(1, term_id, float(viewed_at), keep=3)
+    assert [term_id for term_id, _ in db.get_history(1)] == term_ids[:-4:-1]
+    # Повторный просмотр поднимает термин наверх, а не добавляет второй раз
+    db.add_history(1, term_ids[3], 10.0, keep=3)
+    assert [term_id for term_id, _ in db.get_history(1)] == [term_ids[3], term_ids[5], term_ids[4]]
+    assert db.get_history(2) == []
+
+
+def test_cache_trims_and_moves_to_front(db, term_ids):
+    history = UserHistory(db, size=3)
+    for term_id in term_ids[:4]:
+        history.add(1, term_id, f"Термин {term_id}", now=0)
+    history.add(1, term_ids[2], f"Термин {term_ids[2]}", now=1)
+    expected = [term_ids[2], term_ids[3], term_ids[1]]
+    assert [term_id for term_id, _ in history.get(1, now=2)] == expected
+    # Запись сразу уходит в базу: новый кэш читает ту же историю
+    assert [term_id for term_id, _ in UserHistory(db, size=3).get(1)] == expected
+
+
+def test_idle_and_extra_users_evicted(db, term_ids):
+    history = UserHistory(db, size=3, idle_ttl=60, max_users=2)
+    for user_id in (1, 2, 3):
+        history.add(user_id, term_ids[0], "Термин", now=0)
+    assert len(history) == 2 and 1 not in history._entries
+    history.get(2, now=30)
+    history.get(4, now=70)
+    # Пользователь 3 простаивал дольше idle_ttl, пользователь 2 обращался недавно
+    assert list(history._entries) == [2, 4]
+    # Вытесненная история перечитывается из базы
+    assert [term_id for term_id, _ in history.get(1, now=71)] == [term_ids[0]]
+
+
+def test_change_bus_invalidates_histories(db, term_ids):
+    history = UserHistory(db, size=5)
+    changes = ChangeBus(db)
+    changes.subscribe(history.apply_change, TERM)
+    history.add(1, term_ids[0], "Термин 0", now=0)
+    history.add(1, term_ids[1], "Термин 1", now=0)
+    history.add(2, term_ids[2], "Термин 2", now=0)
+    history.add(3, term_ids[4], "Термин 4", now=0)
+
+    db.delete_term(term_ids[0])
+    db.merge_terms(term_ids[2], term_ids[3])
+    changes.sync()
+    # Истории с удаленным и слитым терминами перечитываются, остальные остаются в памяти
+    assert sorted(history._entries) == [3]
+    assert history.get(1, now=1) == [(term_ids[1], "Термин 1")]
+    assert history.get(2, now=1) == [(term_ids[3], "Термин 3")]